@@ -9,7 +9,10 @@ from app.core.simple_auth import get_current_active_user, require_cost_engineer,
 from app.models.user import User
 from app.models.analysis import AnalysisStatus
 from app.services.price_analysis import PriceAnalysisService
+from app.services.analysis_job import PriceAnalysisJobService
+from app.services.analysis_estimator import AnalysisEstimator
 from app.services.ai_analysis import AIProvider
+from app.services.ai_telemetry import ai_telemetry
 from app.services.project import ProjectService
 
 router = APIRouter()
@@ -18,9 +21,11 @@ router = APIRouter()
 class AnalyzeProjectRequest(BaseModel):
     """分析项目请求模型"""
     material_ids: Optional[List[int]] = Field(None, description="指定要分析的材料ID列表，为空则分析所有材料")
-    batch_size: int = Field(20, ge=1, le=100, description="批量处理大小")
+    batch_size: int = Field(20, ge=1, le=100, description="分析结果批量写入大小")
     force_reanalyze: bool = Field(False, description="是否强制重新分析")
     preferred_provider: Optional[str] = Field(None, description="首选AI服务提供商")
+    cost_budget: Optional[float] = Field(None, ge=0, description="项目AI分析成本预算(元)，为空使用系统配置，0表示不限")
+    include_results: bool = Field(True, description="是否在响应中返回逐个材料的分析结果，为否时只返回统计（结果可通过分析结果接口查询）")
 
 
 class AnalyzeMaterialRequest(BaseModel):
@@ -67,7 +72,9 @@ async def analyze_project_materials(
             material_ids=request.material_ids,
             batch_size=request.batch_size,
             force_reanalyze=request.force_reanalyze,
-            preferred_provider=preferred_provider
+            preferred_provider=preferred_provider,
+            cost_budget=request.cost_budget,
+            include_results=request.include_results
         )
         
         return {
@@ -82,10 +89,148 @@ async def analyze_project_materials(
         )
 
 
+@router.post("/{project_id}/analyze/estimate")
+async def estimate_project_analysis(
+    project_id: int,
+    request: AnalyzeProjectRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """预估批量分析的调用次数、token、成本和耗时（不调用AI服务）"""
+
+    project = await ProjectService.get_project_by_id(db, project_id)
+    if not project:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="项目不存在"
+        )
+
+    preferred_provider = None
+    if request.preferred_provider:
+        try:
+            preferred_provider = AIProvider(request.preferred_provider)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"无效的AI服务提供商: {request.preferred_provider}"
+            )
+
+    try:
+        estimator = AnalysisEstimator()
+        return await estimator.estimate(
+            db=db,
+            project_id=project_id,
+            material_ids=request.material_ids,
+            force_reanalyze=request.force_reanalyze,
+            preferred_provider=preferred_provider,
+            cost_budget=request.cost_budget
+        )
+
+    except Exception as e:
+        logger.error(f"预估分析失败: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"预估分析失败: {str(e)}"
+        )
+
+
+@router.post("/{project_id}/analysis-jobs")
+async def submit_analysis_job(
+    project_id: int,
+    request: AnalyzeProjectRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """提交项目材料价格分析任务（后台执行，支持断点恢复）"""
+
+    project = await ProjectService.get_project_by_id(db, project_id)
+    if not project:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="项目不存在"
+        )
+
+    preferred_provider = None
+    if request.preferred_provider:
+        try:
+            preferred_provider = AIProvider(request.preferred_provider)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"无效的AI服务提供商: {request.preferred_provider}"
+            )
+
+    try:
+        job_service = PriceAnalysisJobService()
+        job = await job_service.submit_job(
+            db=db,
+            project_id=project_id,
+            material_ids=request.material_ids,
+            force_reanalyze=request.force_reanalyze,
+            preferred_provider=preferred_provider,
+            cost_budget=request.cost_budget
+        )
+        return {
+            "message": "分析任务已提交",
+            "job": await job_service.get_job_status(db, job.id)
+        }
+
+    except Exception as e:
+        logger.error(f"提交分析任务失败: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"提交分析任务失败: {str(e)}"
+        )
+
+
+@router.get("/analysis-jobs/{job_id}")
+async def get_analysis_job_status(
+    job_id: int,
+    db: AsyncSession = Depends(get_db)
+):
+    """获取分析任务进度（已完成/失败/剩余数量及预计剩余时间）"""
+
+    job_status = await PriceAnalysisJobService().get_job_status(db, job_id)
+    if not job_status:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="分析任务不存在"
+        )
+    return job_status
+
+
+class ResumeAnalysisJobRequest(BaseModel):
+    """恢复分析任务请求模型"""
+    cost_budget: Optional[float] = Field(None, ge=0, description="新的项目AI分析成本预算(元)，为空沿用任务原预算，0表示不限")
+
+
+@router.post("/analysis-jobs/{job_id}/resume")
+async def resume_analysis_job(
+    job_id: int,
+    request: Optional[ResumeAnalysisJobRequest] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """从检查点恢复中断、失败或预算用完的分析任务"""
+
+    job_service = PriceAnalysisJobService()
+    try:
+        job = await job_service.resume_job(db, job_id, cost_budget=request.cost_budget if request else None)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    return {
+        "message": "分析任务已恢复",
+        "job": await job_service.get_job_status(db, job.id)
+    }
+
+
 class AnalyzePricedMaterialsRequest(BaseModel):
     """分析市场信息价材料请求模型"""
     material_ids: Optional[List[int]] = Field(None, description="要分析的材料ID列表，为空则分析所有材料")
     batch_size: int = Field(10, ge=1, le=100, description="批量处理大小")
+    include_differences: bool = Field(True, description="是否在响应中返回全部差异明细，为否时只返回摘要和分页游标")
+    page_size: int = Field(100, ge=1, le=1000, description="分页游标的每页记录数")
 
 
 @router.post("/{project_id}/analyze-priced-materials")
@@ -114,15 +259,24 @@ async def analyze_priced_materials(
             db=db,
             project_id=project_id,
             material_ids=request.material_ids,
-            batch_size=request.batch_size
+            batch_size=request.batch_size,
+            include_differences=request.include_differences
         )
         
-        return {
+        response = {
             "message": "市场信息价材料分析完成",
             "analyzed_count": result["analyzed_count"],
             "differences_count": result["differences_count"],
             "result": result
         }
+        if not request.include_differences:
+            # 明细已保存，按游标分页读取 GET /{project_id}/priced-materials-analysis
+            response["results_cursor"] = {
+                "path": f"/analysis/{project_id}/priced-materials-analysis",
+                "after_id": 0,
+                "limit": request.page_size
+            }
+        return response
     
     except Exception as e:
         raise HTTPException(
@@ -286,6 +440,7 @@ async def get_priced_materials_analysis(
     material_name: Optional[str] = Query(None, description="材料名称筛选"),
     skip: int = Query(0, ge=0, description="跳过的记录数"),
     limit: int = Query(1000, ge=1, le=1000, description="返回的记录数"),
+    after_id: Optional[int] = Query(None, ge=0, description="游标：只返回材料ID大于该值的记录（传入时忽略 skip）"),
     # 开发环境暂时移除认证要求
     # current_user: SimpleUser = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db)
@@ -329,6 +484,11 @@ async def get_priced_materials_analysis(
 
         if material_name:
             conditions.append(ProjectMaterial.material_name.ilike(f"%{material_name}%"))
+
+        page_conditions = []
+        if after_id is not None:
+            page_conditions.append(ProjectMaterial.id > after_id)
+            skip = 0
         
         # 从数据库获取已保存的市场信息价分析结果
         # 使用左连接确保所有已匹配的材料都能显示，即使分析结果缺失
@@ -347,17 +507,19 @@ async def get_priced_materials_analysis(
                 ProjectMaterial.id == PriceAnalysis.material_id
             )
         ).where(
-            and_(*conditions)
+            and_(*conditions, *page_conditions)
         )
         
         # 应用分析相关的筛选条件
         if analysis_conditions:
             stmt = stmt.where(and_(*analysis_conditions))
             
-        stmt = stmt.offset(skip).limit(limit)
+        # 按材料ID排序，保证分页稳定
+        stmt = stmt.order_by(ProjectMaterial.id).offset(skip).limit(limit)
         
         result = await db.execute(stmt)
         analysis_records = result.all()
+        next_cursor = analysis_records[-1].material_id if len(analysis_records) == limit else None
         
         # 转换为前端需要的格式
         results = []
@@ -440,7 +602,8 @@ async def get_priced_materials_analysis(
         return {
             "project_id": project_id,
             "results": results,
-            "total": total
+            "total": total,
+            "next_cursor": next_cursor
         }
     
     except Exception as e:
@@ -587,7 +750,9 @@ async def get_available_ai_services(
         
         return {
             "available_providers": providers,
-            "total_count": len(providers)
+            "total_count": len(providers),
+            "circuit_breakers": analysis_service.ai_manager.get_circuit_breaker_status(),
+            "routing": analysis_service.ai_manager.get_routing_status()
         }
     
     except Exception as e:
@@ -597,6 +762,24 @@ async def get_available_ai_services(
         )
 
 
+@router.get("/ai-services/stats")
+async def get_ai_service_stats(
+    window_seconds: int = Query(3600, ge=60, le=86400, description="统计时间窗口(秒)"),
+    # 开发环境暂时移除认证要求
+    # current_user: SimpleUser = Depends(get_current_active_user)
+):
+    """获取AI服务调用统计（按服务提供商/模型：延迟分位数、token、成本、解析失败率、超时率）"""
+
+    try:
+        return ai_telemetry.window_stats(window_seconds)
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"获取AI服务统计失败: {str(e)}"
+        )
+
+
 @router.post("/ai-services/test")
 async def test_ai_service(
     provider: str,
@@ -13,6 +13,8 @@ from app.schemas.material import (
     BaseMaterialPeriodDeleteRequest
 )
 from app.services.material import BaseMaterialService, MaterialImportService
+from app.services.price_rollup import price_rollup_service
+from app.services.market_index import market_index_service
 from app.utils.excel import ExcelProcessor
 
 router = APIRouter()
@@ -401,6 +403,111 @@ async def delete_materials_by_period(
         )
 
 
+@router.get("/price-series")
+async def get_material_price_series(
+    material_code: Optional[str] = Query(None, description="材料编码（优先）"),
+    name: Optional[str] = Query(None, description="材料名称（无编码时使用）"),
+    specification: Optional[str] = Query(None, description="规格型号（按名称查询时参与匹配）"),
+    unit: Optional[str] = Query(None, description="计量单位"),
+    region: Optional[str] = Query(None, description="地区"),
+    price_type: Optional[str] = Query(None, description="信息价类型 provincial/municipal"),
+    start_month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$", description="起始月份 YYYY-MM（合同开始）"),
+    end_month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$", description="结束月份 YYYY-MM（合同结束）"),
+    db: AsyncSession = Depends(get_db)
+):
+    """获取材料的月度信息价序列及窗口均价（来自信息价月度汇总表）"""
+    try:
+        window = await price_rollup_service.get_window_average(
+            db,
+            material_code=material_code,
+            name=name,
+            specification=specification,
+            unit=unit,
+            region=region,
+            price_type=price_type,
+            start_month=start_month,
+            end_month=end_month
+        )
+    except ValueError as ve:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(ve)
+        )
+    return {
+        "code": 200,
+        "message": "获取成功",
+        "data": {
+            "series": [price_rollup_service.serialize(row) for row in window['series']],
+            "average": window['average']
+        }
+    }
+
+
+@router.post("/price-series/rebuild")
+async def rebuild_material_price_series(
+    current_user: SimpleUser = Depends(require_admin()),
+    db: AsyncSession = Depends(get_db)
+):
+    """全量重建信息价月度汇总表"""
+    try:
+        written = await price_rollup_service.rebuild(db)
+    except Exception as e:
+        logger.error(f"重建信息价月度汇总失败: {e}")
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="重建信息价月度汇总失败"
+        )
+    return {
+        "code": 200,
+        "message": f"重建完成，共 {written} 条月度汇总",
+        "data": {"rows": written}
+    }
+
+
+@router.get("/market-index")
+async def get_material_market_index(
+    region: str = Query(..., description="地区"),
+    category: Optional[str] = Query(None, description="材料分类（为空时取地区全部材料）"),
+    month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$", description="月份 YYYY-MM（为空时取最新月份）"),
+    db: AsyncSession = Depends(get_db)
+):
+    """查询信息价市场指数（该月及之前最近一个月，分类无指数时退回地区全部材料）"""
+    index = await market_index_service.lookup(db, region, category, month)
+    if index is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="该地区暂无市场指数"
+        )
+    return {
+        "code": 200,
+        "message": "获取成功",
+        "data": index
+    }
+
+
+@router.post("/market-index/rebuild")
+async def rebuild_material_market_index(
+    current_user: SimpleUser = Depends(require_admin()),
+    db: AsyncSession = Depends(get_db)
+):
+    """全量重建信息价市场指数"""
+    try:
+        written = await market_index_service.rebuild(db)
+    except Exception as e:
+        logger.error(f"重建信息价市场指数失败: {e}")
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="重建信息价市场指数失败"
+        )
+    return {
+        "code": 200,
+        "message": f"重建完成，共 {written} 条市场指数",
+        "data": {"rows": written}
+    }
+
+
 @router.get("/{material_id}", response_model=BaseMaterialResponse)
 async def get_base_material(
     material_id: int,
@@ -17,6 +17,10 @@ class ReasonabilityAnalysisRequest(BaseModel):
     """合理性分析请求模型"""
     force_reanalyze: bool = Field(False, description="是否强制重新分析")
     detection_sensitivity: float = Field(0.1, ge=0.01, le=1.0, description="异常检测敏感度")
+    anomaly_baseline: str = Field(
+        "project", pattern="^(project|portfolio)$",
+        description="异常检测基线：project 本项目同类材料，portfolio 全部项目同类材料"
+    )
 
 
 class ManualAdjustmentRequest(BaseModel):
@@ -49,7 +53,8 @@ async def analyze_project_price_reasonability(
             db=db,
             project_id=project_id,
             force_reanalyze=request.force_reanalyze,
-            detection_sensitivity=request.detection_sensitivity
+            detection_sensitivity=request.detection_sensitivity,
+            anomaly_baseline=request.anomaly_baseline
         )
         
         return {
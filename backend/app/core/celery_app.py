@@ -0,0 +1,30 @@
+from celery import Celery
+
+from app.core.config import settings
+
+
+# Celery应用实例
+# 启动worker: celery -A app.core.celery_app worker --loglevel=info
+celery_app = Celery(
+    "uma_audit",
+    broker=settings.CELERY_BROKER_URL,
+    backend=settings.CELERY_RESULT_BACKEND,
+    include=["app.services.analysis_job"],
+)
+
+celery_app.conf.update(
+    task_serializer="json",
+    result_serializer="json",
+    accept_content=["json"],
+    timezone="Asia/Shanghai",
+    enable_utc=True,
+    # 任务执行完成后才确认消息，worker异常退出时消息重新投递，由任务从检查点继续
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    worker_prefetch_multiplier=1,
+    broker_transport_options={"visibility_timeout": settings.CELERY_VISIBILITY_TIMEOUT},
+    result_expires=24 * 3600,
+    # 本地模式：任务在调用进程内同步执行，配合 memory:// broker 用于测试
+    task_always_eager=settings.CELERY_TASK_ALWAYS_EAGER,
+    task_eager_propagates=True,
+)
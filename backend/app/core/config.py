@@ -50,6 +50,10 @@ class Settings(BaseSettings):
     # Celery配置
     CELERY_BROKER_URL: str = "redis://localhost:6379/1"
     CELERY_RESULT_BACKEND: str = "redis://localhost:6379/2"
+    CELERY_TASK_ALWAYS_EAGER: bool = False  # 为True时分析任务在当前进程内执行（本地开发/测试，无需broker）
+    CELERY_VISIBILITY_TIMEOUT: int = 6 * 3600  # 未确认任务重新投递前的等待时间(秒)
+    ANALYSIS_JOB_STALE_SECONDS: int = 300  # 分析任务心跳超过该时间未更新视为中断，可恢复
+    ANALYSIS_JOB_HEARTBEAT_SECONDS: float = 30.0  # 分析任务执行期间刷新心跳的间隔(秒)，需明显小于上一项
     
     # JWT安全配置
     SECRET_KEY: str = generate_secret_key()  # 默认生成安全密钥
@@ -99,10 +103,82 @@ class Settings(BaseSettings):
     
     # AI分析配置
     AI_TIMEOUT: int = 30  # 秒
-    AI_RETRY_TIMES: int = 3
+    AI_RETRY_TIMES: int = 3  # 临时错误（连接错误、429、5xx）的最大重试次数
+    AI_RETRY_BASE_DELAY: float = 1.0  # 指数退避基准时间(秒)
+    AI_RETRY_MAX_DELAY: float = 20.0  # 单次退避上限(秒)，Retry-After 更长时以其为准
+    AI_MATERIAL_TIME_BUDGET: float = 300.0  # 单个材料全部调用、重试和等待的时间上限(秒)
     AI_MAX_CONCURRENT: int = 5
     AI_COST_LIMIT: float = 0.1  # 单次分析成本上限(元)
-    
+    AI_PROJECT_BUDGET: float = 0.0  # 单个项目AI分析累计成本预算(元)，0表示不限
+    ANALYSIS_FLUSH_INTERVAL: float = 2.0  # 分析结果批量写入数据库的最长间隔(秒)
+
+    # AI服务熔断与对冲请求配置
+    AI_CIRCUIT_FAILURE_THRESHOLD: int = 5  # 连续失败/超时次数达到后熔断
+    AI_CIRCUIT_RECOVERY_SECONDS: int = 60  # 熔断后进入半开探测的等待时间(秒)
+    AI_HEDGE_ENABLED: bool = False  # 是否启用对冲请求
+    AI_HEDGE_MIN_DELAY: float = 5.0  # 对冲请求最小等待时间(秒)
+    AI_HEDGE_DEFAULT_DELAY: float = 30.0  # 样本不足时的对冲等待时间(秒)
+    AI_HEDGE_MIN_SAMPLES: int = 10  # 计算p95延迟所需的最少样本数
+
+    # AI服务HTTP连接池配置（进程内共享，按主机限制连接数）
+    AI_HTTP_MAX_CONNECTIONS: int = 50  # 每个主机最大连接数
+    AI_HTTP_MAX_KEEPALIVE: int = 20  # 每个主机最大保持的空闲长连接数
+    AI_HTTP_KEEPALIVE_EXPIRY: float = 60.0  # 空闲长连接保持时间(秒)
+    AI_HTTP2_ENABLED: bool = True  # 服务端支持时使用HTTP/2
+
+    # AI流式响应配置
+    AI_STREAM_ENABLED: bool = False  # OpenAI兼容服务使用流式输出
+    AI_STREAM_FIRST_TOKEN_TIMEOUT: float = 60.0  # 等待首个token的最长时间(秒)
+    AI_STREAM_STALL_TIMEOUT: float = 20.0  # 输出开始后无新token即判定卡死的时间(秒)
+    AI_STREAM_STOP_AFTER_PRICE_RANGE: bool = False  # 价格区间有效后立即停止读取（不保留数据源和推理过程）
+
+    # AI调用遥测
+    AI_TELEMETRY_MAX_EVENTS: int = 20000  # 按时间窗口统计时保留的最近调用数
+    AI_TELEMETRY_EXPORT_ENABLED: bool = True  # 提供 /metrics/ai（Prometheus格式）
+
+    # AI服务路由策略：static 按配置顺序；weighted 按近期成功率/延迟/成本选择
+    AI_ROUTING_POLICY: str = "static"
+    AI_ROUTING_WINDOW_SECONDS: int = 900  # 统计窗口(秒)
+    AI_ROUTING_MIN_SAMPLES: int = 20  # 样本数低于该值的服务处于探索阶段
+    AI_ROUTING_MIN_SUCCESS_RATE: float = 0.95  # 成功率下限
+    AI_ROUTING_MAX_P95_LATENCY: float = 40.0  # p95延迟上限(秒)
+    AI_ROUTING_COST_WEIGHT: float = 1.0  # 每次成功分析成本的权重
+    AI_ROUTING_LATENCY_WEIGHT: float = 0.0  # 每次成功分析耗时的权重
+    AI_ROUTING_REFRESH_SECONDS: float = 10.0  # 路由顺序重新计算间隔(秒)
+
+    # 分析预估（无遥测样本时使用的默认值）
+    AI_ESTIMATE_DEFAULT_LATENCY: float = 30.0  # 单次分析延迟(秒)
+    AI_ESTIMATE_COMPLETION_TOKENS: int = 900  # 单次分析输出token数
+
+    # 分析结果复用（调用AI前查找近期已分析的相近材料）
+    AI_REUSE_ENABLED: bool = True
+    AI_REUSE_SIMILARITY: float = 0.95  # 达到该相似度直接复用
+    AI_REUSE_PROVISIONAL_SIMILARITY: float = 0.85  # 达到该相似度作为暂定价格返回
+    AI_REUSE_MAX_AGE_DAYS: int = 90  # 只复用该天数内完成的分析
+    AI_REUSE_BASE_DATE_WINDOW_MONTHS: int = 3  # 基期信息价日期相差不超过的月数
+
+    # 价格合理性分析
+    REASONABILITY_BASELINE_CACHE_SECONDS: float = 3600.0  # 全部项目单价分布基线（异常检测 portfolio 基线）的缓存时间(秒)
+    MARKET_TREND_THRESHOLD: float = 0.02  # 市场指数近3个月累计变化超过该比例时判定为 rising/falling
+    MARKET_INDEX_CACHE_SECONDS: float = 600.0  # 市场指数查询结果的进程内缓存时间(秒)，导入后按地区失效
+
+    # 报告渲染（Word文档构建在独立进程中执行，不阻塞事件循环）
+    REPORT_RENDER_WORKERS: int = 2  # 渲染进程数，0表示在API进程内同步渲染（本地调试）
+    REPORT_RENDER_TIMEOUT: float = 300.0  # 单份报告渲染的最长时间(秒)
+    CHART_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # 报告图表PNG缓存的总大小上限(字节)，超出时淘汰最久未使用的图表
+
+    # AI服务模拟器（压测/容量规划，启用后不调用真实服务）
+    AI_SIMULATOR_ENABLED: bool = False
+    AI_SIMULATOR_BASE_URL: str = ""  # OpenAI兼容桩服务地址，为空时在进程内模拟
+    AI_SIMULATOR_LATENCY_MEDIAN: float = 8.0  # 延迟中位数(秒)
+    AI_SIMULATOR_LATENCY_SIGMA: float = 0.6  # 对数正态分布sigma
+    AI_SIMULATOR_TIMEOUT_RATE: float = 0.02  # 挂起请求比例
+    AI_SIMULATOR_RATE_LIMIT_RATE: float = 0.02  # 429比例
+    AI_SIMULATOR_MALFORMED_RATE: float = 0.03  # 非JSON响应比例
+    AI_SIMULATOR_SEED: Optional[int] = None
+    AI_SIMULATOR_COST: float = 0.0  # 模拟单次成本(元)
+    AI_SIMULATOR_RATE_LIMIT: int = 100  # 模拟服务每分钟请求数限制
+
     # 系统限制
     MAX_MATERIALS_PER_BATCH: int = 50000
     API_CALL_RATE_LIMIT: int = 100  # 每分钟
@@ -1,6 +1,6 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, text
 from app.core.config import settings
 import redis
 
@@ -67,6 +67,9 @@ async def create_tables():
     from app.models import user, material, unmatched_material, project, analysis
 
     async with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            # 名称模糊搜索的三元组索引依赖 pg_trgm 扩展
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         await conn.run_sync(Base.metadata.create_all)
 
 
@@ -1,6 +1,6 @@
 # 数据库模型包初始化文件
 from app.models.user import User, UserSession, UserRole
-from app.models.material import BaseMaterial, MaterialAlias
+from app.models.material import BaseMaterial, MaterialAlias, MaterialPriceMonthly, MaterialMarketIndex
 from app.models.project import Project, ProjectMaterial, ProjectStatus
 from app.models.analysis import PriceAnalysis, AuditReport, AnalysisStatus
 
@@ -13,6 +13,8 @@ __all__ = [
     # 材料相关
     "BaseMaterial",
     "MaterialAlias",
+    "MaterialPriceMonthly",
+    "MaterialMarketIndex",
     
     # 项目相关
     "Project",
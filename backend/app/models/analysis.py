@@ -15,7 +15,7 @@ class AnalysisStatus(str, enum.Enum):
 
 
 class PriceAnalysis(Base):
-    """价格分析表（当前最新结果，仍保持每个材料一条记录）
+    """价格分析表（当前最新结果，每个材料一条记录，material_id 唯一以支持批量 upsert）
 
     注意：从 2025-12 以后，历史记录会同步写入 `PriceAnalysisHistory` 表，
     前端时间线优先从历史表读取，当前表只保存“最新一次”的完整结果，避免破坏现有逻辑。
@@ -75,7 +75,7 @@ class PriceAnalysis(Base):
     analyzed_at = Column(DateTime(timezone=True), nullable=True, comment="分析完成时间")
     
     __table_args__ = (
-        Index('ix_price_analyses_material', 'material_id'),
+        Index('ix_price_analyses_material', 'material_id', unique=True),
         Index('ix_price_analyses_status', 'status'),
     )
 
@@ -105,8 +105,56 @@ class PriceAnalysisHistory(Base):
         Index('ix_price_analysis_history_material', 'material_id'),
         Index('ix_price_analysis_history_status', 'status'),
     )
-    
-    
+
+
+class AnalysisJobStatus(str, enum.Enum):
+    """分析任务状态枚举"""
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    BUDGET_EXHAUSTED = "budget_exhausted"  # 成本预算用完，剩余材料未分析，提高预算后可恢复
+
+
+class AnalysisJob(Base):
+    """项目AI价格分析任务表
+
+    任务提交时固定待分析的材料清单；每个材料的分析结果单独提交（即检查点），
+    任务中断后根据 `price_analyses` 中本任务开始后已完成/失败的记录跳过已处理材料，从断点继续。
+    """
+    __tablename__ = "analysis_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False, comment="项目ID")
+    task_id = Column(String(100), nullable=True, comment="Celery任务ID")
+    status = Column(SQLEnum(AnalysisJobStatus), default=AnalysisJobStatus.QUEUED, comment="任务状态")
+
+    # 任务参数与待分析材料清单
+    material_ids = Column(JSON, nullable=False, comment="待分析材料ID列表")
+    preferred_provider = Column(String(50), nullable=True, comment="首选AI服务提供商")
+    force_reanalyze = Column(Boolean, default=False, comment="是否强制重新分析")
+    cost_budget = Column(Float, nullable=True, comment="项目AI分析成本预算（元，为空时使用 AI_PROJECT_BUDGET，0表示不限）")
+
+    # 进度
+    total_count = Column(Integer, default=0, comment="材料总数")
+    done_count = Column(Integer, default=0, comment="已成功数量")
+    failed_count = Column(Integer, default=0, comment="失败数量")
+    resumed_count = Column(Integer, default=0, comment="本次运行开始时已处理的数量")
+    attempts = Column(Integer, default=0, comment="运行（含恢复）次数")
+    error_message = Column(Text, nullable=True, comment="任务级错误信息")
+
+    # 时间戳
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), comment="创建时间")
+    started_at = Column(DateTime(timezone=True), nullable=True, comment="本次运行开始时间")
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True, comment="最近一次进度上报时间")
+    finished_at = Column(DateTime(timezone=True), nullable=True, comment="完成时间")
+
+    __table_args__ = (
+        Index('ix_analysis_jobs_project', 'project_id'),
+        Index('ix_analysis_jobs_status', 'status'),
+    )
+
+
 class AuditReport(Base):
     """审计报告表"""
     __tablename__ = "audit_reports"
@@ -96,6 +96,84 @@ class BaseMaterial(Base):
         Index('ix_base_materials_region_date', 'region', 'effective_date'),
         Index('ix_base_materials_category', 'category', 'subcategory'),
         Index('ix_base_materials_price_type_date', 'price_type', 'price_date'),
+        # 名称模糊搜索（ILIKE '%...%'）使用 pg_trgm 三元组索引
+        Index(
+            'ix_base_materials_name_trgm', 'name',
+            postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}
+        ),
+    )
+
+
+class MaterialPriceMonthly(Base):
+    """信息价月度汇总表（按材料标识 × 地区 × 信息价类型 × 月份汇总，由基准材料导入/删除时增量刷新）"""
+    __tablename__ = "material_price_monthly"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    identity_key = Column(Text, nullable=False, comment="材料标识（有编码为 code:编码，否则为 name:名称+规格）")
+    material_code = Column(String(50), nullable=True, comment="材料编码")
+    name = Column(String(200), nullable=False, comment="材料名称")
+    specification = Column(Text, nullable=False, default="", comment="规格型号")
+    unit = Column(String(20), nullable=False, comment="计量单位")
+    region = Column(String(100), nullable=False, comment="适用地区")
+    province = Column(String(50), nullable=True, comment="省份")
+    price_type = Column(String(20), nullable=False, default="", comment="信息价类型 (provincial/municipal)")
+    month = Column(String(7), nullable=False, comment="月份 (YYYY-MM)")
+    
+    # 当月价格均值（空值不参与平均，跨月加权时使用对应字段的非空条数）
+    price = Column(Float, nullable=True, comment="单价均值")
+    price_including_tax = Column(Float, nullable=True, comment="含税信息价均值")
+    price_excluding_tax = Column(Float, nullable=True, comment="除税信息价均值")
+    effective_price = Column(Float, nullable=True, comment="有效单价均值（每条优先取除税价，无除税价时取单价）")
+    sample_count = Column(Integer, nullable=False, default=0, comment="汇总的基准材料条数")
+    price_count = Column(Integer, nullable=False, default=0, comment="单价非空的条数")
+    price_including_tax_count = Column(Integer, nullable=False, default=0, comment="含税信息价非空的条数")
+    price_excluding_tax_count = Column(Integer, nullable=False, default=0, comment="除税信息价非空的条数")
+    effective_count = Column(Integer, nullable=False, default=0, comment="有效单价非空的条数")
+    
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), comment="更新时间")
+    
+    __table_args__ = (
+        Index(
+            'ux_material_price_monthly_grain',
+            'identity_key', 'unit', 'region', 'price_type', 'month',
+            unique=True
+        ),
+        Index('ix_material_price_monthly_code', 'material_code'),
+        Index('ix_material_price_monthly_name', 'name'),
+        Index(
+            'ix_material_price_monthly_name_trgm', 'name',
+            postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}
+        ),
+        Index('ix_material_price_monthly_month', 'month'),
+    )
+
+
+class MaterialMarketIndex(Base):
+    """信息价市场指数表（按地区 × 材料分类 × 月份，由基准材料导入时按地区增量刷新）
+
+    指数按同一材料相邻月份价比的几何平均链式计算，首月为 100；分类为"全部"的行是地区内全部材料的指数。
+    """
+    __tablename__ = "material_market_index"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    region = Column(String(100), nullable=False, comment="适用地区")
+    category = Column(String(100), nullable=False, comment="材料分类（全部 表示地区内全部材料）")
+    month = Column(String(7), nullable=False, comment="月份 (YYYY-MM)")
+    
+    index_value = Column(Float, nullable=False, comment="价格指数（序列首月为100）")
+    mom_change = Column(Float, nullable=True, comment="环比变化率（无可比材料时为空）")
+    yoy_change = Column(Float, nullable=True, comment="同比变化率（无12个月前指数时为空）")
+    trend = Column(String(20), nullable=False, comment="近3个月趋势 (rising/falling/stable)")
+    seasonal_factor = Column(Float, nullable=False, default=1.0, comment="该自然月的季节因子")
+    average_price = Column(Float, nullable=True, comment="当月材料均价")
+    sample_count = Column(Integer, nullable=False, default=0, comment="当月材料数")
+    linked_count = Column(Integer, nullable=False, default=0, comment="与上月可比的材料数")
+    
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), comment="更新时间")
+    
+    __table_args__ = (
+        Index('ux_material_market_index_grain', 'region', 'category', 'month', unique=True),
+        Index('ix_material_market_index_month', 'month'),
     )
 
 
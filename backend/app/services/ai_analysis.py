@@ -1,16 +1,37 @@
 import asyncio
 import json
+import random
 import time
-from typing import Dict, List, Optional, Any, Tuple
+from collections import deque
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Any, Tuple, Callable, Awaitable
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
+from types import SimpleNamespace
 
 import httpx
+import openai
 from openai import AsyncOpenAI
 from loguru import logger
 
 from app.core.config import settings
+from app.services.ai_routing import provider_router
+from app.services.ai_telemetry import (
+    ai_telemetry,
+    OUTCOME_SUCCESS,
+    OUTCOME_PARSE_ERROR,
+    OUTCOME_TIMEOUT,
+    OUTCOME_ERROR,
+    OUTCOME_CANCELLED,
+)
+from app.utils.stream_json import (
+    IncrementalJSONScanner,
+    estimate_tokens,
+    is_numeric_price_range,
+    validate_price_range,
+)
 
 
 class AIProvider(str, Enum):
@@ -22,6 +43,7 @@ class AIProvider(str, Enum):
     BAIDU = "baidu"  # 文心一言
     FALLBACK = "fallback"  # 备用方案
     DEMO = "demo"  # 演示模式
+    SIMULATOR = "simulator"  # 压测模拟器
 
 
 @dataclass
@@ -45,6 +67,251 @@ class PriceAnalysisResult:
     reference_urls: Optional[List[Dict[str, Any]]] = None  # AI分析参考的网址列表
 
 
+class StreamParseFallback(Exception):
+    """流式输出的价格区间不是数字
+
+    属于内容格式问题而不是服务故障：不计入熔断，由 AIServiceManager 按完整文本降级解析。
+    """
+
+    def __init__(self, message: str, content: str, model: Optional[str], usage: Any):
+        super().__init__(message)
+        self.content = content
+        self.model = model
+        self.usage = usage
+
+
+class CircuitState(str, Enum):
+    """熔断器状态枚举"""
+    CLOSED = "closed"  # 正常放行
+    OPEN = "open"  # 熔断中，拒绝请求
+    HALF_OPEN = "half_open"  # 半开，允许单个探测请求
+
+
+class CircuitBreaker:
+    """单个AI服务提供商的熔断器
+
+    连续失败（含超时）达到阈值后熔断；熔断一段时间后进入半开状态，
+    只放行一个探测请求，探测成功则恢复，失败则重新熔断。
+    同时记录最近的成功延迟，用于计算对冲请求的p95等待时间。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: Optional[int] = None,
+        recovery_timeout: Optional[float] = None,
+        latency_window: int = 100
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold or settings.AI_CIRCUIT_FAILURE_THRESHOLD
+        self.recovery_timeout = recovery_timeout or settings.AI_CIRCUIT_RECOVERY_SECONDS
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.total_timeouts = 0
+        self.total_successes = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._latencies = deque(maxlen=latency_window)
+
+    def allow_request(self) -> bool:
+        """判断当前是否允许向该服务发起请求"""
+        if self.state == CircuitState.CLOSED:
+            return True
+
+        if self.state == CircuitState.OPEN:
+            if self.opened_at is not None and time.time() - self.opened_at >= self.recovery_timeout:
+                self.state = CircuitState.HALF_OPEN
+                self._probe_in_flight = False
+                logger.info(f"{self.name} 熔断冷却结束，进入半开探测状态")
+            else:
+                return False
+
+        # 半开状态只允许一个探测请求
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self, latency: float):
+        """记录一次成功调用"""
+        self.total_successes += 1
+        self.consecutive_failures = 0
+        self._latencies.append(latency)
+        if self.state != CircuitState.CLOSED:
+            logger.info(f"{self.name} 探测成功，熔断器恢复关闭")
+        self.state = CircuitState.CLOSED
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self, is_timeout: bool = False):
+        """记录一次失败或超时调用"""
+        self.total_failures += 1
+        if is_timeout:
+            self.total_timeouts += 1
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+
+        if self.state == CircuitState.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != CircuitState.OPEN:
+                logger.warning(
+                    f"{self.name} 连续失败 {self.consecutive_failures} 次，熔断 {self.recovery_timeout} 秒"
+                )
+            self.state = CircuitState.OPEN
+            self.opened_at = time.time()
+
+    def record_cancelled(self):
+        """对冲请求被取消时释放探测名额，不计入成功或失败"""
+        self._probe_in_flight = False
+
+    def p95_latency(self) -> Optional[float]:
+        """最近成功调用延迟的p95，样本不足时返回None"""
+        if len(self._latencies) < settings.AI_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """熔断器状态快照"""
+        return {
+            "state": self.state.value,
+            "consecutive_failures": self.consecutive_failures,
+            "total_successes": self.total_successes,
+            "total_failures": self.total_failures,
+            "total_timeouts": self.total_timeouts,
+            "p95_latency": self.p95_latency(),
+            "opened_at": self.opened_at
+        }
+
+
+# 进程级熔断器注册表：AIServiceManager 按请求创建，熔断状态需要跨请求保留
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(provider: "AIProvider") -> CircuitBreaker:
+    """获取（或创建）指定服务提供商的熔断器"""
+    key = provider.value if isinstance(provider, AIProvider) else str(provider)
+    breaker = _circuit_breakers.get(key)
+    if breaker is None:
+        breaker = CircuitBreaker(key)
+        _circuit_breakers[key] = breaker
+    return breaker
+
+
+# 进程级AI服务注册表：services / primary_service / fallback_services
+_provider_registry: Dict[str, Any] = {}
+
+
+# 进程级HTTP连接池：按主机复用，保持长连接，避免每次请求重新握手
+_http_clients: Dict[str, httpx.AsyncClient] = {}
+_http2_supported: Optional[bool] = None
+
+
+def _http2_available() -> bool:
+    """HTTP/2 需要安装 h2 依赖，未安装时回退到 HTTP/1.1"""
+    global _http2_supported
+    if _http2_supported is None:
+        if not settings.AI_HTTP2_ENABLED:
+            _http2_supported = False
+        else:
+            try:
+                import h2  # noqa: F401
+                _http2_supported = True
+            except ImportError:
+                logger.warning("未安装h2，AI服务HTTP连接使用HTTP/1.1")
+                _http2_supported = False
+    return _http2_supported
+
+
+def get_http_client(base_url: str) -> httpx.AsyncClient:
+    """获取指定主机共享的HTTP客户端（每个主机单独的连接池和连接数限制）"""
+    url = httpx.URL(base_url)
+    key = f"{url.scheme}://{url.host}:{url.port or ''}"
+    client = _http_clients.get(key)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=_http2_available(),
+            limits=httpx.Limits(
+                max_connections=settings.AI_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.AI_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=settings.AI_HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(120.0, connect=10.0)
+        )
+        _http_clients[key] = client
+    return client
+
+
+async def close_ai_clients():
+    """关闭共享HTTP连接池并清空服务注册表
+
+    应用关闭时调用；Celery任务每次运行使用新的事件循环，结束时也需调用，
+    避免下次运行复用绑定在旧事件循环上的连接。
+    """
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    _provider_registry.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"关闭AI服务HTTP客户端失败: {e}")
+
+
+# 当前材料分析的截止时间（事件循环时间），由 AIServiceManager 设置；重试和限流等待不超过该时间
+_material_deadline: ContextVar[Optional[float]] = ContextVar("ai_material_deadline", default=None)
+
+# 可重试的HTTP状态码：请求超时、冲突、限流和服务端临时错误
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+def _error_status_code(error: Exception) -> Optional[int]:
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """判断错误是否可重试：连接错误、429和5xx可重试；超时、鉴权、参数错误和解析错误不重试"""
+    if isinstance(error, asyncio.TimeoutError):
+        # 单次调用超时（含流式卡死）由 AIServiceManager 计入熔断并转移到下一个服务
+        return False
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return True
+    if getattr(error, "retry_after", None) is not None:
+        return True
+    return _error_status_code(error) in RETRYABLE_STATUS_CODES
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """从错误或响应头（Retry-After / retry-after-ms）中读取服务端要求的等待时间"""
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if not headers:
+            return None
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms is not None:
+            try:
+                return max(float(retry_after_ms) / 1000, 0.0)
+            except (TypeError, ValueError):
+                pass
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        # HTTP日期格式
+        return max(parsedate_to_datetime(str(value)).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
 class AIServiceBase(ABC):
     """AI服务基类"""
     
@@ -54,6 +321,8 @@ class AIServiceBase(ABC):
         self.base_url = ""
         self.rate_limit = 100  # 每分钟请求次数
         self.cost_per_request = 0.0  # 单次请求成本
+        self.request_timeout = 60  # 单次调用超时时间（秒），超时计入熔断失败
+        self.supports_streaming = False  # OpenAI兼容的chat.completions接口支持流式输出
         self._request_timestamps = []
     
     @abstractmethod
@@ -82,6 +351,160 @@ class AIServiceBase(ABC):
     def _record_request(self):
         """记录请求时间"""
         self._request_timestamps.append(time.time())
+
+    async def _acquire_rate_slot(self, deadline: float):
+        """等待频率限制名额并记录本次请求（重试同样计入）；截止时间前无法获得名额时报错"""
+        loop = asyncio.get_running_loop()
+        while not self._check_rate_limit():
+            oldest = self._request_timestamps[0] if self._request_timestamps else time.time()
+            wait = max(60 - (time.time() - oldest), 0.05)
+            if loop.time() + wait >= deadline:
+                raise Exception("API调用频率超限")
+            await asyncio.sleep(wait)
+        self._record_request()
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        """指数退避（全抖动）；服务端给出 Retry-After 时至少等待该时间"""
+        backoff = random.uniform(0, min(settings.AI_RETRY_MAX_DELAY, settings.AI_RETRY_BASE_DELAY * 2 ** attempt))
+        retry_after = retry_after_seconds(error)
+        return max(backoff, retry_after) if retry_after is not None else backoff
+
+    async def _call_with_retry(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """按重试策略执行一次远程调用
+
+        - 每次尝试前获取频率限制名额，单次尝试受 request_timeout 约束；
+        - 可重试错误最多重试 AI_RETRY_TIMES 次，退避时间不超过材料剩余的时间预算；
+        - 不可重试的错误和超时直接抛出，由 AIServiceManager 转移到下一个服务。
+        """
+        loop = asyncio.get_running_loop()
+        deadline = _material_deadline.get() or loop.time() + settings.AI_MATERIAL_TIME_BUDGET
+        attempt = 0
+        while True:
+            await self._acquire_rate_slot(deadline)
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"{self.name} 材料分析时间预算已用完")
+            try:
+                return await asyncio.wait_for(call(), timeout=min(self.request_timeout, remaining))
+            except asyncio.TimeoutError:
+                raise
+            except Exception as e:
+                if attempt >= settings.AI_RETRY_TIMES or not is_retryable_error(e):
+                    raise
+                delay = self._retry_delay(attempt, e)
+                if loop.time() + delay >= deadline:
+                    logger.warning(f"{self.name} 调用失败且剩余时间预算不足以重试: {e}")
+                    raise
+                attempt += 1
+                logger.warning(f"{self.name} 调用失败（{e}），{delay:.1f}秒后第{attempt}次重试")
+                await asyncio.sleep(delay)
+
+    async def _create_chat_completion(self, **kwargs) -> Any:
+        """调用 chat.completions（带重试）"""
+        return await self._call_with_retry(lambda: self._create_chat_completion_once(**kwargs))
+
+    async def _create_chat_completion_once(self, **kwargs) -> Any:
+        """单次调用 chat.completions；启用流式模式时改为流式读取，返回结构与非流式响应一致"""
+        if settings.AI_STREAM_ENABLED and self.supports_streaming:
+            return await self._stream_chat_completion(**kwargs)
+        return await self.client.chat.completions.create(**kwargs)
+
+    async def _stream_chat_completion(self, **kwargs) -> Any:
+        """流式读取响应
+
+        - 首个token前等待 AI_STREAM_FIRST_TOKEN_TIMEOUT 秒，之后超过 AI_STREAM_STALL_TIMEOUT 秒
+          没有新内容即判定为卡死，抛出 TimeoutError（计入熔断并转移到下一个服务）；
+        - `price_range` 输出完整后立即校验，数值无效则中止，不再等待剩余内容；
+          不是数字（如字符串 "4200"）时读取完整文本后抛出 StreamParseFallback，按文本降级解析；
+        - 顶层JSON对象闭合后停止读取，忽略之后的多余输出；
+          开启 AI_STREAM_STOP_AFTER_PRICE_RANGE 时在价格区间有效后即停止；
+        - 请求末尾的用量统计（stream_options.include_usage），提前停止读取而没有收到时按文本长度估算。
+        """
+        stream = await self.client.chat.completions.create(
+            stream=True,
+            stream_options={"include_usage": True},
+            **kwargs
+        )
+        scanner = IncrementalJSONScanner()
+        parts: List[str] = []
+        model = kwargs.get("model")
+        usage = None
+        iterator = stream.__aiter__()
+        price_range_checked = False
+        non_numeric_price_range = False
+        content: Optional[str] = None
+
+        try:
+            while True:
+                timeout = settings.AI_STREAM_STALL_TIMEOUT if parts else settings.AI_STREAM_FIRST_TOKEN_TIMEOUT
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise asyncio.TimeoutError(f"{self.name} 流式响应 {timeout} 秒无新内容")
+
+                model = getattr(chunk, "model", None) or model
+                usage = getattr(chunk, "usage", None) or usage
+                choices = getattr(chunk, "choices", None) or []
+                delta = getattr(choices[0].delta, "content", None) if choices else None
+                if not delta:
+                    continue
+
+                parts.append(delta)
+                scanner.feed(delta)
+
+                if scanner.watched_value is not None and not price_range_checked:
+                    price_range_checked = True
+                    if not is_numeric_price_range(scanner.watched_value):
+                        # 格式问题：继续读取完整文本，之后降级解析
+                        non_numeric_price_range = True
+                    else:
+                        error = validate_price_range(scanner.watched_value)
+                        if error:
+                            raise ValueError(f"{self.name} 返回的价格区间无效: {error}")
+                        if settings.AI_STREAM_STOP_AFTER_PRICE_RANGE:
+                            content = json.dumps({"price_range": scanner.watched_value}, ensure_ascii=False)
+                            break
+
+                if scanner.completed and not non_numeric_price_range:
+                    content = scanner.json_text
+                    break
+        finally:
+            # 提前结束时关闭底层连接，不再接收剩余token
+            response = getattr(stream, "response", None)
+            if response is not None:
+                try:
+                    await response.aclose()
+                except Exception:
+                    pass
+
+        full_text = "".join(parts)
+        if usage is None:
+            prompt_tokens = sum(
+                estimate_tokens(str(message.get("content") or "")) for message in kwargs.get("messages") or []
+            )
+            completion_tokens = estimate_tokens(full_text)
+            usage = SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens
+            )
+
+        if non_numeric_price_range:
+            raise StreamParseFallback(
+                f"{self.name} 返回的价格区间不是数字: {scanner.watched_value}", full_text, model, usage
+            )
+
+        if content is None:
+            # 未能识别完整JSON，交由原有解析逻辑处理完整文本
+            content = full_text
+
+        return SimpleNamespace(
+            model=model,
+            usage=usage,
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=content))]
+        )
     
     def _build_price_analysis_prompt(
         self,
@@ -158,13 +581,16 @@ class OpenAIService(AIServiceBase):
         self.api_key = settings.OPENAI_API_KEY
         self.base_url = settings.OPENAI_BASE_URL
         self.cost_per_request = 0.03  # 估算成本
+        self.supports_streaming = True
         
         if not self.api_key or self.api_key in ['your-openai-api-key', 'sk-placeholder'] or self.api_key.startswith('your-'):
             raise ValueError("OpenAI API key not configured")
         
         self.client = AsyncOpenAI(
             api_key=self.api_key,
-            base_url=self.base_url
+            base_url=self.base_url,
+            max_retries=0,  # 重试由 _call_with_retry 统一处理
+            http_client=get_http_client(self.base_url)
         )
     
     async def analyze_material_price(
@@ -177,9 +603,6 @@ class OpenAIService(AIServiceBase):
     ) -> PriceAnalysisResult:
         """使用OpenAI分析材料价格"""
         
-        if not self._check_rate_limit():
-            raise Exception("API调用频率超限")
-        
         start_time = time.time()
         
         try:
@@ -187,7 +610,7 @@ class OpenAIService(AIServiceBase):
                 material_name, specification, unit, region, context.get('base_date') if context else None
             )
             
-            response = await self.client.chat.completions.create(
+            response = await self._create_chat_completion(
                 model="gpt-4-turbo-preview",
                 messages=[
                     {
@@ -199,7 +622,6 @@ class OpenAIService(AIServiceBase):
                 temperature=0.3
             )
             
-            self._record_request()
             analysis_time = time.time() - start_time
             
             # 解析响应
@@ -308,15 +730,17 @@ class DashScopeService(AIServiceBase):
         self.api_key = settings.DASHSCOPE_API_KEY
         self.base_url = settings.DASHSCOPE_BASE_URL
         self.cost_per_request = 0.02
+        self.supports_streaming = True
         
         if not self.api_key or self.api_key in ['your-dashscope-api-key', 'sk-placeholder'] or self.api_key.startswith('your-dashscope'):
             raise ValueError("DashScope API key not configured")
         
         # 使用OpenAI兼容格式的客户端
-        from openai import AsyncOpenAI
         self.client = AsyncOpenAI(
             api_key=self.api_key,
-            base_url=self.base_url
+            base_url=self.base_url,
+            max_retries=0,  # 重试由 _call_with_retry 统一处理
+            http_client=get_http_client(self.base_url)
         )
     
     async def analyze_material_price(
@@ -329,9 +753,6 @@ class DashScopeService(AIServiceBase):
     ) -> PriceAnalysisResult:
         """使用通义千问分析材料价格"""
         
-        if not self._check_rate_limit():
-            raise Exception("API调用频率超限")
-        
         start_time = time.time()
         
         try:
@@ -340,7 +761,7 @@ class DashScopeService(AIServiceBase):
             )
             
             # 使用OpenAI兼容格式调用，启用联网搜索
-            response = await self.client.chat.completions.create(
+            response = await self._create_chat_completion(
                 model=settings.DASHSCOPE_MODEL,
                 messages=[
                     {
@@ -355,7 +776,6 @@ class DashScopeService(AIServiceBase):
                 }
             )
             
-            self._record_request()
             analysis_time = time.time() - start_time
             
             # 解析响应
@@ -505,16 +925,19 @@ class DoubaoService(AIServiceBase):
         self.api_key = settings.DOUBAO_API_KEY
         self.base_url = settings.DOUBAO_BASE_URL
         self.cost_per_request = 0.02
+        self.supports_streaming = True
+        self.request_timeout = 150  # 豆包响应较慢，额外放宽超时时间
         
         if not self.api_key or self.api_key in ['your-doubao-api-key', 'sk-placeholder'] or self.api_key.startswith('your-'):
             raise ValueError("Doubao API key not configured")
         
         # 使用OpenAI兼容格式的客户端，设置较长的超时时间（AI分析需要较长时间）
-        from openai import AsyncOpenAI
         self.client = AsyncOpenAI(
             api_key=self.api_key,
             base_url=self.base_url,
-            timeout=120.0  # 设置120秒超时，避免连接超时错误
+            timeout=120.0,  # 设置120秒超时，避免连接超时错误
+            max_retries=0,  # 重试由 _call_with_retry 统一处理
+            http_client=get_http_client(self.base_url)
         )
     
     async def analyze_material_price(
@@ -527,9 +950,6 @@ class DoubaoService(AIServiceBase):
     ) -> PriceAnalysisResult:
         """使用豆包分析材料价格"""
         
-        if not self._check_rate_limit():
-            raise Exception("API调用频率超限")
-        
         start_time = time.time()
         
         try:
@@ -538,7 +958,7 @@ class DoubaoService(AIServiceBase):
             )
             
             # 使用OpenAI兼容格式调用豆包API
-            response = await self.client.chat.completions.create(
+            response = await self._create_chat_completion(
                 model=settings.DOUBAO_MODEL,
                 messages=[
                     {
@@ -550,7 +970,6 @@ class DoubaoService(AIServiceBase):
                 temperature=0.3
             )
             
-            self._record_request()
             analysis_time = time.time() - start_time
             
             # 解析响应
@@ -692,9 +1111,6 @@ class DeepSeekService(AIServiceBase):
         if not self.api_key:
             raise ValueError("DeepSeek API key not configured")
 
-        if not self._check_rate_limit():
-            raise Exception("API调用频率超限")
-        
         start_time = time.time()
         
         try:
@@ -731,109 +1147,108 @@ class DeepSeekService(AIServiceBase):
                 ]
             }
             
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(url, headers=headers, json=data)
-                
+            client = get_http_client(self.base_url)
+
+            async def send():
+                response = await client.post(url, headers=headers, json=data, timeout=120.0)
                 if response.status_code != 200:
                     logger.error(f"DeepSeek API Error: {response.text}")
                     response.raise_for_status()
-                
-                result_json = response.json()
-                
-                # 检查是否有ToolNotOpen错误（用户未开通联网搜索）
-                if 'error' in result_json:
-                    error_info = result_json['error']
-                    if isinstance(error_info, dict) and error_info.get('code') == 'ToolNotOpen':
-                        logger.warning("用户未开通联网搜索功能，尝试不带搜索工具重试")
-                        # 移除工具配置，重新请求
-                        if 'tools' in data:
-                            del data['tools']
-                            # 重新发送请求
-                            response = await client.post(url, headers=headers, json=data)
-                            if response.status_code != 200:
-                                logger.error(f"DeepSeek API Retry Error: {response.text}")
-                                response.raise_for_status()
-                            result_json = response.json()
-                    else:
-                        # 其他错误，记录并抛出
-                        logger.error(f"DeepSeek API returned error: {result_json}")
-                        raise ValueError(f"DeepSeek API Error: {result_json}")
+                return response
 
-                self._record_request()
-                analysis_time = time.time() - start_time
-                
-                # 解析响应内容
-                content = ""
-                if 'choices' in result_json and len(result_json['choices']) > 0:
-                    message = result_json['choices'][0].get('message', {})
-                    content = message.get('content', '')
-                    if isinstance(content, list): # 有时候content可能是列表（如果多模态）
-                        content = "".join([c.get('text', '') for c in content if c.get('type') == 'text'])
-                elif 'output' in result_json and len(result_json['output']) > 0:
-                    # 处理Volcengine output格式
-                    first_output = result_json['output'][0]
-                    # 有可能是直接在output里，也有可能是message结构
-                    if 'message' in first_output:
-                        # 如果是 {'output': [{'message': {'content': ...}}]} 格式
-                        message = first_output.get('message', {})
-                        raw_content = message.get('content', '')
-                    else:
-                        # 如果是 {'output': [{'content': ...}]} 格式
-                        raw_content = first_output.get('content', '')
+            response = await self._call_with_retry(send)
+            result_json = response.json()
+            
+            # 检查是否有ToolNotOpen错误（用户未开通联网搜索）
+            if 'error' in result_json:
+                error_info = result_json['error']
+                if isinstance(error_info, dict) and error_info.get('code') == 'ToolNotOpen':
+                    logger.warning("用户未开通联网搜索功能，尝试不带搜索工具重试")
+                    # 移除工具配置，重新请求
+                    if 'tools' in data:
+                        del data['tools']
+                        # 重新发送请求
+                        response = await self._call_with_retry(send)
+                        result_json = response.json()
+                else:
+                    # 其他错误，记录并抛出
+                    logger.error(f"DeepSeek API returned error: {result_json}")
+                    raise ValueError(f"DeepSeek API Error: {result_json}")
 
-                    if isinstance(raw_content, list):
-                        content = "".join([c.get('text', '') for c in raw_content if c.get('type') in ['text', 'output_text']])
-                    elif isinstance(raw_content, str):
-                        content = raw_content
+            analysis_time = time.time() - start_time
+            
+            # 解析响应内容
+            content = ""
+            if 'choices' in result_json and len(result_json['choices']) > 0:
+                message = result_json['choices'][0].get('message', {})
+                content = message.get('content', '')
+                if isinstance(content, list): # 有时候content可能是列表（如果多模态）
+                    content = "".join([c.get('text', '') for c in content if c.get('type') == 'text'])
+            elif 'output' in result_json and len(result_json['output']) > 0:
+                # 处理Volcengine output格式
+                first_output = result_json['output'][0]
+                # 有可能是直接在output里，也有可能是message结构
+                if 'message' in first_output:
+                    # 如果是 {'output': [{'message': {'content': ...}}]} 格式
+                    message = first_output.get('message', {})
+                    raw_content = message.get('content', '')
                 else:
-                    # 尝试其他可能的字段，或者如果是ToolNotOpen重试后仍然失败
-                    logger.warning(f"DeepSeek响应结构未知: {result_json.keys()}")
-                    # 如果没有content，不要直接转str，否则会显示raw json
-                    if 'error' in result_json:
-                         raise ValueError(f"DeepSeek API Error: {result_json['error']}")
-                    content = str(result_json)
-
-                # 解析JSON结果
-                try:
-                    json_start = content.find('{')
-                    json_end = content.rfind('}') + 1
-                    if json_start != -1 and json_end > json_start:
-                        json_str = content[json_start:json_end]
-                        result_data = json.loads(json_str)
-                    else:
-                        raise ValueError("未找到JSON格式的结果")
-                    
-                    # 提取搜索URL (如果存在)
-                    search_urls = []
-                    # 尝试从tool_calls或其他字段提取，这里暂时简单处理
-                    
-                    return PriceAnalysisResult(
-                        material_name=material_name,
-                        specification=specification or "",
-                        predicted_price_min=result_data.get("price_range", {}).get("min_price"),
-                        predicted_price_max=result_data.get("price_range", {}).get("max_price"),
-                        predicted_price_avg=None,
-                        confidence_score=result_data.get("confidence_score", 0.5),
-                        data_sources=result_data.get("data_sources", []),
-                        reasoning=result_data.get("reasoning", ""),
-                        risk_factors=result_data.get("risk_factors", []),
-                        recommendations=[],
-                        analysis_time=analysis_time,
-                        analysis_cost=self.cost_per_request,
-                        provider=self.name,
-                        raw_response={
-                            "content": content,
-                            "model": settings.DEEPSEEK_MODEL,
-                            "full_response": result_json
-                        },
-                        analysis_prompt=prompt,
-                        reference_urls=result_data.get("reference_urls", [])
-                    )
+                    # 如果是 {'output': [{'content': ...}]} 格式
+                    raw_content = first_output.get('content', '')
+
+                if isinstance(raw_content, list):
+                    content = "".join([c.get('text', '') for c in raw_content if c.get('type') in ['text', 'output_text']])
+                elif isinstance(raw_content, str):
+                    content = raw_content
+            else:
+                # 尝试其他可能的字段，或者如果是ToolNotOpen重试后仍然失败
+                logger.warning(f"DeepSeek响应结构未知: {result_json.keys()}")
+                # 如果没有content，不要直接转str，否则会显示raw json
+                if 'error' in result_json:
+                     raise ValueError(f"DeepSeek API Error: {result_json['error']}")
+                content = str(result_json)
+
+            # 解析JSON结果
+            try:
+                json_start = content.find('{')
+                json_end = content.rfind('}') + 1
+                if json_start != -1 and json_end > json_start:
+                    json_str = content[json_start:json_end]
+                    result_data = json.loads(json_str)
+                else:
+                    raise ValueError("未找到JSON格式的结果")
                 
-                except (json.JSONDecodeError, ValueError):
-                    return self._parse_text_response(
-                        content, material_name, specification, analysis_time
-                    )
+                # 提取搜索URL (如果存在)
+                search_urls = []
+                # 尝试从tool_calls或其他字段提取，这里暂时简单处理
+                
+                return PriceAnalysisResult(
+                    material_name=material_name,
+                    specification=specification or "",
+                    predicted_price_min=result_data.get("price_range", {}).get("min_price"),
+                    predicted_price_max=result_data.get("price_range", {}).get("max_price"),
+                    predicted_price_avg=None,
+                    confidence_score=result_data.get("confidence_score", 0.5),
+                    data_sources=result_data.get("data_sources", []),
+                    reasoning=result_data.get("reasoning", ""),
+                    risk_factors=result_data.get("risk_factors", []),
+                    recommendations=[],
+                    analysis_time=analysis_time,
+                    analysis_cost=self.cost_per_request,
+                    provider=self.name,
+                    raw_response={
+                        "content": content,
+                        "model": settings.DEEPSEEK_MODEL,
+                        "full_response": result_json
+                    },
+                    analysis_prompt=prompt,
+                    reference_urls=result_data.get("reference_urls", [])
+                )
+            
+            except (json.JSONDecodeError, ValueError):
+                return self._parse_text_response(
+                    content, material_name, specification, analysis_time
+                )
 
         except Exception as e:
             logger.error(f"DeepSeek API调用失败: {e}")
@@ -1027,16 +1442,36 @@ class AIServiceManager:
     """AI服务管理器"""
     
     def __init__(self):
-        self.services = {}
-        self.primary_service = None
-        self.fallback_services = []
-        
-        # 初始化可用的AI服务
-        self._initialize_services()
+        # 服务实例（及其HTTP连接池）在进程内共享，按请求创建的管理器直接复用
+        if not _provider_registry:
+            self.services = {}
+            self.primary_service = None
+            self.fallback_services = []
+
+            # 初始化可用的AI服务
+            self._initialize_services()
+            _provider_registry.update(
+                services=self.services,
+                primary_service=self.primary_service,
+                fallback_services=self.fallback_services
+            )
+        else:
+            self.services = _provider_registry['services']
+            self.primary_service = _provider_registry['primary_service']
+            self.fallback_services = _provider_registry['fallback_services']
     
     def _initialize_services(self):
         """初始化AI服务"""
         
+        # 模拟器模式：只使用模拟服务，用于压测和容量规划
+        if settings.AI_SIMULATOR_ENABLED:
+            from app.services.ai_simulator import SimulatorAIService
+            simulator_service = SimulatorAIService()
+            self.services[AIProvider.SIMULATOR] = simulator_service
+            self.primary_service = simulator_service
+            logger.warning("AI模拟器已启用，所有分析请求由模拟器处理")
+            return
+        
         # 尝试初始化OpenAI服务
         try:
             if (settings.OPENAI_API_KEY and 
@@ -1129,44 +1564,247 @@ class AIServiceManager:
         context: Dict[str, Any] = None,
         preferred_provider: Optional[AIProvider] = None
     ) -> PriceAnalysisResult:
-        """分析材料价格（带故障转移）"""
-        
-        # 确定使用的服务顺序
-        services_to_try = []
-        
-        if preferred_provider and preferred_provider in self.services:
-            services_to_try.append(self.services[preferred_provider])
-        
-        if self.primary_service:
-            services_to_try.append(self.primary_service)
+        """分析材料价格（带熔断、故障转移和可选的对冲请求）
+
+        - 熔断中的服务会被跳过，半开状态只放行一个探测请求；
+        - 每次调用受服务自身的 request_timeout 约束，超时计入熔断失败并立即转移到下一个服务；
+        - 服务内部对临时错误按退避策略重试（见 AIServiceBase._call_with_retry），
+          单个材料的全部调用、重试和等待不超过 AI_MATERIAL_TIME_BUDGET 秒；
+        - 启用对冲时，若当前服务在其p95延迟内仍未返回，则并行发起下一个服务，取最先返回的有效结果。
+        """
         
-        services_to_try.extend(self.fallback_services)
-        
-        # 去重
-        services_to_try = list(dict.fromkeys(services_to_try))
+        # 确定使用的服务顺序（排除单次成本超过上限的服务）
+        services_to_try = self._resolve_service_order(preferred_provider)
         
         if not services_to_try:
             raise Exception("没有可用的AI服务")
+
+        services_to_try = self._filter_by_cost_limit(services_to_try)
+        if not services_to_try:
+            raise Exception(f"没有单次成本不超过 {self._request_cost_limit()} 元的AI服务")
         
-        last_error = None
+        candidates = list(services_to_try)
+        hedge_enabled = settings.AI_HEDGE_ENABLED and len(candidates) > 1
+        pending: Dict[asyncio.Task, Tuple[AIProvider, AIServiceBase, float]] = {}
+        errors: List[Exception] = []
+        fallback_result: Optional[PriceAnalysisResult] = None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.AI_MATERIAL_TIME_BUDGET
         
-        for service in services_to_try:
-            try:
+        def launch_next(force: bool = False) -> bool:
+            """按顺序启动下一个未熔断的服务，返回是否成功启动"""
+            while candidates:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    logger.warning("材料分析时间预算已用完，不再尝试其他服务")
+                    return False
+                provider, service = candidates.pop(0)
+                if not force and not get_circuit_breaker(provider).allow_request():
+                    logger.info(f"{service.name} 处于熔断状态，跳过")
+                    continue
                 logger.info(f"使用 {service.name} 进行价格分析")
-                result = await service.analyze_material_price(
-                    material_name, specification, unit, region, context
+                # 任务创建时复制上下文，服务内的重试和限流等待据此截止
+                token = _material_deadline.set(deadline)
+                try:
+                    task = asyncio.create_task(
+                        asyncio.wait_for(
+                            service.analyze_material_price(
+                                material_name, specification, unit, region, context
+                            ),
+                            timeout=remaining
+                        )
+                    )
+                finally:
+                    _material_deadline.reset(token)
+                pending[task] = (provider, service, time.time())
+                return True
+            return False
+        
+        if not launch_next():
+            # 全部熔断时强制探测首选服务，避免完全不可用
+            logger.warning("所有AI服务均处于熔断状态，强制探测首选服务")
+            candidates[:] = services_to_try[:1]
+            launch_next(force=True)
+        
+        try:
+            while pending:
+                hedge_delay = None
+                if hedge_enabled and candidates:
+                    newest_provider = list(pending.values())[-1][0]
+                    hedge_delay = self._resolve_hedge_delay(newest_provider)
+                
+                done, _ = await asyncio.wait(
+                    pending.keys(),
+                    timeout=hedge_delay,
+                    return_when=asyncio.FIRST_COMPLETED
                 )
-                logger.info(f"价格分析成功，使用服务: {service.name}")
-                return result
-            
-            except Exception as e:
-                logger.warning(f"{service.name} 分析失败: {e}")
-                last_error = e
-                continue
+                
+                if not done:
+                    # 当前请求超过p95延迟仍未返回，发起对冲请求
+                    if launch_next():
+                        logger.info(f"请求超过对冲等待时间 {hedge_delay:.1f}s，已发起对冲请求")
+                    continue
+                
+                for task in done:
+                    provider, service, started_at = pending.pop(task)
+                    breaker = get_circuit_breaker(provider)
+                    try:
+                        result = task.result()
+                    except StreamParseFallback as e:
+                        logger.warning(f"{e}，按完整文本降级解析")
+                        result = self._parse_stream_fallback(
+                            service, e, material_name, specification, time.time() - started_at
+                        )
+                    except asyncio.TimeoutError as e:
+                        logger.warning(f"{service.name} 分析超时: {e}")
+                        breaker.record_failure(is_timeout=True)
+                        self._record_telemetry(provider, service, OUTCOME_TIMEOUT, started_at)
+                        errors.append(e)
+                        continue
+                    except Exception as e:
+                        logger.warning(f"{service.name} 分析失败: {e}")
+                        breaker.record_failure()
+                        self._record_telemetry(provider, service, OUTCOME_ERROR, started_at)
+                        errors.append(e)
+                        continue
+                    
+                    breaker.record_success(time.time() - started_at)
+                    self._record_telemetry(provider, service, None, started_at, result)
+                    if not hedge_enabled or self._is_valid_result(result):
+                        logger.info(f"价格分析成功，使用服务: {service.name}")
+                        return result
+                    # 对冲模式下无效结果先保留，等待其他服务的有效结果
+                    fallback_result = fallback_result or result
+                
+                if not pending:
+                    launch_next()
+        finally:
+            for task, (provider, service, started_at) in pending.items():
+                task.cancel()
+                get_circuit_breaker(provider).record_cancelled()
+                self._record_telemetry(provider, service, OUTCOME_CANCELLED, started_at)
+        
+        if fallback_result is not None:
+            logger.info(f"未获得有效结果，返回 {fallback_result.provider} 的解析降级结果")
+            return fallback_result
         
         # 所有服务都失败了
+        last_error = errors[-1] if errors else None
+        if errors and all(isinstance(e, asyncio.TimeoutError) for e in errors):
+            raise asyncio.TimeoutError(f"所有AI服务均分析超时（共 {len(errors)} 次）")
         raise Exception(f"所有AI服务都失败了，最后一个错误: {last_error}")
     
+    @staticmethod
+    def _parse_stream_fallback(
+        service: AIServiceBase,
+        error: StreamParseFallback,
+        material_name: str,
+        specification: str,
+        analysis_time: float
+    ) -> PriceAnalysisResult:
+        """价格区间格式不符的流式响应按完整文本降级解析，保留模型和用量供遥测统计"""
+        result = service._parse_text_response(error.content, material_name, specification, analysis_time)
+        result.raw_response = {
+            **(result.raw_response or {}),
+            "model": error.model,
+            "usage": service._safe_serialize_usage(error.usage)
+        }
+        return result
+
+    @staticmethod
+    def _record_telemetry(
+        provider: AIProvider,
+        service: AIServiceBase,
+        outcome: Optional[str],
+        started_at: float,
+        result: Optional[PriceAnalysisResult] = None
+    ):
+        """记录一次调用的遥测数据；outcome 为空时根据结果判断成功或解析失败"""
+        raw = (result.raw_response if result else None) or {}
+        if outcome is None:
+            outcome = OUTCOME_PARSE_ERROR if raw.get("parse_error") else OUTCOME_SUCCESS
+        # 失败、超时和取消的调用不一定产生费用，按0计
+        cost = result.analysis_cost if result else 0.0
+        ai_telemetry.record(
+            provider=provider.value,
+            model=raw.get("model") or service.name,
+            outcome=outcome,
+            latency=time.time() - started_at,
+            usage=raw.get("usage"),
+            cost=cost
+        )
+
+    def _resolve_service_order(
+        self,
+        preferred_provider: Optional[AIProvider] = None
+    ) -> List[Tuple[AIProvider, AIServiceBase]]:
+        """返回 (provider, service) 列表：首选服务在前，其余按路由策略排列
+
+        static 策略下为主服务、备用服务的配置顺序；weighted 策略见 ai_routing。
+        """
+        provider_of = {}
+        for provider, service in self.services.items():
+            provider_of.setdefault(id(service), provider)
+        
+        ordered = []
+        if self.primary_service:
+            ordered.append(self.primary_service)
+        ordered.extend(self.fallback_services)
+        
+        # 去重
+        ordered = list(dict.fromkeys(ordered))
+        routed = provider_router.order([(provider_of[id(service)], service) for service in ordered])
+        
+        if preferred_provider and preferred_provider in self.services:
+            preferred = self.services[preferred_provider]
+            routed = [(provider_of[id(preferred)], preferred)] + [
+                item for item in routed if item[1] is not preferred
+            ]
+        return routed
+    
+    def get_routing_status(self) -> Dict[str, Any]:
+        """获取路由策略和各服务的评估"""
+        return provider_router.snapshot(self._resolve_service_order())
+    
+    @staticmethod
+    def _request_cost_limit() -> float:
+        """单次分析成本上限（AI_COST_LIMIT 与 MAX_QUERY_COST 取较小值）"""
+        return min(settings.AI_COST_LIMIT, settings.MAX_QUERY_COST)
+
+    def _filter_by_cost_limit(
+        self,
+        services: List[Tuple[AIProvider, AIServiceBase]]
+    ) -> List[Tuple[AIProvider, AIServiceBase]]:
+        """过滤掉单次成本超过上限的服务"""
+        limit = self._request_cost_limit()
+        return [(provider, service) for provider, service in services if service.cost_per_request <= limit]
+
+    def estimate_request_cost(self, preferred_provider: Optional[AIProvider] = None) -> float:
+        """预估单次分析成本：取实际会首先调用的服务的单次成本"""
+        services = self._filter_by_cost_limit(self._resolve_service_order(preferred_provider))
+        return services[0][1].cost_per_request if services else 0.0
+    
+    def _resolve_hedge_delay(self, provider: AIProvider) -> float:
+        """对冲等待时间：取该服务最近成功延迟的p95，样本不足时使用默认值"""
+        p95 = get_circuit_breaker(provider).p95_latency()
+        if p95 is None:
+            return settings.AI_HEDGE_DEFAULT_DELAY
+        return max(settings.AI_HEDGE_MIN_DELAY, p95)
+    
+    @staticmethod
+    def _is_valid_result(result: PriceAnalysisResult) -> bool:
+        """判断分析结果是否有效（解析成功且给出了价格区间）"""
+        if result.raw_response and result.raw_response.get("parse_error"):
+            return False
+        return result.predicted_price_min is not None and result.predicted_price_max is not None
+    
+    def get_circuit_breaker_status(self) -> Dict[str, Any]:
+        """获取已配置服务的熔断器状态"""
+        return {
+            provider.value: get_circuit_breaker(provider).snapshot()
+            for provider, _ in self._resolve_service_order()
+        }
+    
     def get_available_providers(self) -> List[str]:
         """获取可用的AI服务提供商列表"""
         return [provider.value for provider in self.services.keys()]
@@ -0,0 +1,183 @@
+"""AI服务路由策略
+
+根据近期遥测数据（ai_telemetry）为每次请求排列服务顺序：
+- static：按配置顺序（首个可用密钥为主服务，其余为备用），与原有行为一致；
+- weighted：满足成功率下限和p95延迟上限的服务优先，按加权得分从低到高排序，
+  得分 = 成本权重 × 每次成功分析的成本 + 延迟权重 × 每次成功分析的耗时（均按候选中的最大值归一化）。
+  默认权重（成本1、延迟0）即"成功率>95%且p95<40秒的服务中最便宜的优先"。
+
+样本不足的服务视为满足条件（探索阶段），得分按已知服务的中位水平估计；
+不满足条件的服务排在最后，仍作为故障转移的候选。
+首选服务（preferred_provider）始终排在第一位，熔断和故障转移逻辑不变。
+"""
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services.ai_telemetry import ai_telemetry
+
+
+ROUTING_STATIC = "static"
+ROUTING_WEIGHTED = "weighted"
+
+
+@dataclass
+class ProviderScore:
+    """单个服务的路由评估"""
+    provider: str
+    name: str
+    samples: int
+    success_rate: Optional[float]
+    p95_latency: Optional[float]
+    cost_per_request: float
+    cost_per_success: Optional[float]
+    seconds_per_success: Optional[float]
+    eligible: bool
+    exploring: bool
+    score: Optional[float] = None
+    reason: str = ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'provider': self.provider,
+            'name': self.name,
+            'samples': self.samples,
+            'success_rate': self.success_rate,
+            'p95_latency': self.p95_latency,
+            'cost_per_request': self.cost_per_request,
+            'cost_per_success': self.cost_per_success,
+            'seconds_per_success': self.seconds_per_success,
+            'eligible': self.eligible,
+            'exploring': self.exploring,
+            'score': self.score,
+            'reason': self.reason
+        }
+
+
+class ProviderRouter:
+    """按策略排列AI服务顺序，排序结果缓存 AI_ROUTING_REFRESH_SECONDS 秒"""
+
+    def __init__(self):
+        self._cached_order: Optional[Tuple[str, ...]] = None
+        self._cached_scores: List[ProviderScore] = []
+        self._cached_key: Optional[Tuple[str, ...]] = None
+        self._cached_at = 0.0
+
+    @property
+    def policy(self) -> str:
+        return (settings.AI_ROUTING_POLICY or ROUTING_STATIC).lower()
+
+    def order(self, candidates: List[Tuple[Any, Any]]) -> List[Tuple[Any, Any]]:
+        """对 (provider, service) 列表按路由策略重新排序"""
+        if self.policy != ROUTING_WEIGHTED or len(candidates) < 2:
+            return candidates
+
+        key = tuple(provider.value for provider, _ in candidates)
+        now = time.monotonic()
+        if self._cached_key != key or now - self._cached_at >= settings.AI_ROUTING_REFRESH_SECONDS:
+            self._cached_scores = self.evaluate(candidates)
+            previous = self._cached_order
+            self._cached_order = tuple(score.provider for score in self._cached_scores)
+            self._cached_key = key
+            self._cached_at = now
+            if previous != self._cached_order:
+                logger.info(f"AI服务路由顺序更新: {' > '.join(self._cached_order)}")
+
+        rank = {provider: index for index, provider in enumerate(self._cached_order)}
+        return sorted(candidates, key=lambda item: rank.get(item[0].value, len(rank)))
+
+    def evaluate(self, candidates: List[Tuple[Any, Any]]) -> List[ProviderScore]:
+        """计算各服务的路由评估，返回按推荐顺序排列的列表"""
+        window = settings.AI_ROUTING_WINDOW_SECONDS
+        scores = []
+        for provider, service in candidates:
+            summary = ai_telemetry.provider_summary(provider.value, window)
+            samples = summary['requests']
+            success_rate = summary['success_rate']
+            p95 = summary['latency']['p95']
+            mean_latency = summary['latency']['mean']
+            exploring = samples < settings.AI_ROUTING_MIN_SAMPLES
+
+            cost = service.cost_per_request
+            cost_per_success = seconds_per_success = None
+            if not exploring and success_rate:
+                cost_per_success = cost / success_rate
+                if mean_latency is not None:
+                    seconds_per_success = mean_latency / success_rate
+
+            reason = "样本不足，探索中" if exploring else ""
+            eligible = True
+            if not exploring:
+                if (success_rate or 0.0) < settings.AI_ROUTING_MIN_SUCCESS_RATE:
+                    eligible = False
+                    reason = f"成功率 {success_rate or 0:.1%} 低于 {settings.AI_ROUTING_MIN_SUCCESS_RATE:.0%}"
+                elif p95 is not None and p95 > settings.AI_ROUTING_MAX_P95_LATENCY:
+                    eligible = False
+                    reason = f"p95延迟 {p95:.1f}s 超过 {settings.AI_ROUTING_MAX_P95_LATENCY:.0f}s"
+
+            scores.append(ProviderScore(
+                provider=provider.value,
+                name=service.name,
+                samples=samples,
+                success_rate=success_rate,
+                p95_latency=p95,
+                cost_per_request=cost,
+                cost_per_success=cost_per_success,
+                seconds_per_success=seconds_per_success,
+                eligible=eligible,
+                exploring=exploring,
+                reason=reason
+            ))
+
+        self._assign_scores(scores)
+        # 稳定排序：满足条件的在前，得分低的在前，得分相同保持配置顺序
+        ordered = sorted(
+            enumerate(scores),
+            key=lambda item: (not item[1].eligible, item[1].score, item[0])
+        )
+        return [score for _, score in ordered]
+
+    @staticmethod
+    def _assign_scores(scores: List[ProviderScore]):
+        cost_weight = settings.AI_ROUTING_COST_WEIGHT
+        latency_weight = settings.AI_ROUTING_LATENCY_WEIGHT
+
+        def normalized(values: List[Optional[float]]) -> List[float]:
+            known = sorted(v for v in values if v is not None)
+            # 未知值（探索中的服务）按已知值的中位数估计
+            fallback = known[len(known) // 2] if known else 0.0
+            filled = [fallback if v is None else v for v in values]
+            top = max(filled) if filled else 0.0
+            return [v / top if top > 0 else 0.0 for v in filled]
+
+        # 探索中的服务没有成功率，按配置单价估计每次成功的成本
+        costs = normalized([
+            s.cost_per_success if s.cost_per_success is not None else s.cost_per_request
+            for s in scores
+        ])
+        latencies = normalized([s.seconds_per_success for s in scores])
+        for score, cost, latency in zip(scores, costs, latencies):
+            score.score = round(cost_weight * cost + latency_weight * latency, 4)
+
+    def snapshot(self, candidates: List[Tuple[Any, Any]]) -> Dict[str, Any]:
+        """当前路由策略和各服务评估（不使用缓存）"""
+        return {
+            'policy': self.policy,
+            'window_seconds': settings.AI_ROUTING_WINDOW_SECONDS,
+            'constraints': {
+                'min_success_rate': settings.AI_ROUTING_MIN_SUCCESS_RATE,
+                'max_p95_latency': settings.AI_ROUTING_MAX_P95_LATENCY,
+                'min_samples': settings.AI_ROUTING_MIN_SAMPLES
+            },
+            'weights': {
+                'cost': settings.AI_ROUTING_COST_WEIGHT,
+                'latency': settings.AI_ROUTING_LATENCY_WEIGHT
+            },
+            'providers': [score.to_dict() for score in self.evaluate(candidates)] if candidates else []
+        }
+
+
+provider_router = ProviderRouter()
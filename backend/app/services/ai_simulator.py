@@ -0,0 +1,308 @@
+"""AI服务模拟器
+
+用于容量规划和压测，不产生任何外部调用费用：
+- `SimulationProfile`：延迟分布（对数正态）、token数、429/超时/非JSON响应注入比例；
+- `SimulatorAIService`：可插拔的 AIServiceBase 实现，复用 OpenAIService 的调用和解析逻辑，
+  配置了 AI_SIMULATOR_BASE_URL 时请求本地OpenAI兼容桩服务，否则在进程内模拟；
+- `create_stub_app`：OpenAI兼容的桩服务（POST /v1/chat/completions），由 scripts/ai_stub_server.py 启动。
+"""
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from openai import AsyncOpenAI
+
+from app.core.config import settings
+from app.services.ai_analysis import AIServiceBase, OpenAIService, get_http_client
+
+
+class SimulatedRateLimitError(Exception):
+    """进程内模拟的429错误"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"模拟限流(429)，Retry-After={retry_after}")
+        self.retry_after = retry_after
+
+
+@dataclass
+class SimulationProfile:
+    """模拟参数"""
+    latency_median: float = 8.0  # 延迟中位数(秒)
+    latency_sigma: float = 0.6  # 对数正态分布sigma，越大长尾越明显
+    latency_max: float = 120.0  # 单次延迟上限(秒)
+    timeout_rate: float = 0.02  # 挂起不返回的请求比例
+    timeout_seconds: float = 600.0  # 挂起请求的等待时间，需大于客户端超时
+    rate_limit_rate: float = 0.02  # 返回429的比例
+    retry_after: float = 2.0  # 429响应的Retry-After(秒)
+    malformed_rate: float = 0.03  # 返回非JSON内容的比例
+    prompt_tokens: int = 1200
+    completion_tokens: int = 900
+    seed: Optional[int] = None
+
+    @classmethod
+    def from_settings(cls) -> "SimulationProfile":
+        return cls(
+            latency_median=settings.AI_SIMULATOR_LATENCY_MEDIAN,
+            latency_sigma=settings.AI_SIMULATOR_LATENCY_SIGMA,
+            timeout_rate=settings.AI_SIMULATOR_TIMEOUT_RATE,
+            rate_limit_rate=settings.AI_SIMULATOR_RATE_LIMIT_RATE,
+            malformed_rate=settings.AI_SIMULATOR_MALFORMED_RATE,
+            seed=settings.AI_SIMULATOR_SEED
+        )
+
+
+class ResponseSimulator:
+    """根据模拟参数生成单次调用的结果"""
+
+    def __init__(self, profile: SimulationProfile):
+        self.profile = profile
+        self.rng = random.Random(profile.seed)
+
+    def sample_outcome(self) -> str:
+        """返回 ok / rate_limited / timeout / malformed"""
+        roll = self.rng.random()
+        p = self.profile
+        if roll < p.rate_limit_rate:
+            return "rate_limited"
+        roll -= p.rate_limit_rate
+        if roll < p.timeout_rate:
+            return "timeout"
+        roll -= p.timeout_rate
+        if roll < p.malformed_rate:
+            return "malformed"
+        return "ok"
+
+    def sample_latency(self) -> float:
+        p = self.profile
+        latency = self.rng.lognormvariate(math.log(max(p.latency_median, 1e-3)), p.latency_sigma)
+        return min(latency, p.latency_max)
+
+    def sample_usage(self) -> Dict[str, int]:
+        p = self.profile
+        prompt_tokens = max(1, int(self.rng.gauss(p.prompt_tokens, p.prompt_tokens * 0.1)))
+        completion_tokens = max(1, int(self.rng.gauss(p.completion_tokens, p.completion_tokens * 0.25)))
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+    def build_content(self, prompt: str, malformed: bool = False) -> str:
+        """生成与提示词要求格式一致的回答；malformed 时返回无法解析的文本"""
+        digest = int(hashlib.md5(prompt.encode("utf-8")).hexdigest()[:8], 16)
+        base_price = 10 + digest % 5000
+        spread = 0.05 + (digest % 20) / 100
+        min_price = round(base_price * (1 - spread), 2)
+        max_price = round(base_price * (1 + spread), 2)
+
+        if malformed:
+            if self.rng.random() < 0.5:
+                # 截断的JSON
+                return f'{{"price_range": {{"min_price": {min_price}, "max_price": '
+            return f"根据市场调研，该材料价格大约在{min_price}元到{max_price}元之间，具体以询价为准。"
+
+        payload = {
+            "price_range": {"min_price": min_price, "max_price": max_price},
+            "confidence_score": round(0.6 + (digest % 35) / 100, 2),
+            "data_sources": [
+                {
+                    "source_type": "模拟电商平台",
+                    "platform_examples": "模拟数据",
+                    "data_count": "5/8",
+                    "sample_description": "模拟样本",
+                    "timeliness": "近3个月",
+                    "reliability": "★★★★",
+                    "price_range_min": min_price,
+                    "price_range_max": round((min_price + max_price) / 2, 2)
+                },
+                {
+                    "source_type": "模拟信息价",
+                    "platform_examples": "模拟数据",
+                    "data_count": "3/3",
+                    "sample_description": "模拟样本",
+                    "timeliness": "近1个月",
+                    "reliability": "★★★★★",
+                    "price_range_min": round((min_price + max_price) / 2, 2),
+                    "price_range_max": max_price
+                }
+            ],
+            "reasoning": "模拟器生成的分析结果，仅用于压测。",
+            "risk_factors": ["模拟风险因素"]
+        }
+        return f"```json\n{json.dumps(payload, ensure_ascii=False)}\n```"
+
+    async def stream_pieces(self, content: str, latency: float, stall: bool = False):
+        """按延迟把内容拆成多段输出：首段占总延迟的30%，其余均匀分布；stall 时输出一部分后挂起"""
+        pieces = [content[i:i + 16] for i in range(0, len(content), 16)] or [""]
+        await asyncio.sleep(latency * 0.3)
+        interval = latency * 0.7 / max(len(pieces), 1)
+        stall_at = len(pieces) // 3 if stall else None
+        for index, piece in enumerate(pieces):
+            if index == stall_at:
+                await asyncio.sleep(self.profile.timeout_seconds)
+            yield piece
+            await asyncio.sleep(interval)
+
+
+class _SimulatedCompletions:
+    """进程内模拟的 chat.completions 接口"""
+
+    def __init__(self, simulator: ResponseSimulator):
+        self.simulator = simulator
+
+    async def create(self, model: str, messages: List[Dict[str, Any]], stream: bool = False, **kwargs) -> Any:
+        outcome = self.simulator.sample_outcome()
+        if outcome == "rate_limited":
+            raise SimulatedRateLimitError(self.simulator.profile.retry_after)
+        if stream:
+            include_usage = bool((kwargs.get("stream_options") or {}).get("include_usage"))
+            return self._stream(model, messages, outcome, include_usage)
+        if outcome == "timeout":
+            await asyncio.sleep(self.simulator.profile.timeout_seconds)
+
+        await asyncio.sleep(self.simulator.sample_latency())
+        prompt = messages[-1]["content"] if messages else ""
+        usage = self.simulator.sample_usage()
+        return SimpleNamespace(
+            model=model,
+            usage=SimpleNamespace(**usage),
+            choices=[SimpleNamespace(
+                message=SimpleNamespace(
+                    role="assistant",
+                    content=self.simulator.build_content(prompt, malformed=outcome == "malformed")
+                ),
+                finish_reason="stop"
+            )]
+        )
+
+
+    async def _stream(self, model: str, messages: List[Dict[str, Any]], outcome: str, include_usage: bool = False):
+        prompt = messages[-1]["content"] if messages else ""
+        content = self.simulator.build_content(prompt, malformed=outcome == "malformed")
+        async for piece in self.simulator.stream_pieces(
+            content, self.simulator.sample_latency(), stall=outcome == "timeout"
+        ):
+            yield SimpleNamespace(
+                model=model,
+                usage=None,
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=piece), finish_reason=None)]
+            )
+        if include_usage:
+            # 与OpenAI一致：用量统计在最后一个不含 choices 的分块中返回
+            yield SimpleNamespace(model=model, usage=SimpleNamespace(**self.simulator.sample_usage()), choices=[])
+
+
+class SimulatorAIService(OpenAIService):
+    """模拟AI服务：调用与解析流程与 OpenAIService 完全一致"""
+
+    def __init__(self, profile: Optional[SimulationProfile] = None):
+        AIServiceBase.__init__(self)
+        self.name = "模拟器"
+        self.profile = profile or SimulationProfile.from_settings()
+        self.cost_per_request = settings.AI_SIMULATOR_COST
+        self.rate_limit = settings.AI_SIMULATOR_RATE_LIMIT
+        self.supports_streaming = True
+        self.base_url = settings.AI_SIMULATOR_BASE_URL
+        self.api_key = "sk-simulator"
+
+        if self.base_url:
+            # 请求本地OpenAI兼容桩服务，覆盖HTTP连接池和响应解析的完整路径
+            self.client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0,
+                http_client=get_http_client(self.base_url)
+            )
+        else:
+            self.client = SimpleNamespace(
+                chat=SimpleNamespace(completions=_SimulatedCompletions(ResponseSimulator(self.profile)))
+            )
+
+
+def create_stub_app(profile: Optional[SimulationProfile] = None):
+    """创建OpenAI兼容的桩服务"""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    simulator = ResponseSimulator(profile or SimulationProfile.from_settings())
+    stats = {"requests": 0, "ok": 0, "rate_limited": 0, "timeout": 0, "malformed": 0}
+    app = FastAPI(title="AI服务模拟器")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        outcome = simulator.sample_outcome()
+        stats["requests"] += 1
+        stats[outcome] += 1
+
+        if outcome == "rate_limited":
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": str(simulator.profile.retry_after)},
+                content={"error": {"type": "rate_limit_exceeded", "message": "模拟限流"}}
+            )
+        messages = body.get("messages") or []
+        prompt = messages[-1].get("content", "") if messages else ""
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if body.get("stream"):
+            content = simulator.build_content(prompt, malformed=outcome == "malformed")
+
+            async def event_stream():
+                async for piece in simulator.stream_pieces(
+                    content, simulator.sample_latency(), stall=outcome == "timeout"
+                ):
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model", "simulator"),
+                        "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+                    }
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    usage_chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model", "simulator"),
+                        "choices": [],
+                        "usage": simulator.sample_usage()
+                    }
+                    yield f"data: {json.dumps(usage_chunk, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+        if outcome == "timeout":
+            await asyncio.sleep(simulator.profile.timeout_seconds)
+
+        await asyncio.sleep(simulator.sample_latency())
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "simulator"),
+            "choices": [{
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": simulator.build_content(prompt, malformed=outcome == "malformed")
+                },
+                "finish_reason": "stop"
+            }],
+            "usage": simulator.sample_usage()
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
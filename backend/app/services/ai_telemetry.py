@@ -0,0 +1,256 @@
+"""AI服务调用遥测
+
+按服务提供商/模型汇总每次调用的延迟、token数、成本和结果（成功/解析失败/超时/异常/对冲取消）：
+- 累计直方图：进程启动以来的分布，按 Prometheus 文本格式输出（GET /metrics/ai）；
+- 近期事件环形缓冲：按时间窗口计算分位数和比例（GET /api/v1/analysis/ai-services/stats），
+  同时供路由、对冲和并发控制读取实时数据。
+
+数据保存在进程内，多进程部署（多个uvicorn/Celery worker）时每个进程分别统计。
+"""
+import math
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+
+OUTCOME_SUCCESS = "success"
+OUTCOME_PARSE_ERROR = "parse_error"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_ERROR = "error"
+OUTCOME_CANCELLED = "cancelled"
+OUTCOMES = (OUTCOME_SUCCESS, OUTCOME_PARSE_ERROR, OUTCOME_TIMEOUT, OUTCOME_ERROR, OUTCOME_CANCELLED)
+
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 90, 120, 180)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+COST_BUCKETS = (0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5)
+
+
+@dataclass
+class TelemetryEvent:
+    """单次AI调用记录"""
+    timestamp: float
+    provider: str
+    model: str
+    outcome: str
+    latency: float
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cost: float = 0.0
+
+
+class Histogram:
+    """固定分桶的累计直方图"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                return
+        self.counts[-1] += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Prometheus 格式的累计分桶 (le, count)"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((_format_number(bound), total))
+        result.append(("+Inf", total + self.counts[-1]))
+        return result
+
+
+class _SeriesMetrics:
+    """单个 provider/model 的累计指标"""
+
+    def __init__(self):
+        self.outcomes: Dict[str, int] = {outcome: 0 for outcome in OUTCOMES}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.prompt_tokens = Histogram(TOKEN_BUCKETS)
+        self.completion_tokens = Histogram(TOKEN_BUCKETS)
+        self.cost = Histogram(COST_BUCKETS)
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _percentile(ordered: List[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(math.ceil(q * len(ordered))) - 1))
+    return round(ordered[index], 3)
+
+
+class AITelemetry:
+    """AI调用遥测（进程级单例 ai_telemetry）"""
+
+    def __init__(self, max_events: Optional[int] = None):
+        self.started_at = time.time()
+        self._series: Dict[Tuple[str, str], _SeriesMetrics] = {}
+        self._events: Deque[TelemetryEvent] = deque(maxlen=max_events or settings.AI_TELEMETRY_MAX_EVENTS)
+
+    def record(
+        self,
+        provider: str,
+        model: Optional[str],
+        outcome: str,
+        latency: float,
+        usage: Optional[Dict[str, Any]] = None,
+        cost: float = 0.0
+    ):
+        """记录一次调用"""
+        usage = usage if isinstance(usage, dict) else {}
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        event = TelemetryEvent(
+            timestamp=time.time(),
+            provider=provider,
+            model=model or provider,
+            outcome=outcome,
+            latency=max(latency, 0.0),
+            prompt_tokens=prompt_tokens if isinstance(prompt_tokens, int) else None,
+            completion_tokens=completion_tokens if isinstance(completion_tokens, int) else None,
+            cost=cost or 0.0
+        )
+        self._events.append(event)
+
+        series = self._series.get((event.provider, event.model))
+        if series is None:
+            series = self._series[(event.provider, event.model)] = _SeriesMetrics()
+        series.outcomes[outcome] = series.outcomes.get(outcome, 0) + 1
+        if outcome == OUTCOME_CANCELLED:
+            return
+        series.cost.observe(event.cost)
+        if outcome not in (OUTCOME_SUCCESS, OUTCOME_PARSE_ERROR):
+            # 超时/异常的耗时取决于超时配置，不计入延迟分布
+            return
+        series.latency.observe(event.latency)
+        if event.prompt_tokens is not None:
+            series.prompt_tokens.observe(event.prompt_tokens)
+        if event.completion_tokens is not None:
+            series.completion_tokens.observe(event.completion_tokens)
+
+    def recent_events(self, window_seconds: float, provider: Optional[str] = None) -> List[TelemetryEvent]:
+        cutoff = time.time() - window_seconds
+        return [
+            event for event in self._events
+            if event.timestamp >= cutoff and (provider is None or event.provider == provider)
+        ]
+
+    def window_stats(self, window_seconds: float = 3600) -> Dict[str, Any]:
+        """按时间窗口汇总各 provider/model 的统计"""
+        grouped: Dict[Tuple[str, str], List[TelemetryEvent]] = {}
+        events = self.recent_events(window_seconds)
+        for event in events:
+            grouped.setdefault((event.provider, event.model), []).append(event)
+
+        series = [
+            {'provider': provider, 'model': model, **self._summarize(items, window_seconds)}
+            for (provider, model), items in sorted(grouped.items())
+        ]
+        oldest = self._events[0].timestamp if self._events else None
+        return {
+            'window_seconds': window_seconds,
+            # 环形缓冲已覆盖的起始时间，晚于窗口起点时说明窗口内的早期事件已被淘汰
+            'coverage_start': oldest,
+            'series': series,
+            'total': self._summarize(events, window_seconds)
+        }
+
+    def provider_summary(self, provider: str, window_seconds: float = 600) -> Dict[str, Any]:
+        """单个服务提供商的近期统计（供路由和并发控制使用）"""
+        return self._summarize(self.recent_events(window_seconds, provider), window_seconds)
+
+    @staticmethod
+    def _summarize(events: List[TelemetryEvent], window_seconds: float) -> Dict[str, Any]:
+        outcomes = {outcome: 0 for outcome in OUTCOMES}
+        for event in events:
+            outcomes[event.outcome] = outcomes.get(event.outcome, 0) + 1
+        completed = [event for event in events if event.outcome != OUTCOME_CANCELLED]
+        attempts = len(completed)
+        responded = [event for event in completed if event.outcome in (OUTCOME_SUCCESS, OUTCOME_PARSE_ERROR)]
+        latencies = sorted(event.latency for event in responded)
+        prompt_tokens = [event.prompt_tokens for event in responded if event.prompt_tokens is not None]
+        completion_tokens = [event.completion_tokens for event in responded if event.completion_tokens is not None]
+        total_cost = sum(event.cost for event in completed)
+
+        def rate(count: int, base: int) -> Optional[float]:
+            return round(count / base, 4) if base else None
+
+        return {
+            'requests': attempts,
+            'outcomes': outcomes,
+            'requests_per_minute': round(attempts / (window_seconds / 60), 3) if window_seconds else None,
+            'success_rate': rate(outcomes[OUTCOME_SUCCESS], attempts),
+            'parse_failure_rate': rate(outcomes[OUTCOME_PARSE_ERROR], len(responded)),
+            'timeout_rate': rate(outcomes[OUTCOME_TIMEOUT], attempts),
+            'error_rate': rate(outcomes[OUTCOME_ERROR], attempts),
+            'latency': {
+                'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+                'p50': _percentile(latencies, 0.5),
+                'p90': _percentile(latencies, 0.9),
+                'p95': _percentile(latencies, 0.95),
+                'p99': _percentile(latencies, 0.99),
+                'max': round(latencies[-1], 3) if latencies else None
+            },
+            'tokens': {
+                'prompt_total': sum(prompt_tokens),
+                'completion_total': sum(completion_tokens),
+                'prompt_avg': round(sum(prompt_tokens) / len(prompt_tokens), 1) if prompt_tokens else None,
+                'completion_avg': (
+                    round(sum(completion_tokens) / len(completion_tokens), 1) if completion_tokens else None
+                )
+            },
+            'cost': {
+                'total': round(total_cost, 4),
+                'avg': round(total_cost / attempts, 4) if attempts else None
+            }
+        }
+
+    def prometheus_text(self) -> str:
+        """Prometheus 文本格式的累计指标"""
+        lines = [
+            "# HELP uma_ai_requests_total AI调用次数（按结果）",
+            "# TYPE uma_ai_requests_total counter"
+        ]
+        for (provider, model), series in sorted(self._series.items()):
+            labels = f'provider="{_escape_label(provider)}",model="{_escape_label(model)}"'
+            for outcome, count in series.outcomes.items():
+                lines.append(f'uma_ai_requests_total{{{labels},outcome="{outcome}"}} {count}')
+
+        histograms = (
+            ("uma_ai_request_latency_seconds", "AI调用延迟(秒)", "latency"),
+            ("uma_ai_prompt_tokens", "提示词token数", "prompt_tokens"),
+            ("uma_ai_completion_tokens", "输出token数", "completion_tokens"),
+            ("uma_ai_request_cost", "单次调用成本(元)", "cost"),
+        )
+        for name, description, attribute in histograms:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for (provider, model), series in sorted(self._series.items()):
+                labels = f'provider="{_escape_label(provider)}",model="{_escape_label(model)}"'
+                histogram: Histogram = getattr(series, attribute)
+                for bound, count in histogram.cumulative():
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f"{name}_sum{{{labels}}} {round(histogram.sum, 6)}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+ai_telemetry = AITelemetry()
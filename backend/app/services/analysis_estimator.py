@@ -0,0 +1,173 @@
+"""项目AI分析预估（不调用任何AI服务）
+
+按与正式分析相同的规则筛选材料，去除同批次重复材料和可复用的历史分析后得到实际调用次数；
+token数按提示词模板和字符类型估算，成本按服务单次成本计算，耗时按近期遥测的延迟分布、
+并发数和频率限制估算。每项给出 low / expected / high 区间：
+- 成本：low 为一次成功，high 计入近期失败率带来的重试和故障转移；
+- 耗时：low / expected / high 分别使用延迟 p50 / 均值 / p95，无遥测样本时使用默认延迟并放宽区间。
+"""
+import math
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.services.ai_analysis import AIProvider
+from app.services.ai_telemetry import ai_telemetry
+from app.services.analysis_reuse import material_key
+from app.services.price_analysis import PriceAnalysisService
+
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+_SYSTEM_PROMPT_TOKENS = 60  # 系统消息约60个token
+_TELEMETRY_WINDOW_SECONDS = 24 * 3600
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中文字符及全角符号约1个token，其余约4个字符1个token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return int(math.ceil(cjk + (len(text) - cjk) / 4))
+
+
+class AnalysisEstimator:
+    """项目分析预估"""
+
+    def __init__(self, analysis_service: Optional[PriceAnalysisService] = None):
+        self.analysis_service = analysis_service or PriceAnalysisService()
+        self.ai_manager = self.analysis_service.ai_manager
+
+    async def estimate(
+        self,
+        db: AsyncSession,
+        project_id: int,
+        material_ids: Optional[List[int]] = None,
+        force_reanalyze: bool = False,
+        preferred_provider: Optional[AIProvider] = None,
+        cost_budget: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """预估分析项目材料所需的调用次数、token、成本和耗时"""
+
+        started = time.perf_counter()
+        service = self.analysis_service
+        project_base_date = await service._get_project_base_date(db, project_id)
+        materials = await service._get_materials_for_analysis(db, project_id, material_ids, force_reanalyze)
+
+        # 同批次重复材料只分析一次（与分析流水线一致）
+        groups: Dict[tuple, Any] = {}
+        for material in materials:
+            groups.setdefault(material_key(material), material)
+        leaders = list(groups.values())
+
+        reuse_index = None if force_reanalyze else await service._build_reuse_index(materials)
+        reused = 0
+        provisional = 0
+        to_call = []
+        for material in leaders:
+            match = reuse_index.lookup(material) if reuse_index is not None else None
+            if match:
+                reused += 1
+                provisional += 1 if match.provisional else 0
+            else:
+                to_call.append(material)
+
+        services = self.ai_manager._filter_by_cost_limit(
+            self.ai_manager._resolve_service_order(preferred_provider)
+        )
+        provider_estimate = None
+        tokens = {'prompt_total': 0, 'completion_total': 0, 'prompt_avg': None, 'completion_avg': None}
+        cost = {'low': 0.0, 'expected': 0.0, 'high': 0.0}
+        duration = {'low': 0.0, 'expected': 0.0, 'high': 0.0}
+        calls = len(to_call)
+
+        if services and calls:
+            provider, ai_service = services[0]
+            summary = ai_telemetry.provider_summary(provider.value, _TELEMETRY_WINDOW_SECONDS)
+            has_samples = summary['requests'] >= settings.AI_ROUTING_MIN_SAMPLES
+
+            prompt_tokens = 0
+            for material in to_call:
+                prompt = ai_service._build_price_analysis_prompt(
+                    material.material_name,
+                    material.specification or "",
+                    material.unit,
+                    service._resolve_analysis_region(material),
+                    project_base_date
+                )
+                prompt_tokens += estimate_tokens(prompt) + _SYSTEM_PROMPT_TOKENS
+            completion_avg = summary['tokens']['completion_avg'] or settings.AI_ESTIMATE_COMPLETION_TOKENS
+            tokens = {
+                'prompt_total': prompt_tokens,
+                'completion_total': int(completion_avg * calls),
+                'prompt_avg': round(prompt_tokens / calls, 1),
+                'completion_avg': round(completion_avg, 1),
+                # 近期实际的提示词token均值，可用于校准估算
+                'observed_prompt_avg': summary['tokens']['prompt_avg']
+            }
+
+            success_rate = summary['success_rate'] if has_samples and summary['success_rate'] else 1.0
+            failure_rate = 1.0 - success_rate
+            unit_cost = ai_service.cost_per_request
+            # 失败的调用由后续服务重试，最坏情况按每次失败多付一次成本
+            fallback_cost = services[1][1].cost_per_request if len(services) > 1 else unit_cost
+            cost = {
+                'low': round(calls * unit_cost, 4),
+                'expected': round(calls * (unit_cost + failure_rate * fallback_cost), 4),
+                'high': round(calls * (unit_cost + max(failure_rate * 2, 0.1) * max(unit_cost, fallback_cost)), 4)
+            }
+
+            latency = summary['latency']
+            if has_samples and latency['mean'] is not None:
+                latencies = {'low': latency['p50'], 'expected': latency['mean'], 'high': latency['p95']}
+            else:
+                default = settings.AI_ESTIMATE_DEFAULT_LATENCY
+                latencies = {'low': default * 0.5, 'expected': default, 'high': default * 2}
+            concurrency = min(service.max_concurrent_analyses, calls)
+            # 频率限制约束的最短耗时（每分钟 rate_limit 次）
+            rate_bound = calls / max(ai_service.rate_limit, 1) * 60
+            for band, seconds in latencies.items():
+                duration[band] = round(max(math.ceil(calls / concurrency) * seconds, rate_bound), 1)
+
+            provider_estimate = {
+                'provider': provider.value,
+                'name': ai_service.name,
+                'cost_per_request': unit_cost,
+                'rate_limit_per_minute': ai_service.rate_limit,
+                'concurrency': concurrency,
+                'telemetry_samples': summary['requests'],
+                'success_rate': success_rate,
+                'latency_seconds': latencies
+            }
+
+        budget = await service._create_budget(db, project_id, cost_budget, preferred_provider)
+        affordable_calls = None
+        if budget.limit is not None and provider_estimate:
+            unit_cost = provider_estimate['cost_per_request']
+            affordable_calls = int(budget.remaining // unit_cost) if unit_cost > 0 else calls
+
+        return {
+            'project_id': project_id,
+            'dry_run': True,
+            'materials': {
+                'total': len(materials),
+                'unique': len(leaders),
+                'duplicates': len(materials) - len(leaders),
+                'reusable': reused,
+                'reusable_provisional': provisional,
+                'ai_calls': calls
+            },
+            'provider': provider_estimate,
+            'tokens': tokens,
+            'cost': cost,
+            'duration_seconds': duration,
+            'budget': {
+                'limit': budget.limit,
+                'spent': round(budget.spent, 4),
+                'remaining': budget.remaining,
+                'affordable_calls': affordable_calls
+            },
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+        }
@@ -0,0 +1,442 @@
+from typing import List, Dict, Any, Optional, Set
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, func
+from sqlalchemy.orm import selectinload
+from datetime import datetime, timezone
+from loguru import logger
+import asyncio
+
+from app.core.config import settings
+from app.core.celery_app import celery_app
+from app.core.database import AsyncSessionLocal, engine
+from app.models.project import ProjectMaterial
+from app.models.analysis import PriceAnalysis, AnalysisStatus, AnalysisJob, AnalysisJobStatus
+from app.services.ai_analysis import AIProvider, close_ai_clients
+from app.services.analysis_reuse import AnalysisReuseIndex, material_key, share_analysis_result
+from app.services.price_analysis import AnalysisBudget, MaterialSnapshot, PriceAnalysisService
+
+
+# 本地模式下在API进程内运行的任务，保留引用防止被垃圾回收
+_local_job_tasks: Set[asyncio.Task] = set()
+
+
+class PriceAnalysisJobService:
+    """项目价格分析任务服务
+
+    任务提交后由Celery worker（或本地模式下的当前进程）执行。每个材料的分析结果
+    在完成时立即提交，作为检查点；任务中断后重新执行时，跳过本任务创建之后已完成
+    或已失败的材料，只处理剩余材料（包括卡在处理中状态的材料）。
+    执行期间由独立的定时器每隔 ANALYSIS_JOB_HEARTBEAT_SECONDS 秒刷新心跳，
+    单个材料分析耗时较长（最长 AI_MATERIAL_TIME_BUDGET 秒）时任务也不会被判定为中断。
+    成本预算与同步分析一致（cost_budget，为空则使用 AI_PROJECT_BUDGET）：预算用完后不再开始新的材料，
+    任务置为 budget_exhausted，提高预算后恢复任务即可继续。
+    与同步分析一致，名称/规格/单位标准化后相同的材料只分析一次，其余材料共用结果。
+    """
+
+    def __init__(self):
+        self.analysis_service = PriceAnalysisService()
+        self.max_workers = max(1, settings.AI_MAX_CONCURRENT)
+
+    async def create_job(
+        self,
+        db: AsyncSession,
+        project_id: int,
+        material_ids: Optional[List[int]] = None,
+        force_reanalyze: bool = False,
+        preferred_provider: Optional[AIProvider] = None,
+        cost_budget: Optional[float] = None
+    ) -> AnalysisJob:
+        """创建分析任务并固定待分析材料清单"""
+
+        materials = await self.analysis_service._get_materials_for_analysis(
+            db, project_id, material_ids, force_reanalyze
+        )
+        # 保持按经济影响排序的分析顺序
+        ids = [material.id for material in materials]
+
+        job = AnalysisJob(
+            project_id=project_id,
+            material_ids=ids,
+            preferred_provider=preferred_provider.value if preferred_provider else None,
+            force_reanalyze=force_reanalyze,
+            cost_budget=cost_budget,
+            total_count=len(ids),
+            status=AnalysisJobStatus.QUEUED if ids else AnalysisJobStatus.COMPLETED,
+            finished_at=None if ids else func.now()
+        )
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+
+        logger.info(f"创建分析任务 {job.id}: 项目 {project_id}, 材料 {len(ids)} 个")
+        return job
+
+    def dispatch_job(self, job: AnalysisJob) -> Optional[str]:
+        """投递任务，返回Celery任务ID（本地模式返回None）"""
+
+        if settings.CELERY_TASK_ALWAYS_EAGER:
+            # 本地模式：在当前事件循环中后台执行，无需broker和worker
+            task = asyncio.create_task(self.run_job(job.id))
+            _local_job_tasks.add(task)
+            task.add_done_callback(_local_job_tasks.discard)
+            return None
+
+        async_result = run_price_analysis_job.apply_async(args=[job.id])
+        return async_result.id
+
+    async def submit_job(
+        self,
+        db: AsyncSession,
+        project_id: int,
+        material_ids: Optional[List[int]] = None,
+        force_reanalyze: bool = False,
+        preferred_provider: Optional[AIProvider] = None,
+        cost_budget: Optional[float] = None
+    ) -> AnalysisJob:
+        """创建并投递分析任务"""
+
+        job = await self.create_job(db, project_id, material_ids, force_reanalyze, preferred_provider, cost_budget)
+        if job.status == AnalysisJobStatus.COMPLETED:
+            return job
+
+        task_id = self.dispatch_job(job)
+        if task_id:
+            job.task_id = task_id
+            await db.commit()
+        return job
+
+    async def resume_job(self, db: AsyncSession, job_id: int, cost_budget: Optional[float] = None) -> AnalysisJob:
+        """恢复中断、失败或预算用完的任务，cost_budget 不为空时替换任务的成本预算"""
+
+        job = await db.get(AnalysisJob, job_id)
+        if not job:
+            raise ValueError(f"分析任务 {job_id} 不存在")
+        if job.status == AnalysisJobStatus.COMPLETED:
+            raise ValueError("任务已完成，无需恢复")
+        if job.status == AnalysisJobStatus.RUNNING and not self._is_stale(job):
+            raise ValueError("任务正在运行中")
+
+        # 置为排队状态，新的执行会从检查点继续
+        job.status = AnalysisJobStatus.QUEUED
+        job.task_id = None
+        if cost_budget is not None:
+            job.cost_budget = cost_budget
+        await db.commit()
+
+        task_id = self.dispatch_job(job)
+        if task_id:
+            job.task_id = task_id
+            await db.commit()
+
+        logger.info(f"恢复分析任务 {job_id}")
+        return job
+
+    async def run_job(self, job_id: int, task_id: Optional[str] = None) -> Dict[str, Any]:
+        """执行分析任务（从检查点继续）"""
+
+        async with AsyncSessionLocal() as db:
+            job, materials = await self._claim_job(db, job_id, task_id)
+            if job is None:
+                return {'job_id': job_id, 'skipped': True}
+            project_id = job.project_id
+            preferred_provider = AIProvider(job.preferred_provider) if job.preferred_provider else None
+            project_base_date = await self.analysis_service._get_project_base_date(db, project_id)
+            force_reanalyze = bool(job.force_reanalyze)
+            budget = await self.analysis_service._create_budget(db, project_id, job.cost_budget, preferred_provider)
+
+        reuse_index = None if force_reanalyze else await self.analysis_service._build_reuse_index(materials)
+
+        logger.info(
+            f"分析任务 {job_id} 开始执行: 剩余 {len(materials)} 个材料"
+            + (f"，成本预算 {budget.limit} 元，已发生 {budget.spent:.4f} 元" if budget.limit is not None else "")
+        )
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            # 相同材料只分析第一个，其余材料使用快照（工作协程回滚后不能再读取ORM对象）
+            groups: Dict[tuple, List[ProjectMaterial]] = {}
+            for material in materials:
+                groups.setdefault(material_key(material), []).append(material)
+            queue: asyncio.Queue = asyncio.Queue()
+            for group in groups.values():
+                queue.put_nowait((group[0], [self.analysis_service._snapshot(material) for material in group[1:]]))
+
+            workers = [
+                self._worker(job_id, queue, project_base_date, preferred_provider, budget, reuse_index)
+                for _ in range(min(self.max_workers, len(groups)) or 1)
+            ]
+            await asyncio.gather(*workers)
+
+            if budget.exhausted:
+                # 剩余材料没有检查点，提高预算后恢复任务会继续分析
+                logger.info(f"分析任务 {job_id} 成本预算已用完（已发生 {budget.spent:.4f} 元），停止分析剩余材料")
+                final_values = {
+                    'status': AnalysisJobStatus.BUDGET_EXHAUSTED,
+                    'error_message': f"成本预算已用完（预算 {budget.limit} 元，已发生 {budget.spent:.4f} 元），提高预算后可恢复任务"
+                }
+            else:
+                final_values = {'status': AnalysisJobStatus.COMPLETED, 'finished_at': func.now()}
+
+            async with AsyncSessionLocal() as db:
+                await self.analysis_service._update_project_analysis_statistics(db, project_id)
+                await db.execute(
+                    update(AnalysisJob)
+                    .where(AnalysisJob.id == job_id)
+                    .values(heartbeat_at=func.now(), **final_values)
+                )
+                await db.commit()
+
+        except Exception as e:
+            logger.error(f"分析任务 {job_id} 执行失败: {e}")
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(AnalysisJob)
+                    .where(AnalysisJob.id == job_id)
+                    .values(status=AnalysisJobStatus.FAILED, error_message=str(e), heartbeat_at=func.now())
+                )
+                await db.commit()
+            raise
+        finally:
+            heartbeat.cancel()
+
+        logger.info(f"分析任务 {job_id} 执行结束: {final_values['status'].value}")
+        return {'job_id': job_id, 'skipped': False, 'budget_exhausted': budget.exhausted}
+
+    async def get_job_status(self, db: AsyncSession, job_id: int) -> Optional[Dict[str, Any]]:
+        """获取任务进度"""
+
+        job = await db.get(AnalysisJob, job_id)
+        if not job:
+            return None
+
+        total = job.total_count or 0
+        done = job.done_count or 0
+        failed = job.failed_count or 0
+        remaining = max(total - done - failed, 0)
+
+        # 根据本次运行的平均处理速度估算剩余时间
+        eta_seconds = None
+        processed_this_run = done + failed - (job.resumed_count or 0)
+        if job.status == AnalysisJobStatus.RUNNING and job.started_at and processed_this_run > 0:
+            elapsed = (datetime.now(timezone.utc) - job.started_at).total_seconds()
+            eta_seconds = round(elapsed / processed_this_run * remaining, 1)
+
+        return {
+            'job_id': job.id,
+            'project_id': job.project_id,
+            'task_id': job.task_id,
+            'status': job.status.value if job.status else None,
+            'total': total,
+            'done': done,
+            'failed': failed,
+            'remaining': remaining,
+            'progress': round((done + failed) / total, 4) if total else 1.0,
+            'eta_seconds': eta_seconds,
+            'attempts': job.attempts or 0,
+            'cost_budget': job.cost_budget,
+            'is_stale': job.status == AnalysisJobStatus.RUNNING and self._is_stale(job),
+            'error_message': job.error_message,
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'started_at': job.started_at.isoformat() if job.started_at else None,
+            'heartbeat_at': job.heartbeat_at.isoformat() if job.heartbeat_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None
+        }
+
+    async def _claim_job(
+        self,
+        db: AsyncSession,
+        job_id: int,
+        task_id: Optional[str]
+    ) -> tuple:
+        """锁定任务并根据检查点计算剩余材料"""
+
+        stmt = select(AnalysisJob).where(AnalysisJob.id == job_id).with_for_update()
+        job = (await db.execute(stmt)).scalar_one_or_none()
+        if not job:
+            logger.warning(f"分析任务 {job_id} 不存在")
+            return None, []
+        if job.status == AnalysisJobStatus.COMPLETED:
+            return None, []
+        # 同一任务消息重新投递（worker异常退出）或心跳超时才允许接管运行中的任务
+        if (
+            job.status == AnalysisJobStatus.RUNNING
+            and not (task_id and job.task_id == task_id)
+            and not self._is_stale(job)
+        ):
+            logger.info(f"分析任务 {job_id} 正在由其他进程执行，跳过")
+            return None, []
+
+        # 检查点：本任务创建之后已完成或已失败的材料不再处理
+        material_ids = list(job.material_ids or [])
+        processed_stmt = select(PriceAnalysis.material_id, PriceAnalysis.status).where(
+            PriceAnalysis.material_id.in_(material_ids),
+            PriceAnalysis.status.in_([AnalysisStatus.COMPLETED, AnalysisStatus.FAILED]),
+            PriceAnalysis.updated_at >= job.created_at
+        )
+        processed = {row.material_id: row.status for row in (await db.execute(processed_stmt)).all()}
+        done_count = sum(1 for s in processed.values() if s == AnalysisStatus.COMPLETED)
+        failed_count = len(processed) - done_count
+
+        remaining_ids = [mid for mid in material_ids if mid not in processed]
+        materials: List[ProjectMaterial] = []
+        if remaining_ids:
+            materials_stmt = select(ProjectMaterial).options(
+                selectinload(ProjectMaterial.project)
+            ).where(ProjectMaterial.id.in_(remaining_ids))
+            loaded = {m.id: m for m in (await db.execute(materials_stmt)).scalars().all()}
+            materials = [loaded[mid] for mid in remaining_ids if mid in loaded]
+
+        if job.attempts and processed:
+            logger.info(f"分析任务 {job_id} 从检查点恢复: 已处理 {len(processed)}/{len(material_ids)}")
+
+        job.status = AnalysisJobStatus.RUNNING
+        job.task_id = task_id or job.task_id
+        job.done_count = done_count
+        job.failed_count = failed_count
+        # 材料在提交后被删除时计入失败，保证进度可以走完
+        job.failed_count += len(remaining_ids) - len(materials)
+        job.resumed_count = job.done_count + job.failed_count
+        job.attempts = (job.attempts or 0) + 1
+        job.error_message = None
+        job.started_at = func.now()
+        job.heartbeat_at = func.now()
+        await db.commit()
+        await db.refresh(job)
+        return job, materials
+
+    async def _worker(
+        self,
+        job_id: int,
+        queue: asyncio.Queue,
+        project_base_date: Optional[str],
+        preferred_provider: Optional[AIProvider],
+        budget: AnalysisBudget,
+        reuse_index: Optional[AnalysisReuseIndex] = None
+    ):
+        """分析工作协程：每个协程使用独立的数据库会话，每个材料开始前预留预算，完成后按实际成本结算"""
+
+        async with AsyncSessionLocal() as db:
+            while True:
+                if budget.exhausted:
+                    return
+                try:
+                    material, duplicates = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if not await budget.acquire():
+                    return
+
+                material_id = material.id
+                result: Dict[str, Any] = {'success': False}
+                try:
+                    result = await self.analysis_service._analyze_single_material_task(
+                        db, material, project_base_date, preferred_provider, reuse_index
+                    )
+                except Exception as e:
+                    # 保存失败状态本身出错时，该材料保持处理中，恢复任务时会重新分析
+                    logger.error(f"分析任务 {job_id} 处理材料 {material_id} 异常: {e}")
+                    await db.rollback()
+                    result = {'success': False, 'error': str(e)}
+                finally:
+                    ai_result = result.get('ai_result')
+                    budget.settle(ai_result.analysis_cost if ai_result else 0.0)
+                await self._record_progress(db, job_id, result.get('success', False))
+                if duplicates:
+                    await self._save_duplicate_results(db, job_id, material_id, duplicates, result)
+
+    async def _save_duplicate_results(
+        self,
+        db: AsyncSession,
+        job_id: int,
+        source_id: int,
+        duplicates: List[MaterialSnapshot],
+        result: Dict[str, Any]
+    ):
+        """将相同材料的分析结果复制给其余材料并记录进度（不调用AI、不计费）"""
+
+        ai_result = result.get('ai_result') if result.get('success') else None
+        if ai_result:
+            completed = [(material, share_analysis_result(material, source_id, ai_result)) for material in duplicates]
+            failed = None
+        else:
+            completed = None
+            failed = [(material, result.get('error') or '分析失败') for material in duplicates]
+
+        success = ai_result is not None
+        try:
+            await self.analysis_service.bulk_save_analysis_results(db, completed=completed, failed=failed)
+            await db.commit()
+        except Exception as e:
+            # 没有写入的材料没有检查点，恢复任务时会重新分析
+            logger.error(f"分析任务 {job_id} 保存材料 {source_id} 的共用结果失败: {e}")
+            await db.rollback()
+            success = False
+        await self._record_progress(db, job_id, success, count=len(duplicates))
+
+    async def _heartbeat(self, job_id: int):
+        """任务执行期间定时刷新心跳（与材料分析进度无关）"""
+
+        interval = max(settings.ANALYSIS_JOB_HEARTBEAT_SECONDS, 0.01)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(AnalysisJob)
+                        .where(AnalysisJob.id == job_id, AnalysisJob.status == AnalysisJobStatus.RUNNING)
+                        .values(heartbeat_at=func.now())
+                    )
+                    await db.commit()
+            except Exception as e:
+                logger.warning(f"刷新分析任务 {job_id} 心跳失败: {e}")
+
+    async def _record_progress(self, db: AsyncSession, job_id: int, success: bool, count: int = 1):
+        """原子更新进度计数和心跳"""
+
+        values = {'heartbeat_at': func.now()}
+        if success:
+            values['done_count'] = AnalysisJob.done_count + count
+        else:
+            values['failed_count'] = AnalysisJob.failed_count + count
+
+        try:
+            await db.execute(update(AnalysisJob).where(AnalysisJob.id == job_id).values(**values))
+            await db.commit()
+        except Exception as e:
+            # 进度计数仅用于展示，恢复时会从检查点重新计算
+            logger.warning(f"更新分析任务 {job_id} 进度失败: {e}")
+            await db.rollback()
+
+    def _is_stale(self, job: AnalysisJob) -> bool:
+        """心跳超时判断"""
+        last_seen = job.heartbeat_at or job.started_at or job.created_at
+        if not last_seen:
+            return True
+        if last_seen.tzinfo is None:
+            last_seen = last_seen.replace(tzinfo=timezone.utc)
+        # 超时阈值至少为心跳间隔的3倍，避免数据库短暂不可用时误判
+        threshold = max(settings.ANALYSIS_JOB_STALE_SECONDS, settings.ANALYSIS_JOB_HEARTBEAT_SECONDS * 3)
+        return (datetime.now(timezone.utc) - last_seen).total_seconds() > threshold
+
+
+@celery_app.task(name="analysis.run_price_analysis_job", bind=True)
+def run_price_analysis_job(self, job_id: int) -> Dict[str, Any]:
+    """Celery任务：执行项目价格分析"""
+
+    async def _run():
+        try:
+            return await PriceAnalysisJobService().run_job(job_id, task_id=self.request.id)
+        finally:
+            # 连接池绑定在当前事件循环上，任务结束后释放，避免下一个任务复用失效连接
+            await close_ai_clients()
+            await engine.dispose()
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_run())
+
+    # task_always_eager 时任务在调用方线程内同步执行；调用方已在事件循环中（如API请求、测试）时改在独立线程中运行
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, _run()).result()
@@ -0,0 +1,458 @@
+"""分析结果复用
+
+同一批材料往往已在其他项目中分析过。调用AI之前，先在近期已完成的分析记录中
+查找名称/规格/单位相近、地区相同且基期在窗口内的材料：
+- 相似度 >= AI_REUSE_SIMILARITY：直接复用其分析结果；
+- 相似度 >= AI_REUSE_PROVISIONAL_SIMILARITY：作为暂定价格返回，置信度按相似度折减并提示复核。
+复用结果的 api_response 中记录来源（reused_from），analysis_model 以 `复用:` 开头，
+复用结果本身不会再被复用，来源始终指向真实的AI分析。
+同一次分析中名称/规格/单位标准化后相同的材料只调用一次AI，其余材料共用结果（share_analysis_result）。
+
+单位、地区和基期窗口在SQL中预筛选；数据源、推理过程等大字段只为实际命中的分析加载。
+"""
+import copy
+import dataclasses
+import re
+import time
+import unicodedata
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from difflib import SequenceMatcher
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.analysis import AnalysisStatus, PriceAnalysis
+from app.models.project import Project, ProjectMaterial
+from app.services.ai_analysis import PriceAnalysisResult
+from app.utils.region_mapping import resolve_region_from_codes
+from app.utils.unit_conversion import normalize_unit, unit_spellings
+
+
+REUSE_MODEL_PREFIX = "复用:"
+# 保存分析结果时追加到推理过程末尾的权重说明标题（见 PriceAnalysisService._build_analysis_values）
+WEIGHTING_NOTE_HEADER = "[系统综合权重说明]"
+
+_NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+_MONTH_PATTERN = re.compile(r"(\d{4})\D{0,2}(\d{1,2})")
+_CANDIDATE_LIMIT = 20  # 每次查找最多精确打分的候选数
+_DETAIL_CHUNK_SIZE = 1000  # 加载大字段时每条查询的最大ID数
+_EMPTY_CODES = {'', '0', '00', '000', '0000', '00000', '000000'}
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """名称/规格标准化：全角转半角、小写、去空白、统一括号"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"\s+", "", text)
+    return text.replace("【", "[").replace("】", "]")
+
+
+def material_key(material: ProjectMaterial) -> Tuple[str, str, str]:
+    """标准化的 (名称, 规格, 单位)，相同键的材料可共用一次分析结果"""
+    return (
+        normalize_text(material.material_name),
+        normalize_text(material.specification),
+        normalize_unit(material.unit or "")
+    )
+
+
+def _bigrams(text: str) -> Set[str]:
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _month_index(value: Optional[str]) -> Optional[int]:
+    """'2025-06' / '2025年6月' / '2025-06-01' -> 月序号"""
+    if not value:
+        return None
+    match = _MONTH_PATTERN.search(str(value))
+    if not match:
+        return None
+    year, month = int(match.group(1)), int(match.group(2))
+    if not 1 <= month <= 12:
+        return None
+    return year * 12 + month - 1
+
+
+def resolve_project_region(project: Optional[Project]) -> str:
+    """与 PriceAnalysisService._resolve_analysis_region 一致的项目地区解析"""
+    if not project:
+        return "全国"
+    region = resolve_region_from_codes(
+        project.base_price_province,
+        project.base_price_city,
+        project.base_price_district
+    )
+    if region and region != "全国":
+        return region
+    if project.location and project.location.strip():
+        return project.location.strip()
+    return "全国"
+
+
+@dataclass
+class ReuseEntry:
+    """可复用的历史分析"""
+    analysis_id: int
+    material_id: int
+    project_id: int
+    project_name: str
+    material_name: str
+    specification: str
+    unit: str
+    predicted_price_min: float
+    predicted_price_max: float
+    confidence_score: Optional[float]
+    analysis_model: Optional[str]
+    analyzed_at: Optional[datetime]
+    name_key: str
+    spec_key: str
+    unit_key: str
+    numbers: Tuple[str, ...]
+    # 大字段，构建索引后只为命中的分析加载
+    data_sources: List[Dict[str, Any]] = field(default_factory=list)
+    reasoning: str = ""
+    risk_factors: str = ""
+    recommendations: str = ""
+
+
+@dataclass
+class ReuseMatch:
+    """查找结果"""
+    entry: ReuseEntry
+    similarity: float
+    provisional: bool
+
+
+class AnalysisReuseIndex:
+    """近期已完成分析的相似度索引（单个项目的一次分析运行内使用）
+
+    索引按标准化单位分桶，桶内以名称字符二元组建立倒排表；查找时先命中完全相同的
+    名称+规格+单位，否则取共享二元组最多的候选按名称/规格相似度打分。
+    名称和规格中的数字（直径、厚度、强度等级等）必须完全一致，避免跨规格复用价格。
+    """
+
+    def __init__(
+        self,
+        entries: Iterable[ReuseEntry],
+        reuse_threshold: Optional[float] = None,
+        provisional_threshold: Optional[float] = None
+    ):
+        self.reuse_threshold = reuse_threshold if reuse_threshold is not None else settings.AI_REUSE_SIMILARITY
+        self.provisional_threshold = (
+            provisional_threshold if provisional_threshold is not None
+            else settings.AI_REUSE_PROVISIONAL_SIMILARITY
+        )
+        self._entries: List[ReuseEntry] = []
+        self._exact: Dict[Tuple[str, str, str], ReuseEntry] = {}
+        self._postings: Dict[str, Dict[str, List[int]]] = {}
+
+        # 按分析时间从新到旧加入，完全相同的材料保留最近一次分析
+        for entry in sorted(entries, key=lambda e: e.analyzed_at or datetime.min, reverse=True):
+            key = (entry.name_key, entry.spec_key, entry.unit_key)
+            if key in self._exact:
+                continue
+            self._exact[key] = entry
+            position = len(self._entries)
+            self._entries.append(entry)
+            bucket = self._postings.setdefault(entry.unit_key, {})
+            for gram in _bigrams(entry.name_key):
+                bucket.setdefault(gram, []).append(position)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, material: ProjectMaterial) -> Optional[ReuseMatch]:
+        """查找可复用的分析，没有足够相似的结果时返回None"""
+        name_key, spec_key, unit_key = material_key(material)
+        if not name_key:
+            return None
+
+        exact = self._exact.get((name_key, spec_key, unit_key))
+        if exact:
+            return ReuseMatch(entry=exact, similarity=1.0, provisional=False)
+
+        bucket = self._postings.get(unit_key)
+        if not bucket:
+            return None
+
+        grams = _bigrams(name_key)
+        overlap: Dict[int, int] = {}
+        for gram in grams:
+            for position in bucket.get(gram, ()):
+                overlap[position] = overlap.get(position, 0) + 1
+        if not overlap:
+            return None
+
+        numbers = tuple(sorted(_NUMBER_PATTERN.findall(name_key + "|" + spec_key)))
+        min_overlap = max(1, int(len(grams) * 0.5))
+        candidates = sorted(
+            (position for position, count in overlap.items() if count >= min_overlap),
+            key=lambda position: overlap[position],
+            reverse=True
+        )[:_CANDIDATE_LIMIT]
+
+        best: Optional[ReuseEntry] = None
+        best_score = 0.0
+        for position in candidates:
+            entry = self._entries[position]
+            if entry.numbers != numbers:
+                continue
+            score = self._score(name_key, spec_key, entry)
+            if score > best_score:
+                best, best_score = entry, score
+
+        if best is None or best_score < self.provisional_threshold:
+            return None
+        return ReuseMatch(
+            entry=best,
+            similarity=round(best_score, 4),
+            provisional=best_score < self.reuse_threshold
+        )
+
+    @staticmethod
+    def _score(name_key: str, spec_key: str, entry: ReuseEntry) -> float:
+        name_score = SequenceMatcher(None, name_key, entry.name_key).ratio()
+        if not spec_key and not entry.spec_key:
+            spec_score = 1.0
+        else:
+            spec_score = SequenceMatcher(None, spec_key, entry.spec_key).ratio()
+        return name_score * 0.6 + spec_score * 0.4
+
+    @classmethod
+    async def build(
+        cls,
+        db: AsyncSession,
+        project: Project,
+        materials: List[ProjectMaterial]
+    ) -> "AnalysisReuseIndex":
+        """加载与项目地区相同、基期在窗口内的近期已完成分析
+
+        先只查询打分需要的轻量字段（单位、地区编码和基期在SQL中预筛选，Python中精确判断），
+        再对 materials 逐个查找，只为命中的分析加载数据源、推理过程等大字段。
+        """
+
+        start = time.perf_counter()
+        units = {normalize_unit(m.unit or "") for m in materials}
+        exclude_ids = [m.id for m in materials]
+        cutoff = datetime.utcnow() - timedelta(days=settings.AI_REUSE_MAX_AGE_DAYS)
+        region = resolve_project_region(project)
+        target_month = _month_index(project.base_price_date)
+        window = settings.AI_REUSE_BASE_DATE_WINDOW_MONTHS
+
+        stmt = (
+            select(
+                PriceAnalysis.id,
+                PriceAnalysis.material_id,
+                PriceAnalysis.predicted_price_min,
+                PriceAnalysis.predicted_price_max,
+                PriceAnalysis.confidence_score,
+                PriceAnalysis.analysis_model,
+                PriceAnalysis.analyzed_at,
+                ProjectMaterial.material_name,
+                ProjectMaterial.specification,
+                ProjectMaterial.unit,
+                Project.id.label("project_id"),
+                Project.name.label("project_name"),
+                Project.base_price_date,
+                Project.base_price_province,
+                Project.base_price_city,
+                Project.base_price_district,
+                Project.location,
+            )
+            .join(ProjectMaterial, ProjectMaterial.id == PriceAnalysis.material_id)
+            .join(Project, Project.id == ProjectMaterial.project_id)
+            .where(
+                PriceAnalysis.status == AnalysisStatus.COMPLETED,
+                PriceAnalysis.predicted_price_min.isnot(None),
+                PriceAnalysis.predicted_price_max.isnot(None),
+                PriceAnalysis.analyzed_at >= cutoff,
+                or_(
+                    PriceAnalysis.analysis_model.is_(None),
+                    ~PriceAnalysis.analysis_model.startswith(REUSE_MODEL_PREFIX)
+                ),
+                func.lower(func.trim(ProjectMaterial.unit)).in_(sorted(unit_spellings(units))),
+                *_region_filters(project),
+                _base_date_filter(target_month, window)
+            )
+        )
+        if exclude_ids:
+            stmt = stmt.where(~ProjectMaterial.id.in_(exclude_ids))
+
+        entries = []
+        region_cache: Dict[int, str] = {}
+        for row in (await db.execute(stmt)).all():
+            unit_key = normalize_unit(row.unit or "")
+            if unit_key not in units:
+                continue
+            # 有基期的项目只复用基期相近的分析；无基期（市场价）只复用同样无基期的分析
+            month = _month_index(row.base_price_date)
+            if target_month is None:
+                if month is not None:
+                    continue
+            elif month is None or abs(month - target_month) > window:
+                continue
+            if row.project_id not in region_cache:
+                region_cache[row.project_id] = resolve_project_region(row)
+            if region_cache[row.project_id] != region:
+                continue
+
+            name_key = normalize_text(row.material_name)
+            spec_key = normalize_text(row.specification)
+            entries.append(ReuseEntry(
+                analysis_id=row.id,
+                material_id=row.material_id,
+                project_id=row.project_id,
+                project_name=row.project_name,
+                material_name=row.material_name,
+                specification=row.specification or "",
+                unit=row.unit or "",
+                predicted_price_min=row.predicted_price_min,
+                predicted_price_max=row.predicted_price_max,
+                confidence_score=row.confidence_score,
+                analysis_model=row.analysis_model,
+                analyzed_at=row.analyzed_at,
+                name_key=name_key,
+                spec_key=spec_key,
+                unit_key=unit_key,
+                numbers=tuple(sorted(_NUMBER_PATTERN.findall(name_key + "|" + spec_key)))
+            ))
+
+        index = cls(entries)
+        matched: Dict[int, ReuseEntry] = {}
+        for material in materials:
+            match = index.lookup(material)
+            if match:
+                matched[match.entry.analysis_id] = match.entry
+        await _load_entry_details(db, matched)
+
+        logger.info(
+            f"分析复用索引: 项目 {project.id} 地区 {region}，候选 {len(index)} 条，命中 {len(matched)} 条，"
+            f"耗时 {time.perf_counter() - start:.2f}s"
+        )
+        return index
+
+
+def _has_code(code: Optional[str]) -> bool:
+    return bool(code) and code.strip() not in _EMPTY_CODES
+
+
+def _region_filters(project: Project) -> list:
+    """地区预筛选条件：地区编码相同的项目解析出的地区一定相同，最终以 resolve_project_region 的结果为准"""
+    if not _has_code(project.base_price_province):
+        # 项目没有基期地区编码时按项目地点（或全国）比较，只可能与同样没有省份编码的项目相同
+        return [or_(Project.base_price_province.is_(None), Project.base_price_province.in_(_EMPTY_CODES))]
+
+    filters = [Project.base_price_province == project.base_price_province]
+    for column, code in (
+        (Project.base_price_city, project.base_price_city),
+        (Project.base_price_district, project.base_price_district),
+    ):
+        if _has_code(code):
+            filters.append(column == code)
+        else:
+            filters.append(or_(column.is_(None), column.in_(_EMPTY_CODES)))
+    return filters
+
+
+def _base_date_filter(target_month: Optional[int], window: int):
+    """基期预筛选条件：按基期窗口覆盖的年份前缀匹配（基期格式不统一，精确比较在Python中进行）"""
+    if target_month is None:
+        return or_(Project.base_price_date.is_(None), func.trim(Project.base_price_date) == "")
+    first_year = (target_month - window) // 12
+    last_year = (target_month + window) // 12
+    return or_(*[
+        Project.base_price_date.like(f"{year}%")
+        for year in range(first_year, last_year + 1)
+    ])
+
+
+async def _load_entry_details(db: AsyncSession, entries: Dict[int, ReuseEntry]):
+    """为命中的分析加载数据源、推理过程等大字段"""
+    analysis_ids = list(entries)
+    for i in range(0, len(analysis_ids), _DETAIL_CHUNK_SIZE):
+        stmt = select(
+            PriceAnalysis.id,
+            PriceAnalysis.data_sources,
+            PriceAnalysis.analysis_reasoning,
+            PriceAnalysis.risk_factors,
+            PriceAnalysis.recommendations,
+        ).where(PriceAnalysis.id.in_(analysis_ids[i:i + _DETAIL_CHUNK_SIZE]))
+        for row in (await db.execute(stmt)).all():
+            entry = entries[row.id]
+            entry.data_sources = row.data_sources or []
+            entry.reasoning = row.analysis_reasoning or ""
+            entry.risk_factors = row.risk_factors or ""
+            entry.recommendations = row.recommendations or ""
+
+
+def build_reused_result(material: ProjectMaterial, match: ReuseMatch) -> PriceAnalysisResult:
+    """将命中的历史分析转换为分析结果，记录来源"""
+
+    entry = match.entry
+    provenance = {
+        'analysis_id': entry.analysis_id,
+        'material_id': entry.material_id,
+        'project_id': entry.project_id,
+        'project_name': entry.project_name,
+        'material_name': entry.material_name,
+        'specification': entry.specification,
+        'unit': entry.unit,
+        'analysis_model': entry.analysis_model,
+        'analyzed_at': entry.analyzed_at.isoformat() if entry.analyzed_at else None,
+        'similarity': match.similarity,
+        'provisional': match.provisional
+    }
+
+    label = "暂定价格（近似材料）" if match.provisional else "复用分析结果"
+    # 来源分析保存时已追加过权重说明，保存复用结果时会按数据源重新生成，这里去掉旧的说明
+    source_reasoning = entry.reasoning.split(WEIGHTING_NOTE_HEADER, 1)[0].rstrip()
+    reasoning = (
+        f"[{label}] 来源：项目「{entry.project_name}」材料「{entry.material_name} {entry.specification}」"
+        f"（相似度 {match.similarity:.2f}）\n\n{source_reasoning}"
+    ).strip()
+
+    risk_factors = [item for item in entry.risk_factors.split("; ") if item]
+    confidence = entry.confidence_score if entry.confidence_score is not None else 0.5
+    if match.provisional:
+        risk_factors.append("价格取自近似材料的历史分析，建议人工复核或重新分析")
+        confidence = confidence * match.similarity
+
+    return PriceAnalysisResult(
+        material_name=material.material_name,
+        specification=material.specification or "",
+        predicted_price_min=entry.predicted_price_min,
+        predicted_price_max=entry.predicted_price_max,
+        predicted_price_avg=None,
+        confidence_score=round(confidence, 4),
+        # 保存时会补全数据源字段，复制一份避免修改索引中的数据
+        data_sources=copy.deepcopy(entry.data_sources),
+        reasoning=reasoning,
+        risk_factors=risk_factors,
+        recommendations=[item for item in entry.recommendations.split("; ") if item],
+        analysis_time=0.0,
+        analysis_cost=0.0,
+        provider=f"{REUSE_MODEL_PREFIX}{entry.analysis_model or ''}"[:50],
+        raw_response={'reused_from': provenance}
+    )
+
+
+def share_analysis_result(material: ProjectMaterial, source_id: int, ai_result: PriceAnalysisResult) -> PriceAnalysisResult:
+    """将同一次分析中相同材料的结果复制给另一个材料（不重复计费）"""
+    raw_response = dict(ai_result.raw_response or {})
+    raw_response['deduplicated_from'] = source_id
+    return dataclasses.replace(
+        ai_result,
+        material_name=material.material_name,
+        specification=material.specification or "",
+        # 保存时会补全数据源字段，每个材料使用独立副本
+        data_sources=copy.deepcopy(ai_result.data_sources),
+        analysis_cost=0.0,
+        raw_response=raw_response
+    )
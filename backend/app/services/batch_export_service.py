@@ -7,6 +7,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException
 from loguru import logger
 
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
 from app.services.report_service import ReportService
 from app.schemas.report import ReportConfigSchema
 from app.utils.attachment_manager import AttachmentManager
@@ -50,13 +52,13 @@ class BatchExportService:
             export_folder = self.export_dir / export_id
             export_folder.mkdir(parents=True, exist_ok=True)
             
-            # 并发生成报告
-            semaphore = asyncio.Semaphore(3)  # 限制并发数
+            # 并发生成报告：每个项目使用独立的数据库会话，文档在渲染进程池中并行渲染
+            semaphore = asyncio.Semaphore(max(settings.REPORT_RENDER_WORKERS, 1))  # 并发数与渲染进程数一致
             tasks = []
             
             for project_id in project_ids:
                 task = self._generate_single_report_with_semaphore(
-                    semaphore, db, project_id, user_id, config, export_folder
+                    semaphore, project_id, user_id, config, export_folder
                 )
                 tasks.append(task)
             
@@ -108,22 +110,25 @@ class BatchExportService:
     async def _generate_single_report_with_semaphore(
         self,
         semaphore: asyncio.Semaphore,
-        db: AsyncSession,
         project_id: int,
         user_id: int,
         config: Optional[ReportConfigSchema],
         export_folder: Path
     ) -> Dict[str, Any]:
-        """使用信号量限制的单个报告生成"""
+        """使用信号量限制的单个报告生成
+
+        并发任务不能共用同一个 AsyncSession，每个项目在独立会话中查询数据和写入报告记录。
+        """
         async with semaphore:
             try:
                 # 生成报告
-                report = await self.report_service.generate_report(
-                    db=db,
-                    project_id=project_id,
-                    user_id=user_id,
-                    config=config
-                )
+                async with AsyncSessionLocal() as session:
+                    report = await self.report_service.generate_report(
+                        db=session,
+                        project_id=project_id,
+                        user_id=user_id,
+                        config=config
+                    )
                 
                 # 复制报告文件到导出目录
                 if report.file_path and Path(report.file_path).exists():
@@ -0,0 +1,298 @@
+"""审计报告图表渲染
+
+报告中的图表（风险等级分布、核增减额TOP10、送审与AI核审总额对比、价格偏差分析）按以下方式渲染：
+- 先从报告数据中提取每张图表需要的最小数据（可 JSON 序列化），以 图表类型 + 数据 的哈希作为缓存键；
+- 缓存中没有的图表提交到渲染进程池并行绘制（Agg 后端，中文字体在进程启动时加载一次），返回 PNG 字节；
+- PNG 字节按总大小（CHART_CACHE_MAX_BYTES）做 LRU 淘汰，调用方拿到的是内存缓冲区，不再写临时文件。
+"""
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+import matplotlib
+# 设置matplotlib后端为Agg，必须在导入pyplot之前设置
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib import font_manager, rcParams
+from loguru import logger
+
+from app.core.config import settings
+from app.services.render_pool import run_in_render_pool
+
+
+# 图表样式变化时递增，使旧的缓存失效
+CHART_STYLE_VERSION = 1
+
+CHINESE_FONTS = [
+    'Arial Unicode MS',
+    'Heiti TC',
+    'Songti SC',
+    'STHeiti',
+    'Microsoft YaHei',
+    'SimSun',
+    'PingFang SC',
+    'Noto Sans CJK SC',
+    'SimHei'
+]
+
+RISK_LABELS = {
+    'normal': '正常',
+    'low': '低风险',
+    'medium': '中风险',
+    'high': '高风险',
+    'critical': '极高风险',
+    'severe': '极高风险',
+    'unknown': '待确认'
+}
+RISK_COLORS = {
+    'normal': '#67C23A',
+    'low': '#409EFF',
+    'medium': '#E6A23C',
+    'high': '#F56C6C',
+    'critical': '#C039A5',
+    'severe': '#C039A5',
+    'unknown': '#909399'
+}
+RISK_ORDER = ['normal', 'low', 'medium', 'high', 'critical', 'unknown']
+
+_configured = False
+
+
+def configure_matplotlib():
+    """配置matplotlib中文支持并预先加载字体（每个进程只执行一次，也用作渲染进程的 initializer）"""
+    global _configured
+    if _configured:
+        return
+    rcParams['font.family'] = 'sans-serif'
+    rcParams['font.sans-serif'] = list(CHINESE_FONTS)
+    rcParams['axes.unicode_minus'] = False
+    # 触发字体列表加载和字体查找缓存，避免第一张图表承担该开销
+    font_manager.findfont(font_manager.FontProperties(family=['sans-serif']))
+    _configured = True
+
+
+def chart_inputs(data: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """从报告数据中提取各图表的绘制数据，按报告中的顺序返回 [(图表类型, 数据)]，没有数据的图表不返回"""
+    charts: List[Tuple[str, Any]] = []
+
+    risk_stats = data.get('risk_stats_raw') or {}
+    risk_slices = [[level, risk_stats[level]] for level in RISK_ORDER if level in risk_stats]
+    if risk_stats:
+        charts.append(('risk_levels', risk_slices))
+
+    items = [
+        [item['materialName'], item['adjustment']]
+        for key in ('analysis_materials_report', 'guidance_materials_report')
+        for item in data.get(key, [])
+    ]
+    if items:
+        items.sort(key=lambda x: abs(x[1]), reverse=True)
+        charts.append(('adjustment_top', items[:10]))
+
+    stats = data.get('statistics', {})
+    analysis_totals = stats.get('analysis_totals') or {}
+    guidance_totals = stats.get('guidance_totals') or {}
+    original_totals = [analysis_totals.get('original_total', 0), guidance_totals.get('original_total', 0)]
+    ai_totals = [analysis_totals.get('ai_total', 0), guidance_totals.get('ai_total', 0)]
+    if any(original_totals) or any(ai_totals):
+        charts.append(('totals_compare', {'original': original_totals, 'ai': ai_totals}))
+
+    # 价格偏差分析图：只显示前20个分析结果
+    variances = [
+        [f"材料{i + 1}", analysis.price_variance]
+        for i, analysis in enumerate((data.get('analyses') or [])[:20])
+        if analysis.price_variance is not None
+    ]
+    if len(variances) >= 2:
+        charts.append(('price_variance', variances))
+
+    # 如果以上图表都没有生成（例如项目数据较少），生成一张占位说明图
+    if not charts:
+        charts.append(('no_data', None))
+    return charts
+
+
+def chart_cache_key(chart_type: str, payload: Any) -> str:
+    content = json.dumps([CHART_STYLE_VERSION, chart_type, payload], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def _plot_risk_levels(slices: List[List[Any]]):
+    labels = [RISK_LABELS.get(level, level) for level, _ in slices]
+    sizes = [count for _, count in slices]
+    colors = [RISK_COLORS.get(level, '#409EFF') for level, _ in slices]
+
+    plt.figure(figsize=(8, 8))
+    plt.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%', startangle=90)
+    plt.title('材料风险等级分布', fontsize=16)
+    plt.axis('equal')
+    return {'dpi': 300, 'bbox_inches': 'tight'}
+
+
+def _plot_adjustment_top(items: List[List[Any]]):
+    names = [name for name, _ in items][::-1]
+    values = [value for _, value in items][::-1]
+    colors = ['#F56C6C' if v > 0 else '#67C23A' for v in values]
+
+    plt.figure(figsize=(12, 7))
+    bars = plt.barh(names, values, color=colors)
+    plt.title('核增减额TOP10', fontsize=16)
+    plt.xlabel('金额（元）', fontsize=12)
+    plt.grid(axis='x', alpha=0.2)
+    plt.axvline(0, color='#333', linewidth=0.8)
+
+    max_value = max((abs(v) for v in values), default=0)
+    offset = max_value * 0.02 if max_value else 0
+    for bar, value in zip(bars, values):
+        x_pos = value + offset if value >= 0 else value - offset
+        ha = 'left' if value >= 0 else 'right'
+        plt.text(x_pos, bar.get_y() + bar.get_height() / 2, f"{value:+,.2f}", va='center', ha=ha, fontsize=9)
+
+    plt.tight_layout()
+    return {'dpi': 300}
+
+
+def _plot_totals_compare(totals: Dict[str, List[float]]):
+    categories = ['无信息价材料', '市场信息价材料']
+    original_totals = totals['original']
+    ai_totals = totals['ai']
+    x = range(len(categories))
+    width = 0.35
+
+    plt.figure(figsize=(10, 6))
+    plt.bar([i - width / 2 for i in x], original_totals, width, label='送审总额', color='#409EFF')
+    plt.bar([i + width / 2 for i in x], ai_totals, width, label='AI核审总额', color='#67C23A')
+
+    plt.xticks(list(x), categories)
+    plt.ylabel('金额（元）')
+    plt.title('送审 VS AI 核审 总额对比', fontsize=16)
+    plt.legend()
+    plt.grid(axis='y', alpha=0.2)
+
+    for idx, value in enumerate(original_totals):
+        plt.text(idx - width / 2, value, f"{value:,.2f}", ha='center', va='bottom', fontsize=9)
+    for idx, value in enumerate(ai_totals):
+        plt.text(idx + width / 2, value, f"{value:,.2f}", ha='center', va='bottom', fontsize=9)
+
+    plt.tight_layout()
+    return {'dpi': 300}
+
+
+def _plot_price_variance(items: List[List[Any]]):
+    materials = [label for label, _ in items]
+    variances = [value for _, value in items]
+
+    plt.figure(figsize=(12, 6))
+    colors = ['red' if v > 30 else 'orange' if v > 15 else 'green' for v in variances]
+    plt.bar(materials, variances, color=colors, alpha=0.7)
+    plt.title('材料价格偏差分析', fontsize=16)
+    plt.xlabel('材料', fontsize=12)
+    plt.ylabel('价格偏差（%）', fontsize=12)
+    plt.xticks(rotation=45)
+    plt.axhline(y=15, color='orange', linestyle='--', alpha=0.5, label='15%警戒线')
+    plt.axhline(y=30, color='red', linestyle='--', alpha=0.5, label='30%风险线')
+    plt.legend()
+    plt.grid(True, alpha=0.3)
+    return {'dpi': 300, 'bbox_inches': 'tight'}
+
+
+def _plot_no_data(_: Any):
+    """没有可用数据时的占位图，避免文档中图表区域完全空白"""
+    plt.figure(figsize=(8, 4))
+    plt.axis('off')
+    plt.text(
+        0.5,
+        0.5,
+        '当前项目暂无可展示的图表数据\n（无风险材料或差异为 0）',
+        ha='center',
+        va='center',
+        fontsize=14
+    )
+    return {'dpi': 200, 'bbox_inches': 'tight'}
+
+
+_PLOTTERS = {
+    'risk_levels': _plot_risk_levels,
+    'adjustment_top': _plot_adjustment_top,
+    'totals_compare': _plot_totals_compare,
+    'price_variance': _plot_price_variance,
+    'no_data': _plot_no_data
+}
+
+
+def render_chart(chart_type: str, payload: Any) -> bytes:
+    """绘制单张图表并返回PNG字节（模块级函数，在渲染进程池中执行）"""
+    configure_matplotlib()
+    try:
+        save_options = _PLOTTERS[chart_type](payload)
+        buffer = BytesIO()
+        plt.savefig(buffer, format='png', **save_options)
+        return buffer.getvalue()
+    finally:
+        plt.close('all')
+
+
+class ChartRenderingService:
+    """报告图表的并行渲染与缓存"""
+
+    def __init__(self):
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cache_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _get_cached(self, key: str) -> Optional[bytes]:
+        image = self._cache.get(key)
+        if image is not None:
+            self._cache.move_to_end(key)
+        return image
+
+    def _put_cached(self, key: str, image: bytes):
+        if key in self._cache or len(image) > settings.CHART_CACHE_MAX_BYTES:
+            return
+        self._cache[key] = image
+        self._cache_bytes += len(image)
+        while self._cache_bytes > settings.CHART_CACHE_MAX_BYTES:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted)
+
+    def clear_cache(self):
+        self._cache.clear()
+        self._cache_bytes = 0
+
+    async def render_report_charts(self, data: Dict[str, Any]) -> List[BytesIO]:
+        """渲染报告中的全部图表，按报告顺序返回PNG内存缓冲区（单张图表失败时跳过）"""
+        charts = [(chart_type, payload, chart_cache_key(chart_type, payload)) for chart_type, payload in chart_inputs(data)]
+
+        images: Dict[str, bytes] = {}
+        pending: Dict[str, Tuple[str, Any]] = {}
+        for chart_type, payload, key in charts:
+            if key in images or key in pending:
+                continue
+            image = self._get_cached(key)
+            if image is not None:
+                images[key] = image
+            else:
+                pending[key] = (chart_type, payload)
+
+        self.hits += len(charts) - len(pending)
+        self.misses += len(pending)
+        if pending:
+            results = await asyncio.gather(
+                *(run_in_render_pool(render_chart, chart_type, payload) for chart_type, payload in pending.values()),
+                return_exceptions=True
+            )
+            for (key, (chart_type, _)), result in zip(pending.items(), results):
+                if isinstance(result, BaseException):
+                    logger.error(f"生成图表 {chart_type} 失败: {result}")
+                    continue
+                images[key] = result
+                self._put_cached(key, result)
+
+        return [BytesIO(images[key]) for _, _, key in charts if images.get(key)]
+
+
+chart_rendering_service = ChartRenderingService()
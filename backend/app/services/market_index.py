@@ -0,0 +1,379 @@
+"""信息价市场指数（material_market_index）
+
+按 地区 × 材料分类 × 月份 预先计算市场指数，供价格合理性分析直接查表：
+- 材料月度价格：与信息价月度汇总口径一致（材料标识 × 单位 × 信息价类型 × 月份，优先取除税价）；
+- 环比：同一材料相邻两个月价比的几何平均（只统计上月也有价格的材料），指数由环比链式累乘，序列首月为 100；
+- 同比：与 12 个月前指数相比；趋势：近 3 个月指数累计变化超过 ±MARKET_TREND_THRESHOLD 为 rising/falling；
+- 季节因子：同一自然月的平均对数环比相对全部月份平均对数环比的偏离（至少两年样本，否则为 1）。
+
+基准材料导入后只重算涉及地区中最早导入月份及之后的指数：汇总查询只读取该月的上一个月起的信息价（用于环比），
+之前月份的指数、环比从已保存的指数读取，链式累乘和同比、趋势、季节因子沿用已有序列。
+早于该月的指数行不改写（其季节因子在全量重建时更新），查询结果按 (地区, 分类, 月份) 进程内缓存。
+"""
+import math
+import re
+import time
+from datetime import datetime
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import and_, case, delete, func, insert, literal_column, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.material import BaseMaterial, MaterialMarketIndex
+from app.services.price_rollup import month_of, source_select
+
+
+ALL_CATEGORIES = "全部"
+UNCATEGORIZED = "未分类"
+_TREND_MONTHS = 3
+_MIN_SEASONAL_YEARS = 2
+_MONTH_PATTERN = re.compile(r"(\d{4})\D{0,2}(\d{1,2})")
+# 没有市场指数时使用的默认市场环境（与原先固定的市场环境一致）
+DEFAULT_CONTEXT = {'trend': 'stable', 'inflation_rate': 0.03, 'season_factor': 1.0}
+
+
+def _month_ordinal(month: str) -> int:
+    year, month_number = month.split("-")
+    return int(year) * 12 + int(month_number) - 1
+
+
+def normalize_month(value: Optional[str]) -> Optional[str]:
+    """'2025-06' / '2025年6月' / '2025-06-01' -> '2025-06'，无法识别时返回 None"""
+    match = _MONTH_PATTERN.search(str(value)) if value else None
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        return None
+    return f"{match.group(1)}-{int(match.group(2)):02d}"
+
+
+def _previous_month(month: str) -> str:
+    ordinal = _month_ordinal(month) - 1
+    return f"{ordinal // 12}-{ordinal % 12 + 1:02d}"
+
+
+def _index_statement(regions: Optional[List[str]] = None, from_month: Optional[str] = None):
+    """按 (分类, 地区, 月份) 及 (地区, 月份) 汇总材料数、可比材料数和平均对数环比（from_month 起）"""
+    source = source_select().add_columns(
+        func.coalesce(func.nullif(BaseMaterial.category, ""), UNCATEGORIZED).label("category")
+    )
+    if regions is not None:
+        source = source.where(BaseMaterial.region.in_(regions))
+    src = source.subquery("src")
+
+    item_price = func.avg(func.coalesce(src.c.price_excluding_tax, src.c.price))
+    item_months = (
+        select(
+            src.c.identity_key, src.c.unit, src.c.region, src.c.price_type, src.c.category, src.c.month,
+            item_price.label("price")
+        )
+        .where(src.c.month >= from_month if from_month else src.c.month.isnot(None))
+        .group_by(src.c.identity_key, src.c.unit, src.c.region, src.c.price_type, src.c.category, src.c.month)
+        .having(item_price > 0)
+        .subquery("item_months")
+    )
+
+    series = dict(
+        partition_by=[item_months.c.identity_key, item_months.c.unit, item_months.c.region, item_months.c.price_type],
+        order_by=item_months.c.month
+    )
+    relatives = select(
+        item_months.c.category,
+        item_months.c.region,
+        item_months.c.month,
+        item_months.c.price,
+        func.lag(item_months.c.price).over(**series).label("previous_price"),
+        func.lag(item_months.c.month).over(**series).label("previous_month")
+    ).subquery("relatives")
+
+    previous_month = func.to_char(
+        func.to_date(relatives.c.month, "YYYY-MM") - literal_column("interval '1 month'"), "YYYY-MM"
+    )
+    log_relative = case(
+        (relatives.c.previous_month == previous_month, func.ln(relatives.c.price / relatives.c.previous_price))
+    )
+    return select(
+        relatives.c.category,
+        relatives.c.region,
+        relatives.c.month,
+        func.grouping(relatives.c.category).label("all_categories"),
+        func.count().label("sample_count"),
+        func.count(log_relative).label("linked_count"),
+        func.avg(log_relative).label("mean_log_relative"),
+        func.avg(relatives.c.price).label("average_price")
+    ).group_by(
+        func.grouping_sets(
+            tuple_(relatives.c.category, relatives.c.region, relatives.c.month),
+            tuple_(relatives.c.region, relatives.c.month)
+        )
+    )
+
+
+def build_index_rows(
+    aggregates: Iterable[Any],
+    history: Optional[Dict[Tuple[str, str], List[Any]]] = None,
+    since: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """由按月汇总的平均对数环比计算指数、同比、趋势和季节因子
+
+    增量重算时只生成 since 及之后月份的指数，history 为各 (地区, 分类) 在 since 之前已保存的指数行
+    （按月份升序，需包含 month / index_value / mom_change），指数从其最后一个月接续。
+    """
+    history = history or {}
+    series: Dict[Tuple[str, str], List[Any]] = defaultdict(list)
+    for row in aggregates:
+        if since and row.month < since:
+            continue
+        category = ALL_CATEGORIES if row.all_categories else row.category
+        series[(row.region, category)].append(row)
+
+    rows: List[Dict[str, Any]] = []
+    for (region, category), months in series.items():
+        months.sort(key=lambda item: item.month)
+        previous = history.get((region, category), [])
+
+        # 季节因子：按自然月比较平均对数环比（已保存的月份由环比还原）
+        linked = [(item.month, math.log1p(item.mom_change)) for item in previous if item.mom_change is not None]
+        linked += [(item.month, float(item.mean_log_relative)) for item in months if item.linked_count]
+        overall = sum(value for _, value in linked) / len(linked) if linked else 0.0
+        by_calendar_month: Dict[int, List[float]] = defaultdict(list)
+        for month, value in linked:
+            by_calendar_month[int(month[5:7])].append(value)
+        seasonal = {
+            calendar_month: math.exp(sum(values) / len(values) - overall)
+            for calendar_month, values in by_calendar_month.items()
+            if len(values) >= _MIN_SEASONAL_YEARS
+        }
+
+        index_value = previous[-1].index_value if previous else 100.0
+        index_by_ordinal: Dict[int, float] = {_month_ordinal(item.month): item.index_value for item in previous}
+        for position, item in enumerate(months):
+            mom_change = None
+            if (position or previous) and item.linked_count:
+                growth = math.exp(float(item.mean_log_relative))
+                index_value *= growth
+                mom_change = growth - 1
+            ordinal = _month_ordinal(item.month)
+            index_by_ordinal[ordinal] = index_value
+
+            year_ago = index_by_ordinal.get(ordinal - 12)
+            # 近3个月：取3个月前的指数，缺失时取窗口内最早的指数
+            window_start = next(
+                (index_by_ordinal[key] for key in range(ordinal - _TREND_MONTHS, ordinal) if key in index_by_ordinal),
+                index_value
+            )
+            recent_change = index_value / window_start - 1
+            if recent_change > settings.MARKET_TREND_THRESHOLD:
+                trend = "rising"
+            elif recent_change < -settings.MARKET_TREND_THRESHOLD:
+                trend = "falling"
+            else:
+                trend = "stable"
+
+            rows.append({
+                "region": region,
+                "category": category,
+                "month": item.month,
+                "index_value": round(index_value, 4),
+                "mom_change": round(mom_change, 6) if mom_change is not None else None,
+                "yoy_change": round(index_value / year_ago - 1, 6) if year_ago else None,
+                "trend": trend,
+                "seasonal_factor": round(seasonal.get(int(item.month[5:7]), 1.0), 6),
+                "average_price": float(item.average_price) if item.average_price is not None else None,
+                "sample_count": item.sample_count,
+                "linked_count": item.linked_count
+            })
+    return rows
+
+
+class MarketIndexService:
+    """信息价市场指数的维护与查询"""
+
+    def __init__(self):
+        self.write_chunk_size = 1000  # 单条批量写入语句的最大行数
+        self._cache: Dict[Tuple[str, str, Optional[str]], Tuple[float, Optional[Dict[str, Any]]]] = {}
+
+    async def refresh(
+        self,
+        db: AsyncSession,
+        regions: Optional[Iterable[str]] = None,
+        since: Optional[str] = None
+    ) -> int:
+        """重算指定地区（为 None 时全部地区）since 月份及之后（为 None 时全部月份）的指数（不提交事务），返回写入的行数"""
+        region_list = sorted({region for region in regions if region}) if regions is not None else None
+        if region_list is not None and not region_list:
+            return 0
+
+        history: Dict[Tuple[str, str], List[Any]] = defaultdict(list)
+        if since:
+            stmt = select(
+                MaterialMarketIndex.region,
+                MaterialMarketIndex.category,
+                MaterialMarketIndex.month,
+                MaterialMarketIndex.index_value,
+                MaterialMarketIndex.mom_change
+            ).where(MaterialMarketIndex.month < since).order_by(MaterialMarketIndex.month)
+            if region_list is not None:
+                stmt = stmt.where(MaterialMarketIndex.region.in_(region_list))
+            for row in (await db.execute(stmt)).all():
+                history[(row.region, row.category)].append(row)
+
+        # 增量重算时多读上一个月的信息价，用于计算 since 月份的环比
+        result = await db.execute(_index_statement(region_list, _previous_month(since) if since else None))
+        rows = build_index_rows(result.all(), history, since)
+
+        stmt = delete(MaterialMarketIndex)
+        if region_list is not None:
+            stmt = stmt.where(MaterialMarketIndex.region.in_(region_list))
+        if since:
+            stmt = stmt.where(MaterialMarketIndex.month >= since)
+        await db.execute(stmt)
+        for i in range(0, len(rows), self.write_chunk_size):
+            await db.execute(insert(MaterialMarketIndex), rows[i:i + self.write_chunk_size])
+
+        self.invalidate(region_list)
+        return len(rows)
+
+    async def sync(self, materials: Iterable[BaseMaterial]) -> int:
+        """在独立会话中按导入的基准材料增量重算并提交：每个地区从其最早导入的月份起重算（月份无法确定时重算该地区全部月份）；
+        失败只记录日志，可通过 rebuild 修复"""
+        earliest: Dict[str, Optional[str]] = {}
+        for material in materials:
+            if not material.region:
+                continue
+            month = month_of(material)
+            if material.region not in earliest:
+                earliest[material.region] = month
+            elif earliest[material.region] and (month is None or month < earliest[material.region]):
+                earliest[material.region] = month
+        if not earliest:
+            return 0
+
+        regions_by_month: Dict[Optional[str], List[str]] = defaultdict(list)
+        for region, month in earliest.items():
+            regions_by_month[month].append(region)
+        try:
+            written = 0
+            async with AsyncSessionLocal() as session:
+                for since, regions in regions_by_month.items():
+                    written += await self.refresh(session, regions, since)
+                await session.commit()
+            logger.info(f"市场指数已刷新: 地区 {len(earliest)} 个，指数行 {written} 条")
+            return written
+        except Exception as e:
+            logger.error(f"刷新市场指数失败（可调用重建接口修复）: {e}")
+            return 0
+
+    async def rebuild(self, db: AsyncSession) -> int:
+        """全量重建市场指数并提交"""
+        written = await self.refresh(db)
+        await db.commit()
+        logger.info(f"市场指数全量重建完成，共 {written} 条")
+        return written
+
+    def invalidate(self, regions: Optional[Iterable[str]] = None):
+        """清除查询缓存（regions 为 None 时全部清除）"""
+        if regions is None:
+            self._cache.clear()
+            return
+        regions = set(regions)
+        for key in [key for key in self._cache if key[0] in regions]:
+            del self._cache[key]
+
+    async def lookup(
+        self,
+        db: AsyncSession,
+        region: str,
+        category: Optional[str] = None,
+        month: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """查询 month（为空时取最新）及之前最近一个月的指数，分类没有指数时退回地区全部材料的指数"""
+        category = category or ALL_CATEGORIES
+        key = (region, category, month)
+        cached = self._cache.get(key)
+        if cached and time.monotonic() - cached[0] < settings.MARKET_INDEX_CACHE_SECONDS:
+            return cached[1]
+
+        row = await self._latest_row(db, region, category, month)
+        if row is None and category != ALL_CATEGORIES:
+            row = await self._latest_row(db, region, ALL_CATEGORIES, month)
+        value = self.serialize(row) if row is not None else None
+        self._cache[key] = (time.monotonic(), value)
+        return value
+
+    async def get_context(
+        self,
+        db: AsyncSession,
+        region: str,
+        category: Optional[str] = None,
+        month: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """价格合理性分析使用的市场环境（趋势、通胀率、季节因子），没有指数时返回默认市场环境"""
+        index = await self.lookup(db, region, category, normalize_month(month))
+        context = {
+            **DEFAULT_CONTEXT,
+            'region': region,
+            'analysis_date': datetime.utcnow(),
+            'source': 'default'
+        }
+        if index is None:
+            return context
+
+        # 通胀率优先取同比，不足12个月时按环比年化
+        if index['yoy_change'] is not None:
+            inflation_rate = index['yoy_change']
+        elif index['mom_change'] is not None:
+            inflation_rate = (1 + index['mom_change']) ** 12 - 1
+        else:
+            inflation_rate = DEFAULT_CONTEXT['inflation_rate']
+        context.update({
+            'trend': index['trend'],
+            'inflation_rate': round(inflation_rate, 6),
+            'season_factor': index['seasonal_factor'],
+            'mom_change': index['mom_change'],
+            'index_month': index['month'],
+            'index_category': index['category'],
+            'index_value': index['index_value'],
+            'source': 'market_index'
+        })
+        return context
+
+    async def _latest_row(
+        self,
+        db: AsyncSession,
+        region: str,
+        category: str,
+        month: Optional[str]
+    ) -> Optional[MaterialMarketIndex]:
+        conditions = [MaterialMarketIndex.region == region, MaterialMarketIndex.category == category]
+        if month:
+            conditions.append(MaterialMarketIndex.month <= month)
+        stmt = (
+            select(MaterialMarketIndex)
+            .where(and_(*conditions))
+            .order_by(MaterialMarketIndex.month.desc())
+            .limit(1)
+        )
+        result = await db.execute(stmt)
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    def serialize(row: MaterialMarketIndex) -> Dict[str, Any]:
+        return {
+            'region': row.region,
+            'category': row.category,
+            'month': row.month,
+            'index_value': row.index_value,
+            'mom_change': row.mom_change,
+            'yoy_change': row.yoy_change,
+            'trend': row.trend,
+            'seasonal_factor': row.seasonal_factor,
+            'average_price': row.average_price,
+            'sample_count': row.sample_count,
+            'linked_count': row.linked_count
+        }
+
+
+market_index_service = MarketIndexService()
@@ -3,6 +3,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, and_, or_, text, delete, update
 from sqlalchemy.orm import selectinload
 from datetime import datetime, timedelta
+from types import SimpleNamespace
 import pandas as pd
 from loguru import logger
 
@@ -12,6 +13,16 @@ from app.schemas.material import (
     BaseMaterialImportRequest, MaterialAliasCreate, BaseMaterialPeriodDeleteRequest
 )
 from app.utils.excel import ExcelProcessor
+from app.services.price_rollup import price_rollup_service, identity_key, identity_key_of
+from app.services.market_index import market_index_service
+
+
+def _index_rows(rows) -> List[SimpleNamespace]:
+    """(地区, 信息价日期, 生效日期) 元组转换为 market_index_service.sync 需要的对象"""
+    return [
+        SimpleNamespace(region=region, price_date=price_date, effective_date=effective_date)
+        for region, price_date, effective_date in rows
+    ]
 
 
 class BaseMaterialService:
@@ -27,6 +38,8 @@ class BaseMaterialService:
         db.add(db_material)
         await db.commit()
         await db.refresh(db_material)
+        await price_rollup_service.sync({identity_key_of(db_material)})
+        await market_index_service.sync([db_material])
         return db_material
     
     @staticmethod
@@ -232,12 +245,20 @@ class BaseMaterialService:
     ) -> BaseMaterial:
         """更新基准材料"""
         update_data = material_data.model_dump(exclude_unset=True)
+        previous_key = identity_key_of(material)
+        # 地区/日期修改后，原地区（原月份起）的市场指数也需要重算
+        previous_index_row = SimpleNamespace(
+            region=material.region, price_date=material.price_date, effective_date=material.effective_date
+        )
         
         for field, value in update_data.items():
             setattr(material, field, value)
         
         await db.commit()
         await db.refresh(material)
+        # 编码/名称/规格修改后，原标识和新标识的月度汇总都需要重算
+        await price_rollup_service.sync({previous_key, identity_key_of(material)})
+        await market_index_service.sync([previous_index_row, material])
         return material
     
     @staticmethod
@@ -271,8 +292,14 @@ class BaseMaterialService:
                 await db.delete(alias)
             
             # 删除基准材料
+            rollup_key = identity_key_of(material)
+            index_row = SimpleNamespace(
+                region=material.region, price_date=material.price_date, effective_date=material.effective_date
+            )
             await db.delete(material)
             await db.commit()
+            await price_rollup_service.sync({rollup_key})
+            await market_index_service.sync([index_row])
             
             logger.info(f"成功删除基准材料 {material.name} (ID: {material.id})")
             return True
@@ -318,6 +345,8 @@ class BaseMaterialService:
         material_ids: List[int]
     ) -> int:
         """批量删除材料 - 优化大批量删除性能"""
+        affected_keys = set()
+        affected_index_rows = set()
         try:
             if not material_ids:
                 return 0
@@ -354,7 +383,19 @@ class BaseMaterialService:
                 stmt_delete_alias = delete(MaterialAlias).where(MaterialAlias.base_material_id.in_(batch_ids))
                 await db.execute(stmt_delete_alias)
                 
-                # 3. 批量删除基准材料
+                # 3. 记录受影响的材料标识和地区/日期，删除后重算月度汇总和市场指数
+                stmt_identity = select(
+                    BaseMaterial.material_code, BaseMaterial.name, BaseMaterial.specification
+                ).where(BaseMaterial.id.in_(batch_ids)).distinct()
+                identity_rows = await db.execute(stmt_identity)
+                affected_keys.update(identity_key(*row) for row in identity_rows.all())
+                stmt_index = select(
+                    BaseMaterial.region, BaseMaterial.price_date, BaseMaterial.effective_date
+                ).where(BaseMaterial.id.in_(batch_ids)).distinct()
+                index_rows = await db.execute(stmt_index)
+                affected_index_rows.update(tuple(row) for row in index_rows.all())
+                
+                # 4. 批量删除基准材料
                 stmt_delete_material = delete(BaseMaterial).where(BaseMaterial.id.in_(batch_ids))
                 result = await db.execute(stmt_delete_material)
                 batch_deleted = result.rowcount
@@ -365,11 +406,16 @@ class BaseMaterialService:
                 logger.info(f"第 {current_batch} 批删除完成，本批删除: {batch_deleted}，累计删除: {total_deleted}")
             
             logger.info(f"批量删除完成，共删除 {total_deleted} 个基准材料")
+            await price_rollup_service.sync(affected_keys)
+            await market_index_service.sync(_index_rows(affected_index_rows))
             return total_deleted
         
         except Exception as e:
             logger.error(f"批量删除材料失败: {e}")
             await db.rollback()
+            # 已提交的批次仍需刷新汇总和市场指数
+            await price_rollup_service.sync(affected_keys)
+            await market_index_service.sync(_index_rows(affected_index_rows))
             raise e
 
     @staticmethod
@@ -789,6 +835,8 @@ class MaterialImportService:
             
             created_materials.extend(db_materials)
         
+        await price_rollup_service.sync(identity_key_of(material) for material in created_materials)
+        await market_index_service.sync(created_materials)
         return created_materials
     
     async def import_base_materials(
@@ -926,6 +974,10 @@ class MaterialImportService:
                 except Exception as e:
                     logger.error(f"批量创建材料失败: {e}")
                     errors.append(f"批量创建失败: {str(e)}")
+                
+                # 已提交的批次按材料标识刷新月度汇总，按地区刷新市场指数
+                await price_rollup_service.sync(identity_key_of(material) for material in created_materials)
+                await market_index_service.sync(created_materials)
             
             return {
                 "total_count": len(materials_data),
@@ -1074,6 +1126,10 @@ class MaterialImportService:
                 except Exception as e:
                     logger.error(f"批量创建材料失败: {e}")
                     errors.append(f"批量创建失败: {str(e)}")
+                
+                # 已提交的批次按材料标识刷新月度汇总，按地区刷新市场指数
+                await price_rollup_service.sync(identity_key_of(material) for material in created_materials)
+                await market_index_service.sync(created_materials)
             
             return {
                 "total_count": len(structured_materials),
@@ -1,15 +1,79 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_, func
+from sqlalchemy import select, insert, update, and_, or_, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import datetime, timedelta
 from loguru import logger
 import asyncio
 import re
+from dataclasses import dataclass
 
 from app.models.project import ProjectMaterial, Project
 from app.models.analysis import PriceAnalysis, PriceAnalysisHistory, AnalysisStatus
 from app.services.ai_analysis import AIServiceManager, PriceAnalysisResult, AIProvider
+from app.services.analysis_reuse import AnalysisReuseIndex, WEIGHTING_NOTE_HEADER, build_reused_result, material_key, share_analysis_result
 from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+
+
+@dataclass(frozen=True)
+class MaterialSnapshot:
+    """分析所需的材料字段快照
+
+    写入失败回滚会使会话中已加载的 ProjectMaterial 全部过期，之后再读取其属性会触发
+    隐式加载（异步会话中抛出 MissingGreenlet）。分析开始前先复制需要的字段，
+    AI调用、结果共享和结果写入都只使用快照。
+    """
+    id: int
+    project_id: int
+    material_name: str
+    specification: Optional[str]
+    unit: Optional[str]
+    unit_price: Optional[float]
+    region: str
+
+
+class AnalysisBudget:
+    """项目AI分析成本预算
+
+    以已发生的 analysis_cost 为基础，每个材料开始分析前按预估单次成本预留额度，
+    分析完成后按实际成本结算；剩余额度不足时不再开始新的分析。
+    """
+
+    def __init__(self, limit: Optional[float], spent: float = 0.0, estimated_cost: float = 0.0):
+        self.limit = limit if limit and limit > 0 else None
+        self.spent = spent
+        self.estimated_cost = estimated_cost
+        self.reserved = 0.0
+        self.exhausted = False
+        self._settled = asyncio.Event()
+
+    @property
+    def remaining(self) -> Optional[float]:
+        if self.limit is None:
+            return None
+        return max(self.limit - self.spent, 0.0)
+
+    async def acquire(self) -> bool:
+        """为一个材料预留额度，额度不足但仍有进行中的分析时等待其结算"""
+        if self.limit is None:
+            return True
+        while True:
+            if self.spent + self.reserved + self.estimated_cost <= self.limit:
+                self.reserved += self.estimated_cost
+                return True
+            if self.reserved <= 1e-9:
+                self.exhausted = True
+                return False
+            self._settled.clear()
+            await self._settled.wait()
+
+    def settle(self, actual_cost: Optional[float]):
+        """按实际成本结算一个已预留的材料"""
+        if self.limit is not None:
+            self.reserved = max(self.reserved - self.estimated_cost, 0.0)
+        self.spent += actual_cost or 0.0
+        self._settled.set()
 
 
 class PriceAnalysisService:
@@ -18,10 +82,9 @@ class PriceAnalysisService:
     def __init__(self):
         self.ai_manager = AIServiceManager()
         self.max_concurrent_analyses = 20  # 最大并发分析数
-        self.analysis_timeout = 60  # 默认单个分析超时时间（秒）
-        self.provider_timeout_overrides = {
-            AIProvider.DOUBAO: 150  # 豆包响应较慢，额外放宽超时时间
-        }
+        self.bulk_write_chunk_size = 500  # 单条批量写入语句的最大行数
+        # 单次调用超时由各AI服务的 request_timeout 控制（豆包150秒，其余60秒），
+        # 超时后由 AIServiceManager 计入熔断并转移到下一个服务
     
     async def analyze_project_materials(
         self,
@@ -30,9 +93,19 @@ class PriceAnalysisService:
         material_ids: Optional[List[int]] = None,
         batch_size: int = 20,
         force_reanalyze: bool = False,
-        preferred_provider: Optional[AIProvider] = None
+        preferred_provider: Optional[AIProvider] = None,
+        cost_budget: Optional[float] = None,
+        include_results: bool = True
     ) -> Dict[str, Any]:
-        """分析项目材料价格"""
+        """分析项目材料价格
+
+        材料按经济影响（总价或数量×单价）从高到低分析；设置成本预算时（cost_budget，
+        为空则使用 AI_PROJECT_BUDGET，0表示不限），项目累计分析成本达到预算后停止，
+        未开始的材料保持未分析状态，提高预算后再次分析即可继续。
+        非强制重新分析时，近期已分析过的相近材料直接复用其结果，不调用AI（见 analysis_reuse）。
+        include_results 为 True 时结果中包含逐个材料的分析结果（results，成功的材料附带 analysis），
+        为 False 时只返回统计，分析结果已保存到数据库，可通过分析结果接口查询。
+        """
 
         # 获取项目基期信息价日期
         project_base_date = await self._get_project_base_date(db, project_id)
@@ -43,50 +116,81 @@ class PriceAnalysisService:
         )
         
         if not materials_to_analyze:
-            return {
+            response = {
                 'project_id': project_id,
                 'total_materials': 0,
                 'analyzed_count': 0,
                 'success_count': 0,
                 'failed_count': 0,
-                'skipped_count': 0
+                'skipped_count': 0,
+                'reused_count': 0,
+                'deferred_count': 0,
+                'budget_exhausted': False,
+                'value_coverage': await self.get_value_coverage(db, project_id)
             }
+            if include_results:
+                response['results'] = []
+            return response
         
-        logger.info(f"开始分析项目 {project_id} 的 {len(materials_to_analyze)} 个材料")
-        
-        # 统计结果
-        analyzed_count = 0
-        success_count = 0
-        failed_count = 0
-        skipped_count = 0
+        budget = await self._create_budget(db, project_id, cost_budget, preferred_provider)
+        reuse_index = None if force_reanalyze else await self._build_reuse_index(materials_to_analyze)
+        logger.info(
+            f"开始分析项目 {project_id} 的 {len(materials_to_analyze)} 个材料"
+            + (f"，成本预算 {budget.limit} 元，已发生 {budget.spent:.4f} 元" if budget.limit is not None else "")
+        )
         
-        # 分批处理材料
-        for i in range(0, len(materials_to_analyze), batch_size):
-            batch = materials_to_analyze[i:i + batch_size]
-            
-            # 并发分析批次材料
-            batch_results = await self._analyze_material_batch(db, batch, project_base_date, preferred_provider)
-            
-            for result in batch_results:
-                analyzed_count += 1
-                if result['success']:
-                    success_count += 1
-                elif result['skipped']:
-                    skipped_count += 1
-                else:
-                    failed_count += 1
+        # 流水线处理：AI调用滑动并发，结果按批写入数据库
+        results = await self._run_analysis_pipeline(
+            db, materials_to_analyze, project_base_date, preferred_provider,
+            flush_size=batch_size, budget=budget, reuse_index=reuse_index
+        )
+
+        analyzed_count = len(results)
+        success_count = sum(1 for r in results if r['success'])
+        skipped_count = sum(1 for r in results if not r['success'] and r.get('skipped'))
+        failed_count = analyzed_count - success_count - skipped_count
+        reused_count = sum(1 for r in results if r.get('reused'))
         
         # 更新项目统计
         await self._update_project_analysis_statistics(db, project_id)
         
-        return {
+        response = {
             'project_id': project_id,
             'total_materials': len(materials_to_analyze),
             'analyzed_count': analyzed_count,
             'success_count': success_count,
             'failed_count': failed_count,
-            'skipped_count': skipped_count
+            'skipped_count': skipped_count,
+            'reused_count': reused_count,  # 复用历史分析、未调用AI的材料数
+            'deferred_count': len(materials_to_analyze) - analyzed_count,  # 因预算不足未开始分析的材料数
+            'budget_limit': budget.limit,
+            'budget_spent': round(budget.spent, 4),
+            'budget_exhausted': budget.exhausted,
+            'value_coverage': await self.get_value_coverage(db, project_id)
         }
+        if include_results:
+            response['results'] = await self._attach_analysis_payloads(db, results)
+        return response
+
+    async def _attach_analysis_payloads(
+        self,
+        db: AsyncSession,
+        results: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """为分析成功的材料附带已保存的分析结果（一次查询）"""
+        success_ids = [r['material_id'] for r in results if r.get('success')]
+        analyses: Dict[int, PriceAnalysis] = {}
+        if success_ids:
+            stmt = select(PriceAnalysis).where(PriceAnalysis.material_id.in_(success_ids))
+            analyses = {a.material_id: a for a in (await db.execute(stmt)).scalars().all()}
+
+        payloads = []
+        for result in results:
+            analysis = analyses.get(result['material_id']) if result.get('success') else None
+            if analysis is not None:
+                result = {**result, 'analysis': self._format_analysis_result(analysis)}
+            payloads.append(result)
+        return payloads
     
     async def analyze_single_material(
         self,
@@ -108,6 +212,7 @@ class PriceAnalysisService:
         
         if not material:
             raise ValueError(f"材料 {material_id} 不存在")
+        snapshot = self._snapshot(material)
         
         # 检查是否需要重新分析
         if not force_reanalyze:
@@ -121,14 +226,14 @@ class PriceAnalysisService:
         
         try:
             # 获取项目基期信息价日期
-            project_base_date = await self._get_project_base_date(db, material.project_id)
+            project_base_date = await self._get_project_base_date(db, snapshot.project_id)
             # 执行AI分析
             ai_result = await self._perform_ai_analysis(
-                material, project_base_date, preferred_provider
+                snapshot, project_base_date, preferred_provider
             )
             
             # 保存分析结果
-            analysis = await self._save_analysis_result(db, material, ai_result)
+            analysis = await self._save_analysis_result(db, snapshot, ai_result)
             await db.commit()
             await db.refresh(analysis)
             
@@ -141,8 +246,9 @@ class PriceAnalysisService:
         except Exception as e:
             logger.error(f"分析材料 {material_id} 失败: {e}")
             
-            # 记录失败的分析
-            await self._save_failed_analysis(db, material, str(e))
+            # 记录失败的分析（保存结果失败时会话中的对象已不可用，使用快照）
+            await db.rollback()
+            await self._save_failed_analysis(db, snapshot, str(e))
             await db.commit()
             
             return {
@@ -281,7 +387,8 @@ class PriceAnalysisService:
             'pending_materials': pending_materials,  # 分析中的材料数
             'failed_materials': failed_materials,  # 分析失败的材料数
             'analysis_rate': analyzed_materials / total_unpriced if total_unpriced > 0 else 0,  # 分析完成率
-            'reasonable_rate': reasonable_materials / analyzed_materials if analyzed_materials > 0 else 0  # 合理率
+            'reasonable_rate': reasonable_materials / analyzed_materials if analyzed_materials > 0 else 0,  # 合理率
+            'value_coverage': await self.get_value_coverage(db, project_id)  # 已分析材料价值占比
         }
     
     async def _get_materials_for_analysis(
@@ -302,7 +409,7 @@ class PriceAnalysisService:
             selectinload(ProjectMaterial.project)
         ).where(
             ProjectMaterial.project_id == project_id
-        )
+        ).order_by(ProjectMaterial.id)
         
         if material_ids:
             stmt = stmt.where(ProjectMaterial.id.in_(material_ids))
@@ -311,7 +418,7 @@ class PriceAnalysisService:
         all_materials = result.scalars().all()
         
         if force_reanalyze:
-            return all_materials
+            return sorted(all_materials, key=self._material_value, reverse=True)
         
         # 过滤出需要分析的材料（未分析或分析失败的）
         materials_to_analyze = []
@@ -334,131 +441,239 @@ class PriceAnalysisService:
                 if needs_analysis:
                     materials_to_analyze.append(material)
         
+        # 按经济影响从高到低排序，少数高价值材料优先分析
+        materials_to_analyze.sort(key=self._material_value, reverse=True)
         return materials_to_analyze
-    
-    async def _analyze_material_batch(
+
+    @staticmethod
+    def _material_value(material: ProjectMaterial) -> float:
+        """材料经济影响：优先使用总价，否则数量×单价"""
+        if material.total_price:
+            return abs(float(material.total_price))
+        if material.quantity and material.unit_price:
+            return abs(float(material.quantity) * float(material.unit_price))
+        return 0.0
+
+    async def _create_budget(
         self,
         db: AsyncSession,
-        materials: List[ProjectMaterial],
-        project_base_date: Optional[str] = None,
+        project_id: int,
+        cost_budget: Optional[float],
         preferred_provider: Optional[AIProvider] = None
-    ) -> List[Dict[str, Any]]:
-        """批量分析材料 - 支持并行和串行处理"""
-        
-        # 如果材料数量较少，使用串行处理
-        if len(materials) <= 2:
-            return await self._analyze_material_batch_serial(db, materials, project_base_date, preferred_provider)
+    ) -> AnalysisBudget:
+        """创建项目成本预算，已发生成本按历史分析记录的 analysis_cost 累计"""
+        limit = cost_budget if cost_budget is not None else settings.AI_PROJECT_BUDGET
+        if not limit or limit <= 0:
+            return AnalysisBudget(None)
+
+        stmt = select(func.coalesce(func.sum(PriceAnalysisHistory.analysis_cost), 0.0)).join(
+            ProjectMaterial, ProjectMaterial.id == PriceAnalysisHistory.material_id
+        ).where(ProjectMaterial.project_id == project_id)
+        spent = float((await db.execute(stmt)).scalar() or 0.0)
+
+        return AnalysisBudget(
+            limit,
+            spent=spent,
+            estimated_cost=self.ai_manager.estimate_request_cost(preferred_provider)
+        )
 
-        # 对于较多材料，使用并行处理
-        return await self._analyze_material_batch_parallel(db, materials, project_base_date, preferred_provider)
+    async def get_value_coverage(self, db: AsyncSession, project_id: int) -> Dict[str, Any]:
+        """无信息价材料中已完成分析的材料价值占比"""
+        value_expr = func.abs(func.coalesce(
+            ProjectMaterial.total_price,
+            ProjectMaterial.quantity * ProjectMaterial.unit_price,
+            0.0
+        ))
+        stmt = select(
+            func.coalesce(func.sum(value_expr), 0.0),
+            func.coalesce(func.sum(value_expr).filter(PriceAnalysis.status == AnalysisStatus.COMPLETED), 0.0)
+        ).select_from(ProjectMaterial).outerjoin(
+            PriceAnalysis, PriceAnalysis.material_id == ProjectMaterial.id
+        ).where(
+            ProjectMaterial.project_id == project_id,
+            ProjectMaterial.is_matched.is_not(True)
+        )
+        total_value, analyzed_value = (await db.execute(stmt)).one()
+        total_value = float(total_value or 0.0)
+        analyzed_value = float(analyzed_value or 0.0)
+        return {
+            'total_value': round(total_value, 2),
+            'analyzed_value': round(analyzed_value, 2),
+            'coverage': round(analyzed_value / total_value, 4) if total_value > 0 else 0
+        }
     
-    async def _analyze_material_batch_serial(
+    async def _run_analysis_pipeline(
         self,
         db: AsyncSession,
         materials: List[ProjectMaterial],
         project_base_date: Optional[str] = None,
-        preferred_provider: Optional[AIProvider] = None
+        preferred_provider: Optional[AIProvider] = None,
+        flush_size: int = 20,
+        budget: Optional[AnalysisBudget] = None,
+        reuse_index: Optional[AnalysisReuseIndex] = None
     ) -> List[Dict[str, Any]]:
-        """串行处理材料分析 - 避免数据库冲突"""
+        """流式分析流水线：有界材料队列 -> N个AI工作协程 -> 数据库写入协程
 
-        batch_results = []
+        AI调用之间不再按批次互相等待，慢请求只占用一个工作协程；
+        写入协程每累计 flush_size 个结果或每隔 ANALYSIS_FLUSH_INTERVAL 秒提交一次。
+        材料按传入顺序开始分析，预算不足时停止投递剩余材料。
+        名称/规格/单位标准化后相同的材料只分析一次，结果共用。
+        """
 
+        if not materials:
+            return []
+
+        # 写入协程与调用方共用会话，回滚后ORM对象会过期，流水线只使用快照
+        groups: Dict[tuple, List[MaterialSnapshot]] = {}
         for material in materials:
-            try:
-                result = await self._analyze_single_material_task(db, material, project_base_date, preferred_provider)
-                batch_results.append(result)
-            except Exception as e:
-                logger.error(f"材料 {material.id} 分析异常: {e}")
-                batch_results.append({
-                    'material_id': material.id,
-                    'success': False,
-                    'skipped': False,
-                    'error': str(e)
-                })
-        
-        return batch_results
-    
-    async def _analyze_material_batch_parallel(
+            snapshot = self._snapshot(material)
+            groups.setdefault(material_key(snapshot), []).append(snapshot)
+
+        worker_count = min(self.max_concurrent_analyses, len(groups))
+        flush_size = max(1, flush_size)
+        flush_interval = settings.ANALYSIS_FLUSH_INTERVAL
+        material_queue: asyncio.Queue = asyncio.Queue(maxsize=worker_count * 2)
+        result_queue: asyncio.Queue = asyncio.Queue()
+        results: List[Dict[str, Any]] = []
+
+        worker_done = object()
+
+        async def producer():
+            for group in groups.values():
+                if budget and not await budget.acquire():
+                    logger.info(f"项目AI分析预算已用完（已发生 {budget.spent:.4f} 元），停止分析剩余材料")
+                    break
+                await material_queue.put(group)
+            for _ in range(worker_count):
+                await material_queue.put(None)
+
+        async def ai_worker():
+            while True:
+                group = await material_queue.get()
+                if group is None:
+                    await result_queue.put(worker_done)
+                    return
+                material = group[0]
+                result = await self._analyze_single_material_parallel(
+                    material, project_base_date, preferred_provider, reuse_index
+                )
+                if budget:
+                    ai_result = result.get('ai_result')
+                    budget.settle(ai_result.analysis_cost if ai_result else 0.0)
+                await result_queue.put((material, result))
+                for duplicate in group[1:]:
+                    if result.get('success'):
+                        shared = {**result, 'ai_result': share_analysis_result(duplicate, material.id, result['ai_result'])}
+                    else:
+                        shared = result
+                    await result_queue.put((duplicate, {**shared, 'material_id': duplicate.id}))
+
+        async def writer():
+            loop = asyncio.get_running_loop()
+            pending = []
+            deadline = 0.0
+            finished_workers = 0
+            while finished_workers < worker_count:
+                timeout = max(deadline - loop.time(), 0) if pending else None
+                try:
+                    item = await asyncio.wait_for(result_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    item = None
+
+                if item is worker_done:
+                    finished_workers += 1
+                elif item is not None:
+                    if not pending:
+                        deadline = loop.time() + flush_interval
+                    pending.append(item)
+
+                if pending and (len(pending) >= flush_size or loop.time() >= deadline):
+                    results.extend(await self._flush_analysis_results(db, pending))
+                    pending = []
+
+            if pending:
+                results.extend(await self._flush_analysis_results(db, pending))
+
+        tasks = [
+            asyncio.create_task(producer()),
+            asyncio.create_task(writer()),
+            *[asyncio.create_task(ai_worker()) for _ in range(worker_count)]
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        return results
+
+    async def _flush_analysis_results(
         self,
         db: AsyncSession,
-        materials: List[ProjectMaterial],
-        project_base_date: Optional[str] = None,
-        preferred_provider: Optional[AIProvider] = None
+        items: List[tuple]
     ) -> List[Dict[str, Any]]:
-        """并行处理材料分析 - 提升处理速度"""
+        """将一批AI分析结果批量写入数据库，一次提交；批量失败时逐条重试"""
 
-        # 创建分析任务
-        tasks = []
-        for material in materials:
-            task = self._analyze_single_material_parallel(material, project_base_date, preferred_provider)
-            tasks.append(task)
-        
-        # 并发执行分析任务（限制并发数量）
-        semaphore = asyncio.Semaphore(self.max_concurrent_analyses)  # 限制最大并发数
-        
-        async def run_with_semaphore(task):
-            async with semaphore:
-                return await task
-        
-        # 执行所有任务
-        results = await asyncio.gather(
-            *[run_with_semaphore(task) for task in tasks],
-            return_exceptions=True
-        )
-        
-        # 处理结果，保存到数据库
-        batch_results = []
-        for i, result in enumerate(results):
-            material = materials[i]
-            
-            if isinstance(result, Exception):
-                logger.error(f"材料 {material.id} 并行分析异常: {result}")
-                batch_results.append({
+        try:
+            await self._bulk_save_pipeline_items(db, items)
+            await db.commit()
+            return [self._summarize_pipeline_result(material, result) for material, result in items]
+        except Exception as e:
+            logger.warning(f"批量写入 {len(items)} 条分析结果失败，改为逐条写入: {e}")
+            await db.rollback()
+
+        outcomes = []
+        for material, result in items:
+            try:
+                await self._bulk_save_pipeline_items(db, [(material, result)])
+                await db.commit()
+                outcomes.append(self._summarize_pipeline_result(material, result))
+            except Exception as e:
+                logger.error(f"保存材料 {material.id} 分析结果失败: {e}")
+                await db.rollback()
+                outcomes.append({
                     'material_id': material.id,
                     'success': False,
                     'skipped': False,
-                    'error': str(result)
+                    'error': f"保存结果失败: {str(e)}"
                 })
-            else:
-                # 保存分析结果到数据库
-                try:
-                    if result.get('success'):
-                        analysis = await self._save_analysis_result_from_ai_result(
-                            db, material, result['ai_result']
-                        )
-                        await db.commit()
-                        await db.refresh(analysis)
-                        
-                        batch_results.append({
-                            'material_id': material.id,
-                            'success': True,
-                            'skipped': False,
-                            'analysis': self._format_analysis_result(analysis)
-                        })
-                    else:
-                        batch_results.append(result)
-                except Exception as e:
-                    logger.error(f"保存材料 {material.id} 分析结果失败: {e}")
-                    batch_results.append({
-                        'material_id': material.id,
-                        'success': False,
-                        'skipped': False,
-                        'error': f"保存结果失败: {str(e)}"
-                    })
-        
-        return batch_results
+        return outcomes
+
+    async def _bulk_save_pipeline_items(self, db: AsyncSession, items: List[tuple]):
+        """按成功/失败拆分流水线结果后批量写入（不提交）"""
+        completed = [(material, result['ai_result']) for material, result in items if result.get('success')]
+        failed = [
+            (material, result.get('error') or '分析失败')
+            for material, result in items if not result.get('success')
+        ]
+        await self.bulk_save_analysis_results(db, completed=completed, failed=failed)
+
+    def _summarize_pipeline_result(self, material: MaterialSnapshot, result: Dict[str, Any]) -> Dict[str, Any]:
+        """流水线结果摘要（不包含AI原始结果）"""
+        if result.get('success'):
+            return {
+                'material_id': material.id,
+                'success': True,
+                'skipped': False,
+                'reused': self._is_reused_result(result['ai_result'])
+            }
+        return result
     
     async def _analyze_single_material_parallel(
         self,
-        material: ProjectMaterial,
+        material: MaterialSnapshot,
         project_base_date: Optional[str] = None,
-        preferred_provider: Optional[AIProvider] = None
+        preferred_provider: Optional[AIProvider] = None,
+        reuse_index: Optional[AnalysisReuseIndex] = None
     ) -> Dict[str, Any]:
         """并行分析单个材料 - 不涉及数据库操作"""
 
         try:
             # 执行AI分析（不涉及数据库会话）
-            ai_result = await self._perform_ai_analysis(material, project_base_date, preferred_provider)
+            ai_result = await self._perform_ai_analysis(
+                material, project_base_date, preferred_provider, reuse_index
+            )
             
             return {
                 'material_id': material.id,
@@ -481,31 +696,33 @@ class PriceAnalysisService:
         db: AsyncSession,
         material: ProjectMaterial,
         project_base_date: Optional[str] = None,
-        preferred_provider: Optional[AIProvider] = None
+        preferred_provider: Optional[AIProvider] = None,
+        reuse_index: Optional[AnalysisReuseIndex] = None
     ) -> Dict[str, Any]:
         """单个材料分析任务"""
 
+        # 回滚后 material 会过期，之后只使用快照
+        material = self._snapshot(material)
         try:
             # 创建或更新分析记录为处理中状态
             analysis = await self._create_processing_analysis(db, material)
             await db.commit()  # 提交处理中状态
 
-            # 执行AI分析
-            timeout = self._resolve_analysis_timeout(preferred_provider)
-            ai_result = await asyncio.wait_for(
-                self._perform_ai_analysis(material, project_base_date, preferred_provider),
-                timeout=timeout
+            # 执行AI分析（超时与故障转移由AIServiceManager处理，全部超时时抛出TimeoutError）
+            ai_result = await self._perform_ai_analysis(
+                material, project_base_date, preferred_provider, reuse_index
             )
             
             # 更新分析结果
-            await self._update_analysis_result(db, analysis, ai_result)
+            await self._update_analysis_result(db, analysis, material, ai_result)
             await db.commit()  # 提交分析结果
             
             return {
                 'material_id': material.id,
                 'success': True,
                 'skipped': False,
-                'analysis_id': analysis.id
+                'analysis_id': analysis.id,
+                'ai_result': ai_result
             }
         
         except asyncio.TimeoutError:
@@ -547,18 +764,28 @@ class PriceAnalysisService:
 
     async def _perform_ai_analysis(
         self,
-        material: ProjectMaterial,
+        material: MaterialSnapshot,
         project_base_date: Optional[str] = None,
-        preferred_provider: Optional[AIProvider] = None
+        preferred_provider: Optional[AIProvider] = None,
+        reuse_index: Optional[AnalysisReuseIndex] = None
     ) -> PriceAnalysisResult:
-        """执行AI分析"""
+        """执行AI分析；命中复用索引时直接返回历史分析结果"""
+
+        if reuse_index is not None:
+            match = reuse_index.lookup(material)
+            if match:
+                logger.info(
+                    f"材料 {material.id} 复用分析 {match.entry.analysis_id}"
+                    f"（相似度 {match.similarity:.2f}{'，暂定价格' if match.provisional else ''}）"
+                )
+                return build_reused_result(material, match)
 
         # 准备context参数
         context = {}
         if project_base_date:
             context['base_date'] = project_base_date
 
-        region = self._resolve_analysis_region(material)
+        region = material.region
         if region and project_base_date:
             context['base_region'] = region
 
@@ -571,6 +798,36 @@ class PriceAnalysisService:
             preferred_provider=preferred_provider
         )
 
+    async def _build_reuse_index(self, materials: List[ProjectMaterial]) -> Optional[AnalysisReuseIndex]:
+        """构建分析复用索引，未启用或构建失败时返回None（全部走AI分析）
+
+        使用独立会话查询，失败时不影响调用方会话中的事务和已加载的材料。
+        """
+        if not settings.AI_REUSE_ENABLED or not materials:
+            return None
+        try:
+            async with AsyncSessionLocal() as reuse_db:
+                return await AnalysisReuseIndex.build(reuse_db, materials[0].project, materials)
+        except Exception as e:
+            logger.warning(f"构建分析复用索引失败，本次不复用历史分析: {e}")
+            return None
+
+    def _snapshot(self, material: ProjectMaterial) -> MaterialSnapshot:
+        """复制分析所需的材料字段（需在任何写入和回滚之前调用）"""
+        return MaterialSnapshot(
+            id=material.id,
+            project_id=material.project_id,
+            material_name=material.material_name,
+            specification=material.specification,
+            unit=material.unit,
+            unit_price=material.unit_price,
+            region=self._resolve_analysis_region(material)
+        )
+
+    @staticmethod
+    def _is_reused_result(ai_result: Optional[PriceAnalysisResult]) -> bool:
+        return bool(ai_result and ai_result.raw_response and 'reused_from' in ai_result.raw_response)
+
     def _resolve_analysis_region(self, material: ProjectMaterial) -> str:
         """根据项目基期信息价地区确定分析区域"""
         from app.utils.region_mapping import resolve_region_from_codes
@@ -600,22 +857,10 @@ class PriceAnalysisService:
 
         return "全国"
 
-    def _resolve_analysis_timeout(
-        self,
-        preferred_provider: Optional[AIProvider]
-    ) -> int:
-        """根据指定的AI服务提供商决定超时时间"""
-        if preferred_provider and preferred_provider in self.provider_timeout_overrides:
-            return max(
-                self.analysis_timeout,
-                self.provider_timeout_overrides[preferred_provider]
-            )
-        return self.analysis_timeout
-    
     async def _create_processing_analysis(
         self,
         db: AsyncSession,
-        material: ProjectMaterial
+        material: MaterialSnapshot
     ) -> PriceAnalysis:
         """创建处理中的分析记录"""
         
@@ -685,28 +930,45 @@ class PriceAnalysisService:
         self,
         db: AsyncSession,
         analysis: PriceAnalysis,
+        material: MaterialSnapshot,
         ai_result: PriceAnalysisResult
     ):
         """更新分析结果"""
-        
-        # 先获取材料信息，用于日志和后续计算
-        stmt = select(ProjectMaterial).where(ProjectMaterial.id == analysis.material_id)
-        result = await db.execute(stmt)
-        material = result.scalar_one_or_none()
+
+        values = self._build_analysis_values(material, ai_result)
+        for key, value in values.items():
+            setattr(analysis, key, value)
+        await db.execute(
+            update(ProjectMaterial).where(ProjectMaterial.id == material.id).values(is_analyzed=True)
+        )
+
+        # 将本次分析结果写入历史表（用于时间线展示）
+        try:
+            db.add(PriceAnalysisHistory(**self._build_history_values(analysis.material_id, values)))
+        except Exception as e:
+            # 历史记录写入失败不影响主流程，只记录日志
+            logger.warning(f"写入价格分析历史记录失败(analysis_id={analysis.id}): {e}")
+
+    def _build_analysis_values(
+        self,
+        material: Optional[MaterialSnapshot],
+        ai_result: PriceAnalysisResult
+    ) -> Dict[str, Any]:
+        """根据AI结果计算分析记录字段（不访问数据库，只读取材料快照）"""
+
         material_name = material.material_name if material else ai_result.material_name
-        
-        analysis.status = AnalysisStatus.COMPLETED
+        values: Dict[str, Any] = {'status': AnalysisStatus.COMPLETED}
         base_predicted_min = ai_result.predicted_price_min
         base_predicted_max = ai_result.predicted_price_max
-        analysis.predicted_price_avg = None  # 不再使用加权平均价
-        analysis.confidence_score = ai_result.confidence_score
-        analysis.analysis_model = ai_result.provider
-        analysis.analysis_prompt = ai_result.analysis_prompt
+        values['predicted_price_avg'] = None  # 不再使用加权平均价
+        values['confidence_score'] = ai_result.confidence_score
+        values['analysis_model'] = ai_result.provider
+        values['analysis_prompt'] = ai_result.analysis_prompt
         # 保存API响应和参考网址
         api_response = ai_result.raw_response.copy() if ai_result.raw_response else {}
         if ai_result.reference_urls:
             api_response['reference_urls'] = ai_result.reference_urls
-        analysis.api_response = api_response
+        values['api_response'] = api_response
         # 验证并处理数据源，确保每个来源都有价格区间
         data_sources = ai_result.data_sources or []
         logger.info(f"材料 {material_name} 的原始数据源数量: {len(data_sources)}")
@@ -775,102 +1037,147 @@ class PriceAnalysisService:
         )
 
         if weighted_min is not None and weighted_max is not None:
-            analysis.predicted_price_min = weighted_min
-            analysis.predicted_price_max = weighted_max
+            values['predicted_price_min'] = weighted_min
+            values['predicted_price_max'] = weighted_max
         else:
-            analysis.predicted_price_min = base_predicted_min
-            analysis.predicted_price_max = base_predicted_max
+            values['predicted_price_min'] = base_predicted_min
+            values['predicted_price_max'] = base_predicted_max
 
-        analysis.data_sources = validated_sources
-        analysis.reference_prices = validated_sources  # 兼容字段
+        values['data_sources'] = validated_sources
+        values['reference_prices'] = validated_sources  # 兼容字段
         reasoning_text = ai_result.reasoning or ""
         if weighting_note:
-            reasoning_text = f"{reasoning_text}\n\n[系统综合权重说明]\n{weighting_note}".strip()
-        analysis.analysis_reasoning = reasoning_text
-        analysis.risk_factors = "; ".join(ai_result.risk_factors)
-        analysis.recommendations = "; ".join(ai_result.recommendations)
-        analysis.analysis_cost = ai_result.analysis_cost
-        analysis.analysis_time = ai_result.analysis_time
-        analysis.analyzed_at = datetime.utcnow()
+            reasoning_text = f"{reasoning_text}\n\n{WEIGHTING_NOTE_HEADER}\n{weighting_note}".strip()
+        values['analysis_reasoning'] = reasoning_text
+        values['risk_factors'] = "; ".join(ai_result.risk_factors)
+        values['recommendations'] = "; ".join(ai_result.recommendations)
+        values['analysis_cost'] = ai_result.analysis_cost
+        values['analysis_time'] = ai_result.analysis_time
+        values['analyzed_at'] = datetime.utcnow()
         
         # 判断价格合理性
         if material and material.unit_price:
-            analysis.is_reasonable = self._check_price_reasonability(
+            values['is_reasonable'] = self._check_price_reasonability(
                 material.unit_price,
-                analysis.predicted_price_min,
-                analysis.predicted_price_max
+                values['predicted_price_min'],
+                values['predicted_price_max']
             )
 
             # 修改偏差率计算逻辑 - 只使用最低价和最高价
-            analysis.price_variance = self._calculate_price_variance(
+            values['price_variance'] = self._calculate_price_variance(
                 material.unit_price,
                 None,  # 不再使用加权平均价
-                analysis.predicted_price_min,
-                analysis.predicted_price_max
+                values['predicted_price_min'],
+                values['predicted_price_max']
             )
 
             # 根据新的偏差率计算风险等级
-            analysis.risk_level = self._calculate_risk_level(analysis.price_variance)
+            values['risk_level'] = self._calculate_risk_level(values['price_variance'])
         else:
             # 如果没有材料或单价信息，设置默认值
-            analysis.is_reasonable = None
-            analysis.price_variance = None
-            analysis.risk_level = 'low'
+            values['is_reasonable'] = None
+            values['price_variance'] = None
+            values['risk_level'] = 'low'
 
-        # 将本次分析结果写入历史表（用于时间线展示）
-        try:
-            history_entry = PriceAnalysisHistory(
-                material_id=analysis.material_id,
-                status=analysis.status,
-                predicted_price_min=analysis.predicted_price_min,
-                predicted_price_max=analysis.predicted_price_max,
-                confidence_score=analysis.confidence_score,
-                risk_level=analysis.risk_level,
-                analysis_model=analysis.analysis_model,
-                analysis_cost=analysis.analysis_cost,
-                analysis_time=analysis.analysis_time,
-                analysis_reasoning=analysis.analysis_reasoning,
-            )
-            db.add(history_entry)
-        except Exception as e:
-            # 历史记录写入失败不影响主流程，只记录日志
-            logger.warning(f"写入价格分析历史记录失败(analysis_id={analysis.id}): {e}")
+        return values
+
+    def _build_history_values(self, material_id: int, values: Dict[str, Any]) -> Dict[str, Any]:
+        """根据分析记录字段生成历史快照字段"""
+        return {
+            'material_id': material_id,
+            'status': values.get('status'),
+            'predicted_price_min': values.get('predicted_price_min'),
+            'predicted_price_max': values.get('predicted_price_max'),
+            'confidence_score': values.get('confidence_score'),
+            'risk_level': values.get('risk_level'),
+            'analysis_model': values.get('analysis_model'),
+            'analysis_cost': values.get('analysis_cost'),
+            'analysis_time': values.get('analysis_time'),
+            'analysis_reasoning': values.get('analysis_reasoning'),
+        }
     
     async def _save_failed_analysis(
         self,
         db: AsyncSession,
-        material: ProjectMaterial,
+        material: MaterialSnapshot,
         error_message: str
     ):
-        """保存失败的分析"""
-        
-        stmt = select(PriceAnalysis).where(
-            PriceAnalysis.material_id == material.id
-        )
-        result = await db.execute(stmt)
-        analysis = result.scalar_one_or_none()
-        
-        if analysis:
-            analysis.status = AnalysisStatus.FAILED
-            analysis.analysis_reasoning = error_message
-        else:
-            analysis = PriceAnalysis(
-                material_id=material.id,
-                status=AnalysisStatus.FAILED,
-                analysis_reasoning=error_message
-            )
-            db.add(analysis)
+        """保存失败的分析（同时记录失败历史）"""
+        await self.bulk_save_analysis_results(db, failed=[(material, error_message)])
 
-        # 记录失败历史
-        try:
-            history_entry = PriceAnalysisHistory(
-                material_id=material.id,
-                status=AnalysisStatus.FAILED,
-                analysis_reasoning=error_message
+    async def bulk_save_analysis_results(
+        self,
+        db: AsyncSession,
+        completed: Optional[List[Tuple[MaterialSnapshot, PriceAnalysisResult]]] = None,
+        failed: Optional[List[Tuple[MaterialSnapshot, str]]] = None
+    ) -> Dict[int, int]:
+        """批量保存分析结果（不提交，由调用方在同一事务中提交）
+
+        材料以 MaterialSnapshot 传入：写入失败回滚后调用方还要逐条重试或记录失败，
+        此时会话中的 ProjectMaterial 已过期，不能再读取。
+
+        - `price_analyses` 按 material_id 执行 INSERT ... ON CONFLICT DO UPDATE
+        - 失败记录只更新状态和失败原因，保留上一次的分析数据
+        - 每条结果同时写入 `price_analysis_history`，批量插入
+        - 分析成功的材料同步标记 `ProjectMaterial.is_analyzed`
+
+        返回 material_id -> analysis_id 映射。
+        """
+
+        # 同一批次中同一材料只保留最后一条结果（ON CONFLICT 不允许同一行更新两次）
+        completed_by_material = {material.id: (material, ai_result) for material, ai_result in (completed or [])}
+        failed_by_material = {
+            material.id: error_message
+            for material, error_message in (failed or [])
+            if material.id not in completed_by_material
+        }
+
+        analysis_rows = []
+        history_rows = []
+        for material_id, (material, ai_result) in completed_by_material.items():
+            values = self._build_analysis_values(material, ai_result)
+            analysis_rows.append({'material_id': material_id, **values})
+            history_rows.append(self._build_history_values(material_id, values))
+
+        failed_rows = []
+        for material_id, error_message in failed_by_material.items():
+            values = {'status': AnalysisStatus.FAILED, 'analysis_reasoning': error_message}
+            failed_rows.append({'material_id': material_id, **values})
+            history_rows.append(self._build_history_values(material_id, values))
+
+        analysis_ids: Dict[int, int] = {}
+        for rows in (analysis_rows, failed_rows):
+            for i in range(0, len(rows), self.bulk_write_chunk_size):
+                analysis_ids.update(await self._upsert_analysis_rows(db, rows[i:i + self.bulk_write_chunk_size]))
+
+        if history_rows:
+            await db.execute(insert(PriceAnalysisHistory), history_rows)
+
+        if completed_by_material:
+            await db.execute(
+                update(ProjectMaterial)
+                .where(ProjectMaterial.id.in_(list(completed_by_material.keys())))
+                .values(is_analyzed=True)
             )
-            db.add(history_entry)
-        except Exception as e:
-            logger.warning(f"写入失败分析历史记录失败(material_id={material.id}): {e}")
+
+        return analysis_ids
+
+    async def _upsert_analysis_rows(self, db: AsyncSession, rows: List[Dict[str, Any]]) -> Dict[int, int]:
+        """按 material_id 插入或更新分析记录，所有行字段需一致"""
+        if not rows:
+            return {}
+
+        stmt = pg_insert(PriceAnalysis).values(rows)
+        update_columns = {key: stmt.excluded[key] for key in rows[0] if key != 'material_id'}
+        # ON CONFLICT 更新不会触发ORM的onupdate，需显式更新时间戳
+        update_columns['updated_at'] = func.now()
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PriceAnalysis.material_id],
+            set_=update_columns
+        ).returning(PriceAnalysis.material_id, PriceAnalysis.id)
+
+        result = await db.execute(stmt)
+        return {row.material_id: row.id for row in result.all()}
 
     def _parse_reliability_score(self, reliability: Optional[str]) -> float:
         """将可靠性字符串转换为0-1权重"""
@@ -1106,48 +1413,19 @@ class PriceAnalysisService:
     async def _save_analysis_result(
         self,
         db: AsyncSession,
-        material: ProjectMaterial,
+        material: MaterialSnapshot,
         ai_result: PriceAnalysisResult
     ) -> PriceAnalysis:
         """保存分析结果"""
-        
-        # 查找现有分析
+
+        await self.bulk_save_analysis_results(db, completed=[(material, ai_result)])
+
+        # 重新加载，覆盖会话中可能存在的旧对象
         stmt = select(PriceAnalysis).where(
             PriceAnalysis.material_id == material.id
-        )
+        ).execution_options(populate_existing=True)
         result = await db.execute(stmt)
-        existing_analyses = result.scalars().all()
-        
-        analysis = None
-        if existing_analyses:
-            # 使用第一条记录
-            analysis = existing_analyses[0]
-            # 删除重复的分析记录
-            if len(existing_analyses) > 1:
-                logger.warning(f"发现材料 {material.id} 有 {len(existing_analyses)} 条分析记录，将删除多余记录")
-                for duplicate in existing_analyses[1:]:
-                    await db.delete(duplicate)
-        else:
-            # 创建新记录
-            analysis = PriceAnalysis(
-                material_id=material.id,
-                status=AnalysisStatus.PROCESSING
-            )
-            db.add(analysis)
-        
-        # 更新分析结果
-        await self._update_analysis_result(db, analysis, ai_result)
-        
-        return analysis
-    
-    async def _save_analysis_result_from_ai_result(
-        self,
-        db: AsyncSession,
-        material: ProjectMaterial,
-        ai_result: PriceAnalysisResult
-    ) -> PriceAnalysis:
-        """从AI结果保存分析结果 - 用于并行处理"""
-        return await self._save_analysis_result(db, material, ai_result)
+        return result.scalar_one()
     
     async def _update_project_analysis_statistics(
         self,
@@ -0,0 +1,271 @@
+"""信息价月度汇总（material_price_monthly）
+
+每行对应 材料标识 × 单位 × 地区 × 信息价类型 × 月份，保存当月除税/含税/单价均值、有效单价均值
+（每条优先取除税价，无除税价时取单价）以及汇总条数和各价格字段的非空条数：
+- 材料标识：有材料编码时为 code:编码，否则为 name:名称 + 规格（与合同期价格的匹配口径一致）；
+- 月份：优先取信息价期数 price_date（支持 2024-03 / 2024/3 / 2024年3月），无有效期数时取生效日期所在月份；
+- 基准材料导入、删除、修改后按受影响的材料标识增量重算（整组删除后由 INSERT ... SELECT 重新汇总），
+  也可通过 rebuild 全量重建。
+
+合同期均价、风险幅度和历史价格趋势均从汇总表读取，不再逐期扫描 base_materials。
+"""
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from loguru import logger
+from sqlalchemy import String, and_, case, delete, func, insert, literal, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import AsyncSessionLocal
+from app.models.material import BaseMaterial, MaterialPriceMonthly
+
+
+IDENTITY_SEPARATOR = "\x1f"
+_MONTH_PATTERN = r"^\s*(\d{4})\s*[-/.年]\s*(0?[1-9]|1[0-2])\s*月?\s*$"
+_REFRESH_CHUNK_SIZE = 500
+
+
+def identity_key(material_code: Optional[str], name: Optional[str], specification: Optional[str]) -> str:
+    """材料标识，与汇总表 identity_key 的计算方式一致"""
+    if material_code:
+        return f"code:{material_code}"
+    return f"name:{name or ''}{IDENTITY_SEPARATOR}{specification or ''}"
+
+
+def identity_key_of(material: Any) -> str:
+    """从基准材料对象或字典计算材料标识"""
+    if isinstance(material, dict):
+        return identity_key(material.get('material_code'), material.get('name'), material.get('specification'))
+    return identity_key(material.material_code, material.name, material.specification)
+
+
+def month_of(material: Any) -> Optional[str]:
+    """基准材料所属月份（与 source_select 的月份口径一致），无法确定时返回 None"""
+    match = re.match(_MONTH_PATTERN, material.price_date or "")
+    if match:
+        return f"{match.group(1)}-{int(match.group(2)):02d}"
+    if material.effective_date:
+        return material.effective_date.strftime("%Y-%m")
+    return None
+
+
+def source_select():
+    """按汇总口径展开的基准材料（标识、月份等均已计算），供外层分组汇总"""
+    code = func.coalesce(BaseMaterial.material_code, "")
+    specification = func.coalesce(BaseMaterial.specification, "")
+    normalized_date = func.regexp_replace(BaseMaterial.price_date, _MONTH_PATTERN, r"\1-\2")
+    month = case(
+        (
+            BaseMaterial.price_date.op("~")(_MONTH_PATTERN),
+            func.split_part(normalized_date, "-", 1, type_=String)
+            + literal("-")
+            + func.lpad(func.split_part(normalized_date, "-", 2), 2, "0", type_=String)
+        ),
+        else_=func.to_char(BaseMaterial.effective_date, "YYYY-MM", type_=String)
+    )
+    identity = case(
+        (code != "", literal("code:") + code),
+        else_=literal("name:") + BaseMaterial.name + literal(IDENTITY_SEPARATOR) + specification
+    )
+    return select(
+        identity.label("identity_key"),
+        func.nullif(code, "").label("material_code"),
+        BaseMaterial.name.label("name"),
+        specification.label("specification"),
+        BaseMaterial.unit.label("unit"),
+        BaseMaterial.region.label("region"),
+        BaseMaterial.province.label("province"),
+        func.coalesce(BaseMaterial.price_type, "").label("price_type"),
+        month.label("month"),
+        BaseMaterial.price.label("price"),
+        BaseMaterial.price_including_tax.label("price_including_tax"),
+        BaseMaterial.price_excluding_tax.label("price_excluding_tax")
+    )
+
+
+def _rollup_insert(source):
+    """INSERT INTO material_price_monthly SELECT ... GROUP BY 汇总粒度"""
+    src = source.subquery("src")
+    # 与合同期均价的取值一致：除税价为空或为0时取单价
+    effective = func.coalesce(func.nullif(src.c.price_excluding_tax, 0), src.c.price)
+    aggregated = select(
+        src.c.identity_key,
+        func.max(src.c.material_code),
+        func.max(src.c.name),
+        func.max(src.c.specification),
+        src.c.unit,
+        src.c.region,
+        func.max(src.c.province),
+        src.c.price_type,
+        src.c.month,
+        func.avg(src.c.price),
+        func.avg(src.c.price_including_tax),
+        func.avg(src.c.price_excluding_tax),
+        func.avg(effective),
+        func.count(),
+        func.count(src.c.price),
+        func.count(src.c.price_including_tax),
+        func.count(src.c.price_excluding_tax),
+        func.count(effective)
+    ).where(src.c.month.isnot(None)).group_by(
+        src.c.identity_key, src.c.unit, src.c.region, src.c.price_type, src.c.month
+    )
+    return insert(MaterialPriceMonthly).from_select(
+        [
+            "identity_key", "material_code", "name", "specification", "unit", "region", "province",
+            "price_type", "month", "price", "price_including_tax", "price_excluding_tax", "effective_price",
+            "sample_count", "price_count", "price_including_tax_count", "price_excluding_tax_count", "effective_count"
+        ],
+        aggregated
+    )
+
+
+class PriceRollupService:
+    """信息价月度汇总的维护与查询"""
+
+    async def refresh(self, db: AsyncSession, keys: Iterable[str]) -> int:
+        """重算指定材料标识的全部月份（不提交事务），返回写入的汇总行数"""
+        keys = sorted({key for key in keys if key})
+        written = 0
+        for i in range(0, len(keys), _REFRESH_CHUNK_SIZE):
+            chunk = keys[i:i + _REFRESH_CHUNK_SIZE]
+            codes = [key[len("code:"):] for key in chunk if key.startswith("code:")]
+            names = [
+                key[len("name:"):].split(IDENTITY_SEPARATOR, 1)[0]
+                for key in chunk if key.startswith("name:")
+            ]
+
+            await db.execute(delete(MaterialPriceMonthly).where(MaterialPriceMonthly.identity_key.in_(chunk)))
+
+            # 先按编码/名称走索引缩小范围，再精确匹配标识
+            prefilter = []
+            if codes:
+                prefilter.append(BaseMaterial.material_code.in_(codes))
+            if names:
+                prefilter.append(BaseMaterial.name.in_(names))
+            source = source_select().where(or_(*prefilter)).subquery("scoped")
+            scoped = select(source).where(source.c.identity_key.in_(chunk))
+            result = await db.execute(_rollup_insert(scoped))
+            written += max(result.rowcount or 0, 0)
+        return written
+
+    async def sync(self, keys: Iterable[str]) -> int:
+        """在独立会话中重算并提交，用于基准材料变更之后；失败只记录日志，可通过 rebuild 修复"""
+        keys = {key for key in keys if key}
+        if not keys:
+            return 0
+        try:
+            async with AsyncSessionLocal() as session:
+                written = await self.refresh(session, keys)
+                await session.commit()
+            logger.info(f"信息价月度汇总已刷新: 材料标识 {len(keys)} 个，汇总行 {written} 条")
+            return written
+        except Exception as e:
+            logger.error(f"刷新信息价月度汇总失败（可调用重建接口修复）: {e}")
+            return 0
+
+    async def rebuild(self, db: AsyncSession) -> int:
+        """全量重建汇总表并提交"""
+        await db.execute(delete(MaterialPriceMonthly))
+        result = await db.execute(_rollup_insert(source_select()))
+        await db.commit()
+        written = max(result.rowcount or 0, 0)
+        logger.info(f"信息价月度汇总全量重建完成，共 {written} 条")
+        return written
+
+    async def get_series(
+        self,
+        db: AsyncSession,
+        material_code: Optional[str] = None,
+        name: Optional[str] = None,
+        specification: Optional[str] = None,
+        unit: Optional[str] = None,
+        region: Optional[str] = None,
+        price_type: Optional[str] = None,
+        start_month: Optional[str] = None,
+        end_month: Optional[str] = None
+    ) -> List[MaterialPriceMonthly]:
+        """查询材料的月度价格序列（按月份升序）
+
+        有材料编码时按编码查询；否则按名称+规格查询。单位、地区、信息价类型为可选过滤条件。
+        """
+        if not material_code and not name:
+            raise ValueError("材料编码和材料名称至少需要提供一个")
+
+        conditions = [
+            MaterialPriceMonthly.identity_key == identity_key(material_code, name, specification)
+        ]
+        if unit:
+            conditions.append(MaterialPriceMonthly.unit == unit)
+        if region:
+            conditions.append(MaterialPriceMonthly.region == region)
+        if price_type:
+            conditions.append(MaterialPriceMonthly.price_type == price_type)
+        if start_month:
+            conditions.append(MaterialPriceMonthly.month >= start_month)
+        if end_month:
+            conditions.append(MaterialPriceMonthly.month <= end_month)
+
+        stmt = (
+            select(MaterialPriceMonthly)
+            .where(and_(*conditions))
+            .order_by(MaterialPriceMonthly.month, MaterialPriceMonthly.region, MaterialPriceMonthly.unit)
+        )
+        result = await db.execute(stmt)
+        return list(result.scalars().all())
+
+    @staticmethod
+    def serialize(row: MaterialPriceMonthly) -> Dict[str, Any]:
+        return {
+            'month': row.month,
+            'material_code': row.material_code,
+            'name': row.name,
+            'specification': row.specification,
+            'unit': row.unit,
+            'region': row.region,
+            'province': row.province,
+            'price_type': row.price_type,
+            'price': row.price,
+            'price_including_tax': row.price_including_tax,
+            'price_excluding_tax': row.price_excluding_tax,
+            'effective_price': row.effective_price,
+            'sample_count': row.sample_count
+        }
+
+    @staticmethod
+    def window_average(rows: List[Any]) -> Dict[str, Any]:
+        """按各字段的非空条数加权计算窗口均价（等同于窗口内该字段非空的全部基准材料的算术平均）"""
+        averages: Dict[str, Any] = {}
+        for field in ("price", "price_including_tax", "price_excluding_tax", "effective_price"):
+            count_field = "effective_count" if field == "effective_price" else f"{field}_count"
+            total = 0.0
+            count = 0
+            for row in rows:
+                value = getattr(row, field)
+                weight = getattr(row, count_field)
+                if value is None or not weight:
+                    continue
+                total += value * weight
+                count += weight
+            averages[field] = round(total / count, 4) if count else None
+
+        units: Set[str] = {row.unit for row in rows}
+        return {
+            **averages,
+            'months': len({row.month for row in rows}),
+            'sample_count': sum(row.sample_count or 0 for row in rows),
+            # 多个单位的价格直接平均没有意义，调用方应按单位过滤
+            'mixed_units': len(units) > 1,
+            'units': sorted(units)
+        }
+
+    async def get_window_average(self, db: AsyncSession, **filters) -> Dict[str, Any]:
+        """合同期（start_month ~ end_month）内的月度序列及加权均价"""
+        rows = await self.get_series(db, **filters)
+        return {
+            'series': rows,
+            'average': self.window_average(rows)
+        }
+
+
+price_rollup_service = PriceRollupService()
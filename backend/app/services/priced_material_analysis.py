@@ -6,13 +6,14 @@
 
 from typing import List, Dict, Any, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_, func
+from sqlalchemy import select, and_, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import logging
 from decimal import Decimal, ROUND_HALF_UP
-import asyncio
+from types import SimpleNamespace
 
 from app.models.project import ProjectMaterial
-from app.models.material import BaseMaterial
+from app.models.material import BaseMaterial, MaterialPriceMonthly
 from app.models.analysis import PriceAnalysis, AnalysisStatus
 from app.utils.unit_conversion import (
     normalize_unit,
@@ -21,22 +22,54 @@ from app.utils.unit_conversion import (
     convert_unit_price,
     convert_unit_price_with_spec,
 )
+from app.utils.price_difference import PriceDifferenceEngine, PriceDifferenceRow
 
 logger = logging.getLogger(__name__)
 
 
 class PricedMaterialAnalysisService:
     """市场信息价材料分析服务"""
+
+    # 写入分析结果时未涉及的字段，重置为新建记录的默认值
+    _reset_columns: Dict[str, Any] = {
+        'predicted_price_min': None,
+        'predicted_price_max': None,
+        'predicted_price_avg': None,
+        'confidence_score': None,
+        'is_reasonable': None,
+        'price_variance': None,
+        'risk_level': None,
+        'analysis_model': None,
+        'analysis_prompt': None,
+        'api_response': None,
+        'data_sources': None,
+        'market_data': None,
+        'reference_prices': None,
+        'analysis_reasoning': None,
+        'risk_factors': None,
+        'recommendations': None,
+        'analysis_cost': None,
+        'analysis_time': None,
+        'retry_count': 0,
+        'is_reviewed': False,
+        'reviewed_by': None,
+        'review_notes': None,
+        'reviewed_at': None,
+        'analyzed_at': None
+    }
     
     def __init__(self):
         self.price_threshold = Decimal('0.05')  # 5%的价格差异阈值
+        self.query_chunk_size = 1000  # IN 查询单次参数数量
+        self.bulk_write_chunk_size = 500  # 单条批量写入语句的最大行数
         
     async def analyze_priced_materials(
         self,
         db: AsyncSession,
         project_id: int,
         material_ids: Optional[List[int]] = None,
-        batch_size: int = 10
+        batch_size: int = 10,
+        include_differences: bool = True
     ) -> Dict[str, Any]:
         """
         分析市场信息价材料价格差异
@@ -45,7 +78,9 @@ class PricedMaterialAnalysisService:
             db: 数据库会话
             project_id: 项目ID
             material_ids: 要分析的材料ID列表，如果为空则分析所有已匹配的材料
-            batch_size: 批量处理大小
+            batch_size: 保留参数（兼容旧接口），材料已整批查询和分析
+            include_differences: 是否在结果中返回逐个材料的差异明细；为 False 时只返回统计和摘要，
+                明细已保存到数据库，可分页查询
             
         Returns:
             分析结果字典
@@ -65,21 +100,32 @@ class PricedMaterialAnalysisService:
             
         logger.info(f"开始分析项目 {project_id} 的市场信息价材料价格差异，材料数量: {len(material_ids)}")
         
-        analyzed_count = 0
-        differences = []
+        # 合同信息、材料及其合同期价格序列均整批查询一次，逐个材料的分析只使用内存数据
+        contract_info = await self._get_project_contract_info(db, project_id)
+        materials = await self._load_material_rows(db, project_id, material_ids)
+        price_series = await self._prefetch_contract_period_prices(db, materials)
         
-        # 分批处理材料
-        for i in range(0, len(material_ids), batch_size):
-            batch = material_ids[i:i + batch_size]
-            logger.info(f"处理批次 {i // batch_size + 1}，材料ID: {batch}")
-            
-            batch_differences = await self._analyze_material_batch(db, project_id, batch)
-            differences.extend(batch_differences)
-            analyzed_count += len(batch)
-            
-            # 避免过度频繁的数据库操作
-            if i + batch_size < len(material_ids):
-                await asyncio.sleep(0.1)
+        related_prices = [
+            self._select_contract_period_prices(material, price_series, contract_info)
+            for material in materials
+        ]
+        differences = []
+        for material, analysis in zip(
+            materials, self._analyze_materials(materials, contract_info, related_prices)
+        ):
+            if isinstance(analysis, Exception):
+                logger.error(f"分析材料 {material.id} 时出错: {str(analysis)}")
+                # 创建错误记录
+                differences.append({
+                    "material_id": material.id,
+                    "material_name": material.material_name,
+                    "error": str(analysis),
+                    "has_difference": False,
+                    "analysis_status": "failed"
+                })
+            else:
+                differences.append(analysis)
+        analyzed_count = len(materials)
         
         # 统计差异数量
         differences_count = len([d for d in differences if d['has_difference']])
@@ -90,25 +136,23 @@ class PricedMaterialAnalysisService:
         result = {
             "analyzed_count": analyzed_count,
             "differences_count": differences_count,
-            "differences": differences,
             "summary": await self._generate_summary(differences)
         }
+        if include_differences:
+            result["differences"] = differences
         
         logger.info(f"市场信息价材料分析完成，分析了 {analyzed_count} 个材料，发现 {differences_count} 个差异")
         return result
     
-    async def _analyze_material_batch(
+    async def _load_material_rows(
         self,
         db: AsyncSession,
         project_id: int,
         material_ids: List[int]
-    ) -> List[Dict[str, Any]]:
-        """分析一批材料的价格差异"""
+    ) -> List[Any]:
+        """查询项目材料及其匹配的基准材料信息，按 material_ids 的顺序返回"""
         
-        contract_info = await self._get_project_contract_info(db, project_id)
-        
-        # 获取项目材料及其匹配的基准材料信息
-        stmt = select(
+        columns = (
             ProjectMaterial.id,
             ProjectMaterial.material_name,
             ProjectMaterial.specification,
@@ -122,51 +166,37 @@ class PricedMaterialAnalysisService:
             BaseMaterial.name.label('base_material_name'),
             BaseMaterial.specification.label('base_specification'),
             BaseMaterial.unit.label('base_unit'),
+            BaseMaterial.price.label('base_price'),
             BaseMaterial.price_including_tax.label('base_price_including_tax'),
             BaseMaterial.price_excluding_tax.label('base_price_excluding_tax'),
             BaseMaterial.material_code.label('base_material_code'),
             BaseMaterial.category_id,
             BaseMaterial.price_type.label('source_type'),
             BaseMaterial.price_date.label('year_month'),
-            BaseMaterial.region
-        ).select_from(
-            ProjectMaterial.__table__.join(
-                BaseMaterial, ProjectMaterial.matched_material_id == BaseMaterial.id
-            )
-        ).where(
-            and_(
-                ProjectMaterial.project_id == project_id,
-                ProjectMaterial.id.in_(material_ids),
-                ProjectMaterial.is_matched == True,
-                ProjectMaterial.matched_material_id.isnot(None)
-            )
+            BaseMaterial.region,
+            BaseMaterial.province.label('base_province')
         )
         
-        result = await db.execute(stmt)
-        materials = result.all()
-        
-        differences = []
-        
-        for material in materials:
-            try:
-                analysis = await self._analyze_single_material(
-                    material,
-                    contract_info=contract_info,
-                    db=db
+        rows_by_id = {}
+        for i in range(0, len(material_ids), self.query_chunk_size):
+            chunk = material_ids[i:i + self.query_chunk_size]
+            stmt = select(*columns).select_from(
+                ProjectMaterial.__table__.join(
+                    BaseMaterial, ProjectMaterial.matched_material_id == BaseMaterial.id
                 )
-                differences.append(analysis)
-            except Exception as e:
-                logger.error(f"分析材料 {material.id} 时出错: {str(e)}")
-                # 创建错误记录
-                differences.append({
-                    "material_id": material.id,
-                    "material_name": material.material_name,
-                    "error": str(e),
-                    "has_difference": False,
-                    "analysis_status": "failed"
-                })
+            ).where(
+                and_(
+                    ProjectMaterial.project_id == project_id,
+                    ProjectMaterial.id.in_(chunk),
+                    ProjectMaterial.is_matched == True,
+                    ProjectMaterial.matched_material_id.isnot(None)
+                )
+            )
+            result = await db.execute(stmt)
+            for row in result.all():
+                rows_by_id[row.id] = row
         
-        return differences
+        return [rows_by_id[mid] for mid in dict.fromkeys(material_ids) if mid in rows_by_id]
 
     async def _get_project_contract_info(self, db: AsyncSession, project_id: int) -> Dict[str, Optional[str]]:
         from app.models.project import Project
@@ -244,47 +274,85 @@ class PricedMaterialAnalysisService:
             return False
         return True
     
-    async def _get_contract_period_prices(
+    async def _prefetch_contract_period_prices(
         self,
         db: AsyncSession,
+        materials: List[Any]
+    ) -> Dict[str, Dict[Any, List[Any]]]:
+        """整批查询所有基准材料的同类月度价格序列（信息价月度汇总表）
+
+        有材料编码的按编码查询并分组；无编码的按名称查询，再按名称/规格/单位/地区/价格类型在内存中匹配。
+        每行为一个月的均价，effective_price 为当月有效单价（除税价优先）均值，effective_count 为其非空条数。
+        返回 {"code": {编码: [价格行]}, "name": {名称: [价格行]}}。
+        """
+        
+        codes = sorted({m.base_material_code for m in materials if m.base_material_code})
+        names = sorted({m.base_material_name for m in materials if not m.base_material_code and m.base_material_name})
+        columns = (
+            MaterialPriceMonthly.material_code,
+            MaterialPriceMonthly.name,
+            MaterialPriceMonthly.specification,
+            MaterialPriceMonthly.unit,
+            MaterialPriceMonthly.region,
+            MaterialPriceMonthly.province,
+            MaterialPriceMonthly.price_type,
+            MaterialPriceMonthly.effective_price,
+            MaterialPriceMonthly.month.label('price_date'),
+            MaterialPriceMonthly.effective_count
+        )
+        
+        series: Dict[str, Dict[Any, List[Any]]] = {"code": {}, "name": {}}
+        for kind, column, values in (
+            ("code", MaterialPriceMonthly.material_code, codes),
+            ("name", MaterialPriceMonthly.name, names)
+        ):
+            for i in range(0, len(values), self.query_chunk_size):
+                chunk = values[i:i + self.query_chunk_size]
+                result = await db.execute(select(*columns).where(column.in_(chunk)))
+                for row in result.all():
+                    key = row.material_code if kind == "code" else row.name
+                    series[kind].setdefault(key, []).append(row)
+        
+        logger.info(
+            f"预取合同期价格序列: 编码 {len(codes)} 个，名称 {len(names)} 个，"
+            f"月度价格 {sum(len(v) for group in series.values() for v in group.values())} 条"
+        )
+        return series
+    
+    def _select_contract_period_prices(
+        self,
         material_row,
+        price_series: Dict[str, Dict[Any, List[Any]]],
         contract_info: Dict[str, Optional[str]]
-    ) -> List[BaseMaterial]:
-        base_material = None
-        if material_row.base_material_id:
-            base_material = await db.get(BaseMaterial, material_row.base_material_id)
-        if not base_material:
+    ) -> List[Any]:
+        """从预取的价格序列中选出与基准材料同类、且在合同期内的价格"""
+        if not material_row.base_material_id:
             return []
         
-        conditions = []
-        if base_material.material_code:
-            conditions.append(BaseMaterial.material_code == base_material.material_code)
+        if material_row.base_material_code:
+            materials = price_series["code"].get(material_row.base_material_code, [])
         else:
-            conditions.append(BaseMaterial.name == base_material.name)
-            if base_material.specification:
-                conditions.append(BaseMaterial.specification == base_material.specification)
-            else:
-                conditions.append(
-                    or_(
-                        BaseMaterial.specification.is_(None),
-                        BaseMaterial.specification == ""
-                    )
-                )
-            if base_material.unit:
-                conditions.append(BaseMaterial.unit == base_material.unit)
-            if base_material.region:
-                conditions.append(BaseMaterial.region == base_material.region)
-            elif getattr(base_material, 'province', None):
-                conditions.append(BaseMaterial.province == base_material.province)
-            if base_material.price_type:
-                conditions.append(BaseMaterial.price_type == base_material.price_type)
-        
-        stmt = select(BaseMaterial).where(and_(*conditions))
-        result = await db.execute(stmt)
-        materials = result.scalars().all()
+            spec = material_row.base_specification
+            unit = material_row.base_unit
+            region = material_row.region
+            province = material_row.base_province
+            price_type = material_row.source_type
+            materials = [
+                m for m in price_series["name"].get(material_row.base_material_name, [])
+                if (m.specification == spec if spec else not m.specification)
+                and (not unit or m.unit == unit)
+                and (m.region == region if region else (not province or m.province == province))
+                and (not price_type or m.price_type == price_type)
+            ]
         
         if not materials:
-            materials = [base_material]
+            # 至少使用匹配的基准材料本身
+            materials = [SimpleNamespace(
+                unit=material_row.base_unit,
+                effective_price=material_row.base_price_excluding_tax or material_row.base_price,
+                price_date=material_row.year_month,
+                effective_count=1
+            )]
         
         contract_prices = [
             m for m in materials
@@ -296,8 +364,40 @@ class PricedMaterialAnalysisService:
         
         return contract_prices
     
-    async def _analyze_single_material(self, material, contract_info=None, db=None) -> Dict[str, Any]:
-        """分析单个材料的价格差异"""
+    def _analyze_materials(self, materials: List[Any], contract_info, related_prices: List[List[Any]]) -> List[Any]:
+        """列式计算所有材料的价格差异，返回与 materials 对齐的结果字典或异常
+
+        位于舍入进位点附近的材料改用逐行 Decimal 计算，保证结果与逐行计算一致。
+        """
+        engine = PriceDifferenceEngine(self.price_threshold)
+        try:
+            rows = engine.compute(materials, related_prices, use_contract_prices=bool(contract_info))
+        except Exception as e:
+            logger.warning(f"价格差异列式计算失败，改为逐行计算: {e}")
+            rows = [None] * len(materials)
+        
+        results = []
+        exact_count = 0
+        for material, row, related in zip(materials, rows, related_prices):
+            if row is None:
+                exact_count += 1
+                try:
+                    row = self._compute_single_material(material, contract_info, related)
+                except Exception as e:
+                    row = e
+            results.append(row if isinstance(row, Exception) else self._build_analysis_result(material, row))
+        
+        logger.debug(f"价格差异列式计算完成: {len(materials)} 个材料，逐行精确计算 {exact_count} 个")
+        return results
+    
+    def _analyze_single_material(self, material, contract_info=None, related_prices=None) -> Dict[str, Any]:
+        """分析单个材料的价格差异（related_prices 为预取的合同期价格）"""
+        return self._build_analysis_result(
+            material, self._compute_single_material(material, contract_info, related_prices)
+        )
+    
+    def _compute_single_material(self, material, contract_info=None, related_prices=None) -> PriceDifferenceRow:
+        """逐行 Decimal 计算单个材料的价格差异，是列式计算的精确参照"""
         
         # 获取价格数据
         project_price = Decimal(str(material.project_unit_price or 0))
@@ -317,9 +417,6 @@ class PricedMaterialAnalysisService:
         project_unit = normalize_unit(project_unit_raw)
         base_unit = normalize_unit(base_unit_raw)
 
-        # 调试日志
-        logger.info(f"Analysis Debug: material={material.material_name}, base_price={base_price}, base_unit={base_unit}, project_unit={project_unit}, spec={material.base_specification}")
-
         conversion_factor = Decimal("1")
         conversion_applied = False
 
@@ -327,13 +424,14 @@ class PricedMaterialAnalysisService:
             # 尝试带规格的换算 (优先处理张->m2等特殊换算，如果不行则回退到通用换算)
             # base_specification 通常是市场材料的规格
             spec_for_conversion = material.base_specification or ""
-            
-            logger.info(f"Attempting conversion with spec: {spec_for_conversion}")
 
             converted_excl = convert_unit_price_with_spec(base_price, base_unit, project_unit, spec_for_conversion)
             converted_incl = convert_unit_price_with_spec(base_price_including_tax, base_unit, project_unit, spec_for_conversion)
             
-            logger.info(f"Conversion result: excl={converted_excl}, incl={converted_incl}")
+            logger.debug(
+                f"单位换算: material={material.material_name}, {base_unit}->{project_unit}, spec={spec_for_conversion}, "
+                f"excl={converted_excl}, incl={converted_incl}"
+            )
             
             if converted_excl is not None and converted_incl is not None:
                 conversion_applied = True
@@ -366,12 +464,12 @@ class PricedMaterialAnalysisService:
         contract_average_price = base_price
         contract_period_prices = []
         
-        if contract_info and db:
-            related_prices = await self._get_contract_period_prices(db, material, contract_info)
+        if contract_info:
             if related_prices:
                 price_values = []
+                weights = []
                 for related in related_prices:
-                    price_value = related.price_excluding_tax or related.price
+                    price_value = related.effective_price
                     if price_value is None:
                         continue
                     try:
@@ -403,9 +501,11 @@ class PricedMaterialAnalysisService:
                             continue
 
                     price_values.append(price_in_project_unit)
+                    weights.append(Decimal(related.effective_count or 1))
                 if price_values:
+                    # 月度有效单价按其非空条数加权，等同于对合同期内全部信息价（除税价优先）取平均
                     contract_average_price = (
-                        sum(price_values) / Decimal(len(price_values))
+                        sum(p * w for p, w in zip(price_values, weights)) / sum(weights)
                     ).quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
                     contract_period_prices = [float(p) for p in price_values]
 
@@ -431,40 +531,57 @@ class PricedMaterialAnalysisService:
         # 3. 计算价格差异 (Price Diff): 项目单价 - 基期信息价
         price_difference = project_price - base_price
         
-        # 变量映射到API响应
-        # price_difference_rate 对应 风险幅度
-        price_difference_rate = risk_rate
-        
-        # 判断是否有显著差异 (基于风险幅度是否超过阈值)
-        has_difference = abs(risk_rate) > self.price_threshold
-        
-        # 确定差异等级 (基于风险幅度)
-        difference_level = self._get_difference_level(price_difference_rate)
+        return PriceDifferenceRow(
+            project_unit=project_unit,
+            base_unit=base_unit,
+            project_price=float(project_price),
+            quantity=float(quantity),
+            base_price_including_tax=float(base_price_including_tax),
+            base_price_excluding_tax=float(base_price_excluding_tax),
+            contract_average_price=float(contract_average_price),
+            contract_period_prices=contract_period_prices,
+            unit_price_difference=float(price_difference),
+            total_price_difference=float(total_price_difference),
+            # price_difference_rate 对应 风险幅度
+            price_difference_rate=risk_rate,
+            # 判断是否有显著差异 (基于风险幅度是否超过阈值)
+            has_difference=abs(risk_rate) > self.price_threshold,
+            conversion_applied=conversion_applied,
+            conversion_factor=float(conversion_factor),
+            original_base_price_excluding_tax=float(original_base_price_excluding_tax),
+            original_base_price_including_tax=float(original_base_price_including_tax)
+        )
+    
+    def _build_analysis_result(self, material, row: PriceDifferenceRow) -> Dict[str, Any]:
+        """把差异计算结果组装为API响应/入库使用的字典"""
+        project_unit_raw = material.unit or ""
+        base_unit_raw = material.base_unit or ""
         
-        analysis_result = {
+        return {
             "material_id": material.id,
             "material_name": material.material_name,
             "specification": material.specification or "",
-            "unit": project_unit_raw or "",
-            "base_unit": base_unit_raw or "",
-            "quantity": float(quantity),
+            "unit": project_unit_raw,
+            "base_unit": base_unit_raw,
+            "quantity": row.quantity,
             "material_code": material.serial_number or "",
             "remarks": material.notes or "",
             
             # 价格信息
-            "project_unit_price": float(project_price),
-            "base_unit_price": float(contract_average_price),
-            "base_price_including_tax": float(base_price_including_tax),
-            "base_price_excluding_tax": float(base_price_excluding_tax),
-            "original_base_price": float(base_price),
-            "contract_period_prices": contract_period_prices,
+            "project_unit_price": row.project_price,
+            "base_unit_price": row.contract_average_price,
+            "base_price_including_tax": row.base_price_including_tax,
+            "base_price_excluding_tax": row.base_price_excluding_tax,
+            "original_base_price": row.base_price_excluding_tax,
+            "contract_period_prices": row.contract_period_prices,
             
             # 差异分析
-            "unit_price_difference": float(price_difference),
-            "total_price_difference": float(total_price_difference),
-            "price_difference_rate": float(price_difference_rate),
-            "has_difference": has_difference,
-            "difference_level": difference_level,
+            "unit_price_difference": row.unit_price_difference,
+            "total_price_difference": row.total_price_difference,
+            "price_difference_rate": float(row.price_difference_rate),
+            "has_difference": row.has_difference,
+            # 确定差异等级 (基于风险幅度)
+            "difference_level": self._get_difference_level(row.price_difference_rate),
             
             # 基准材料信息
             "base_material_id": material.base_material_id,
@@ -478,21 +595,19 @@ class PricedMaterialAnalysisService:
             "region": material.region or "",
 
             "unit_conversion": {
-                "applied": conversion_applied,
-                "factor": float(conversion_factor),
-                "project_unit": project_unit_raw or "",
-                "base_unit": base_unit_raw or "",
-                "normalized_project_unit": project_unit,
-                "normalized_base_unit": base_unit,
-                "original_base_price_excluding_tax": float(original_base_price_excluding_tax),
-                "original_base_price_including_tax": float(original_base_price_including_tax),
+                "applied": row.conversion_applied,
+                "factor": row.conversion_factor,
+                "project_unit": project_unit_raw,
+                "base_unit": base_unit_raw,
+                "normalized_project_unit": row.project_unit,
+                "normalized_base_unit": row.base_unit,
+                "original_base_price_excluding_tax": row.original_base_price_excluding_tax,
+                "original_base_price_including_tax": row.original_base_price_including_tax,
             },
             
             "analysis_status": "completed",
             "analyzed_at": None  # 将在保存时设置
         }
-        
-        return analysis_result
     
     def _get_difference_level(self, difference_rate: Decimal) -> str:
         """根据差异率确定差异等级"""
@@ -507,106 +622,109 @@ class PricedMaterialAnalysisService:
         else:  # 30%以上
             return "high"
     
+    def _analysis_row(self, diff: Dict[str, Any]) -> Dict[str, Any]:
+        """分析结果对应的 PriceAnalysis 整行字段（与新建记录一致，未涉及的字段重置为默认值）"""
+        row = dict(self._reset_columns)
+        row['material_id'] = diff['material_id']
+
+        # 如果分析失败，保存失败状态
+        if diff.get('analysis_status') == 'failed':
+            row.update(
+                status=AnalysisStatus.FAILED,
+                analysis_reasoning=f"分析失败: {diff.get('error', '未知错误')}"
+            )
+            return row
+
+        row.update(
+            status=AnalysisStatus.COMPLETED,
+
+            # 使用市场信息价作为预测价格
+            predicted_price_min=diff['base_unit_price'],
+            predicted_price_max=diff['base_unit_price'],
+            predicted_price_avg=diff['base_unit_price'],
+            confidence_score=100.0,  # 市场信息价置信度100%
+
+            # 价格合理性分析
+            is_reasonable=not diff['has_difference'],
+            price_variance=diff['price_difference_rate'] * 100,  # 转换为百分比
+            risk_level=diff['difference_level'],
+
+            # 分析模型信息
+            analysis_model="guided_price_comparison",
+
+            # 存储完整的分析结果
+            api_response={
+                "analysis_type": "guided_price",
+                "unit": diff['unit'],
+                "base_unit": diff.get('base_unit'),
+                "project_unit_price": diff['project_unit_price'],
+                "base_unit_price": diff['base_unit_price'],
+                "base_price_including_tax": diff.get('base_price_including_tax'),
+                "base_price_excluding_tax": diff.get('base_price_excluding_tax'),
+                "contract_average_price": diff['base_unit_price'],
+                "contract_period_prices": diff.get('contract_period_prices'),
+                "original_base_price": diff.get('original_base_price'),
+                "unit_price_difference": diff['unit_price_difference'],
+                "total_price_difference": diff['total_price_difference'],
+                "price_difference_rate": diff['price_difference_rate'],
+                "has_difference": diff['has_difference'],
+                "difference_level": diff['difference_level'],
+                "unit_conversion": diff.get('unit_conversion'),
+                "base_material_info": {
+                    "id": diff.get('base_material_id'),
+                    "name": diff.get('base_material_name'),
+                    "specification": diff.get('base_specification'),
+                    "source_type": diff.get('source_type'),
+                    "region": diff.get('region')
+                }
+            },
+
+            # 分析说明
+            analysis_reasoning=(
+                f"合同期平均价{diff['base_unit_price']:.2f}元，对比项目单价"
+                f"{diff['project_unit_price']:.2f}元，差异率{diff['price_difference_rate']:.2%}"
+            )
+        )
+        return row
+
     async def _save_analysis_results(self, db: AsyncSession, differences: List[Dict[str, Any]]):
-        """保存分析结果到数据库"""
-        
+        """保存分析结果到数据库
+
+        按 material_id 分块 INSERT ... ON CONFLICT DO UPDATE 批量写入并整体提交一次。
+        每行写入完整字段，等同于删除旧记录后新建（人工审核等字段一并重置）。
+        """
+
         try:
-            from app.models.analysis import PriceAnalysis, AnalysisStatus
-            from sqlalchemy import delete
-            
-            for diff in differences:
-                # 先删除该材料的旧分析记录（如果存在）
-                # 使用 delete 语句直接删除，避免多条记录导致 scalar_one_or_none 报错
-                stmt_delete = delete(PriceAnalysis).where(PriceAnalysis.material_id == diff['material_id'])
-                await db.execute(stmt_delete)
-                
-                # 如果分析失败，保存失败状态
-                if diff.get('analysis_status') == 'failed':
-                    analysis = PriceAnalysis(
-                        material_id=diff['material_id'],
-                        status=AnalysisStatus.FAILED,
-                        analysis_reasoning=f"分析失败: {diff.get('error', '未知错误')}",
-                        created_at=func.now(),
-                        updated_at=func.now()
-                    )
-                    db.add(analysis)
-                    continue
-                
-                # 创建新的分析记录
-                analysis = PriceAnalysis(
-                    material_id=diff['material_id'],
-                    status=AnalysisStatus.COMPLETED,
-                    
-                    # 使用市场信息价作为预测价格
-                    predicted_price_min=diff['base_unit_price'],
-                    predicted_price_max=diff['base_unit_price'],
-                    predicted_price_avg=diff['base_unit_price'],
-                    confidence_score=100.0,  # 市场信息价置信度100%
-                    
-                    # 价格合理性分析
-                    is_reasonable=not diff['has_difference'],
-                    price_variance=diff['price_difference_rate'] * 100,  # 转换为百分比
-                    risk_level=diff['difference_level'],
-                    
-                    # 分析模型信息
-                    analysis_model="guided_price_comparison",
-                    
-                    # 存储完整的分析结果
-                    api_response={
-                        "analysis_type": "guided_price",
-                        "unit": diff['unit'],
-                        "base_unit": diff.get('base_unit'),
-                        "project_unit_price": diff['project_unit_price'],
-                        "base_unit_price": diff['base_unit_price'],
-                        "base_price_including_tax": diff.get('base_price_including_tax'),
-                        "base_price_excluding_tax": diff.get('base_price_excluding_tax'),
-                        "contract_average_price": diff['base_unit_price'],
-                        "contract_period_prices": diff.get('contract_period_prices'),
-                        "original_base_price": diff.get('original_base_price'),
-                        "unit_price_difference": diff['unit_price_difference'],
-                        "total_price_difference": diff['total_price_difference'],
-                        "price_difference_rate": diff['price_difference_rate'],
-                        "has_difference": diff['has_difference'],
-                        "difference_level": diff['difference_level'],
-                        "unit_conversion": diff.get('unit_conversion'),
-                        "base_material_info": {
-                            "id": diff.get('base_material_id'),
-                            "name": diff.get('base_material_name'),
-                            "specification": diff.get('base_specification'),
-                            "source_type": diff.get('source_type'),
-                            "region": diff.get('region')
-                        }
-                    },
-                    
-                    # 分析说明
-                    analysis_reasoning=(
-                        f"合同期平均价{diff['base_unit_price']:.2f}元，对比项目单价"
-                        f"{diff['project_unit_price']:.2f}元，差异率{diff['price_difference_rate']:.2%}"
-                    ),
-                    
-                    created_at=func.now(),
-                    updated_at=func.now()
-                )
-                
-                db.add(analysis)
-                
-                # 记录日志
-                if diff.get('has_difference'):
-                    logger.info(
-                        f"保存价格差异分析: {diff['material_name']} "
-                        f"项目价格: {diff['project_unit_price']}, "
-                        f"基准价格: {diff['base_unit_price']}, "
-                        f"差异率: {diff['price_difference_rate']:.2%}, "
-                        f"合价差: {diff['total_price_difference']:.2f}"
-                    )
-            
+            rows = [self._analysis_row(diff) for diff in differences]
+            for i in range(0, len(rows), self.bulk_write_chunk_size):
+                await self._upsert_analysis_rows(db, rows[i:i + self.bulk_write_chunk_size])
+
             await db.commit()
-            logger.info(f"保存了 {len(differences)} 个材料的市场信息价分析结果到数据库")
-            
+            logger.info(
+                f"保存了 {len(differences)} 个材料的市场信息价分析结果到数据库，"
+                f"其中存在价格差异 {sum(1 for diff in differences if diff.get('has_difference'))} 个"
+            )
+
         except Exception as e:
             logger.error(f"保存分析结果失败: {str(e)}")
             await db.rollback()
             raise
+
+    async def _upsert_analysis_rows(self, db: AsyncSession, rows: List[Dict[str, Any]]):
+        """按 material_id 插入或更新分析记录，所有行字段需一致"""
+        if not rows:
+            return
+
+        stmt = pg_insert(PriceAnalysis).values(rows)
+        update_columns = {key: stmt.excluded[key] for key in rows[0] if key != 'material_id'}
+        # 与重新创建记录一致：创建时间和更新时间均刷新（ON CONFLICT 不会触发ORM的onupdate）
+        update_columns['created_at'] = func.now()
+        update_columns['updated_at'] = func.now()
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PriceAnalysis.material_id],
+            set_=update_columns
+        )
+        await db.execute(stmt)
     
     async def _generate_summary(self, differences: List[Dict[str, Any]]) -> Dict[str, Any]:
         """生成分析摘要"""
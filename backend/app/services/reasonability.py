@@ -1,33 +1,47 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_, func
+from sqlalchemy import Boolean, Float, Integer, String, Text, select, update, and_, or_, func, column, true, values
 from datetime import datetime, timedelta
+import time
 from loguru import logger
 
-from app.models.project import ProjectMaterial
+from app.core.config import settings
+from app.models.project import Project, ProjectMaterial
 from app.models.analysis import PriceAnalysis, AnalysisStatus
-from app.models.material import BaseMaterial
+from app.models.material import MaterialPriceMonthly
+from app.services.analysis_reuse import resolve_project_region
+from app.services.market_index import market_index_service
 from app.utils.price_reasonability import (
-    PriceReasonabilityAnalyzer, PriceAnomalyDetector, 
+    PriceReasonabilityAnalyzer, PriceAnomalyDetector, PriceDistribution,
     PriceReasonabilityResult, RiskLevel, PriceStatus
 )
 
 
+# 全部项目材料的单价分布（异常检测的 portfolio 基线），各服务实例共享
+_portfolio_distributions_cache: Dict[str, Any] = {'distributions': None, 'computed_at': 0.0}
+
+
 class ReasonabilityAnalysisService:
     """价格合理性分析服务"""
     
     def __init__(self):
         self.analyzer = PriceReasonabilityAnalyzer()
         self.anomaly_detector = PriceAnomalyDetector()
+        self.history_chunk_size = 500  # 单条历史价格查询的材料名称+单位数量
+        self.bulk_write_chunk_size = 500  # 单条批量写回语句的最大行数
     
     async def analyze_project_price_reasonability(
         self,
         db: AsyncSession,
         project_id: int,
         force_reanalyze: bool = False,
-        detection_sensitivity: float = 0.1
+        detection_sensitivity: float = 0.1,
+        anomaly_baseline: str = 'project'
     ) -> Dict[str, Any]:
-        """分析项目材料价格合理性"""
+        """分析项目材料价格合理性
+
+        anomaly_baseline: 异常检测基线，project 为本项目同类材料，portfolio 为全部项目同类材料
+        """
         
         logger.info(f"开始分析项目 {project_id} 的价格合理性")
         
@@ -46,12 +60,17 @@ class ReasonabilityAnalysisService:
             }
         
         # 准备分析数据
-        materials_data = []
-        for material, analysis in analyzed_materials:
-            if not material.unit_price:
-                continue  # 跳过没有原始价格的材料
-            
-            material_data = {
+        # 跳过没有原始价格的材料
+        priced_materials = [
+            (material, analysis) for material, analysis in analyzed_materials if material.unit_price
+        ]
+        
+        # 全部材料的历史价格一次批量查询，相同名称+单位只查一次
+        historical_data = await self._prefetch_historical_data(
+            db, [(material.material_name, material.unit) for material, _ in priced_materials]
+        )
+        materials_data = [
+            {
                 'material_id': material.id,
                 'material_name': material.material_name,
                 'original_price': material.unit_price,
@@ -61,9 +80,10 @@ class ReasonabilityAnalysisService:
                     'predicted_price_avg': analysis.predicted_price_avg,
                     'confidence_score': analysis.confidence_score or 0.5
                 },
-                'historical_data': await self._get_historical_data(db, material.material_name, material.unit)
+                'historical_data': historical_data.get((material.material_name, material.unit), [])
             }
-            materials_data.append(material_data)
+            for material, analysis in priced_materials
+        ]
         
         if not materials_data:
             return {
@@ -84,12 +104,15 @@ class ReasonabilityAnalysisService:
             materials_data, market_context
         )
         
-        # 执行异常检测
+        # 执行异常检测（按材料分类 × 单位分组，可选以全部项目同类材料的分布为基线）
+        baselines = await self._get_portfolio_distributions(db) if anomaly_baseline == 'portfolio' else None
         anomaly_results = self.anomaly_detector.detect_price_anomalies(
-            [{'id': m['material_id'], 'material_name': m['material_name'], 
-              'unit_price': m['original_price'], 'category': 'default'} 
-             for m in materials_data],
-            detection_sensitivity
+            [{'id': material.id, 'material_name': material.material_name,
+              'unit_price': material.unit_price, 'unit': material.unit,
+              'specification': material.specification, 'category': material.category}
+             for material, _ in priced_materials],
+            detection_sensitivity,
+            baselines
         )
         
         # 更新数据库中的分析结果
@@ -326,84 +349,196 @@ class ReasonabilityAnalysisService:
         unit: str,
         days_back: int = 365
     ) -> List[Dict[str, Any]]:
-        """获取历史价格数据"""
-        
-        # 从基准材料库获取相似材料的历史数据
-        stmt = select(BaseMaterial).where(
-            and_(
-                BaseMaterial.name.ilike(f"%{material_name}%"),
-                BaseMaterial.unit == unit,
-                BaseMaterial.effective_date >= datetime.utcnow() - timedelta(days=days_back)
+        """获取历史价格数据（信息价月度汇总，每条为某地区某月的均价）"""
+        
+        historical_data = await self._prefetch_historical_data(db, [(material_name, unit)], days_back)
+        return historical_data.get((material_name, unit), [])
+    
+    async def _prefetch_historical_data(
+        self,
+        db: AsyncSession,
+        keys: List[Tuple[str, str]],
+        days_back: int = 365
+    ) -> Dict[Tuple[str, str], List[Dict[str, Any]]]:
+        """批量获取历史价格数据，返回 (材料名称, 单位) -> 历史价格列表
+
+        每个名称+单位只查一次；每块键值用一条 VALUES + LATERAL 查询，
+        名称模糊匹配走 material_price_monthly.name 的三元组索引，每个键取最近的20个月度均价。
+        """
+        
+        unique_keys = list(dict.fromkeys(keys))
+        historical_data: Dict[Tuple[str, str], List[Dict[str, Any]]] = {key: [] for key in unique_keys}
+        cutoff_month = (datetime.utcnow() - timedelta(days=days_back)).strftime('%Y-%m')
+        
+        for i in range(0, len(unique_keys), self.history_chunk_size):
+            chunk = unique_keys[i:i + self.history_chunk_size]
+            lookup_keys = values(
+                column('key_index', Integer),
+                column('pattern', String),
+                column('unit', String),
+                name='lookup_keys'
+            ).data([(index, f"%{name}%", unit) for index, (name, unit) in enumerate(chunk)])
+            history = (
+                select(
+                    MaterialPriceMonthly.price,
+                    MaterialPriceMonthly.month,
+                    MaterialPriceMonthly.region,
+                    MaterialPriceMonthly.price_type,
+                    MaterialPriceMonthly.price_count
+                )
+                .where(
+                    and_(
+                        MaterialPriceMonthly.name.ilike(lookup_keys.c.pattern),
+                        MaterialPriceMonthly.unit == lookup_keys.c.unit,
+                        MaterialPriceMonthly.month >= cutoff_month
+                    )
+                )
+                .order_by(MaterialPriceMonthly.month.desc())
+                .limit(20)
+                .lateral('history')
             )
-        ).limit(20)
+            stmt = (
+                select(lookup_keys.c.key_index, history)
+                .select_from(lookup_keys.join(history, true()))
+                .order_by(lookup_keys.c.key_index, history.c.month.desc())
+            )
+            
+            result = await db.execute(stmt)
+            for row in result.all():
+                year, month = row.month.split('-')
+                historical_data[chunk[row.key_index]].append({
+                    'price': row.price,
+                    'date': datetime(int(year), int(month), 1),
+                    'region': row.region,
+                    'source': row.price_type or '信息价',
+                    'sample_count': row.price_count
+                })
         
+        return historical_data
+    
+    async def _get_portfolio_distributions(
+        self,
+        db: AsyncSession
+    ) -> Dict[Tuple[str, str], PriceDistribution]:
+        """全部项目材料按 (分类, 基准单位) 的单价分布，进程内缓存 REASONABILITY_BASELINE_CACHE_SECONDS 秒"""
+        
+        now = time.monotonic()
+        cached = _portfolio_distributions_cache
+        if cached['distributions'] is not None and now - cached['computed_at'] < settings.REASONABILITY_BASELINE_CACHE_SECONDS:
+            return cached['distributions']
+        
+        stmt = select(
+            ProjectMaterial.category,
+            ProjectMaterial.unit,
+            ProjectMaterial.specification,
+            ProjectMaterial.unit_price
+        ).where(
+            and_(ProjectMaterial.unit_price.isnot(None), ProjectMaterial.unit_price != 0)
+        )
         result = await db.execute(stmt)
-        base_materials = result.scalars().all()
-        
-        historical_data = []
-        for bm in base_materials:
-            historical_data.append({
-                'price': bm.price,
-                'date': bm.effective_date,
-                'region': bm.region,
-                'source': bm.source
-            })
+        distributions = self.anomaly_detector.compute_distributions(
+            [row._mapping for row in result.all()]
+        )
         
-        return historical_data
+        cached['distributions'] = distributions
+        cached['computed_at'] = now
+        logger.info(f"已计算全部项目材料的单价分布基线，共 {len(distributions)} 个分类+单位分组")
+        return distributions
     
     async def _get_market_context(
         self,
         db: AsyncSession,
         project_id: int
     ) -> Dict[str, Any]:
-        """获取市场环境信息"""
-        
-        # 简化的市场环境信息，实际应用中可以从外部数据源获取
-        return {
-            'trend': 'stable',        # 市场趋势：stable/rising/falling
-            'inflation_rate': 0.03,   # 通胀率
-            'season_factor': 1.0,     # 季节因子
-            'region': '全国',         # 地区
-            'analysis_date': datetime.utcnow()
-        }
+        """获取市场环境信息
+
+        从信息价市场指数查询项目地区在基期月份（无基期时取最新月份）的趋势、通胀率和季节因子；
+        分析器每次只接收一个市场环境，因此取地区全部材料的指数。
+        """
+        project = await db.get(Project, project_id)
+        return await market_index_service.get_context(
+            db,
+            resolve_project_region(project),
+            month=project.base_price_date if project else None
+        )
     
     async def _update_reasonability_results(
         self,
         db: AsyncSession,
         reasonability_results: List[PriceReasonabilityResult],
         anomaly_results: List[Dict[str, Any]]
-    ):
-        """更新合理性分析结果到数据库"""
+    ) -> int:
+        """更新合理性分析结果到数据库
+
+        每块结果用一条 UPDATE ... FROM (VALUES ...) 写回，异常检测标记在组装行数据时一并合入，
+        全部写完后提交一次。返回更新的记录数。
+        """
         
         # 创建异常材料ID集合，用于标记
         anomaly_material_ids = {anomaly['material_id'] for anomaly in anomaly_results}
         
+        rows = []
         for result in reasonability_results:
-            # 获取对应的分析记录
-            stmt = select(PriceAnalysis).where(
-                PriceAnalysis.material_id == result.material_id
-            )
-            db_result = await db.execute(stmt)
-            analysis = db_result.scalar_one_or_none()
-            
-            if not analysis:
-                continue
-            
-            # 更新合理性分析结果
-            analysis.is_reasonable = (result.price_status == PriceStatus.REASONABLE)
-            analysis.price_variance = result.price_variance
-            analysis.risk_level = result.risk_level.value
-            analysis.risk_factors = "; ".join(result.risk_factors)
-            analysis.recommendations = "; ".join(result.recommendations)
+            risk_level = result.risk_level.value
+            risk_factors = "; ".join(result.risk_factors)
             
             # 如果是异常检测到的材料，特别标记
             if result.material_id in anomaly_material_ids:
-                analysis.risk_level = RiskLevel.HIGH.value
-                existing_factors = analysis.risk_factors or ""
-                analysis.risk_factors = f"{existing_factors}; 统计学异常检测标记"
-        
-        await db.commit()
-        logger.info(f"更新了 {len(reasonability_results)} 个材料的合理性分析结果")
+                risk_level = RiskLevel.HIGH.value
+                risk_factors = f"{risk_factors}; 统计学异常检测标记"
+            
+            rows.append((
+                result.material_id,
+                result.price_status == PriceStatus.REASONABLE,
+                result.price_variance,
+                risk_level,
+                risk_factors,
+                "; ".join(result.recommendations)
+            ))
+        
+        updated = 0
+        try:
+            for i in range(0, len(rows), self.bulk_write_chunk_size):
+                chunk = rows[i:i + self.bulk_write_chunk_size]
+                updates = values(
+                    column('material_id', Integer),
+                    column('is_reasonable', Boolean),
+                    column('price_variance', Float),
+                    column('risk_level', String),
+                    column('risk_factors', Text),
+                    column('recommendations', Text),
+                    name='reasonability_updates'
+                ).data(chunk)
+                stmt = (
+                    update(PriceAnalysis)
+                    .where(PriceAnalysis.material_id == updates.c.material_id)
+                    .values(
+                        is_reasonable=updates.c.is_reasonable,
+                        price_variance=updates.c.price_variance,
+                        risk_level=updates.c.risk_level,
+                        risk_factors=updates.c.risk_factors,
+                        recommendations=updates.c.recommendations
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                result = await db.execute(stmt)
+                
+                # 分析记录可能已被删除（如材料被移除），此时跳过，与逐条更新一致
+                if result.rowcount != len(chunk):
+                    logger.warning(
+                        f"合理性分析结果写回第 {i // self.bulk_write_chunk_size + 1} 批: "
+                        f"预期 {len(chunk)} 条，实际更新 {result.rowcount} 条"
+                    )
+                updated += max(result.rowcount or 0, 0)
+            
+            await db.commit()
+        except Exception as e:
+            logger.error(f"写回合理性分析结果失败: {e}")
+            await db.rollback()
+            raise
+        
+        logger.info(f"更新了 {updated} 个材料的合理性分析结果（异常标记 {len(anomaly_material_ids)} 个）")
+        return updated
     
     def _calculate_analysis_statistics(
         self,
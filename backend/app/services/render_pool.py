@@ -0,0 +1,91 @@
+"""报告渲染进程池
+
+Word 文档构建（python-docx）和图表绘制（matplotlib）都是纯 CPU 计算，放在事件循环线程中执行会阻塞整个 API 进程。
+这里维护一个进程级共享的 ProcessPoolExecutor，渲染函数及其参数必须可 pickle（模块级函数 + 普通数据）：
+- 进程数由 REPORT_RENDER_WORKERS 配置，为 0 时在当前进程内同步渲染（本地调试）；
+- 子进程使用 spawn 方式启动，不继承父进程的事件循环和数据库连接，启动时加载一次 matplotlib 字体；
+- 单次渲染超过 REPORT_RENDER_TIMEOUT 秒时抛出 TimeoutError，并把当前进程池换下、终止其子进程
+  （同一进程池中仍在执行的其他渲染以 BrokenProcessPool 失败），后续渲染提交到新的进程池，
+  避免卡死的子进程继续占用 CPU 和内存。
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List, Optional
+
+from loguru import logger
+
+from app.core.config import settings
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_TERMINATE_GRACE_SECONDS = 5  # 子进程收到 SIGTERM 后等待退出的时间，超时后 SIGKILL
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # 进程启动时配置 Agg 后端和中文字体（延迟导入，避免与图表渲染模块循环导入）
+        from app.services.chart_rendering import configure_matplotlib
+
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.REPORT_RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=configure_matplotlib
+        )
+        logger.info(f"报告渲染进程池已创建，进程数: {settings.REPORT_RENDER_WORKERS}")
+    return _pool
+
+
+def _terminate_workers(processes: List[multiprocessing.process.BaseProcess]):
+    """终止子进程，未在宽限时间内退出的强制结束"""
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(_TERMINATE_GRACE_SECONDS)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+
+def _retire_pool(pool: ProcessPoolExecutor):
+    """换下指定的进程池并终止其子进程（卡死的渲染无法取消，只能结束进程），后续渲染使用新的进程池"""
+    global _pool
+    if _pool is pool:
+        _pool = None
+    # shutdown 之后进程池会清空进程表，先取出子进程
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    # 等待子进程退出会阻塞，放到后台线程中执行
+    threading.Thread(target=_terminate_workers, args=(processes,), name="render-pool-reaper", daemon=True).start()
+
+
+async def run_in_render_pool(func: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+    """在渲染进程池中执行 func(*args)，timeout 默认取 REPORT_RENDER_TIMEOUT"""
+    if settings.REPORT_RENDER_WORKERS <= 0:
+        return func(*args)
+
+    timeout = settings.REPORT_RENDER_TIMEOUT if timeout is None else timeout
+    pool = _get_pool()
+    future = asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"渲染超时（{timeout}秒）: {getattr(func, '__name__', func)}，已更换渲染进程池")
+        _retire_pool(pool)
+        raise TimeoutError(f"渲染超时（超过{timeout}秒）")
+    except BrokenProcessPool:
+        # 子进程异常退出后进程池不可再用
+        _retire_pool(pool)
+        raise
+
+
+def shutdown_render_pool():
+    """关闭渲染进程池（应用关闭时调用）"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
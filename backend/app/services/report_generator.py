@@ -1,17 +1,13 @@
 import os
 import re
-import uuid
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Tuple, Union
+from typing import Dict, List, Optional, Any, Union
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, inspect as sa_inspect
 from pathlib import Path
+from types import SimpleNamespace
 import json
 from loguru import logger
-import matplotlib
-# 设置matplotlib后端为Agg，必须在导入pyplot之前设置
-matplotlib.use('Agg')
-logger.info(f"Matplotlib backend set to: {matplotlib.get_backend()}")
 
 from docx import Document
 from docx.shared import Inches, Cm, Pt
@@ -20,9 +16,6 @@ from docx.enum.table import WD_TABLE_ALIGNMENT, WD_ALIGN_VERTICAL
 from docx.enum.section import WD_SECTION, WD_ORIENT
 from docx.oxml.shared import OxmlElement, qn
 from docx.oxml.ns import nsdecls
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib import rcParams
 import seaborn as sns
 import pandas as pd
 from io import BytesIO
@@ -33,6 +26,8 @@ from app.models.analysis import AuditReport
 from app.models.project import Project, ProjectMaterial, ProjectType
 from app.models.analysis import PriceAnalysis
 from app.models.user import User
+from app.services.chart_rendering import chart_rendering_service, configure_matplotlib
+from app.services.render_pool import run_in_render_pool
 
 
 PROVINCE_MAP = {
@@ -74,6 +69,14 @@ AUDIT_SCOPE_MAP = {
 }
 
 
+def _snapshot(instance: Any) -> Any:
+    """ORM 对象 -> 只包含列属性的普通对象（可 pickle），非 ORM 对象原样返回"""
+    state = sa_inspect(instance, raiseerr=False)
+    if state is None or not hasattr(state, 'mapper'):
+        return instance
+    return SimpleNamespace(**{attr.key: getattr(instance, attr.key) for attr in state.mapper.column_attrs})
+
+
 class ReportGenerator:
     """审计报告生成器"""
     
@@ -91,19 +94,7 @@ class ReportGenerator:
         logger.info(f"ReportGenerator output directory: {self.reports_dir.absolute()}")
         
         # 配置matplotlib中文支持（增加常见中文字体作为回退）
-        rcParams['font.family'] = 'sans-serif'
-        rcParams['font.sans-serif'] = [
-            'Arial Unicode MS',
-            'Heiti TC',
-            'Songti SC',
-            'STHeiti',
-            'Microsoft YaHei',
-            'SimSun',
-            'PingFang SC',
-            'Noto Sans CJK SC',
-            'SimHei'
-        ]
-        rcParams['axes.unicode_minus'] = False
+        configure_matplotlib()
         
     async def generate_audit_report(
         self,
@@ -127,71 +118,93 @@ class ReportGenerator:
             报告文件路径
         """
         try:
-            # 解析配置
+            # 数据准备（需要数据库）在事件循环中完成，文档渲染放到渲染进程池中执行
+            report_data = await self._prepare_report_data(db, project, materials, analyses)
+
+            # 使用项目名称作为文件名的一部分
+            project_name_safe = re.sub(r'[\\/*?:"<>|]', '_', project.name) if project.name else f"project_{project.id}"
+            report_filename = f"分析报告_{project_name_safe}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
+            report_path = str(self.reports_dir / report_filename)
+
+            # 图表：优先使用前端传入的图片，否则按数据哈希从缓存读取或在渲染进程中并行绘制
             config = report_config or {}
-            include_charts = config.get('include_charts', True)
-            include_details = config.get('include_detailed_analysis', True)
-            include_recommendations = config.get('include_recommendations', True)
-            include_appendices = config.get('include_appendices', True)
+            chart_files: List[BytesIO] = []
+            if config.get('include_charts', True) and not chart_images:
+                try:
+                    chart_files = await chart_rendering_service.render_report_charts(report_data)
+                except Exception as e:
+                    logger.error(f"生成图表失败: {e}")
 
-            # 生成报告数据
-            report_data = await self._prepare_report_data(db, project, materials, analyses)
+            await run_in_render_pool(render_audit_report, report_data, config, chart_images, report_path, chart_files)
 
-            # 创建Word文档
-            doc = Document()
-            self._setup_document_styles(doc)
-            self._apply_document_layout(doc)
+            logger.info(f"审计报告生成成功: {report_path}")
+            return report_path
+            
+        except Exception as e:
+            logger.error(f"生成审计报告失败: {e}")
+            raise
 
-            self._add_header_footer(doc, report_title='造价材料审计报告')
-            # 添加报告标题页
-            self._add_title_page(doc, report_data)
+    def render_document(
+        self,
+        report_data: Dict[str, Any],
+        report_config: Dict[str, Any],
+        chart_images: Optional[Dict[str, str]],
+        report_path: str,
+        chart_files: Optional[List[Union[bytes, BytesIO]]] = None
+    ):
+        """渲染并保存Word文档（不访问数据库，report_data 为 _prepare_report_data 的结果）
+
+        chart_images 为前端传入的图表（base64），没有时使用 chart_files（已渲染好的PNG）。
+        """
+        config = report_config or {}
+        include_charts = config.get('include_charts', True)
+        include_details = config.get('include_detailed_analysis', True)
+        include_recommendations = config.get('include_recommendations', True)
+        include_appendices = config.get('include_appendices', True)
 
-            # 添加执行摘要
-            self._add_executive_summary(doc, report_data)
+        # 创建Word文档
+        doc = Document()
+        self._setup_document_styles(doc)
+        self._apply_document_layout(doc)
 
-            # 添加项目概况
-            self._add_project_overview(doc, report_data)
+        self._add_header_footer(doc, report_title='造价材料审计报告')
+        # 添加报告标题页
+        self._add_title_page(doc, report_data)
 
-            # 添加分析方法与数据来源
-            self._add_methodology_section(doc, report_data)
+        # 添加执行摘要
+        self._add_executive_summary(doc, report_data)
 
-            # 添加分析结果
-            chart_files = []
-            if include_charts:
-                try:
-                    if chart_images:
-                        chart_files = self._process_chart_images(chart_images)
-                    else:
-                        chart_files = self._generate_charts(report_data)
-                except Exception as e:
-                    logger.error(f"生成图表失败: {e}")
+        # 添加项目概况
+        self._add_project_overview(doc, report_data)
 
-            await self._add_analysis_results(doc, report_data, include_details=include_details, chart_files=chart_files)
+        # 添加分析方法与数据来源
+        self._add_methodology_section(doc, report_data)
 
-            # 添加问题材料详情
-            # self._add_problematic_materials(doc, report_data)
+        # 添加分析结果
+        if not include_charts:
+            chart_files = []
+        elif chart_images:
+            try:
+                chart_files = self._process_chart_images(chart_images)
+            except Exception as e:
+                logger.error(f"处理图表失败: {e}")
+                chart_files = []
 
-            # 添加建议措施
-            if include_recommendations:
-                self._add_recommendations(doc, report_data)
+        self._add_analysis_results(doc, report_data, include_details=include_details, chart_files=chart_files)
 
-            # 添加附录
-            if include_appendices:
-                self._add_appendices(doc, report_data)
+        # 添加问题材料详情
+        # self._add_problematic_materials(doc, report_data)
 
-            # 保存报告
-            # 使用项目名称作为文件名的一部分
-            project_name_safe = re.sub(r'[\\/*?:"<>|]', '_', project.name) if project.name else f"project_{project.id}"
-            report_filename = f"分析报告_{project_name_safe}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
-            report_path = self.reports_dir / report_filename
-            doc.save(str(report_path))
+        # 添加建议措施
+        if include_recommendations:
+            self._add_recommendations(doc, report_data)
 
-            logger.info(f"审计报告生成成功: {report_path}")
-            return str(report_path)
-            
-        except Exception as e:
-            logger.error(f"生成审计报告失败: {e}")
-            raise
+        # 添加附录
+        if include_appendices:
+            self._add_appendices(doc, report_data)
+
+        # 保存报告
+        doc.save(report_path)
     
     async def _prepare_report_data(
         self,
@@ -483,9 +496,12 @@ class ReportGenerator:
             for level, count in risk_stats.items()
         }
 
+        # ORM 对象转换为普通对象，报告数据整体可 pickle 后交给渲染进程
+        material_snapshots = [_snapshot(material) for material in materials]
+        analysis_snapshots = [_snapshot(analysis) for analysis in analyses]
+
         return {
-            'project': project,
-            'db': db,
+            'project': _snapshot(project),
             'report_date': datetime.now(),
             'statistics': {
                 'total_materials': total_materials,
@@ -501,9 +517,9 @@ class ReportGenerator:
             },
             'risk_stats_raw': risk_stats,
             'risk_stats': risk_distribution,
-            'materials': materials,
-            'analyses': analyses,
-            'price_analyses': price_analyses,
+            'materials': material_snapshots,
+            'analyses': analysis_snapshots,
+            'price_analyses': {a.material_id: a for a in analysis_snapshots},
             'analysis_materials_report': analysis_materials_report,
             'guidance_materials_report': guidance_materials_report,
             'top_adjustments': top_adjustments,
@@ -846,7 +862,7 @@ class ReportGenerator:
 
         doc.add_paragraph()
 
-    async def _add_analysis_results(self, doc: Document, data: Dict[str, Any], include_details: bool = True, chart_files: Optional[List[Union[bytes, BytesIO, str]]] = None):
+    def _add_analysis_results(self, doc: Document, data: Dict[str, Any], include_details: bool = True, chart_files: Optional[List[Union[bytes, BytesIO, str]]] = None):
         """添加分析结果"""
         doc.add_heading('分析结果', 1)
         
@@ -1125,227 +1141,6 @@ class ReportGenerator:
                 
         return chart_data_list
 
-    def _generate_charts(self, data: Dict[str, Any]) -> List[str]:
-        """生成图表文件"""
-        chart_files = []
-        
-        try:
-            chart_path = self._create_risk_level_pie_chart(data)
-            if chart_path:
-                chart_files.append(chart_path)
-            
-            chart_path = self._create_adjustment_top_chart(data)
-            if chart_path:
-                chart_files.append(chart_path)
-
-            chart_path = self._create_total_comparison_chart(data)
-            if chart_path:
-                chart_files.append(chart_path)
-
-            # 新增：价格偏差分析图（如果有分析结果）
-            chart_path = self._create_price_variance_chart(data)
-            if chart_path:
-                chart_files.append(chart_path)
-
-            # 如果以上图表都没有生成（例如项目数据较少），生成一张占位说明图
-            if not chart_files:
-                chart_path = self._create_no_data_chart()
-                if chart_path:
-                    chart_files.append(chart_path)
-
-        except Exception as e:
-            logger.error(f"生成图表失败: {e}")
-        
-        return chart_files
-    
-    def _create_risk_level_pie_chart(self, data: Dict[str, Any]) -> Optional[str]:
-        """创建风险等级饼图"""
-        risk_stats = data.get('risk_stats_raw', {})
-        if not risk_stats:
-            return None
-        
-        # 准备数据
-        label_map = {
-            'normal': '正常',
-            'low': '低风险',
-            'medium': '中风险',
-            'high': '高风险',
-            'critical': '极高风险',
-            'severe': '极高风险',
-            'unknown': '待确认'
-        }
-        color_map = {
-            'normal': '#67C23A',
-            'low': '#409EFF',
-            'medium': '#E6A23C',
-            'high': '#F56C6C',
-            'critical': '#C039A5',
-            'severe': '#C039A5',
-            'unknown': '#909399'
-        }
-
-        ordered_levels = ['normal', 'low', 'medium', 'high', 'critical', 'unknown']
-        labels = []
-        sizes = []
-        colors = []
-        for level in ordered_levels:
-            if level in risk_stats:
-                labels.append(label_map.get(level, level))
-                sizes.append(risk_stats[level])
-                colors.append(color_map.get(level, '#409EFF'))
-
-        # 创建饼图
-        plt.figure(figsize=(8, 8))
-        plt.pie(sizes, labels=labels, colors=colors[:len(labels)], autopct='%1.1f%%', startangle=90)
-        plt.title('材料风险等级分布', fontsize=16)
-        plt.axis('equal')
-        
-        # 保存图表
-        chart_filename = f"risk_levels_{uuid.uuid4().hex[:8]}.png"
-        chart_path = self.reports_dir / chart_filename
-        plt.savefig(chart_path, dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        return str(chart_path)
-
-    def _create_adjustment_top_chart(self, data: Dict[str, Any]) -> Optional[str]:
-        items: List[Tuple[str, float]] = []
-        for item in data.get('analysis_materials_report', []):
-            items.append((item['materialName'], item['adjustment']))
-        for item in data.get('guidance_materials_report', []):
-            items.append((item['materialName'], item['adjustment']))
-
-        if not items:
-            return None
-
-        items.sort(key=lambda x: abs(x[1]), reverse=True)
-        top_items = items[:10]
-        names = [name for name, _ in top_items][::-1]
-        values = [value for _, value in top_items][::-1]
-        colors = ['#F56C6C' if v > 0 else '#67C23A' for v in values]
-
-        plt.figure(figsize=(12, 7))
-        bars = plt.barh(names, values, color=colors)
-        plt.title('核增减额TOP10', fontsize=16)
-        plt.xlabel('金额（元）', fontsize=12)
-        plt.grid(axis='x', alpha=0.2)
-        plt.axvline(0, color='#333', linewidth=0.8)
-
-        max_value = max((abs(v) for v in values), default=0)
-        offset = max_value * 0.02 if max_value else 0
-        for bar, value in zip(bars, values):
-            x_pos = value + offset if value >= 0 else value - offset
-            ha = 'left' if value >= 0 else 'right'
-            plt.text(x_pos, bar.get_y() + bar.get_height() / 2, f"{value:+,.2f}", va='center', ha=ha, fontsize=9)
-
-        plt.tight_layout()
-
-        chart_filename = f"adjustment_top_{uuid.uuid4().hex[:8]}.png"
-        chart_path = self.reports_dir / chart_filename
-        plt.savefig(chart_path, dpi=300)
-        plt.close()
-
-        return str(chart_path)
-
-    def _create_total_comparison_chart(self, data: Dict[str, Any]) -> Optional[str]:
-        stats = data.get('statistics', {})
-        analysis_totals = stats.get('analysis_totals') or {}
-        guidance_totals = stats.get('guidance_totals') or {}
-
-        categories = ['无信息价材料', '市场信息价材料']
-        original_totals = [analysis_totals.get('original_total', 0), guidance_totals.get('original_total', 0)]
-        ai_totals = [analysis_totals.get('ai_total', 0), guidance_totals.get('ai_total', 0)]
-
-        if not any(original_totals) and not any(ai_totals):
-            return None
-
-        x = range(len(categories))
-        width = 0.35
-
-        plt.figure(figsize=(10, 6))
-        plt.bar([i - width / 2 for i in x], original_totals, width, label='送审总额', color='#409EFF')
-        plt.bar([i + width / 2 for i in x], ai_totals, width, label='AI核审总额', color='#67C23A')
-
-        plt.xticks(list(x), categories)
-        plt.ylabel('金额（元）')
-        plt.title('送审 VS AI 核审 总额对比', fontsize=16)
-        plt.legend()
-        plt.grid(axis='y', alpha=0.2)
-
-        for idx, value in enumerate(original_totals):
-            plt.text(idx - width / 2, value, f"{value:,.2f}", ha='center', va='bottom', fontsize=9)
-        for idx, value in enumerate(ai_totals):
-            plt.text(idx + width / 2, value, f"{value:,.2f}", ha='center', va='bottom', fontsize=9)
-
-        plt.tight_layout()
-
-        chart_filename = f"totals_compare_{uuid.uuid4().hex[:8]}.png"
-        chart_path = self.reports_dir / chart_filename
-        plt.savefig(chart_path, dpi=300)
-        plt.close()
-
-        return str(chart_path)
-    def _create_price_variance_chart(self, data: Dict[str, Any]) -> Optional[str]:
-        """创建价格偏差分析图"""
-        analyses = data['analyses']
-        if not analyses:
-            return None
-        
-        # 准备数据
-        variances = []
-        materials = []
-        
-        for i, analysis in enumerate(analyses[:20]):  # 只显示前20个
-            if analysis.price_variance is not None:
-                variances.append(analysis.price_variance)
-                materials.append(f"材料{i+1}")
-        
-        if len(variances) < 2:
-            return None
-        
-        # 创建条形图
-        plt.figure(figsize=(12, 6))
-        colors = ['red' if v > 30 else 'orange' if v > 15 else 'green' for v in variances]
-        plt.bar(materials, variances, color=colors, alpha=0.7)
-        plt.title('材料价格偏差分析', fontsize=16)
-        plt.xlabel('材料', fontsize=12)
-        plt.ylabel('价格偏差（%）', fontsize=12)
-        plt.xticks(rotation=45)
-        plt.axhline(y=15, color='orange', linestyle='--', alpha=0.5, label='15%警戒线')
-        plt.axhline(y=30, color='red', linestyle='--', alpha=0.5, label='30%风险线')
-        plt.legend()
-        plt.grid(True, alpha=0.3)
-        
-        # 保存图表
-        chart_filename = f"price_variance_{uuid.uuid4().hex[:8]}.png"
-        chart_path = self.reports_dir / chart_filename
-        plt.savefig(chart_path, dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        return str(chart_path)
-
-    def _create_no_data_chart(self) -> Optional[str]:
-        """当没有可用数据时生成占位图，避免文档中图表区域完全空白"""
-        try:
-            plt.figure(figsize=(8, 4))
-            plt.axis('off')
-            plt.text(
-                0.5,
-                0.5,
-                '当前项目暂无可展示的图表数据\n（无风险材料或差异为 0）',
-                ha='center',
-                va='center',
-                fontsize=14
-            )
-            chart_filename = f"no_data_{uuid.uuid4().hex[:8]}.png"
-            chart_path = self.reports_dir / chart_filename
-            plt.savefig(chart_path, dpi=200, bbox_inches='tight')
-            plt.close()
-            return str(chart_path)
-        except Exception as e:
-            logger.error(f"生成占位图失败: {e}")
-            return None
-    
     def _add_charts_to_document(self, doc: Document, chart_files: List[str]):
         """将图表添加到文档中"""
         if not chart_files:
@@ -1811,3 +1606,21 @@ class ReportGenerator:
         notes.runs[0].font.size = Pt(8)
         
         doc.add_paragraph()  # 添加间距
+
+
+_worker_generator: Optional[ReportGenerator] = None
+
+
+def render_audit_report(
+    report_data: Dict[str, Any],
+    report_config: Dict[str, Any],
+    chart_images: Optional[Dict[str, str]],
+    report_path: str,
+    chart_files: Optional[List[Union[bytes, BytesIO]]] = None
+) -> str:
+    """报告渲染阶段（模块级函数，在渲染进程池中执行），每个进程复用一个 ReportGenerator"""
+    global _worker_generator
+    if _worker_generator is None:
+        _worker_generator = ReportGenerator()
+    _worker_generator.render_document(report_data, report_config, chart_images, report_path, chart_files)
+    return report_path
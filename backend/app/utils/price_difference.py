@@ -0,0 +1,275 @@
+"""市场信息价材料价格差异的列式计算引擎。
+
+整个项目的基期价、合同期价格、项目单价和数量组装成 NumPy 数组后统一计算：
+- 单位换算使用 convert_unit_prices 按数组换算，(原单位, 目标单位, 规格) 组合只解析一次；
+- 换算后价格、合同期均价、风险幅度按浮点数组计算，四舍五入到 0.0001 时若结果离进位边界过近
+  （浮点误差可能改变舍入方向），该行标记为需要精确计算，由调用方按逐行 Decimal 逻辑处理；
+- 未量化的输出（单价差、调差单价、调差总额、换算系数）在输出边界用 Decimal 精确计算。
+
+因此结果与逐行 Decimal 计算完全一致。
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.utils.unit_conversion import convert_unit_prices, normalize_unit, resolve_price_conversion
+
+_SCALE = 10000  # 量化到 0.0001
+# 判定"离舍入进位点过近"的容差：绝对 1e-9（以 0.0001 为单位）+ 相对 1e-11
+_TIE_ABS_TOLERANCE = 1e-9
+_TIE_REL_TOLERANCE = 1e-11
+# 超过该量级（以 0.0001 为单位）时浮点数已无法精确表示整数，一律走精确计算
+_MAX_EXACT_SCALED = 2.0 ** 52
+
+def quantize_scaled(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """按 ROUND_HALF_UP 量化到 0.0001，返回 (以 0.0001 为单位的绝对值整数, 是否离舍入进位点过近)"""
+    with np.errstate(invalid='ignore', over='ignore'):
+        scaled = np.abs(values) * _SCALE
+        representable = np.isfinite(scaled) & (scaled < _MAX_EXACT_SCALED)
+        scaled = np.where(representable, scaled, 0.0)
+        floor = np.floor(scaled)
+        fraction = scaled - floor
+        tolerance = _TIE_ABS_TOLERANCE + scaled * _TIE_REL_TOLERANCE
+        ambiguous = (np.abs(fraction - 0.5) <= tolerance) | ~representable
+        units = np.where(fraction >= 0.5, floor + 1, floor).astype(np.int64)
+    return units, ambiguous
+
+
+def _units_to_float(units: np.ndarray, values: np.ndarray) -> np.ndarray:
+    # 整数 / 10000 为正确舍入的除法，结果与 float(Decimal 量化值) 相同；保留负零的符号
+    return np.copysign(units / _SCALE, values)
+
+
+def _units_to_decimal(units: int, negative: bool) -> Decimal:
+    quantized = Decimal(int(units)).scaleb(-4)
+    return quantized.copy_negate() if negative else quantized
+
+
+def _decimal(value: Any) -> Decimal:
+    return Decimal(str(value or 0))
+
+
+@dataclass
+class PriceDifferenceRow:
+    """单个材料的差异计算结果（数值均为输出值）"""
+    project_unit: str
+    base_unit: str
+    project_price: float
+    quantity: float
+    base_price_including_tax: float
+    base_price_excluding_tax: float
+    contract_average_price: float
+    contract_period_prices: List[float]
+    unit_price_difference: float
+    total_price_difference: float
+    price_difference_rate: Decimal
+    has_difference: bool
+    conversion_applied: bool
+    conversion_factor: float
+    original_base_price_excluding_tax: float
+    original_base_price_including_tax: float
+
+
+class PriceDifferenceEngine:
+    """价格差异列式计算引擎"""
+
+    def __init__(self, threshold: Decimal):
+        self.threshold = threshold
+        self._threshold_units = int(threshold * _SCALE)
+
+    def compute(
+        self,
+        materials: Sequence[Any],
+        related_prices: Sequence[Optional[Sequence[Any]]],
+        use_contract_prices: bool = True
+    ) -> List[Any]:
+        """
+        计算一批材料的价格差异。
+
+        返回与 materials 对齐的列表，元素为 PriceDifferenceRow、ValueError（无法分析的原因），
+        或 None（存在舍入边界情况，需要调用方逐行精确计算）。
+        """
+        n = len(materials)
+        results: List[Any] = [None] * n
+        if n == 0:
+            return results
+
+        project_units = [normalize_unit(material.unit or "") for material in materials]
+        base_units = [normalize_unit(material.base_unit or "") for material in materials]
+        specifications = [material.base_specification or "" for material in materials]
+        excl = np.array([float(material.base_price_excluding_tax or 0) for material in materials])
+        incl = np.array([float(material.base_price_including_tax or 0) for material in materials])
+        converted = np.array([
+            bool(base_unit and project_unit and base_unit != project_unit)
+            for base_unit, project_unit in zip(base_units, project_units)
+        ], dtype=bool)
+
+        # 基期价换算（仅单位不一致的材料）
+        excl_converted = excl.copy()
+        incl_converted = incl.copy()
+        failed = np.zeros(n, dtype=bool)
+        rows = np.flatnonzero(converted)
+        if rows.size:
+            from_units = [base_units[i] for i in rows]
+            to_units = [project_units[i] for i in rows]
+            row_specs = [specifications[i] for i in rows]
+            excl_converted[rows], valid = convert_unit_prices(excl[rows], from_units, to_units, row_specs)
+            incl_converted[rows], _ = convert_unit_prices(incl[rows], from_units, to_units, row_specs)
+            for i in rows[~valid]:
+                failed[i] = True
+                material = materials[i]
+                results[i] = ValueError(
+                    f"材料 {material.material_name} 的单位不一致且无法换算: "
+                    f"项目单位 {material.unit or ''}, 基准单位 {material.base_unit or ''}"
+                )
+            converted &= ~failed
+
+        excl_units, excl_ambiguous = quantize_scaled(excl_converted)
+        incl_units, incl_ambiguous = quantize_scaled(incl_converted)
+        exact = converted & (excl_ambiguous | incl_ambiguous)
+        base = np.where(converted, _units_to_float(excl_units, excl_converted), excl)
+        base_incl = np.where(converted, _units_to_float(incl_units, incl_converted), incl)
+
+        invalid = ~failed & ~exact & (base <= 0)
+        for i in np.flatnonzero(invalid):
+            failed[i] = True
+            results[i] = ValueError(
+                f"材料 {materials[i].material_name} 的不含税价格为0或不存在，无法进行价格差异分析"
+            )
+
+        # 合同期价格：展开为一维数组，按材料下标汇总
+        row_index: List[int] = []
+        values: List[float] = []
+        weights: List[float] = []
+        value_units_from: List[str] = []
+        if use_contract_prices:
+            for i, related_rows in enumerate(related_prices):
+                if failed[i] or not related_rows:
+                    continue
+                for related in related_rows:
+                    price_value = related.effective_price
+                    if price_value is None:
+                        continue
+                    row_index.append(i)
+                    values.append(float(price_value))
+                    weights.append(float(related.effective_count or 1))
+                    value_units_from.append(normalize_unit(related.unit or ""))
+
+        index_array = np.asarray(row_index, dtype=np.int64)
+        value_array = np.asarray(values, dtype=float)
+        weight_array = np.asarray(weights, dtype=float)
+        value_converted = np.array([
+            bool(project_units[i] and related_unit and related_unit != project_units[i])
+            for i, related_unit in zip(row_index, value_units_from)
+        ], dtype=bool)
+
+        raw_converted = value_array.copy()
+        keep = np.ones(len(row_index), dtype=bool)
+        value_rows = np.flatnonzero(value_converted)
+        if value_rows.size:
+            raw_converted[value_rows], valid = convert_unit_prices(
+                value_array[value_rows],
+                [value_units_from[k] for k in value_rows],
+                [project_units[row_index[k]] for k in value_rows],
+                [specifications[row_index[k]] for k in value_rows]
+            )
+            # 无法换算的合同期价格不参与平均
+            keep[value_rows[~valid]] = False
+        index_array = index_array[keep]
+        value_array = value_array[keep]
+        weight_array = weight_array[keep]
+        value_converted = value_converted[keep]
+        raw_converted = raw_converted[keep]
+
+        value_units, value_ambiguous = quantize_scaled(raw_converted)
+        contract_values = np.where(value_converted, _units_to_float(value_units, raw_converted), value_array)
+        if index_array.size:
+            exact |= np.bincount(index_array, weights=value_converted & value_ambiguous, minlength=n) > 0
+
+        weighted_sum = np.bincount(index_array, weights=contract_values * weight_array, minlength=n)
+        weight_sum = np.bincount(index_array, weights=weight_array, minlength=n)
+        has_prices = weight_sum > 0
+        average_raw = np.divide(weighted_sum, weight_sum, out=np.zeros(n), where=has_prices)
+        average_units, average_ambiguous = quantize_scaled(average_raw)
+        exact |= has_prices & average_ambiguous
+        average = np.where(has_prices, _units_to_float(average_units, average_raw), base)
+
+        # 风险幅度 = (合同期均价 - 基期价) / 基期价
+        safe_base = np.where(base > 0, base, 1.0)
+        rate_raw = np.where(base > 0, (average - base) / safe_base, 0.0)
+        rate_units, rate_ambiguous = quantize_scaled(rate_raw)
+        exact |= rate_ambiguous & (base > 0)
+
+        # 逐行输出前先转为 Python 列表，避免在循环中逐个访问 NumPy 标量
+        counts = np.bincount(index_array, minlength=n) if index_array.size else np.zeros(n, dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(counts))).tolist()
+        contract_list = contract_values.tolist()
+        skip = (failed | exact).tolist()
+        converted_list = converted.tolist()
+        excl_units_list, excl_negative = excl_units.tolist(), (excl_converted < 0).tolist()
+        average_units_list, average_negative = average_units.tolist(), (average_raw < 0).tolist()
+        rate_units_list, rate_negative = rate_units.tolist(), (rate_raw < 0).tolist()
+        has_prices_list = has_prices.tolist()
+        base_list, base_incl_list, average_list = base.tolist(), base_incl.tolist(), average.tolist()
+        incl_list = incl.tolist()
+
+        one = Decimal('1')
+        zero = Decimal('0')
+        upper = one + self.threshold
+        lower = one - self.threshold
+        for i, material in enumerate(materials):
+            if skip[i]:
+                continue
+
+            # 输出边界：未量化的结果用 Decimal 精确计算
+            base_raw_excl = _decimal(material.base_price_excluding_tax)
+            if converted_list[i]:
+                base_decimal = _units_to_decimal(excl_units_list[i], excl_negative[i])
+                operation, conversion_value = resolve_price_conversion(
+                    base_units[i], project_units[i], specifications[i]
+                )
+                converted_excl = (
+                    base_raw_excl * conversion_value if operation == "mul" else base_raw_excl / conversion_value
+                )
+                conversion_factor = float(base_raw_excl / converted_excl)
+            else:
+                base_decimal = base_raw_excl
+                conversion_factor = 1.0
+            average_decimal = (
+                _units_to_decimal(average_units_list[i], average_negative[i]) if has_prices_list[i] else base_decimal
+            )
+
+            rate_units_i = -rate_units_list[i] if rate_negative[i] else rate_units_list[i]
+            if rate_units_i > self._threshold_units:
+                adjustment = average_decimal - base_decimal * upper
+            elif rate_units_i < -self._threshold_units:
+                adjustment = average_decimal - base_decimal * lower
+            else:
+                adjustment = zero
+            quantity = _decimal(material.quantity)
+            project_price = _decimal(material.project_unit_price)
+
+            results[i] = PriceDifferenceRow(
+                project_unit=project_units[i],
+                base_unit=base_units[i],
+                project_price=float(project_price),
+                quantity=float(quantity),
+                base_price_including_tax=base_incl_list[i],
+                base_price_excluding_tax=base_list[i],
+                contract_average_price=average_list[i],
+                contract_period_prices=contract_list[offsets[i]:offsets[i + 1]] if has_prices_list[i] else [],
+                unit_price_difference=float(project_price - base_decimal),
+                total_price_difference=float(adjustment * quantity),
+                price_difference_rate=_units_to_decimal(rate_units_list[i], rate_negative[i]),
+                has_difference=abs(rate_units_i) > self._threshold_units,
+                conversion_applied=converted_list[i],
+                conversion_factor=conversion_factor,
+                original_base_price_excluding_tax=float(base_raw_excl),
+                original_base_price_including_tax=incl_list[i]
+            )
+
+        return results
@@ -7,6 +7,8 @@ from datetime import datetime, timedelta
 from loguru import logger
 import numpy as np
 
+from app.utils.unit_conversion import canonical_unit, convert_unit_prices, normalize_unit
+
 
 class RiskLevel(str, Enum):
     """风险等级枚举"""
@@ -51,6 +53,19 @@ class PriceReasonabilityResult:
     created_at: datetime
 
 
+# 批量分析中状态和风险等级的数组编码
+_STATUS_VALUES = (
+    PriceStatus.REASONABLE, PriceStatus.UNDERPRICED, PriceStatus.OVERPRICED,
+    PriceStatus.ABNORMAL, PriceStatus.UNKNOWN
+)
+_REASONABLE, _UNDERPRICED, _OVERPRICED, _ABNORMAL, _UNKNOWN = range(len(_STATUS_VALUES))
+_RISK_VALUES = (RiskLevel.LOW, RiskLevel.MEDIUM, RiskLevel.HIGH, RiskLevel.CRITICAL)
+_LOW, _MEDIUM, _HIGH, _CRITICAL = range(len(_RISK_VALUES))
+_NUMERIC_TYPES = frozenset({int, float, type(None)})
+_EMPTY_ROW = (None,) * 5
+_NEEDS_FALLBACK = object()  # 历史数据无法按组统计，需逐个分析
+
+
 class PriceReasonabilityAnalyzer:
     """价格合理性分析器"""
     
@@ -183,21 +198,13 @@ class PriceReasonabilityAnalyzer:
             'weight': 0.3
         }
         
-        if len(historical_data) < 3:
+        stats = self._historical_stats(historical_data)
+        if stats is None:
             analysis['status'] = PriceStatus.UNKNOWN
             analysis['risk_level'] = RiskLevel.MEDIUM
             return analysis
         
-        # 提取历史价格数据
-        prices = [item.get('price', 0) for item in historical_data if item.get('price')]
-        if not prices:
-            analysis['status'] = PriceStatus.UNKNOWN
-            analysis['risk_level'] = RiskLevel.MEDIUM
-            return analysis
-        
-        # 计算统计指标
-        mean_price = statistics.mean(prices)
-        std_dev = statistics.stdev(prices) if len(prices) > 1 else 0
+        mean_price, std_dev = stats
         
         # Z-score分析
         if std_dev > 0:
@@ -230,6 +237,22 @@ class PriceReasonabilityAnalyzer:
         
         return analysis
     
+    def _historical_stats(self, historical_data: List[Dict[str, Any]]) -> Optional[Tuple[float, float]]:
+        """历史价格的均值和标准差，数据不足时返回 None"""
+        
+        if len(historical_data) < 3:
+            return None
+        
+        # 提取历史价格数据
+        prices = [item.get('price', 0) for item in historical_data if item.get('price')]
+        if not prices:
+            return None
+        
+        # 计算统计指标
+        mean_price = statistics.mean(prices)
+        std_dev = statistics.stdev(prices) if len(prices) > 1 else 0
+        return mean_price, std_dev
+    
     def _market_trend_analysis(
         self,
         original_price: float,
@@ -513,13 +536,12 @@ class PriceReasonabilityAnalyzer:
         method_bonus = min(0.2, analysis_count * 0.1)
         
         # 风险等级调整
+        risk_penalty = 0
+        risk_bonus = 0
         if risk_level == RiskLevel.CRITICAL:
             risk_penalty = -0.1  # 严重风险降低置信度
         elif risk_level == RiskLevel.LOW:
             risk_bonus = 0.1     # 低风险提高置信度
-        else:
-            risk_penalty = 0
-            risk_bonus = 0
         
         final_confidence = base_confidence + method_bonus + risk_bonus + risk_penalty
         
@@ -531,149 +553,552 @@ class PriceReasonabilityAnalyzer:
         materials_data: List[Dict[str, Any]],
         market_context: Optional[Dict[str, Any]] = None
     ) -> List[PriceReasonabilityResult]:
-        """批量分析材料价格合理性"""
-        
-        results = []
-        
-        for material_data in materials_data:
+        """批量分析材料价格合理性
+
+        原价、AI预测区间和置信度组装为数组按列计算，历史价格统计按历史数据分组只算一次
+        （同名称+单位的材料共用同一份历史数据）。输入不是有限数值、或计算中会出现除零的材料
+        按 analyze_price_reasonability 逐个分析，结果与逐个分析完全一致。
+        """
+
+        try:
+            results = self._vectorized_batch_analyze(materials_data, market_context)
+        except Exception as e:
+            logger.warning(f"批量合理性分析失败，改为逐个分析: {e}")
+            results = [None] * len(materials_data)
+
+        return [
+            result if result is not None else self._analyze_material_data(material_data, market_context)
+            for material_data, result in zip(materials_data, results)
+        ]
+
+    def _analyze_material_data(
+        self,
+        material_data: Dict[str, Any],
+        market_context: Optional[Dict[str, Any]] = None
+    ) -> PriceReasonabilityResult:
+        """逐个分析单个材料，出错时返回错误结果"""
+
+        try:
+            return self.analyze_price_reasonability(
+                material_id=material_data['material_id'],
+                material_name=material_data['material_name'],
+                original_price=material_data['original_price'],
+                ai_analysis_result=material_data['ai_analysis_result'],
+                historical_data=material_data.get('historical_data'),
+                market_context=market_context
+            )
+
+        except Exception as e:
+            logger.error(f"分析材料 {material_data.get('material_id')} 时出错: {e}")
+            # 创建错误结果
+            return PriceReasonabilityResult(
+                material_id=material_data['material_id'],
+                material_name=material_data['material_name'],
+                original_price=material_data['original_price'],
+                predicted_price_min=None,
+                predicted_price_max=None,
+                predicted_price_avg=None,
+                price_status=PriceStatus.UNKNOWN,
+                risk_level=RiskLevel.MEDIUM,
+                price_variance=0,
+                analysis_details={"error": str(e)},
+                risk_factors=[f"分析过程出错: {str(e)}"],
+                recommendations=["建议人工审核"],
+                confidence_score=0.1,
+                analysis_method="error_handling",
+                created_at=datetime.utcnow()
+            )
+
+    def _vectorized_batch_analyze(
+        self,
+        materials_data: List[Dict[str, Any]],
+        market_context: Optional[Dict[str, Any]]
+    ) -> List[Optional[PriceReasonabilityResult]]:
+        """按列计算批量分析结果，需要逐个分析的材料返回 None
+
+        浮点运算的顺序与逐个分析保持一致（包括权重累加顺序、max/min 的取值规则），
+        指数函数使用 math.exp，因此数值结果逐位相同。
+        """
+
+        count = len(materials_data)
+        results: List[Optional[PriceReasonabilityResult]] = [None] * count
+        if count == 0:
+            return results
+
+        # 输入列：原价、预测下限、预测上限、预测均价、AI置信度
+        rows: List[Tuple[Any, ...]] = []
+        fallback = np.zeros(count, dtype=bool)
+        has_stat = np.zeros(count, dtype=bool)
+        stat_mean = np.full(count, np.nan)
+        stat_std = np.full(count, np.nan)
+        stat_known = np.zeros(count, dtype=bool)
+        group_stats: Dict[int, Any] = {}
+        for i, material_data in enumerate(materials_data):
             try:
-                result = self.analyze_price_reasonability(
-                    material_id=material_data['material_id'],
-                    material_name=material_data['material_name'],
-                    original_price=material_data['original_price'],
-                    ai_analysis_result=material_data['ai_analysis_result'],
-                    historical_data=material_data.get('historical_data'),
-                    market_context=market_context
+                ai_result = material_data['ai_analysis_result']
+                row = (
+                    material_data['original_price'],
+                    ai_result.get('predicted_price_min'),
+                    ai_result.get('predicted_price_max'),
+                    ai_result.get('predicted_price_avg'),
+                    ai_result.get('confidence_score', 0.5)
                 )
-                results.append(result)
-            
-            except Exception as e:
-                logger.error(f"分析材料 {material_data.get('material_id')} 时出错: {e}")
-                # 创建错误结果
-                error_result = PriceReasonabilityResult(
-                    material_id=material_data['material_id'],
-                    material_name=material_data['material_name'],
-                    original_price=material_data['original_price'],
-                    predicted_price_min=None,
-                    predicted_price_max=None,
-                    predicted_price_avg=None,
-                    price_status=PriceStatus.UNKNOWN,
-                    risk_level=RiskLevel.MEDIUM,
-                    price_variance=0,
-                    analysis_details={"error": str(e)},
-                    risk_factors=[f"分析过程出错: {str(e)}"],
-                    recommendations=["建议人工审核"],
-                    confidence_score=0.1,
-                    analysis_method="error_handling",
-                    created_at=datetime.utcnow()
+                if 'material_id' not in material_data or 'material_name' not in material_data:
+                    # 缺少标识字段时交给逐个分析处理，保持与逐个分析相同的报错
+                    raise KeyError("material_id/material_name")
+                historical_data = material_data.get('historical_data')
+            except Exception:
+                fallback[i] = True
+                rows.append(_EMPTY_ROW)
+                continue
+
+            if not {type(value) for value in row} <= _NUMERIC_TYPES or row[0] is None or row[4] is None:
+                fallback[i] = True
+                rows.append(_EMPTY_ROW)
+                continue
+            rows.append(row)
+
+            if not historical_data:
+                continue
+            has_stat[i] = True
+            # 同一份历史数据只统计一次
+            key = id(historical_data)
+            if key not in group_stats:
+                try:
+                    stats = self._historical_stats(historical_data)
+                    if stats is not None and not {type(value) for value in stats} <= _NUMERIC_TYPES:
+                        stats = _NEEDS_FALLBACK
+                except Exception:
+                    stats = _NEEDS_FALLBACK
+                group_stats[key] = stats
+            stats = group_stats[key]
+            if stats is _NEEDS_FALLBACK:
+                fallback[i] = True
+            elif stats is not None:
+                stat_known[i] = True
+                stat_mean[i], stat_std[i] = stats
+
+        table = np.array(rows, dtype=object)
+        missing = np.equal(table, None)
+        values = np.where(missing, np.nan, table).astype(float)
+        present = ~missing
+        fallback |= (present & ~np.isfinite(values)).any(axis=1)
+
+        price, predicted_min, predicted_max, predicted_avg, confidence = values.T
+        min_present, max_present, avg_present = present[:, 1], present[:, 2], present[:, 3]
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            # 1. AI预测区间对比
+            has_ai = min_present & (predicted_min != 0) & max_present & (predicted_max != 0)
+            avg_truthy = avg_present & (predicted_avg != 0)
+            in_range = has_ai & (predicted_min <= price) & (price <= predicted_max)
+            outside = has_ai & ~in_range
+            reference = np.where(avg_truthy, predicted_avg, (predicted_min + predicted_max) / 2)
+            fallback |= outside & (reference == 0)
+            ai_variance = np.where(outside, np.abs(price - reference) / reference * 100, 0.0)
+            ai_status = np.where(
+                in_range, _REASONABLE,
+                np.where(price > predicted_max, _OVERPRICED, _UNDERPRICED)
+            )
+            ai_risk = np.where(in_range, _LOW, self._variance_risk_codes(ai_variance))
+
+            # 2. 统计学分析（历史均值和标准差已按组计算）
+            fallback |= stat_known & (stat_mean == 0)
+            deviation = np.abs(price - stat_mean)
+            std_positive = stat_known & (stat_std > 0)
+            z_score = np.where(std_positive, deviation / stat_std, np.nan)
+            stat_variance = np.where(stat_known, deviation / stat_mean * 100, 0.0)
+            z_status = np.select(
+                [z_score <= 1.96, z_score <= 2.58],
+                [_REASONABLE, np.where(price > stat_mean, _OVERPRICED, _UNDERPRICED)],
+                _ABNORMAL
+            )
+            z_risk = np.select([z_score <= 1.96, z_score <= 2.58], [_LOW, _MEDIUM], _HIGH)
+            flat_reasonable = stat_variance < 5
+            stat_status = np.where(
+                ~stat_known, _UNKNOWN,
+                np.where(std_positive, z_status, np.where(flat_reasonable, _REASONABLE, _ABNORMAL))
+            )
+            stat_risk = np.where(
+                ~stat_known, _MEDIUM,
+                np.where(std_positive, z_risk, np.where(flat_reasonable, _LOW, _HIGH))
+            )
+
+            # 3. 市场趋势分析与材料价格无关，整批只计算一次
+            market_analysis = self._market_trend_analysis(None, market_context) if market_context else None
+            has_market = market_analysis is not None
+
+            # 综合：按 AI / 统计 / 市场 的顺序累加权重和加权偏差
+            total_weight = np.where(has_ai, 0.0 + 0.6, 0.0)
+            total_weight = np.where(has_stat, total_weight + 0.3, total_weight)
+            if has_market:
+                total_weight = total_weight + 0.1
+            weighted_variance = np.where(has_ai, 0.0 + ai_variance * (0.6 / total_weight), 0.0)
+            weighted_variance = np.where(
+                has_stat, weighted_variance + stat_variance * (0.3 / total_weight), weighted_variance
+            )
+            if has_market:
+                weighted_variance = weighted_variance + 0.0 * (0.1 / total_weight)
+            # 权重 AI 0.6 > 统计 0.3 + 市场 0.1，统计 0.3 > 市场 0.1，投票结果即第一个参与分析的方法的状态
+            final_status = np.where(has_ai, ai_status, np.where(has_stat, stat_status, _REASONABLE))
+
+            # 风险评分（方案A）
+            v = np.abs(weighted_variance)
+            range_sum = predicted_min + predicted_max
+            denom = np.where(avg_truthy, predicted_avg, range_sum / 2)
+            denom_truthy = avg_truthy | (min_present & max_present & (range_sum != 0) & (denom != 0))
+            width = np.where(
+                denom_truthy & min_present & max_present, (predicted_max - predicted_min) / denom, 0.0
+            )
+            width = np.where(width > 0.0, width, 0.0)
+            c = np.where(confidence != 0, confidence, 0.5)
+            direction_factor = np.where(denom_truthy & (price > denom), 1.15, 0.95)
+            exponent = -(v - 15.0) / 7.0
+            fallback |= ~np.isfinite(exponent) | ~np.isfinite(width)
+            exponent = np.where(fallback, 0.0, exponent)
+            g = 1.0 / (1.0 + np.fromiter(map(math.exp, exponent.tolist()), dtype=float, count=count))
+            h = width / 0.30
+            h = np.where(h > 0.0, h, 0.0)
+            h = np.where(h < 1.0, h, 1.0)
+            risk_score = direction_factor * (0.6 * g + 0.2 * (1.0 - c) + 0.2 * h)
+            final_risk = np.select(
+                [risk_score <= 0.25, risk_score <= 0.5, risk_score <= 0.75],
+                [_LOW, _MEDIUM, _HIGH],
+                _CRITICAL
+            )
+
+            # 最终置信度
+            method_count = has_ai.astype(int) + has_stat.astype(int) + int(has_market)
+            final_confidence = confidence + np.minimum(0.2, method_count * 0.1)
+            final_confidence = final_confidence + np.where(final_risk == _LOW, 0.1, 0.0)
+            final_confidence = final_confidence + np.where(final_risk == _CRITICAL, -0.1, 0.0)
+            final_confidence = np.where(final_confidence < 1.0, final_confidence, 1.0)
+            final_confidence = np.where(final_confidence > 0.0, final_confidence, 0.0)
+
+            fallback |= ~np.isfinite(weighted_variance) | ~np.isfinite(risk_score) | ~np.isfinite(final_confidence)
+            fallback |= std_positive & ~np.isfinite(z_score)
+
+        # 逐行输出前先转为 Python 列表，避免在循环中逐个访问 NumPy 标量
+        skip = fallback.tolist()
+        has_ai_list, in_range_list, has_stat_list = has_ai.tolist(), in_range.tolist(), has_stat.tolist()
+        stat_known_list, std_positive_list = stat_known.tolist(), std_positive.tolist()
+        ai_variance_list, ai_status_list, ai_risk_list = ai_variance.tolist(), ai_status.tolist(), ai_risk.tolist()
+        stat_variance_list, z_score_list = stat_variance.tolist(), z_score.tolist()
+        stat_status_list, stat_risk_list = stat_status.tolist(), stat_risk.tolist()
+        total_weight_list, weighted_variance_list = total_weight.tolist(), weighted_variance.tolist()
+        final_status_list, final_risk_list = final_status.tolist(), final_risk.tolist()
+        risk_score_list, final_confidence_list = risk_score.tolist(), final_confidence.tolist()
+        v_list, width_list, direction_list = v.tolist(), width.tolist(), direction_factor.tolist()
+        g_list, h_list = g.tolist(), h.tolist()
+
+        for i, material_data in enumerate(materials_data):
+            if skip[i]:
+                continue
+
+            original_price, predicted_min_value, predicted_max_value, predicted_avg_value, ai_confidence = rows[i]
+            if not (has_ai_list[i] or has_stat_list[i] or has_market):
+                results[i] = self._synthesize_analysis_results(
+                    material_data['material_id'], material_data['material_name'], original_price,
+                    predicted_min_value, predicted_max_value, predicted_avg_value, [], ai_confidence
                 )
-                results.append(error_result)
-        
+                continue
+
+            total = total_weight_list[i]
+            analysis_results = []
+            status_votes: Dict[PriceStatus, float] = {}
+            if has_ai_list[i]:
+                if in_range_list[i]:
+                    ai_analysis = {
+                        'method': 'ai_prediction_comparison',
+                        'weight': 0.6,
+                        'status': PriceStatus.REASONABLE,
+                        'risk_level': RiskLevel.LOW,
+                        'variance': 0
+                    }
+                else:
+                    status = _STATUS_VALUES[ai_status_list[i]]
+                    ai_analysis = {
+                        'method': 'ai_prediction_comparison',
+                        'weight': 0.6,
+                        'variance': ai_variance_list[i],
+                        'status': status,
+                        'direction': 'high' if status == PriceStatus.OVERPRICED else 'low',
+                        'risk_level': _RISK_VALUES[ai_risk_list[i]]
+                    }
+                analysis_results.append(ai_analysis)
+            if has_stat_list[i]:
+                stat_analysis: Dict[str, Any] = {'method': 'statistical_analysis', 'weight': 0.3}
+                if std_positive_list[i]:
+                    stat_analysis['z_score'] = z_score_list[i]
+                stat_analysis['status'] = _STATUS_VALUES[stat_status_list[i]]
+                stat_analysis['risk_level'] = _RISK_VALUES[stat_risk_list[i]]
+                if stat_known_list[i]:
+                    stat_analysis['variance'] = stat_variance_list[i]
+                analysis_results.append(stat_analysis)
+            if has_market:
+                analysis_results.append(dict(market_analysis))
+            for analysis in analysis_results:
+                status = analysis['status']
+                status_votes[status] = status_votes.get(status, 0) + analysis['weight'] / total
+
+            final_status = _STATUS_VALUES[final_status_list[i]]
+            final_risk_level = _RISK_VALUES[final_risk_list[i]]
+            weighted = weighted_variance_list[i]
+            results[i] = PriceReasonabilityResult(
+                material_id=material_data['material_id'],
+                material_name=material_data['material_name'],
+                original_price=original_price,
+                predicted_price_min=predicted_min_value,
+                predicted_price_max=predicted_max_value,
+                predicted_price_avg=predicted_avg_value,
+                price_status=final_status,
+                risk_level=final_risk_level,
+                price_variance=weighted,
+                analysis_details={
+                    'analysis_results': analysis_results,
+                    'weighted_variance': weighted,
+                    'final_risk_score': risk_score_list[i],
+                    'status_votes': status_votes,
+                    'ai_confidence': ai_confidence,
+                    'scheme': 'A',
+                    'uncertainty': {
+                        'v_abs_variance': v_list[i],
+                        'range_width_ratio': width_list[i],
+                        'direction_factor': direction_list[i],
+                        'g_variance_component': g_list[i],
+                        'h_uncertainty_component': h_list[i]
+                    }
+                },
+                risk_factors=self._generate_risk_factors(final_status, final_risk_level, weighted, ai_confidence),
+                recommendations=self._generate_recommendations(final_status, final_risk_level, weighted),
+                confidence_score=final_confidence_list[i],
+                analysis_method="综合分析",
+                created_at=datetime.utcnow()
+            )
+
         return results
 
+    def _variance_risk_codes(self, variance: np.ndarray) -> np.ndarray:
+        """按偏差阈值计算风险等级编码（与 _calculate_risk_level 一致）"""
+        return np.select(
+            [
+                variance <= self.VARIANCE_THRESHOLDS['reasonable'],
+                variance <= self.VARIANCE_THRESHOLDS['moderate'],
+                variance <= self.VARIANCE_THRESHOLDS['high']
+            ],
+            [_LOW, _MEDIUM, _HIGH],
+            _CRITICAL
+        )
+
+
+@dataclass
+class PriceDistribution:
+    """某分类+单位下的单价分布（单价已换算到单位族的基准单位）"""
+    count: int
+    median: float
+    mad: float  # 中位数绝对偏差
+    q1: float
+    q3: float
+
 
 class PriceAnomalyDetector:
-    """价格异常检测器"""
+    """价格异常检测器
+
+    材料按 分类 × 基准单位 分组，单价先换算到单位族的基准单位（如 元/t → 元/kg）；
+    所有分组的中位数、MAD 和四分位数按组排序后一次算出。IQR 边界外的材料判为异常，
+    并按稳健 Z 分数（0.6745 × |单价 - 中位数| / MAD）从高到低排序返回。
+    分组基线默认取本项目材料，也可传入预先计算的分组分布（如全部项目的同类材料）。
+    """
+    
+    MIN_GROUP_SIZE = 3  # 分组（或基线）样本数低于该值时不检测
+    MIN_PROJECT_MATERIALS = 5  # 使用项目基线时的最少材料数
+    MAD_SCALE = 0.6745  # 正态分布下 MAD / 标准差 的比值
+    DEFAULT_CATEGORY = '未分类'
     
     def __init__(self):
         self.detection_methods = [
-            'statistical_outlier',
-            'isolation_forest',
-            'local_outlier_factor'
+            'iqr_outlier',
+            'robust_z_score'
         ]
     
     def detect_price_anomalies(
         self,
         project_materials: List[Dict[str, Any]],
-        detection_sensitivity: float = 0.1  # 异常检测敏感度
+        detection_sensitivity: float = 0.1,  # 异常检测敏感度
+        baselines: Optional[Dict[Tuple[str, str], PriceDistribution]] = None
     ) -> List[Dict[str, Any]]:
-        """检测项目中的价格异常"""
+        """检测项目中的价格异常，按异常程度从高到低返回
+
+        baselines 为 (分类, 基准单位) -> 分布，提供时对应分组以其为基线，其余分组使用本项目材料。
+        """
         
-        if len(project_materials) < 5:
+        if not baselines and len(project_materials) < self.MIN_PROJECT_MATERIALS:
             logger.warning("材料数量不足，无法进行有效的异常检测")
             return []
         
-        anomalies = []
+        keys, prices, valid = self._normalized_prices(project_materials)
+        rows = np.flatnonzero(valid)
+        if not rows.size:
+            return []
         
-        # 按材料类别分组检测
-        material_groups = self._group_materials_by_category(project_materials)
+        group_index: Dict[Tuple[str, str], int] = {}
+        group_ids = np.fromiter(
+            (group_index.setdefault(keys[i], len(group_index)) for i in rows), dtype=np.int64, count=rows.size
+        )
+        values = prices[rows]
+        counts, median, mad, q1, q3 = self._group_statistics(group_ids, values, len(group_index))
+        
+        from_baseline = np.zeros(len(group_index), dtype=bool)
+        if baselines:
+            for key, group in group_index.items():
+                baseline = baselines.get(key)
+                if baseline is not None:
+                    counts[group], median[group], mad[group] = baseline.count, baseline.median, baseline.mad
+                    q1[group], q3[group] = baseline.q1, baseline.q3
+                    from_baseline[group] = True
+        
+        # IQR 边界，按敏感度外扩
+        iqr = q3 - q1
+        lower_bound = q1 - 1.5 * iqr - iqr * detection_sensitivity
+        upper_bound = q3 + 1.5 * iqr + iqr * detection_sensitivity
         
-        for category, materials in material_groups.items():
-            if len(materials) < 3:
-                continue
-            
-            # 提取价格数据
-            prices = [m['unit_price'] for m in materials if m.get('unit_price')]
-            if not prices:
-                continue
-            
-            # 统计学异常检测
-            category_anomalies = self._statistical_outlier_detection(
-                materials, prices, detection_sensitivity
-            )
-            
-            anomalies.extend(category_anomalies)
+        lower, upper = lower_bound[group_ids], upper_bound[group_ids]
+        outlier = (counts[group_ids] >= self.MIN_GROUP_SIZE) & ((values < lower) | (values > upper))
+        flagged = np.flatnonzero(outlier)
+        if not flagged.size:
+            return []
+        
+        # 稳健 Z 分数；MAD 为 0（一半以上价格相同）时偏离中位数即视为无穷大
+        group_median, group_mad = median[group_ids][flagged], mad[group_ids][flagged]
+        deviation = values[flagged] - group_median
+        with np.errstate(divide='ignore', invalid='ignore'):
+            robust_z = np.where(group_mad > 0, self.MAD_SCALE * deviation / group_mad, np.copysign(np.inf, deviation))
+            relative = np.abs(deviation) / np.abs(group_median)
+        order = np.lexsort((-np.nan_to_num(relative, nan=0.0), -np.abs(robust_z)))
+        
+        group_keys = list(group_index)
+        anomalies = []
+        for rank, (position, z_value) in enumerate(zip(flagged[order].tolist(), robust_z[order].tolist()), start=1):
+            material = project_materials[rows[position]]
+            group = int(group_ids[position])
+            price = float(values[position])
+            lower_value, upper_value = float(lower[position]), float(upper[position])
+            anomalies.append({
+                'material_id': material['id'],
+                'material_name': material['material_name'],
+                'unit_price': material.get('unit_price'),
+                'anomaly_type': 'price_outlier',
+                'severity': 'high' if (price < lower_value * 0.5 or price > upper_value * 2) else 'medium',
+                # 边界、中位数和 MAD 均为基准单位下的单价
+                'bounds': {
+                    'lower': lower_value,
+                    'upper': upper_value
+                },
+                'category': group_keys[group][0],
+                'unit': material.get('unit'),
+                'normalized_unit': group_keys[group][1],
+                'normalized_price': price,
+                'median': float(median[group]),
+                'mad': float(mad[group]),
+                'robust_z': z_value if math.isfinite(z_value) else None,
+                'baseline': 'portfolio' if from_baseline[group] else 'project',
+                'rank': rank
+            })
         
         return anomalies
     
-    def _group_materials_by_category(
+    def compute_distributions(
         self,
         materials: List[Dict[str, Any]]
-    ) -> Dict[str, List[Dict[str, Any]]]:
-        """按类别分组材料"""
-        
-        groups = {}
+    ) -> Dict[Tuple[str, str], PriceDistribution]:
+        """按 (分类, 基准单位) 计算单价分布，可作为其他项目检测时的基线"""
         
-        for material in materials:
-            category = material.get('category', '未分类')
-            if category not in groups:
-                groups[category] = []
-            groups[category].append(material)
+        keys, prices, valid = self._normalized_prices(materials)
+        rows = np.flatnonzero(valid)
+        if not rows.size:
+            return {}
         
-        return groups
+        group_index: Dict[Tuple[str, str], int] = {}
+        group_ids = np.fromiter(
+            (group_index.setdefault(keys[i], len(group_index)) for i in rows), dtype=np.int64, count=rows.size
+        )
+        counts, median, mad, q1, q3 = self._group_statistics(group_ids, prices[rows], len(group_index))
+        return {
+            key: PriceDistribution(
+                count=int(counts[group]),
+                median=float(median[group]),
+                mad=float(mad[group]),
+                q1=float(q1[group]),
+                q3=float(q3[group])
+            )
+            for key, group in group_index.items()
+        }
     
-    def _statistical_outlier_detection(
+    def _normalized_prices(
         self,
-        materials: List[Dict[str, Any]],
-        prices: List[float],
-        sensitivity: float
-    ) -> List[Dict[str, Any]]:
-        """统计学异常检测"""
-        
-        if len(prices) < 3:
-            return []
-        
-        # 计算四分位数和IQR
-        q1 = np.percentile(prices, 25)
-        q3 = np.percentile(prices, 75)
-        iqr = q3 - q1
-        
-        # 计算异常边界
-        lower_bound = q1 - 1.5 * iqr
-        upper_bound = q3 + 1.5 * iqr
-        
-        # 根据敏感度调整边界
-        range_adjustment = iqr * sensitivity
-        lower_bound -= range_adjustment
-        upper_bound += range_adjustment
-        
-        anomalies = []
-        
+        materials: List[Dict[str, Any]]
+    ) -> Tuple[List[Tuple[str, str]], np.ndarray, np.ndarray]:
+        """分组键 (分类, 基准单位)、换算到基准单位的单价，以及单价是否有效"""
+        
+        keys: List[Tuple[str, str]] = []
+        units: List[str] = []
+        targets: List[str] = []
+        specifications: List[str] = []
+        raw_prices: List[float] = []
         for material in materials:
+            unit = normalize_unit(material.get('unit') or '')
+            target = canonical_unit(unit)
+            keys.append((material.get('category') or self.DEFAULT_CATEGORY, target))
+            units.append(unit)
+            targets.append(target)
+            specifications.append(material.get('specification') or '')
             price = material.get('unit_price')
-            if price and (price < lower_bound or price > upper_bound):
-                anomaly = {
-                    'material_id': material['id'],
-                    'material_name': material['material_name'],
-                    'unit_price': price,
-                    'anomaly_type': 'price_outlier',
-                    'severity': 'high' if (price < lower_bound * 0.5 or price > upper_bound * 2) else 'medium',
-                    'bounds': {
-                        'lower': lower_bound,
-                        'upper': upper_bound
-                    },
-                    'category': material.get('category', '未分类')
-                }
-                anomalies.append(anomaly)
-        
-        return anomalies
+            raw_prices.append(float(price) if price else np.nan)
+        
+        prices = np.asarray(raw_prices, dtype=float)
+        converted = np.flatnonzero(np.array([unit != target for unit, target in zip(units, targets)], dtype=bool))
+        if converted.size:
+            prices[converted], _ = convert_unit_prices(
+                prices[converted],
+                [units[i] for i in converted],
+                [targets[i] for i in converted],
+                [specifications[i] for i in converted]
+            )
+        return keys, prices, np.isfinite(prices)
+    
+    def _group_statistics(
+        self,
+        group_ids: np.ndarray,
+        values: np.ndarray,
+        group_count: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """各分组的样本数、中位数、MAD、Q1、Q3（每个分组至少一个样本）"""
+        
+        counts = np.bincount(group_ids, minlength=group_count)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        
+        ordered = values[np.lexsort((values, group_ids))]
+        q1 = self._group_quantile(ordered, starts, counts, 0.25)
+        median = self._group_quantile(ordered, starts, counts, 0.5)
+        q3 = self._group_quantile(ordered, starts, counts, 0.75)
+        
+        deviations = np.abs(values - median[group_ids])
+        mad = self._group_quantile(deviations[np.lexsort((deviations, group_ids))], starts, counts, 0.5)
+        return counts, median, mad, q1, q3
+    
+    @staticmethod
+    def _group_quantile(ordered: np.ndarray, starts: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+        """按组排好序的数组中各组的分位数（线性插值，与 np.percentile 默认方法一致）"""
+        
+        position = q * (counts - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, counts - 1)
+        fraction = position - lower
+        low_values = ordered[starts + lower]
+        high_values = ordered[starts + upper]
+        difference = high_values - low_values
+        return np.where(
+            fraction >= 0.5,
+            high_values - difference * (1 - fraction),
+            low_values + difference * fraction
+        )
@@ -0,0 +1,123 @@
+"""流式JSON扫描工具。
+
+逐块接收大模型流式输出，跟踪第一个顶层JSON对象的括号深度，用于：
+- 顶层对象闭合后立即停止读取（忽略之后的多余输出）；
+- `price_range` 对象完整输出后立即提取并校验，尽早发现无效结果；
+- 估算没有返回用量统计的流式响应的token数。
+"""
+from __future__ import annotations
+
+import json
+import math
+import re
+from typing import Any, Dict, List, Optional
+
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+
+class IncrementalJSONScanner:
+    """增量扫描第一个顶层JSON对象"""
+
+    def __init__(self, watch_key: str = "price_range"):
+        self.watch_key = watch_key
+        self.completed = False
+        self.watched_value: Optional[Dict[str, Any]] = None
+
+        self._buffer: List[str] = []
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_chars: List[str] = []
+        self._last_string: Optional[str] = None
+        self._current_key: Optional[str] = None
+        self._watch_start: Optional[int] = None
+        self._length = 0
+
+    @property
+    def json_text(self) -> str:
+        """已扫描到的JSON文本（从第一个 '{' 开始）"""
+        return "".join(self._buffer)
+
+    def feed(self, chunk: str) -> None:
+        """输入一段文本；顶层对象闭合后忽略后续内容"""
+        for char in chunk:
+            if self.completed:
+                return
+            if not self._started:
+                if char != "{":
+                    continue
+                self._started = True
+
+            self._buffer.append(char)
+            self._length += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = "".join(self._string_chars)
+                else:
+                    self._string_chars.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_chars = []
+            elif char == ":":
+                # 顶层对象中紧跟冒号的字符串为键名
+                if self._depth == 1:
+                    self._current_key = self._last_string
+            elif char in "{[":
+                self._depth += 1
+                if char == "{" and self._depth == 2 and self._current_key == self.watch_key:
+                    self._watch_start = self._length - 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._watch_start is not None and char == "}":
+                    self._capture_watched()
+                elif self._depth == 0:
+                    self.completed = True
+            elif char == "," and self._depth == 1:
+                self._current_key = None
+
+    def _capture_watched(self) -> None:
+        text = self.json_text[self._watch_start:]
+        self._watch_start = None
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            return
+        if isinstance(value, dict):
+            self.watched_value = value
+
+
+def is_numeric_price_range(price_range: Dict[str, Any]) -> bool:
+    """价格区间的最低价和最高价是否都是数字（"4200" 之类的字符串属于格式问题，不算无效价格）"""
+    values = (price_range.get("min_price"), price_range.get("max_price"))
+    return all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values)
+
+
+def validate_price_range(price_range: Dict[str, Any]) -> Optional[str]:
+    """校验价格区间，返回错误说明，合法时返回None"""
+    min_price = price_range.get("min_price")
+    max_price = price_range.get("max_price")
+    if not is_numeric_price_range(price_range):
+        return f"价格区间不是数字: {price_range}"
+    if min_price <= 0 or max_price <= 0:
+        return f"价格区间必须为正数: {price_range}"
+    if min_price > max_price:
+        return f"最低价高于最高价: {price_range}"
+    return None
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中文字符及全角标点按每字1个token，其余字符按每4个字符1个token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
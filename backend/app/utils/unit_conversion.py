@@ -1,12 +1,18 @@
 """单位换算工具。
 
 提供单位标准化、量值换算与单价换算能力，用于在分析环节对齐项目材料与市场信息价材料的计量单位。
+单位族和换算系数在导入时编译为 (from_unit, to_unit) -> 系数 的查找表，
+单位标准化、规格面积解析和单价换算方式解析均有容量受限的 LRU 缓存，
+convert_unit_prices 可对整批价格按数组换算。
 """
 from __future__ import annotations
 
 import re
 from decimal import Decimal
-from typing import Dict, Optional
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, Optional, Sequence, Set, Tuple
+
+import numpy as np
 
 # 基础单位组定义，值表示 1 个该单位折算到基准单位（长度:m、面积:m²、体积:m³、重量:kg）
 _UNIT_FACTORS: Dict[str, Dict[str, Decimal]] = {
@@ -95,6 +101,35 @@ _UNIT_ALIASES: Dict[str, str] = {
 }
 
 
+# 编译后的查找表：单位 -> 单位族；(from_unit, to_unit) -> 1 个 from_unit 等于多少个 to_unit
+_UNIT_FAMILIES: Dict[str, str] = {
+    unit: family
+    for family, factors in _UNIT_FACTORS.items()
+    for unit in factors
+}
+_CONVERSION_FACTORS: Dict[Tuple[str, str], Decimal] = {
+    (from_unit, to_unit): factor_from / factor_to
+    for factors in _UNIT_FACTORS.values()
+    for from_unit, factor_from in factors.items()
+    for to_unit, factor_to in factors.items()
+}
+
+# 单位族的基准单位（换算系数为 1 的单位）
+_FAMILY_BASE_UNITS: Dict[str, str] = {
+    family: next(unit for unit, factor in factors.items() if factor == 1)
+    for family, factors in _UNIT_FACTORS.items()
+}
+
+_SHEET_UNITS = frozenset(["张", "块", "片"])
+_AREA_UNITS = frozenset(["m²", "m2", "㎡", "平方米", "平米"])
+_SHEET_SIZE_PATTERN = re.compile(r"(\d+(?:\.\d+)?)[xX\*×](\d+(?:\.\d+)?)(?:[xX\*×](\d+(?:\.\d+)?))?")
+
+_UNIT_CACHE_SIZE = 1024
+_SPEC_CACHE_SIZE = 8192
+_CONVERSION_CACHE_SIZE = 16384
+
+
+@lru_cache(maxsize=_UNIT_CACHE_SIZE)
 def normalize_unit(unit: str) -> str:
     """标准化单位表示，未知单位返回小写去空格形式。"""
     if not unit:
@@ -112,11 +147,38 @@ def normalize_unit(unit: str) -> str:
     return cleaned.lower()
 
 
+def _build_unit_spellings() -> Dict[str, FrozenSet[str]]:
+    spellings: Dict[str, Set[str]] = {}
+    for alias, normalized in _UNIT_ALIASES.items():
+        spellings.setdefault(normalized, {normalized.lower()}).add(alias.strip().lower())
+    return {normalized: frozenset(values) for normalized, values in spellings.items()}
+
+
+_UNIT_SPELLINGS = _build_unit_spellings()
+
+
+def unit_spellings(normalized_units: Iterable[str]) -> Set[str]:
+    """标准化单位的全部写法（小写、去空格），用于在数据库中按 lower(trim(unit)) 预筛选。
+
+    normalize_unit(u) 属于 normalized_units 时，u 去空格后的小写形式一定在返回集合中。
+    """
+    result: Set[str] = set()
+    for normalized in normalized_units:
+        if normalized:
+            result |= _UNIT_SPELLINGS.get(normalized, frozenset((normalized.lower(),)))
+    return result
+
+
+@lru_cache(maxsize=_UNIT_CACHE_SIZE)
+def canonical_unit(unit: str) -> str:
+    """单位所属单位族的基准单位（m、m²、m³、kg），不属于任何单位族时返回标准化后的单位。"""
+    normalized = normalize_unit(unit)
+    family = _UNIT_FAMILIES.get(normalized)
+    return _FAMILY_BASE_UNITS[family] if family else normalized
+
+
 def _find_unit_family(unit: str) -> Optional[str]:
-    for family, factors in _UNIT_FACTORS.items():
-        if unit in factors:
-            return family
-    return None
+    return _UNIT_FAMILIES.get(unit)
 
 
 def can_convert_units(unit1: str, unit2: str) -> bool:
@@ -130,15 +192,9 @@ def can_convert_units(unit1: str, unit2: str) -> bool:
 
 def get_conversion_factor(from_unit: str, to_unit: str) -> Optional[Decimal]:
     """计算 1 个 from_unit 等于多少个 to_unit。无法换算返回 None。"""
-    if not can_convert_units(from_unit, to_unit):
+    if not from_unit or not to_unit:
         return None
-    family = _find_unit_family(from_unit)
-    assert family is not None
-    factors = _UNIT_FACTORS[family]
-    # from/to 均在 factors 中
-    factor_from = factors[from_unit]
-    factor_to = factors[to_unit]
-    return factor_from / factor_to
+    return _CONVERSION_FACTORS.get((from_unit, to_unit))
 
 
 def convert_quantity(value: Decimal, from_unit: str, to_unit: str) -> Optional[Decimal]:
@@ -167,6 +223,7 @@ def convert_price_to_target_unit(price: Decimal, original_unit: str, target_unit
     return convert_unit_price(price, original_unit, target_unit)
 
 
+@lru_cache(maxsize=_SPEC_CACHE_SIZE)
 def _calculate_sheet_area(specification: str) -> Optional[Decimal]:
     """
     从规格字符串中解析板材面积（平方米）。
@@ -182,8 +239,7 @@ def _calculate_sheet_area(specification: str) -> Optional[Decimal]:
     # 尝试匹配两个或三个数字，由分隔符连接
     # 例如: 2440×1220×12
     # 匹配模式：数字[xX*×]数字...
-    pattern = r"(\d+(?:\.\d+)?)[xX\*×](\d+(?:\.\d+)?)(?:[xX\*×](\d+(?:\.\d+)?))?"
-    match = re.search(pattern, spec)
+    match = _SHEET_SIZE_PATTERN.search(spec)
     
     if match:
         try:
@@ -212,50 +268,103 @@ def _calculate_sheet_area(specification: str) -> Optional[Decimal]:
     return None
 
 
-def convert_unit_price_with_spec(
-    price: Decimal, 
-    from_unit: str, 
-    to_unit: str, 
+@lru_cache(maxsize=_CONVERSION_CACHE_SIZE)
+def resolve_price_conversion(
+    from_unit: str,
+    to_unit: str,
     specification: str = ""
-) -> Optional[Decimal]:
+) -> Optional[Tuple[str, Decimal]]:
     """
-    带规格参数的单价换算。
-    优先尝试基于规格的特殊换算（如 张 -> m²），
-    如果无法进行特殊换算，则回退到通用单位换算。
+    解析带规格的单价换算方式，返回 ("div", 系数) 或 ("mul", 系数)，无法换算返回 None。
+    换算后单价 = 单价 / 系数（div）或 单价 * 系数（mul），与 convert_unit_price_with_spec 一致，
+    便于批量换算时按单位组合只解析一次。
     """
     norm_from = normalize_unit(from_unit)
     norm_to = normalize_unit(to_unit)
     
     # 特殊换算：张 -> m² / m2
     # 扩展支持其他类似“张”的计数单位，如“块”、“片”
-    sheet_units = ["张", "块", "片"]
-    area_units = ["m²", "m2", "㎡", "平方米", "平米"]
-    
-    if norm_from in sheet_units and norm_to in area_units:
+    if norm_from in _SHEET_UNITS and norm_to in _AREA_UNITS:
         area = _calculate_sheet_area(specification)
         if area and area > 0:
             # 1 张 = area m²
             # 单价换算：元/张 / (area m²/张) = 元/m²
-            return price / area
+            return "div", area
             
     # 特殊换算：m² -> 张
-    if norm_from in area_units and norm_to in sheet_units:
+    if norm_from in _AREA_UNITS and norm_to in _SHEET_UNITS:
         area = _calculate_sheet_area(specification)
         if area and area > 0:
             # 1 张 = area m²
             # 单价换算：元/m² * (area m²/张) = 元/张
-            return price * area
+            return "mul", area
 
     # 回退到通用换算
-    return convert_unit_price(price, from_unit, to_unit)
+    factor = get_conversion_factor(from_unit, to_unit)
+    if factor is None or factor == 0:
+        return None
+    return "div", factor
+
+
+def convert_unit_price_with_spec(
+    price: Decimal, 
+    from_unit: str, 
+    to_unit: str, 
+    specification: str = ""
+) -> Optional[Decimal]:
+    """
+    带规格参数的单价换算。
+    优先尝试基于规格的特殊换算（如 张 -> m²），
+    如果无法进行特殊换算，则回退到通用单位换算。
+    """
+    conversion = resolve_price_conversion(from_unit, to_unit, specification)
+    if conversion is None:
+        return None
+    operation, factor = conversion
+    return price * factor if operation == "mul" else price / factor
+
+
+def convert_unit_prices(
+    prices: Sequence[float],
+    from_units: Sequence[str],
+    to_units: Sequence[str],
+    specifications: Optional[Sequence[str]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    批量单价换算（浮点数组），逐项语义与 convert_unit_price_with_spec 一致。
+    换算方式按 (原单位, 目标单位, 规格) 组合只解析一次。
+    返回 (换算后价格, 是否可换算)，不可换算的位置价格为 NaN。
+    """
+    count = len(prices)
+    specifications = specifications if specifications is not None else [""] * count
+    multiply = np.zeros(count, dtype=bool)
+    factors = np.full(count, np.nan)
+
+    resolved: Dict[Tuple[str, str, str], Optional[Tuple[str, Decimal]]] = {}
+    for index, key in enumerate(zip(from_units, to_units, specifications)):
+        key = (key[0] or "", key[1] or "", key[2] or "")
+        if key not in resolved:
+            resolved[key] = resolve_price_conversion(*key)
+        conversion = resolved[key]
+        if conversion is not None:
+            multiply[index] = conversion[0] == "mul"
+            factors[index] = float(conversion[1])
+
+    values = np.asarray(prices, dtype=float)
+    valid = ~np.isnan(factors)
+    converted = np.where(multiply, values * factors, values / np.where(valid, factors, 1.0))
+    return np.where(valid, converted, np.nan), valid
 
 
 __all__ = [
     "normalize_unit",
+    "canonical_unit",
     "can_convert_units",
     "get_conversion_factor",
     "convert_quantity",
     "convert_unit_price",
     "convert_price_to_target_unit",
     "convert_unit_price_with_spec",
+    "resolve_price_conversion",
+    "convert_unit_prices",
 ]
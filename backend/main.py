@@ -1,7 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from loguru import logger
@@ -18,6 +18,9 @@ from app.core.middleware import (
 )
 from app.core.error_handlers import register_exception_handlers
 from app.api.router import api_router
+from app.services.ai_analysis import close_ai_clients
+from app.services.ai_telemetry import ai_telemetry
+from app.services.render_pool import shutdown_render_pool
 
 # 配置日志
 logger.remove()
@@ -58,6 +61,8 @@ async def lifespan(app: FastAPI):
     finally:
         # 关闭时执行
         logger.info("🔄 正在关闭应用...")
+        await close_ai_clients()
+        shutdown_render_pool()
 
 
 def create_app() -> FastAPI:
@@ -241,9 +246,17 @@ def create_app() -> FastAPI:
                 "rate_limit": settings.API_RATE_LIMIT,
                 "max_file_size": settings.MAX_FILE_SIZE,
                 "ai_timeout": settings.AI_TIMEOUT
-            }
+            },
+            "ai_services": ai_telemetry.window_stats(3600)["series"]
         }
     
+    @app.get("/metrics/ai", response_class=PlainTextResponse)
+    async def ai_metrics():
+        """AI服务调用指标（Prometheus文本格式）"""
+        if not settings.AI_TELEMETRY_EXPORT_ENABLED:
+            return PlainTextResponse("# AI metrics export disabled\n", status_code=404)
+        return PlainTextResponse(ai_telemetry.prometheus_text(), media_type="text/plain; version=0.0.4")
+    
     return app
 
 
@@ -0,0 +1,68 @@
+"""Add analysis_jobs table for resumable price analysis jobs
+
+Revision ID: a1c4e7b9d2f3
+Revises: 9d4e5f6a7b8c
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "a1c4e7b9d2f3"
+down_revision = "9d4e5f6a7b8c"
+branch_labels = None
+depends_on = None
+
+
+analysis_job_status = sa.Enum(
+    "QUEUED", "RUNNING", "COMPLETED", "FAILED", name="analysisjobstatus"
+)
+
+
+def upgrade() -> None:
+    """Create analysis_jobs table."""
+    op.create_table(
+        "analysis_jobs",
+        sa.Column("id", sa.Integer(), primary_key=True, index=True),
+        sa.Column(
+            "project_id",
+            sa.Integer(),
+            sa.ForeignKey("projects.id", ondelete="CASCADE"),
+            nullable=False,
+            comment="项目ID",
+        ),
+        sa.Column("task_id", sa.String(length=100), nullable=True, comment="Celery任务ID"),
+        sa.Column("status", analysis_job_status, nullable=True, comment="任务状态"),
+        sa.Column("material_ids", sa.JSON(), nullable=False, comment="待分析材料ID列表"),
+        sa.Column("preferred_provider", sa.String(length=50), nullable=True, comment="首选AI服务提供商"),
+        sa.Column("force_reanalyze", sa.Boolean(), nullable=True, comment="是否强制重新分析"),
+        sa.Column("total_count", sa.Integer(), nullable=True, comment="材料总数"),
+        sa.Column("done_count", sa.Integer(), nullable=True, comment="已成功数量"),
+        sa.Column("failed_count", sa.Integer(), nullable=True, comment="失败数量"),
+        sa.Column("resumed_count", sa.Integer(), nullable=True, comment="本次运行开始时已处理的数量"),
+        sa.Column("attempts", sa.Integer(), nullable=True, comment="运行（含恢复）次数"),
+        sa.Column("error_message", sa.Text(), nullable=True, comment="任务级错误信息"),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.func.now(),
+            nullable=True,
+            comment="创建时间",
+        ),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=True, comment="本次运行开始时间"),
+        sa.Column("heartbeat_at", sa.DateTime(timezone=True), nullable=True, comment="最近一次进度上报时间"),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True, comment="完成时间"),
+    )
+
+    op.create_index("ix_analysis_jobs_project", "analysis_jobs", ["project_id"])
+    op.create_index("ix_analysis_jobs_status", "analysis_jobs", ["status"])
+
+
+def downgrade() -> None:
+    """Drop analysis_jobs table."""
+    op.drop_index("ix_analysis_jobs_status", table_name="analysis_jobs")
+    op.drop_index("ix_analysis_jobs_project", table_name="analysis_jobs")
+    op.drop_table("analysis_jobs")
+    analysis_job_status.drop(op.get_bind(), checkfirst=True)
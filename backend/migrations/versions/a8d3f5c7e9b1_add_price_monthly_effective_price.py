@@ -0,0 +1,92 @@
+"""Add effective price and per-field counts to material_price_monthly
+
+Revision ID: a8d3f5c7e9b1
+Revises: f4b1d8e3a6c2
+Create Date: 2026-10-19 08:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "a8d3f5c7e9b1"
+down_revision = "f4b1d8e3a6c2"
+branch_labels = None
+depends_on = None
+
+
+COUNT_COLUMNS = (
+    ("price_count", "单价非空的条数"),
+    ("price_including_tax_count", "含税信息价非空的条数"),
+    ("price_excluding_tax_count", "除税信息价非空的条数"),
+    ("effective_count", "有效单价非空的条数"),
+)
+
+# 与 app/services/price_rollup.py 的汇总口径一致
+REBUILD_ROLLUP_SQL = r"""
+INSERT INTO material_price_monthly (
+    identity_key, material_code, name, specification, unit, region, province,
+    price_type, month, price, price_including_tax, price_excluding_tax, effective_price,
+    sample_count, price_count, price_including_tax_count, price_excluding_tax_count, effective_count
+)
+SELECT
+    identity_key, MAX(material_code), MAX(name), MAX(specification), unit, region, MAX(province),
+    price_type, month, AVG(price), AVG(price_including_tax), AVG(price_excluding_tax), AVG(effective_price),
+    COUNT(*), COUNT(price), COUNT(price_including_tax), COUNT(price_excluding_tax), COUNT(effective_price)
+FROM (
+    SELECT
+        CASE WHEN COALESCE(material_code, '') <> ''
+            THEN 'code:' || material_code
+            ELSE 'name:' || name || chr(31) || COALESCE(specification, '')
+        END AS identity_key,
+        NULLIF(COALESCE(material_code, ''), '') AS material_code,
+        name,
+        COALESCE(specification, '') AS specification,
+        unit,
+        region,
+        province,
+        COALESCE(price_type, '') AS price_type,
+        CASE WHEN price_date ~ '^\s*(\d{4})\s*[-/.年]\s*(0?[1-9]|1[0-2])\s*月?\s*$'
+            THEN split_part(regexp_replace(price_date, '^\s*(\d{4})\s*[-/.年]\s*(0?[1-9]|1[0-2])\s*月?\s*$', '\1-\2'), '-', 1)
+                || '-'
+                || lpad(split_part(regexp_replace(price_date, '^\s*(\d{4})\s*[-/.年]\s*(0?[1-9]|1[0-2])\s*月?\s*$', '\1-\2'), '-', 2), 2, '0')
+            ELSE to_char(effective_date, 'YYYY-MM')
+        END AS month,
+        price,
+        price_including_tax,
+        price_excluding_tax,
+        COALESCE(NULLIF(price_excluding_tax, 0), price) AS effective_price
+    FROM base_materials
+) src
+WHERE month IS NOT NULL
+GROUP BY identity_key, unit, region, price_type, month
+"""
+
+
+def upgrade() -> None:
+    """Add effective_price and per-field non-null counts, then rebuild the rollup."""
+    op.add_column(
+        "material_price_monthly",
+        sa.Column(
+            "effective_price",
+            sa.Float(),
+            nullable=True,
+            comment="有效单价均值（每条优先取除税价，无除税价时取单价）",
+        ),
+    )
+    for name, comment in COUNT_COLUMNS:
+        op.add_column(
+            "material_price_monthly",
+            sa.Column(name, sa.Integer(), nullable=False, server_default="0", comment=comment),
+        )
+
+    op.execute("DELETE FROM material_price_monthly")
+    op.execute(REBUILD_ROLLUP_SQL)
+
+
+def downgrade() -> None:
+    """Drop effective_price and the per-field counts."""
+    for name, _ in reversed(COUNT_COLUMNS):
+        op.drop_column("material_price_monthly", name)
+    op.drop_column("material_price_monthly", "effective_price")
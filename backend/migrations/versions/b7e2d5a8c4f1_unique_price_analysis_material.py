@@ -0,0 +1,43 @@
+"""Deduplicate price_analyses and make material_id unique
+
+Revision ID: b7e2d5a8c4f1
+Revises: a1c4e7b9d2f3
+Create Date: 2026-10-19 00:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b7e2d5a8c4f1"
+down_revision = "a1c4e7b9d2f3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Keep the newest analysis per material and add a unique index."""
+    # 每个材料只保留最新（id最大）的一条分析记录
+    op.execute(
+        """
+        DELETE FROM price_analyses a
+        USING price_analyses b
+        WHERE a.material_id = b.material_id
+          AND a.id < b.id
+        """
+    )
+
+    op.drop_index("ix_price_analyses_material", table_name="price_analyses")
+    op.create_index(
+        "ix_price_analyses_material",
+        "price_analyses",
+        ["material_id"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    """Restore the non-unique material index."""
+    op.drop_index("ix_price_analyses_material", table_name="price_analyses")
+    op.create_index("ix_price_analyses_material", "price_analyses", ["material_id"])
@@ -0,0 +1,103 @@
+"""Add material_price_monthly rollup table
+
+Revision ID: c3f8a1d6e2b9
+Revises: b7e2d5a8c4f1
+Create Date: 2026-10-19 00:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c3f8a1d6e2b9"
+down_revision = "b7e2d5a8c4f1"
+branch_labels = None
+depends_on = None
+
+
+# 与 app/services/price_rollup.py 的汇总口径一致
+INITIAL_ROLLUP_SQL = r"""
+INSERT INTO material_price_monthly (
+    identity_key, material_code, name, specification, unit, region, province,
+    price_type, month, price, price_including_tax, price_excluding_tax, sample_count
+)
+SELECT
+    identity_key, MAX(material_code), MAX(name), MAX(specification), unit, region, MAX(province),
+    price_type, month, AVG(price), AVG(price_including_tax), AVG(price_excluding_tax), COUNT(*)
+FROM (
+    SELECT
+        CASE WHEN COALESCE(material_code, '') <> ''
+            THEN 'code:' || material_code
+            ELSE 'name:' || name || chr(31) || COALESCE(specification, '')
+        END AS identity_key,
+        NULLIF(COALESCE(material_code, ''), '') AS material_code,
+        name,
+        COALESCE(specification, '') AS specification,
+        unit,
+        region,
+        province,
+        COALESCE(price_type, '') AS price_type,
+        CASE WHEN price_date ~ '^\s*(\d{4})\s*[-/.年]\s*(0?[1-9]|1[0-2])\s*月?\s*$'
+            THEN split_part(regexp_replace(price_date, '^\s*(\d{4})\s*[-/.年]\s*(0?[1-9]|1[0-2])\s*月?\s*$', '\1-\2'), '-', 1)
+                || '-'
+                || lpad(split_part(regexp_replace(price_date, '^\s*(\d{4})\s*[-/.年]\s*(0?[1-9]|1[0-2])\s*月?\s*$', '\1-\2'), '-', 2), 2, '0')
+            ELSE to_char(effective_date, 'YYYY-MM')
+        END AS month,
+        price,
+        price_including_tax,
+        price_excluding_tax
+    FROM base_materials
+) src
+WHERE month IS NOT NULL
+GROUP BY identity_key, unit, region, price_type, month
+"""
+
+
+def upgrade() -> None:
+    """Create material_price_monthly and populate it from base_materials."""
+    op.create_table(
+        "material_price_monthly",
+        sa.Column("id", sa.Integer(), primary_key=True, index=True),
+        sa.Column("identity_key", sa.Text(), nullable=False, comment="材料标识（有编码为 code:编码，否则为 name:名称+规格）"),
+        sa.Column("material_code", sa.String(length=50), nullable=True, comment="材料编码"),
+        sa.Column("name", sa.String(length=200), nullable=False, comment="材料名称"),
+        sa.Column("specification", sa.Text(), nullable=False, comment="规格型号"),
+        sa.Column("unit", sa.String(length=20), nullable=False, comment="计量单位"),
+        sa.Column("region", sa.String(length=100), nullable=False, comment="适用地区"),
+        sa.Column("province", sa.String(length=50), nullable=True, comment="省份"),
+        sa.Column("price_type", sa.String(length=20), nullable=False, comment="信息价类型 (provincial/municipal)"),
+        sa.Column("month", sa.String(length=7), nullable=False, comment="月份 (YYYY-MM)"),
+        sa.Column("price", sa.Float(), nullable=True, comment="单价均值"),
+        sa.Column("price_including_tax", sa.Float(), nullable=True, comment="含税信息价均值"),
+        sa.Column("price_excluding_tax", sa.Float(), nullable=True, comment="除税信息价均值"),
+        sa.Column("sample_count", sa.Integer(), nullable=False, comment="汇总的基准材料条数"),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.func.now(),
+            nullable=True,
+            comment="更新时间",
+        ),
+    )
+
+    op.create_index(
+        "ux_material_price_monthly_grain",
+        "material_price_monthly",
+        ["identity_key", "unit", "region", "price_type", "month"],
+        unique=True,
+    )
+    op.create_index("ix_material_price_monthly_code", "material_price_monthly", ["material_code"])
+    op.create_index("ix_material_price_monthly_name", "material_price_monthly", ["name"])
+    op.create_index("ix_material_price_monthly_month", "material_price_monthly", ["month"])
+
+    op.execute(INITIAL_ROLLUP_SQL)
+
+
+def downgrade() -> None:
+    """Drop material_price_monthly."""
+    op.drop_index("ix_material_price_monthly_month", table_name="material_price_monthly")
+    op.drop_index("ix_material_price_monthly_name", table_name="material_price_monthly")
+    op.drop_index("ix_material_price_monthly_code", table_name="material_price_monthly")
+    op.drop_index("ux_material_price_monthly_grain", table_name="material_price_monthly")
+    op.drop_table("material_price_monthly")
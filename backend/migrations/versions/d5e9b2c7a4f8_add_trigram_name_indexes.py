@@ -0,0 +1,43 @@
+"""Add pg_trgm indexes for material name substring search
+
+Revision ID: d5e9b2c7a4f8
+Revises: c3f8a1d6e2b9
+Create Date: 2026-10-19 00:30:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "d5e9b2c7a4f8"
+down_revision = "c3f8a1d6e2b9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Enable pg_trgm and index material names for ILIKE '%...%' lookups."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # 合理性分析按名称模糊匹配历史月度价格
+    op.create_index(
+        "ix_material_price_monthly_name_trgm",
+        "material_price_monthly",
+        ["name"],
+        postgresql_using="gin",
+        postgresql_ops={"name": "gin_trgm_ops"},
+    )
+    # 基准材料列表和匹配的名称模糊搜索
+    op.create_index(
+        "ix_base_materials_name_trgm",
+        "base_materials",
+        ["name"],
+        postgresql_using="gin",
+        postgresql_ops={"name": "gin_trgm_ops"},
+    )
+
+
+def downgrade() -> None:
+    """Drop the trigram indexes (the pg_trgm extension is left installed)."""
+    op.drop_index("ix_base_materials_name_trgm", table_name="base_materials")
+    op.drop_index("ix_material_price_monthly_name_trgm", table_name="material_price_monthly")
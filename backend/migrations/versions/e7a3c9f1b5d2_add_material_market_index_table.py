@@ -0,0 +1,57 @@
+"""Add material_market_index table
+
+Revision ID: e7a3c9f1b5d2
+Revises: d5e9b2c7a4f8
+Create Date: 2026-10-19 00:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e7a3c9f1b5d2"
+down_revision = "d5e9b2c7a4f8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Create material_market_index (populate via POST /api/v1/base-materials/market-index/rebuild)."""
+    op.create_table(
+        "material_market_index",
+        sa.Column("id", sa.Integer(), primary_key=True, index=True),
+        sa.Column("region", sa.String(length=100), nullable=False, comment="适用地区"),
+        sa.Column("category", sa.String(length=100), nullable=False, comment="材料分类（全部 表示地区内全部材料）"),
+        sa.Column("month", sa.String(length=7), nullable=False, comment="月份 (YYYY-MM)"),
+        sa.Column("index_value", sa.Float(), nullable=False, comment="价格指数（序列首月为100）"),
+        sa.Column("mom_change", sa.Float(), nullable=True, comment="环比变化率（无可比材料时为空）"),
+        sa.Column("yoy_change", sa.Float(), nullable=True, comment="同比变化率（无12个月前指数时为空）"),
+        sa.Column("trend", sa.String(length=20), nullable=False, comment="近3个月趋势 (rising/falling/stable)"),
+        sa.Column("seasonal_factor", sa.Float(), nullable=False, comment="该自然月的季节因子"),
+        sa.Column("average_price", sa.Float(), nullable=True, comment="当月材料均价"),
+        sa.Column("sample_count", sa.Integer(), nullable=False, comment="当月材料数"),
+        sa.Column("linked_count", sa.Integer(), nullable=False, comment="与上月可比的材料数"),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.func.now(),
+            nullable=True,
+            comment="更新时间",
+        ),
+    )
+
+    op.create_index(
+        "ux_material_market_index_grain",
+        "material_market_index",
+        ["region", "category", "month"],
+        unique=True,
+    )
+    op.create_index("ix_material_market_index_month", "material_market_index", ["month"])
+
+
+def downgrade() -> None:
+    """Drop material_market_index."""
+    op.drop_index("ix_material_market_index_month", table_name="material_market_index")
+    op.drop_index("ux_material_market_index_grain", table_name="material_market_index")
+    op.drop_table("material_market_index")
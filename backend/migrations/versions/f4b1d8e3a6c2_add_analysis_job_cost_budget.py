@@ -0,0 +1,38 @@
+"""Add cost budget and budget-exhausted status to analysis_jobs
+
+Revision ID: f4b1d8e3a6c2
+Revises: e7a3c9f1b5d2
+Create Date: 2026-10-19 08:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "f4b1d8e3a6c2"
+down_revision = "e7a3c9f1b5d2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Add analysis_jobs.cost_budget and the BUDGET_EXHAUSTED job status."""
+    op.add_column(
+        "analysis_jobs",
+        sa.Column(
+            "cost_budget",
+            sa.Float(),
+            nullable=True,
+            comment="项目AI分析成本预算（元，为空时使用 AI_PROJECT_BUDGET，0表示不限）",
+        ),
+    )
+    # ALTER TYPE ... ADD VALUE 不能在事务中执行
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE analysisjobstatus ADD VALUE IF NOT EXISTS 'BUDGET_EXHAUSTED'")
+
+
+def downgrade() -> None:
+    """Drop analysis_jobs.cost_budget (PostgreSQL cannot drop enum values; budget-exhausted jobs become failed)."""
+    op.execute("UPDATE analysis_jobs SET status = 'FAILED' WHERE status = 'BUDGET_EXHAUSTED'")
+    op.drop_column("analysis_jobs", "cost_budget")
@@ -0,0 +1,74 @@
+"""测试公共配置：使用临时 SQLite 数据库（aiosqlite）代替 PostgreSQL"""
+import asyncio
+import os
+import tempfile
+
+_db_dir = tempfile.mkdtemp(prefix="uma_audit_test_")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ["AI_REUSE_ENABLED"] = "false"
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import functions
+
+from app.core.database import AsyncSessionLocal, Base, engine
+import app.models  # noqa: F401  注册全部模型
+from app.models.project import Project, ProjectMaterial
+from app.models.user import User
+
+
+@compiles(functions.now, "sqlite")
+def _sqlite_now(element, compiler, **kw):
+    # SQLite 以文本比较时间，CURRENT_TIMESTAMP 只精确到秒，与带小数秒的参数比较时结果不对
+    return "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+@pytest.fixture
+def database():
+    """每个测试使用重新建表的空数据库"""
+
+    async def reset():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        await engine.dispose()
+
+    asyncio.run(reset())
+    yield
+    asyncio.run(engine.dispose())
+
+
+@pytest_asyncio.fixture
+async def async_database(database):
+    """异步测试使用：连接在测试的事件循环中创建，也在该循环中释放"""
+    yield
+    await engine.dispose()
+
+
+async def create_project_with_materials(count: int) -> tuple:
+    """创建一个项目及 count 个无信息价材料，返回 (project_id, [material_id, ...])，材料按总价从高到低排列"""
+
+    async with AsyncSessionLocal() as db:
+        user = User(username="tester", email="tester@example.com", hashed_password="x")
+        db.add(user)
+        await db.flush()
+        project = Project(name="测试项目", created_by=user.id, base_price_date="2024-01")
+        db.add(project)
+        await db.flush()
+        materials = [
+            ProjectMaterial(
+                project_id=project.id,
+                material_name=f"材料{i}",
+                specification=f"规格{i}",
+                unit="t",
+                quantity=10.0,
+                unit_price=100.0 * (count - i),
+                total_price=1000.0 * (count - i),
+                is_matched=False
+            )
+            for i in range(count)
+        ]
+        db.add_all(materials)
+        await db.commit()
+        return project.id, [material.id for material in materials]
@@ -0,0 +1,103 @@
+"""流式响应：价格区间格式降级与用量统计"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.config import settings
+from app.services import ai_analysis
+from app.services.ai_analysis import AIProvider, AIServiceManager
+from app.services.ai_simulator import SimulationProfile, SimulatorAIService
+from app.services.ai_telemetry import OUTCOME_PARSE_ERROR, OUTCOME_SUCCESS, ai_telemetry
+
+
+class _ScriptedCompletions:
+    """按固定内容分块输出的 chat.completions，usage 不为空时在最后一个分块返回用量"""
+
+    def __init__(self, content: str, usage=None):
+        self.content = content
+        self.usage = usage
+        self.requests = []
+
+    async def create(self, model, messages, stream=False, **kwargs):
+        self.requests.append({"model": model, "stream": stream, **kwargs})
+        return self._stream(model)
+
+    async def _stream(self, model):
+        for i in range(0, len(self.content), 8):
+            yield SimpleNamespace(
+                model=model,
+                usage=None,
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=self.content[i:i + 8]))]
+            )
+        if self.usage:
+            yield SimpleNamespace(model=model, usage=SimpleNamespace(**self.usage), choices=[])
+
+
+def _manager_with(completions: _ScriptedCompletions) -> AIServiceManager:
+    service = SimulatorAIService(SimulationProfile.from_settings())
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    manager = AIServiceManager.__new__(AIServiceManager)
+    manager.services = {AIProvider.SIMULATOR: service}
+    manager.primary_service = service
+    manager.fallback_services = []
+    return manager
+
+
+@pytest.fixture(autouse=True)
+def streaming(monkeypatch):
+    monkeypatch.setattr(settings, "AI_STREAM_ENABLED", True)
+    monkeypatch.setattr(settings, "AI_HEDGE_ENABLED", False, raising=False)
+    monkeypatch.setattr(ai_analysis, "_circuit_breakers", {})
+
+
+def _content(price_range) -> str:
+    payload = {"price_range": price_range, "confidence_score": 0.8, "data_sources": [], "reasoning": "测试"}
+    return "```json\n" + json.dumps(payload, ensure_ascii=False) + "\n```"
+
+
+@pytest.mark.asyncio
+async def test_non_numeric_price_range_falls_back_without_provider_failure():
+    completions = _ScriptedCompletions(
+        _content({"min_price": "4200", "max_price": "4500"}),
+        usage={"prompt_tokens": 120, "completion_tokens": 80, "total_tokens": 200}
+    )
+    manager = _manager_with(completions)
+
+    result = await manager.analyze_material_price("钢筋", "HRB400 Φ12", "t")
+
+    assert result.raw_response["parse_error"] is True
+    # 读取了完整文本（包括末尾的用量分块）
+    assert "4500" in result.reasoning
+    assert result.raw_response["usage"]["prompt_tokens"] == 120
+
+    breaker = ai_analysis.get_circuit_breaker(AIProvider.SIMULATOR)
+    assert breaker.total_failures == 0
+    assert breaker.total_successes == 1
+
+    event = ai_telemetry.recent_events(60, provider=AIProvider.SIMULATOR.value)[-1]
+    assert event.outcome == OUTCOME_PARSE_ERROR
+    assert event.completion_tokens == 80
+
+
+@pytest.mark.asyncio
+async def test_streaming_requests_usage_and_estimates_it_when_stopped_early():
+    # 顶层JSON闭合后即停止读取，收不到末尾的用量分块，按文本长度估算
+    completions = _ScriptedCompletions(
+        _content({"min_price": 4200, "max_price": 4500}),
+        usage={"prompt_tokens": 120, "completion_tokens": 80, "total_tokens": 200}
+    )
+    manager = _manager_with(completions)
+
+    result = await manager.analyze_material_price("钢筋", "HRB400 Φ12", "t")
+
+    assert completions.requests[0]["stream_options"] == {"include_usage": True}
+    assert result.predicted_price_min == 4200
+    usage = result.raw_response["usage"]
+    assert usage["prompt_tokens"] > 0
+    assert usage["completion_tokens"] > 0
+    assert usage["total_tokens"] == usage["prompt_tokens"] + usage["completion_tokens"]
+
+    event = ai_telemetry.recent_events(60, provider=AIProvider.SIMULATOR.value)[-1]
+    assert event.outcome == OUTCOME_SUCCESS
+    assert event.prompt_tokens == usage["prompt_tokens"]
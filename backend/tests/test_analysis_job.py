@@ -0,0 +1,220 @@
+"""分析任务：Celery eager 模式下的提交、中断与从检查点恢复"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update
+
+from app.core.celery_app import celery_app
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.analysis import AnalysisJob, AnalysisJobStatus, AnalysisStatus, PriceAnalysis
+from app.models.project import ProjectMaterial
+from app.services.ai_analysis import AIServiceManager, PriceAnalysisResult
+from app.services.analysis_job import PriceAnalysisJobService
+from app.services.price_analysis import PriceAnalysisService
+from tests.conftest import create_project_with_materials
+
+
+class WorkerLost(BaseException):
+    """模拟worker进程异常退出（不经过任务内的异常处理）"""
+
+
+def _fake_result(material) -> PriceAnalysisResult:
+    return PriceAnalysisResult(
+        material_name=material.material_name,
+        specification=material.specification or "",
+        predicted_price_min=90.0,
+        predicted_price_max=110.0,
+        predicted_price_avg=None,
+        confidence_score=0.8,
+        data_sources=[],
+        reasoning="测试",
+        risk_factors=[],
+        recommendations=[],
+        analysis_time=0.01,
+        analysis_cost=0.01,
+        provider="simulator",
+        raw_response={}
+    )
+
+
+@pytest.fixture
+def celery_eager(monkeypatch):
+    """通过Celery的 task_always_eager 执行任务（不走本地 asyncio.create_task 模式）"""
+    monkeypatch.setattr(settings, "CELERY_TASK_ALWAYS_EAGER", False)
+    monkeypatch.setattr(celery_app.conf, "task_always_eager", True)
+    monkeypatch.setattr(settings, "AI_MAX_CONCURRENT", 1)
+
+
+async def _load_job(project_id: int) -> AnalysisJob:
+    async with AsyncSessionLocal() as db:
+        stmt = select(AnalysisJob).where(AnalysisJob.project_id == project_id)
+        return (await db.execute(stmt)).scalar_one()
+
+
+def test_job_resumes_from_checkpoint_after_worker_crash(database, celery_eager, monkeypatch):
+    project_id, material_ids = asyncio.run(create_project_with_materials(3))
+
+    calls = []
+
+    async def perform_ai_analysis(self, material, *args, **kwargs):
+        calls.append(material.id)
+        if len(calls) == 2:
+            raise WorkerLost()
+        return _fake_result(material)
+
+    monkeypatch.setattr(PriceAnalysisService, "_perform_ai_analysis", perform_ai_analysis)
+
+    async def submit():
+        async with AsyncSessionLocal() as db:
+            await PriceAnalysisJobService().submit_job(db, project_id)
+
+    # 第二个材料分析时worker退出：任务停留在运行中，第一个材料已作为检查点提交
+    with pytest.raises(WorkerLost):
+        asyncio.run(submit())
+
+    job = asyncio.run(_load_job(project_id))
+    assert job.status == AnalysisJobStatus.RUNNING
+    assert job.done_count == 1
+
+    async def resume():
+        async with AsyncSessionLocal() as db:
+            return await PriceAnalysisJobService().resume_job(db, job.id)
+
+    # 心跳未超时前视为仍在运行
+    with pytest.raises(ValueError):
+        asyncio.run(resume())
+
+    async def expire_heartbeat():
+        stale_at = datetime.now(timezone.utc) - timedelta(seconds=settings.ANALYSIS_JOB_STALE_SECONDS + 60)
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(AnalysisJob).where(AnalysisJob.id == job.id).values(heartbeat_at=stale_at))
+            await db.commit()
+
+    asyncio.run(expire_heartbeat())
+    asyncio.run(resume())
+
+    # 已完成的第一个材料不再重新分析
+    assert calls == [material_ids[0], material_ids[1], material_ids[1], material_ids[2]]
+
+    job = asyncio.run(_load_job(project_id))
+    assert job.status == AnalysisJobStatus.COMPLETED
+    assert job.done_count == 3
+    assert job.attempts == 2
+    assert job.task_id
+
+    async def load_statuses():
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(PriceAnalysis.material_id, PriceAnalysis.status))).all()
+            return {row.material_id: row.status for row in rows}
+
+    assert asyncio.run(load_statuses()) == {mid: AnalysisStatus.COMPLETED for mid in material_ids}
+
+
+def test_heartbeat_refreshes_while_material_is_slow(database, celery_eager, monkeypatch):
+    monkeypatch.setattr(settings, "ANALYSIS_JOB_HEARTBEAT_SECONDS", 0.05)
+    project_id, _ = asyncio.run(create_project_with_materials(1))
+
+    heartbeats = []
+
+    async def perform_ai_analysis(self, material, *args, **kwargs):
+        # 单个材料分析期间不会记录进度，心跳只能来自定时器
+        for _ in range(3):
+            await asyncio.sleep(1.1)
+            heartbeats.append((await _load_job(project_id)).heartbeat_at)
+        return _fake_result(material)
+
+    monkeypatch.setattr(PriceAnalysisService, "_perform_ai_analysis", perform_ai_analysis)
+
+    async def submit():
+        async with AsyncSessionLocal() as db:
+            await PriceAnalysisJobService().submit_job(db, project_id)
+
+    asyncio.run(submit())
+
+    assert len(set(heartbeats)) == 3
+    assert asyncio.run(_load_job(project_id)).status == AnalysisJobStatus.COMPLETED
+
+
+def test_job_stops_at_cost_budget_and_resumes_with_a_higher_one(database, celery_eager, monkeypatch):
+    project_id, material_ids = asyncio.run(create_project_with_materials(3))
+
+    calls = []
+
+    async def perform_ai_analysis(self, material, *args, **kwargs):
+        calls.append(material.id)
+        return _fake_result(material)
+
+    monkeypatch.setattr(PriceAnalysisService, "_perform_ai_analysis", perform_ai_analysis)
+    monkeypatch.setattr(AIServiceManager, "estimate_request_cost", lambda self, provider=None: 0.01)
+
+    async def submit():
+        async with AsyncSessionLocal() as db:
+            await PriceAnalysisJobService().submit_job(db, project_id, cost_budget=0.025)
+
+    asyncio.run(submit())
+
+    # 每个材料成本 0.01 元，预算只够分析按价值排序的前两个材料
+    assert calls == material_ids[:2]
+    job = asyncio.run(_load_job(project_id))
+    assert job.status == AnalysisJobStatus.BUDGET_EXHAUSTED
+    assert job.cost_budget == 0.025
+    assert job.done_count == 2
+    assert job.finished_at is None
+
+    async def resume():
+        async with AsyncSessionLocal() as db:
+            return await PriceAnalysisJobService().resume_job(db, job.id, cost_budget=1.0)
+
+    asyncio.run(resume())
+
+    assert calls == material_ids
+    job = asyncio.run(_load_job(project_id))
+    assert job.status == AnalysisJobStatus.COMPLETED
+    assert job.done_count == 3
+    assert job.cost_budget == 1.0
+
+
+def test_job_analyzes_identical_materials_once(database, celery_eager, monkeypatch):
+    project_id, material_ids = asyncio.run(create_project_with_materials(3))
+
+    async def make_duplicate():
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(ProjectMaterial)
+                .where(ProjectMaterial.id == material_ids[2])
+                .values(material_name="材料0 ", specification="规格０")
+            )
+            await db.commit()
+
+    asyncio.run(make_duplicate())
+
+    calls = []
+
+    async def perform_ai_analysis(self, material, *args, **kwargs):
+        calls.append(material.id)
+        return _fake_result(material)
+
+    monkeypatch.setattr(PriceAnalysisService, "_perform_ai_analysis", perform_ai_analysis)
+
+    async def submit():
+        async with AsyncSessionLocal() as db:
+            await PriceAnalysisJobService().submit_job(db, project_id)
+
+    asyncio.run(submit())
+
+    assert calls == material_ids[:2]
+    job = asyncio.run(_load_job(project_id))
+    assert job.status == AnalysisJobStatus.COMPLETED
+    assert job.done_count == 3
+
+    async def load_shared():
+        async with AsyncSessionLocal() as db:
+            stmt = select(PriceAnalysis).where(PriceAnalysis.material_id == material_ids[2])
+            return (await db.execute(stmt)).scalar_one()
+
+    shared = asyncio.run(load_shared())
+    assert shared.status == AnalysisStatus.COMPLETED
+    assert shared.analysis_cost == 0.0
+    assert shared.api_response['deduplicated_from'] == material_ids[0]
@@ -0,0 +1,104 @@
+"""分析复用索引"""
+from datetime import datetime
+
+import pytest
+
+from app.core.database import AsyncSessionLocal
+from app.models.analysis import AnalysisStatus, PriceAnalysis
+from app.models.project import Project, ProjectMaterial
+from app.models.user import User
+from app.services.analysis_reuse import WEIGHTING_NOTE_HEADER, AnalysisReuseIndex, build_reused_result
+from app.services.price_analysis import PriceAnalysisService
+
+
+def _project(user_id: int, name: str, province: str = "330000", base_date: str = "2025-06") -> Project:
+    return Project(
+        name=name,
+        created_by=user_id,
+        base_price_date=base_date,
+        base_price_province=province,
+        base_price_city="330100"
+    )
+
+
+async def _seed_history() -> Project:
+    """已分析的历史项目 + 待分析的新项目，返回新项目（已加载材料）"""
+    async with AsyncSessionLocal() as db:
+        user = User(username="tester", email="tester@example.com", hashed_password="x")
+        db.add(user)
+        await db.flush()
+
+        history = _project(user.id, "历史项目")
+        other_province = _project(user.id, "外省项目", province="320000")
+        out_of_window = _project(user.id, "旧基期项目", base_date="2023-01")
+        target = _project(user.id, "新项目", base_date="2025-08")
+        db.add_all([history, other_province, out_of_window, target])
+        await db.flush()
+
+        analyzed = [
+            (history, "热轧带肋钢筋", "HRB400 Φ12", "吨"),
+            (history, "商品混凝土", "C30", "m³"),
+            (history, "镀锌钢管", "DN50", "m"),
+            (other_province, "热轧带肋钢筋", "HRB400 Φ12", "t"),
+            (out_of_window, "热轧带肋钢筋", "HRB400 Φ12", "t"),
+        ]
+        for project, name, spec, unit in analyzed:
+            material = ProjectMaterial(
+                project_id=project.id, material_name=name, specification=spec, unit=unit,
+                quantity=1.0, unit_price=4000.0, is_analyzed=True
+            )
+            db.add(material)
+            await db.flush()
+            db.add(PriceAnalysis(
+                material_id=material.id,
+                status=AnalysisStatus.COMPLETED,
+                predicted_price_min=3900.0,
+                predicted_price_max=4300.0,
+                confidence_score=0.8,
+                analysis_model="通义千问",
+                analyzed_at=datetime.utcnow(),
+                data_sources=[{"source_type": "网络搜索", "price_range_min": 3900.0, "price_range_max": 4300.0}],
+                analysis_reasoning=f"{name}的分析过程\n\n{WEIGHTING_NOTE_HEADER}\n旧的权重说明",
+                risk_factors="价格波动",
+                recommendations=""
+            ))
+
+        db.add_all([
+            ProjectMaterial(
+                project_id=target.id, material_name="热轧带肋钢筋", specification="HRB400 Φ12",
+                unit="t", quantity=10.0, unit_price=4100.0
+            ),
+            ProjectMaterial(
+                project_id=target.id, material_name="预拌砂浆", specification="M10",
+                unit="m³", quantity=5.0, unit_price=500.0
+            ),
+        ])
+        await db.commit()
+        return target
+
+
+@pytest.mark.asyncio
+async def test_index_filters_in_sql_and_loads_details_only_for_matches(async_database):
+    target = await _seed_history()
+    service = PriceAnalysisService()
+
+    async with AsyncSessionLocal() as db:
+        materials = await service._get_materials_for_analysis(db, target.id, None, False)
+        index = await AnalysisReuseIndex.build(db, materials[0].project, materials)
+
+    # 同地区、基期窗口内、单位可比（吨/t、m³）的只有历史项目的钢筋和混凝土
+    assert sorted(entry.material_name for entry in index._entries) == ["商品混凝土", "热轧带肋钢筋"]
+    concrete = next(entry for entry in index._entries if entry.material_name == "商品混凝土")
+    assert concrete.reasoning == "" and concrete.data_sources == []
+
+    rebar = next(material for material in materials if material.material_name == "热轧带肋钢筋")
+    match = index.lookup(rebar)
+    assert match is not None and match.similarity == 1.0
+    assert match.entry.data_sources and match.entry.reasoning
+
+    # 保存复用结果时重新生成权重说明，只保留一份
+    reused = build_reused_result(rebar, match)
+    values = service._build_analysis_values(service._snapshot(rebar), reused)
+    assert values['analysis_reasoning'].count(WEIGHTING_NOTE_HEADER) == 1
+    assert "旧的权重说明" not in values['analysis_reasoning']
+    assert "热轧带肋钢筋的分析过程" in values['analysis_reasoning']
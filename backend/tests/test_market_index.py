@@ -0,0 +1,53 @@
+"""市场指数增量重算"""
+from collections import defaultdict
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.market_index import ALL_CATEGORIES, build_index_rows
+
+
+def _aggregates():
+    """两个地区 26 个月的按月汇总（第 5 个月缺失，用于覆盖环比中断）"""
+    rows = []
+    for region, drift in (("杭州市", 0.01), ("宁波市", -0.004)):
+        for ordinal in range(2023 * 12, 2023 * 12 + 26):
+            if ordinal == 2023 * 12 + 4:
+                continue
+            month = f"{ordinal // 12}-{ordinal % 12 + 1:02d}"
+            relative = drift + 0.02 * ((ordinal % 12) in (0, 1)) - 0.01 * ((ordinal % 12) == 6)
+            linked = ordinal not in (2023 * 12, 2023 * 12 + 5)
+            rows.append(SimpleNamespace(
+                region=region,
+                category=None,
+                all_categories=1,
+                month=month,
+                sample_count=10,
+                linked_count=8 if linked else 0,
+                mean_log_relative=relative if linked else None,
+                average_price=100.0
+            ))
+    return rows
+
+
+@pytest.mark.parametrize("since", ["2023-06", "2024-03", "2025-02"])
+def test_incremental_rows_continue_saved_series(since):
+    full = build_index_rows(_aggregates())
+
+    history = defaultdict(list)
+    for row in sorted(full, key=lambda item: item["month"]):
+        if row["month"] < since:
+            history[(row["region"], row["category"])].append(SimpleNamespace(**row))
+    incremental = build_index_rows(_aggregates(), history, since)
+
+    expected = {(row["region"], row["month"]): row for row in full if row["month"] >= since}
+    assert {(row["region"], row["month"]) for row in incremental} == set(expected)
+    for row in incremental:
+        reference = expected[(row["region"], row["month"])]
+        assert row["category"] == ALL_CATEGORIES
+        assert row["trend"] == reference["trend"]
+        for field in ("index_value", "mom_change", "yoy_change", "seasonal_factor"):
+            if reference[field] is None:
+                assert row[field] is None
+            else:
+                assert row[field] == pytest.approx(reference[field], rel=1e-4, abs=1e-5)
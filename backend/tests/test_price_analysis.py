@@ -0,0 +1,163 @@
+"""项目材料分析流水线"""
+import asyncio
+
+import pytest
+from sqlalchemy import select, text, update
+
+from app.core.database import AsyncSessionLocal
+from app.models.analysis import AnalysisStatus, PriceAnalysis
+from app.models.project import ProjectMaterial
+from app.services.ai_analysis import PriceAnalysisResult
+from app.services.price_analysis import PriceAnalysisService
+from tests.conftest import create_project_with_materials
+
+
+def _fake_result(material_name: str, specification: str) -> PriceAnalysisResult:
+    return PriceAnalysisResult(
+        material_name=material_name,
+        specification=specification,
+        predicted_price_min=90.0,
+        predicted_price_max=110.0,
+        predicted_price_avg=None,
+        confidence_score=0.8,
+        data_sources=[],
+        reasoning="测试",
+        risk_factors=[],
+        recommendations=[],
+        analysis_time=0.01,
+        analysis_cost=0.01,
+        provider="simulator",
+        raw_response={}
+    )
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_per_row_after_rollback(async_database, monkeypatch):
+    project_id, material_ids = await create_project_with_materials(5)
+    bad_material_id = material_ids[1]
+
+    service = PriceAnalysisService()
+    service.max_concurrent_analyses = 1
+
+    async def analyze_material_price(material_name, specification, **kwargs):
+        await asyncio.sleep(0)
+        return _fake_result(material_name, specification)
+
+    monkeypatch.setattr(service.ai_manager, "analyze_material_price", analyze_material_price)
+
+    bulk_save = service.bulk_save_analysis_results
+
+    async def failing_bulk_save(db, completed=None, failed=None):
+        await bulk_save(db, completed=completed, failed=failed)
+        # 包含问题材料的写入在数据库层面失败，调用方必须回滚整个事务
+        if any(material.id == bad_material_id for material, _ in completed or []):
+            await db.execute(text("INSERT INTO missing_table VALUES (1)"))
+
+    monkeypatch.setattr(service, "bulk_save_analysis_results", failing_bulk_save)
+
+    async with AsyncSessionLocal() as db:
+        result = await service.analyze_project_materials(db, project_id, batch_size=2)
+
+    assert result['analyzed_count'] == 5
+    assert result['success_count'] == 4
+    assert result['failed_count'] == 1
+
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(PriceAnalysis.material_id, PriceAnalysis.status))).all()
+    statuses = {row.material_id: row.status for row in rows}
+    assert bad_material_id not in statuses
+    assert statuses == {mid: AnalysisStatus.COMPLETED for mid in material_ids if mid != bad_material_id}
+
+
+@pytest.mark.asyncio
+async def test_results_include_saved_analysis_unless_disabled(async_database, monkeypatch):
+    project_id, material_ids = await create_project_with_materials(3)
+
+    service = PriceAnalysisService()
+
+    async def analyze_material_price(material_name, specification, **kwargs):
+        return _fake_result(material_name, specification)
+
+    monkeypatch.setattr(service.ai_manager, "analyze_material_price", analyze_material_price)
+
+    async with AsyncSessionLocal() as db:
+        result = await service.analyze_project_materials(db, project_id)
+
+    assert sorted(r['material_id'] for r in result['results']) == sorted(material_ids)
+    for item in result['results']:
+        assert item['success']
+        assert item['analysis']['material_id'] == item['material_id']
+        assert item['analysis']['status'] == AnalysisStatus.COMPLETED.value
+        assert item['analysis']['predicted_price_min'] == 90.0
+
+    async with AsyncSessionLocal() as db:
+        result = await service.analyze_project_materials(
+            db, project_id, force_reanalyze=True, include_results=False
+        )
+
+    assert result['success_count'] == 3
+    assert 'results' not in result
+
+
+@pytest.mark.asyncio
+async def test_single_material_save_failure_is_recorded(async_database, monkeypatch):
+    _, material_ids = await create_project_with_materials(1)
+
+    service = PriceAnalysisService()
+
+    async def analyze_material_price(material_name, specification, **kwargs):
+        return _fake_result(material_name, specification)
+
+    monkeypatch.setattr(service.ai_manager, "analyze_material_price", analyze_material_price)
+
+    bulk_save = service.bulk_save_analysis_results
+
+    async def failing_bulk_save(db, completed=None, failed=None):
+        await bulk_save(db, completed=completed, failed=failed)
+        if completed:
+            await db.execute(text("INSERT INTO missing_table VALUES (1)"))
+
+    monkeypatch.setattr(service, "bulk_save_analysis_results", failing_bulk_save)
+
+    async with AsyncSessionLocal() as db:
+        result = await service.analyze_single_material(db, material_ids[0])
+
+    assert result['status'] == 'failed'
+    async with AsyncSessionLocal() as db:
+        analysis = (await db.execute(select(PriceAnalysis))).scalar_one()
+    assert analysis.status == AnalysisStatus.FAILED
+
+
+@pytest.mark.asyncio
+async def test_identical_materials_share_one_ai_call(async_database, monkeypatch):
+    project_id, material_ids = await create_project_with_materials(3)
+    async with AsyncSessionLocal() as db:
+        # 首尾空格和全角数字不同，标准化后与第一个材料相同
+        await db.execute(
+            update(ProjectMaterial)
+            .where(ProjectMaterial.id == material_ids[1])
+            .values(material_name=" 材料0 ", specification="规格０")
+        )
+        await db.commit()
+
+    service = PriceAnalysisService()
+    calls = []
+
+    async def analyze_material_price(material_name, specification, **kwargs):
+        calls.append(material_name)
+        return _fake_result(material_name, specification)
+
+    monkeypatch.setattr(service.ai_manager, "analyze_material_price", analyze_material_price)
+
+    async with AsyncSessionLocal() as db:
+        result = await service.analyze_project_materials(db, project_id)
+
+    assert len(calls) == 2
+    assert result['success_count'] == 3
+
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(PriceAnalysis))).scalars().all()
+    analyses = {row.material_id: row for row in rows}
+    shared = analyses[material_ids[1]]
+    assert shared.api_response['deduplicated_from'] == material_ids[0]
+    assert shared.analysis_cost == 0.0
@@ -0,0 +1,78 @@
+"""价格合理性分析：批量（按列计算）与逐个分析的结果一致"""
+import random
+
+import pytest
+
+from app.utils.price_reasonability import PriceReasonabilityAnalyzer
+
+
+COMPARED_FIELDS = (
+    "material_id", "material_name", "original_price", "predicted_price_min", "predicted_price_max",
+    "predicted_price_avg", "price_status", "risk_level", "price_variance", "analysis_details",
+    "risk_factors", "recommendations", "confidence_score", "analysis_method"
+)
+
+
+def _materials(count: int, seed: int):
+    """合成材料：覆盖缺少预测、缺少均价、空历史、历史中含空价格和整数价格等情况"""
+    rng = random.Random(seed)
+    histories = [[]]
+    for _ in range(30):
+        center = rng.lognormvariate(4, 1.2)
+        histories.append([
+            {"price": round(center * rng.uniform(0.8, 1.2), 2) if rng.random() > 0.1 else None}
+            for _ in range(rng.choice([1, 2, 3, 5, 12]))
+        ])
+    histories.append([{"price": 100}, {"price": 120}])
+
+    materials = []
+    for i in range(count):
+        avg = round(rng.lognormvariate(4, 1.2), 2)
+        spread = rng.uniform(0, 0.4)
+        has_prediction = rng.random() > 0.1
+        materials.append({
+            "material_id": i + 1,
+            "material_name": f"材料{i}",
+            "original_price": round(avg * rng.uniform(0.3, 2.5), 2) if rng.random() > 0.02 else 0,
+            "ai_analysis_result": {
+                "predicted_price_min": round(avg * (1 - spread), 2) if has_prediction else None,
+                "predicted_price_max": round(avg * (1 + spread), 2) if has_prediction else None,
+                "predicted_price_avg": avg if rng.random() > 0.2 else None,
+                "confidence_score": round(rng.uniform(0.2, 1.0), 2)
+            },
+            "historical_data": rng.choice(histories)
+        })
+    return materials
+
+
+@pytest.mark.parametrize("market_context", [
+    None,
+    {"trend": "stable", "inflation_rate": 0.03, "season_factor": 1.0},
+    {"trend": "rising", "inflation_rate": 0.08, "season_factor": 1.12},
+    {"trend": "falling", "inflation_rate": -0.02, "season_factor": 0.9},
+])
+def test_batch_matches_per_material_analysis(market_context):
+    analyzer = PriceReasonabilityAnalyzer()
+    materials = _materials(2000, seed=20251019)
+
+    expected = [
+        analyzer.analyze_price_reasonability(
+            material_id=material["material_id"],
+            material_name=material["material_name"],
+            original_price=material["original_price"],
+            ai_analysis_result=material["ai_analysis_result"],
+            historical_data=material["historical_data"],
+            market_context=market_context
+        )
+        for material in materials
+    ]
+    actual = analyzer.batch_analyze_materials(materials, market_context)
+
+    # 绝大多数材料应由按列计算得到，而不是回退到逐个分析
+    vectorized = analyzer._vectorized_batch_analyze(materials, market_context)
+    assert sum(result is not None for result in vectorized) > len(materials) * 0.9
+
+    assert len(actual) == len(expected)
+    for left, right in zip(expected, actual):
+        for field in COMPARED_FIELDS:
+            assert repr(getattr(right, field)) == repr(getattr(left, field)), (left.material_id, field)
@@ -0,0 +1,40 @@
+"""信息价月度汇总的窗口均价"""
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.price_rollup import PriceRollupService
+
+
+def _month(month, price, price_excluding_tax, effective_price, sample_count, price_count, excluding_count, effective_count):
+    return SimpleNamespace(
+        month=month,
+        unit="t",
+        price=price,
+        price_including_tax=None,
+        price_excluding_tax=price_excluding_tax,
+        effective_price=effective_price,
+        sample_count=sample_count,
+        price_count=price_count,
+        price_including_tax_count=0,
+        price_excluding_tax_count=excluding_count,
+        effective_count=effective_count
+    )
+
+
+def test_window_average_weights_each_field_by_its_non_null_count():
+    rows = [
+        # 两条信息价：一条只有除税价 100，一条只有单价 200
+        _month("2025-01", 200.0, 100.0, 150.0, 2, 1, 1, 2),
+        # 三条信息价，均有单价和除税价
+        _month("2025-02", 330.0, 300.0, 300.0, 3, 3, 3, 3),
+    ]
+
+    average = PriceRollupService.window_average(rows)
+
+    assert average["price"] == pytest.approx((200.0 + 330.0 * 3) / 4)
+    assert average["price_excluding_tax"] == pytest.approx((100.0 + 300.0 * 3) / 4)
+    assert average["price_including_tax"] is None
+    # 有效单价（除税价优先）= 全部 5 条信息价的算术平均
+    assert average["effective_price"] == pytest.approx((100.0 + 200.0 + 300.0 * 3) / 5)
+    assert average["sample_count"] == 5
@@ -0,0 +1,37 @@
+"""报告渲染进程池"""
+import time
+from multiprocessing.connection import wait
+
+import pytest
+
+from app.core.config import settings
+from app.services import render_pool
+
+
+@pytest.mark.asyncio
+async def test_timeout_terminates_stuck_worker(monkeypatch):
+    monkeypatch.setattr(settings, "REPORT_RENDER_WORKERS", 1)
+    retired = []
+    terminate_workers = render_pool._terminate_workers
+
+    def record_terminate(processes):
+        retired.extend(processes)
+        terminate_workers(processes)
+
+    monkeypatch.setattr(render_pool, "_terminate_workers", record_terminate)
+
+    try:
+        with pytest.raises(TimeoutError):
+            await render_pool.run_in_render_pool(time.sleep, 600, timeout=3)
+
+        assert render_pool._pool is None
+        assert retired
+        # 进程池管理线程、回收线程都会 waitpid 同一子进程，is_alive 可能在回收的间隙误报存活，
+        # 改为等待 sentinel（子进程退出即就绪，与由谁回收无关）
+        for process in retired:
+            assert wait([process.sentinel], 10)
+
+        # 后续渲染使用新的进程池
+        assert await render_pool.run_in_render_pool(abs, -2, timeout=60) == 2
+    finally:
+        render_pool.shutdown_render_pool()
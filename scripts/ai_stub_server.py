@@ -0,0 +1,50 @@
+"""OpenAI兼容的AI服务桩服务（压测用）
+
+用法:
+    python scripts/ai_stub_server.py --port 9100 --latency-median 8 --rate-limit-rate 0.02
+
+后端配置 AI_SIMULATOR_ENABLED=true、AI_SIMULATOR_BASE_URL=http://127.0.0.1:9100/v1 后，
+所有价格分析请求都会发送到该服务。访问 /stats 查看各类响应的数量。
+"""
+import argparse
+import sys
+from pathlib import Path
+
+# Add backend directory to sys.path
+backend_path = Path(__file__).resolve().parent.parent / "backend"
+sys.path.append(str(backend_path))
+
+import uvicorn
+
+from app.services.ai_simulator import SimulationProfile, create_stub_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI服务桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-median", type=float, default=8.0, help="延迟中位数(秒)")
+    parser.add_argument("--latency-sigma", type=float, default=0.6, help="对数正态分布sigma")
+    parser.add_argument("--timeout-rate", type=float, default=0.02, help="挂起请求比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.02, help="429比例")
+    parser.add_argument("--malformed-rate", type=float, default=0.03, help="非JSON响应比例")
+    parser.add_argument("--prompt-tokens", type=int, default=1200)
+    parser.add_argument("--completion-tokens", type=int, default=900)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    profile = SimulationProfile(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        timeout_rate=args.timeout_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        malformed_rate=args.malformed_rate,
+        prompt_tokens=args.prompt_tokens,
+        completion_tokens=args.completion_tokens,
+        seed=args.seed
+    )
+    uvicorn.run(create_stub_app(profile), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""AI价格分析流水线压测
+
+在数据库中创建合成项目，使用AI服务模拟器驱动
+PriceAnalysisService.analyze_project_materials，按并发数和频率限制组合输出
+吞吐量、数据库写入速率和尾延迟。运行结束后删除合成项目。
+
+用法:
+    python scripts/benchmark_analysis.py --materials 200 --concurrency 5,10,20 --rate-limits 60,600
+    # 使用桩服务（先启动 scripts/ai_stub_server.py）
+    python scripts/benchmark_analysis.py --stub-url http://127.0.0.1:9100/v1
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+# Add backend directory to sys.path
+backend_path = Path(__file__).resolve().parent.parent / "backend"
+sys.path.append(str(backend_path))
+
+from sqlalchemy import select, delete
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, engine
+from app.models.user import User
+from app.models.project import Project, ProjectMaterial
+from app.models import analysis  # noqa: F401  注册关联关系
+from app.services.ai_analysis import close_ai_clients
+from app.services.price_analysis import PriceAnalysisService
+
+
+MATERIAL_NAMES = ["钢筋", "水泥", "碎石", "镀锌钢管", "电缆", "防水卷材", "铝合金门窗", "石材", "PVC管", "灯具"]
+UNITS = ["t", "t", "m3", "m", "m", "m2", "m2", "m2", "m", "套"]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def create_synthetic_project(user_id: int, count: int, seed: int) -> int:
+    rng = random.Random(seed)
+    async with AsyncSessionLocal() as db:
+        project = Project(name=f"[压测] 合成项目 {int(time.time())}", created_by=user_id, location="全国")
+        db.add(project)
+        await db.flush()
+        for i in range(count):
+            idx = rng.randrange(len(MATERIAL_NAMES))
+            quantity = round(rng.lognormvariate(3, 1.5), 2)
+            unit_price = round(rng.lognormvariate(4, 1.2), 2)
+            db.add(ProjectMaterial(
+                project_id=project.id,
+                material_name=f"{MATERIAL_NAMES[idx]}-{i}",
+                specification=f"规格{rng.randint(1, 50)}",
+                unit=UNITS[idx],
+                quantity=quantity,
+                unit_price=unit_price,
+                total_price=round(quantity * unit_price, 2),
+                is_matched=False
+            ))
+        await db.commit()
+        return project.id
+
+
+async def drop_project(project_id: int):
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(Project).where(Project.id == project_id))
+        await db.commit()
+
+
+async def run_case(args, user_id: int, concurrency: int, rate_limit: int) -> dict:
+    # 重建服务注册表，使模拟器配置生效
+    await close_ai_clients()
+    settings.AI_SIMULATOR_RATE_LIMIT = rate_limit
+
+    project_id = await create_synthetic_project(user_id, args.materials, args.seed)
+    service = PriceAnalysisService()
+    service.max_concurrent_analyses = concurrency
+
+    latencies = []
+    original_analyze = service.ai_manager.analyze_material_price
+
+    async def timed_analyze(*a, **kw):
+        start = time.perf_counter()
+        try:
+            return await original_analyze(*a, **kw)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    service.ai_manager.analyze_material_price = timed_analyze
+
+    flush_stats = {"rows": 0, "seconds": 0.0, "flushes": 0}
+    original_flush = service._flush_analysis_results
+
+    async def timed_flush(db, items):
+        start = time.perf_counter()
+        try:
+            return await original_flush(db, items)
+        finally:
+            flush_stats["rows"] += len(items)
+            flush_stats["seconds"] += time.perf_counter() - start
+            flush_stats["flushes"] += 1
+
+    service._flush_analysis_results = timed_flush
+
+    try:
+        start = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            result = await service.analyze_project_materials(
+                db, project_id, batch_size=args.flush_size, force_reanalyze=True
+            )
+        wall = time.perf_counter() - start
+    finally:
+        if not args.keep:
+            await drop_project(project_id)
+
+    return {
+        "concurrency": concurrency,
+        "rate_limit": rate_limit,
+        "success": result["success_count"],
+        "failed": result["failed_count"],
+        "wall": wall,
+        "throughput": result["analyzed_count"] / wall * 60 if wall > 0 else 0.0,
+        "db_rows_per_s": flush_stats["rows"] / flush_stats["seconds"] if flush_stats["seconds"] > 0 else 0.0,
+        "flushes": flush_stats["flushes"],
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "max": max(latencies) if latencies else 0.0
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="AI价格分析流水线压测")
+    parser.add_argument("--materials", type=int, default=200, help="合成项目材料数")
+    parser.add_argument("--concurrency", default="5,10,20", help="AI并发数列表，逗号分隔")
+    parser.add_argument("--rate-limits", default="100", help="每分钟请求数限制列表，逗号分隔")
+    parser.add_argument("--flush-size", type=int, default=20, help="结果批量写入大小")
+    parser.add_argument("--stub-url", default="", help="OpenAI兼容桩服务地址，为空时进程内模拟")
+    parser.add_argument("--latency-median", type=float, default=2.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.6)
+    parser.add_argument("--timeout-rate", type=float, default=0.01)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.02)
+    parser.add_argument("--malformed-rate", type=float, default=0.03)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--user-id", type=int, default=None, help="合成项目的创建用户，默认取第一个用户")
+    parser.add_argument("--keep", action="store_true", help="保留合成项目数据")
+    args = parser.parse_args()
+
+    settings.AI_SIMULATOR_ENABLED = True
+    settings.AI_SIMULATOR_BASE_URL = args.stub_url
+    settings.AI_SIMULATOR_LATENCY_MEDIAN = args.latency_median
+    settings.AI_SIMULATOR_LATENCY_SIGMA = args.latency_sigma
+    settings.AI_SIMULATOR_TIMEOUT_RATE = args.timeout_rate
+    settings.AI_SIMULATOR_RATE_LIMIT_RATE = args.rate_limit_rate
+    settings.AI_SIMULATOR_MALFORMED_RATE = args.malformed_rate
+    settings.AI_SIMULATOR_SEED = args.seed
+    settings.AI_PROJECT_BUDGET = 0
+
+    user_id = args.user_id
+    if user_id is None:
+        async with AsyncSessionLocal() as db:
+            user_id = (await db.execute(select(User.id).order_by(User.id).limit(1))).scalar()
+        if user_id is None:
+            print("数据库中没有用户，请先创建用户或通过 --user-id 指定")
+            return
+
+    rows = []
+    try:
+        for rate_limit in [int(v) for v in args.rate_limits.split(",") if v]:
+            for concurrency in [int(v) for v in args.concurrency.split(",") if v]:
+                print(f"运行: 并发={concurrency}, 频率限制={rate_limit}/分钟 ...")
+                rows.append(await run_case(args, user_id, concurrency, rate_limit))
+    finally:
+        await close_ai_clients()
+        await engine.dispose()
+
+    header = (
+        f"{'并发':>4} | {'限流/分':>7} | {'成功':>5} | {'失败':>5} | {'耗时(s)':>8} | "
+        f"{'材料/分':>8} | {'写入行/s':>9} | {'批次':>4} | {'p50':>6} | {'p95':>6} | {'p99':>6} | {'max':>6}"
+    )
+    print()
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(
+            f"{r['concurrency']:>4} | {r['rate_limit']:>7} | {r['success']:>5} | {r['failed']:>5} | "
+            f"{r['wall']:>8.1f} | {r['throughput']:>8.1f} | {r['db_rows_per_s']:>9.1f} | {r['flushes']:>4} | "
+            f"{r['p50']:>6.2f} | {r['p95']:>6.2f} | {r['p99']:>6.2f} | {r['max']:>6.2f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
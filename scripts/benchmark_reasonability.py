@@ -0,0 +1,98 @@
+"""价格合理性批量分析基准测试
+
+生成合成材料数据（AI预测区间、置信度、按名称+单位共用的历史价格），对比逐个分析
+（analyze_price_reasonability）与批量分析（batch_analyze_materials）的耗时，
+并逐项校验两者的结果一致（状态、风险等级、偏差、置信度、风险因素、建议和分析详情）。
+不需要数据库。
+
+用法:
+    python scripts/benchmark_reasonability.py --materials 100000
+    python scripts/benchmark_reasonability.py --materials 20000 --history-groups 500 --seed 7
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+# Add backend directory to sys.path
+backend_path = Path(__file__).resolve().parent.parent / "backend"
+sys.path.append(str(backend_path))
+
+from app.utils.price_reasonability import PriceReasonabilityAnalyzer
+
+
+COMPARED_FIELDS = (
+    "material_id", "material_name", "original_price", "predicted_price_min", "predicted_price_max",
+    "predicted_price_avg", "price_status", "risk_level", "price_variance", "analysis_details",
+    "risk_factors", "recommendations", "confidence_score", "analysis_method"
+)
+
+
+def build_materials(count: int, history_groups: int, seed: int):
+    rng = random.Random(seed)
+
+    histories = []
+    for _ in range(history_groups):
+        center = rng.lognormvariate(4, 1.2)
+        size = rng.choice([0, 1, 2, 3, 5, 12, 20])
+        histories.append([
+            {"price": round(center * rng.uniform(0.8, 1.2), 2) if rng.random() > 0.05 else None}
+            for _ in range(size)
+        ])
+
+    materials = []
+    for i in range(count):
+        avg = round(rng.lognormvariate(4, 1.2), 2)
+        spread = rng.uniform(0, 0.4)
+        has_prediction = rng.random() > 0.1
+        materials.append({
+            "material_id": i + 1,
+            "material_name": f"材料{i}",
+            "original_price": round(avg * rng.uniform(0.3, 2.5), 2),
+            "ai_analysis_result": {
+                "predicted_price_min": round(avg * (1 - spread), 2) if has_prediction else None,
+                "predicted_price_max": round(avg * (1 + spread), 2) if has_prediction else None,
+                "predicted_price_avg": avg if rng.random() > 0.2 else None,
+                "confidence_score": round(rng.uniform(0.2, 1.0), 2)
+            },
+            "historical_data": rng.choice(histories)
+        })
+    return materials
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--materials", type=int, default=100000, help="材料数量")
+    parser.add_argument("--history-groups", type=int, default=2000, help="不同历史价格序列的数量")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    analyzer = PriceReasonabilityAnalyzer()
+    materials = build_materials(args.materials, args.history_groups, args.seed)
+    market_context = {"trend": "stable", "inflation_rate": 0.03, "season_factor": 1.0}
+
+    started = time.perf_counter()
+    expected = [analyzer._analyze_material_data(material, market_context) for material in materials]
+    per_material_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    actual = analyzer.batch_analyze_materials(materials, market_context)
+    batch_seconds = time.perf_counter() - started
+
+    mismatches = 0
+    for left, right in zip(expected, actual):
+        if any(repr(getattr(left, field)) != repr(getattr(right, field)) for field in COMPARED_FIELDS):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"不一致: 材料 {left.material_id}\n  逐个: {left}\n  批量: {right}")
+
+    print(f"材料数量: {args.materials}，历史价格序列: {args.history_groups}")
+    print(f"逐个分析: {per_material_seconds:.2f}s ({args.materials / per_material_seconds:,.0f} 个/秒)")
+    print(f"批量分析: {batch_seconds:.2f}s ({args.materials / batch_seconds:,.0f} 个/秒)")
+    print(f"加速比: {per_material_seconds / batch_seconds:.1f}x，结果不一致: {mismatches}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()